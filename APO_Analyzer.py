@@ -1,13 +1,14 @@
 from __future__ import annotations
 from dataclasses import dataclass, field
 from typing import List, Dict, Tuple, Optional, Set
-import re
 import html
 
 import streamlit as st
 import pandas as pd
 import plotly.express as px
 
+from utils import wason_log
+
 
 
 @dataclass
@@ -17,36 +18,28 @@ class _SiteBucket:
     apop_lines: List[str] = field(default_factory=list)
     # (traffic_hex, conn_hex, state, raw_line)
     apop_rows: List[Tuple[str, str, str, str]] = field(default_factory=list)
+    # (first_ip, call_id, conn_hex, raw_line) ของ Conn ใน wason_lines
+    conns: List[Tuple[str, int, str, str]] = field(default_factory=list)
 
 
 class ApoRemnantAnalyzer:
     def __init__(self, raw_text: str, site_map: Dict[str, str] | None = None):
         """
         raw_text: เนื้อ log ทั้งไฟล์ (string)
-        site_map: map ip → ชื่อไซต์ (ไม่ส่งมาก็มีค่า default ให้)
+        site_map: map ip → ชื่อไซต์ (ไม่ส่งมาใช้ wason_log.DEFAULT_SITE_TABLE)
         """
         self.raw_text = raw_text
-        self.lines = raw_text.splitlines()
-        self.site_map = site_map or {
-            "30.10.90.6":  "HYI-4",
-            "30.10.10.6":  "Jasmine",
-            "30.10.30.6":  "Phu Nga",
-            "30.10.50.6":  "SNI-POI",
-            "30.10.70.6":  "NKS",
-            "30.10.110.6": "PKT",
-        }
+        self.site_map = site_map or dict(wason_log.DEFAULT_SITE_TABLE)
 
-        # ===== regex =====
-        self.re_wason_exec = re.compile(r'^\s*ZXPOTN\(.*\)#\s*exec\s+diag_c\("cc-cmd setcallcv SetupApo"\)')
-        self.re_wason_end  = re.compile(r'^\[WASON\]ushell command finished\b', re.I)
-        self.re_wason_conn = re.compile(r"^\[WASON\]\s*Conn\s*\[")
+        # ===== regex (อยู่ที่ utils.wason_log) =====
+        self.re_wason_exec = wason_log.WASON_EXEC_RE
+        self.re_wason_end  = wason_log.WASON_END_RE
+        self.re_wason_conn = wason_log.WASON_CONN_RE
 
-        self.re_apop_begin = re.compile(r'^\[APOPLUS\]\s*===\s*show all och-inst\s*===', re.I)
-        self.re_apop_top   = re.compile(r'^\[APOPLUS\]\s*TopNeIp\s*:\s*([0-9\.]+)')
-        self.re_apop_end   = re.compile(r'^\[APOPLUS\]ushell command finished\b', re.I)
-        self.re_apop_row   = re.compile(
-            r"^\[APOPLUS\]\d+\s+0x[0-9a-fA-F]+\s+0x[0-9a-fA-F]+\s+(0x[0-9a-fA-F]{8})\s+(0x[0-9a-fA-F]{8}).*(HEAD_[A-Z_]+)"
-        )
+        self.re_apop_begin = wason_log.APOP_BEGIN_RE
+        self.re_apop_top   = wason_log.APOP_TOP_RE
+        self.re_apop_end   = wason_log.APOP_END_RE
+        self.re_apop_row   = wason_log.APOP_ROW_RE
 
         # outputs
         self.per_site: Dict[str, _SiteBucket] = {}  # key: wason_first_ip
@@ -54,110 +47,25 @@ class ApoRemnantAnalyzer:
         self.rendered: List[Tuple[str, Tuple[str, str, str, Set[str]], bool, str]] = []
 
     # ---------- helpers ----------
-    @staticmethod
-    def _topne_to_wason_ip(top_ne_ip: str) -> Optional[str]:
-        m = re.match(r"(\d+)\.(\d+)\.(\d+)\.(\d+)", top_ne_ip)
-        if not m:
-            return None
-        x = m.group(3)
-        return f"30.10.{x}.6"
-
-    @staticmethod
-    def _wason_pair_for_compare(conn_line: str) -> Optional[Tuple[str, int, str]]:
-        """
-        [WASON] Conn [30.10.x.x 30.10.y.y CALLID CONNNO] ...
-        return: (first_ip, call_id:int, conn_hex:str)
-        """
-        m = re.search(r"Conn\s*\[\s*([\d\.]+)\s+([\d\.]+)\s+(\d+)\s+(\d+)\s*\]", conn_line)
-        if not m:
-            return None
-        first_ip, _second_ip, call_id_str, conn_no_str = m.groups()
-        call_id = int(call_id_str)
-        conn_hex = f"0x{int(conn_no_str):08x}".lower()
-        return first_ip, call_id, conn_hex
-
-    def _ensure_bucket(self, ip: str):
-        if ip not in self.per_site:
-            self.per_site[ip] = _SiteBucket(name=self.site_map.get(ip, ip))
+    _topne_to_wason_ip = staticmethod(wason_log.topne_to_wason_ip)
+    _wason_pair_for_compare = staticmethod(wason_log.wason_conn_pair)
 
     # ---------- ขั้นที่ 1: parse ----------
     def parse(self) -> Dict[str, _SiteBucket]:
-        wason_prebuf: List[str] = []
-        apop_prebuf:  List[str] = []
-        cap_wason = cap_apop = False
-        cur_wason_ip_ctx: Optional[str] = None
-        cur_apop_site_ip: Optional[str] = None
-
-        for ln in self.lines:
-            # WASON begin / end
-            if self.re_wason_exec.search(ln):
-                cap_wason = True
-                cur_wason_ip_ctx = None
-                wason_prebuf.clear()
-                wason_prebuf.append(ln)
-            if self.re_wason_end.search(ln):
-                if cap_wason and cur_wason_ip_ctx:
-                    self.per_site[cur_wason_ip_ctx].wason_lines.append(ln)
-                cap_wason = False
-                cur_wason_ip_ctx = None
-                wason_prebuf.clear()
-                continue
-
-            # APOP begin / end
-            if self.re_apop_begin.search(ln):
-                cap_apop = True
-                cur_apop_site_ip = None
-                apop_prebuf.clear()
-                apop_prebuf.append(ln)
-                continue
-            if self.re_apop_end.search(ln):
-                if cap_apop and cur_apop_site_ip:
-                    self.per_site[cur_apop_site_ip].apop_lines.append(ln)
-                cap_apop = False
-                cur_apop_site_ip = None
-                apop_prebuf.clear()
-                continue
-
-            # collect WASON
-            if cap_wason:
-                if ln.startswith("[WASON]"):
-                    if cur_wason_ip_ctx is None:
-                        wason_prebuf.append(ln)
-                        if self.re_wason_conn.search(ln):
-                            info = self._wason_pair_for_compare(ln)
-                            if info:
-                                first_ip, _, _ = info
-                                cur_wason_ip_ctx = first_ip
-                                self._ensure_bucket(first_ip)
-                                self.per_site[first_ip].wason_lines.extend(wason_prebuf)
-                                wason_prebuf.clear()
-                    else:
-                        self.per_site[cur_wason_ip_ctx].wason_lines.append(ln)
-                continue
-
-            # collect APOP
-            if cap_apop and ln.startswith("[APOPLUS]"):
-                if cur_apop_site_ip is None:
-                    apop_prebuf.append(ln)
-                    mtop = self.re_apop_top.search(ln)
-                    if mtop:
-                        mapped_ip = self._topne_to_wason_ip(mtop.group(1))
-                        cur_apop_site_ip = mapped_ip
-                        if mapped_ip:
-                            self._ensure_bucket(mapped_ip)
-                            self.per_site[mapped_ip].apop_lines.extend(apop_prebuf)
-                            apop_prebuf.clear()
-                    continue
-
-                self.per_site[cur_apop_site_ip].apop_lines.append(ln)
-                mrow = self.re_apop_row.match(ln)
-                if mrow:
-                    traffic = mrow.group(1).lower()
-                    connno  = mrow.group(2).lower()
-                    state   = mrow.group(3)
-                    self.per_site[cur_apop_site_ip].apop_rows.append((traffic, connno, state, ln))
-                continue
-
+        """
+        แยก WASON / APOPLUS ต่อไซต์จาก utils.wason_log (อ่าน log รอบเดียว + cache ตาม hash)
+        list ในแต่ละ bucket ใช้ร่วมกับ cache → ห้ามแก้ไข
+        """
+        self.per_site = {
+            ip: _SiteBucket(
+                name=self.site_map.get(ip, ip),
+                wason_lines=site.wason_lines,
+                apop_lines=site.apop_lines,
+                apop_rows=site.apop_rows,
+                conns=site.conns,
+            )
+            for ip, site in wason_log.parse(self.raw_text).sites.items()
+        }
         return self.per_site
 
     # ---------- ขั้นที่ 2: analyze ----------
@@ -183,16 +91,11 @@ class ApoRemnantAnalyzer:
 
 
             # --- collect WASON calls ---
-            wason_calls: List[Tuple[int, str, str]] = []  # (call_id, conn_hex, raw_line)
-            for ln_w in bucket.wason_lines:
-                if not self.re_wason_conn.search(ln_w):
-                    continue
-                parsed = self._wason_pair_for_compare(ln_w)
-                if not parsed:
-                    continue
-                first_ip, call_id, c_hex = parsed
-                if first_ip == wip:
-                    wason_calls.append((call_id, c_hex, ln_w))
+            wason_calls: List[Tuple[int, str, str]] = [  # (call_id, conn_hex, raw_line)
+                (call_id, c_hex, ln_w)
+                for first_ip, call_id, c_hex, ln_w in bucket.conns
+                if first_ip == wip
+            ]
 
             if not wason_calls:
                 self.rendered.append((wip, (site_name, wason_snippet, apop_snippet, set(), set()), False, site_name))
@@ -2,6 +2,10 @@
 import pandas as pd
 import streamlit as st
 from utils.filters import cascading_filter
+from utils.table_view import paged_table
+from utils import memo, rules
+from utils.reference import ReferenceRegistry, get_registry, normalize_columns
+from utils.mapping import merge_on_mapping
 from pandas.io.formats.style import Styler
 import altair as alt
 
@@ -17,9 +21,28 @@ class CPU_Analyzer:
       - แสดง Visualization: Bar Chart + Heatmap
     """
 
-    def __init__(self, df_cpu: pd.DataFrame, df_ref: pd.DataFrame, ns: str = "cpu"):
+    # เพิ่มเมื่อแก้ตรรกะใน compute() → ผลใน utils.memo ของเวอร์ชันเก่าจะไม่ถูกใช้
+    VERSION = 2
+
+    # กฎ abnormal (utils.rules) — ตาราง, banner, abnormal, Summary และ PDF ใช้ชุดเดียวกัน
+    RULES = rules.RuleSet([
+        rules.outside("CPU utilization ratio", "Minimum threshold", "Maximum threshold", name="CPU"),
+        rules.startswith("Route", "Preset", name="Preset"),
+    ])
+
+    def __init__(self, df_cpu: pd.DataFrame, df_ref: pd.DataFrame | None = None, ns: str = "cpu",
+                 registry: ReferenceRegistry | None = None):
         self.df_cpu = df_cpu
+        # ไม่ส่ง df_ref มา → ใช้ reference จาก registry (อ่าน Excel ครั้งเดียวต่อ process)
+        # พร้อม index ของ Mapping ที่สร้างไว้แล้ว
+        self._ref_index = None
+        self._ref_version = None
+        if df_ref is None:
+            table = (registry or get_registry()).get("cpu")
+            df_ref, self._ref_index = table.frame(), table.mapping_index
+            self._ref_version = table.version
         self.df_ref = df_ref
+        self.df_unmatched = pd.DataFrame()  # key ที่ไม่เจอใน reference
         self.ns     = ns
 
         # column name mapping
@@ -33,17 +56,10 @@ class CPU_Analyzer:
         # abnormal storage (เพิ่มเหมือน FAN)
         self.df_abnormal = pd.DataFrame()   # abnormal ทั้งหมด
         self.df_abnormal_by_type = {}       # abnormal แยกตาม BoardType (SNP(E), NCPM, NCPQ)
+        self.df_result = None               # ทุกบอร์ดหลัง merge (prepare) → utils.device_history
 
     # ---------- Utilities ----------
-    @staticmethod
-    def _normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
-        df.columns = (
-            df.columns.astype(str)
-            .str.strip()
-            .str.replace(r"\s+", " ", regex=True)
-            .str.replace("\u00a0", " ")
-        )
-        return df
+    _normalize_columns = staticmethod(normalize_columns)
 
     def _check_required(self) -> None:
         required_cols = {self.COL_ME, self.COL_MOBJ, self.COL_VAL}
@@ -58,10 +74,6 @@ class CPU_Analyzer:
             raise ValueError(f"Reference file must contain columns: {', '.join(sorted(required_ref_cols))}")
 
     def _merge_with_ref(self) -> pd.DataFrame:
-        self.df_cpu["Mapping Format"] = (
-            self.df_cpu[self.COL_ME].astype(str).str.strip()
-            + self.df_cpu[self.COL_MOBJ].astype(str).str.strip()
-        )
         self.df_ref["Mapping"] = self.df_ref["Mapping"].astype(str).str.strip()
         self.df_ref["order"]   = range(len(self.df_ref))
 
@@ -70,25 +82,11 @@ class CPU_Analyzer:
             if extra in self.df_ref.columns:
                 ref_cols.append(extra)
 
-        df_merged = pd.merge(
-            self.df_cpu,
-            self.df_ref[ref_cols],
-            left_on="Mapping Format",
-            right_on="Mapping",
-            how="inner"
+        df_merged, self.df_unmatched = merge_on_mapping(
+            self.df_cpu, self.df_ref, ref_cols, index=self._ref_index
         )
         return df_merged
 
-    @staticmethod
-    def _row_has_issue(r, col_val, col_min, col_max) -> bool:
-        v  = r.get(col_val)
-        lo = r.get(col_min)
-        hi = r.get(col_max)
-        try:
-            return (pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi))
-        except:
-            return False
-
     def _style_dataframe(self, df_view: pd.DataFrame) -> Styler:
         for c in [self.COL_VAL, self.COL_MAX, self.COL_MIN]:
             if c in df_view.columns:
@@ -103,36 +101,8 @@ class CPU_Analyzer:
         if "Minimum threshold" in df_view.columns and df_view[self.COL_MIN].max() <= 1:
             df_view[self.COL_MIN] = df_view[self.COL_MIN] * 100
 
-        def gray_row(r):
-            return [
-                'background-color:#e6e6e6;color:black'
-                if self._row_has_issue(r, self.COL_VAL, self.COL_MIN, self.COL_MAX) else ''
-                for _ in r
-            ]
-
-        def red_value(_):
-            return [
-                'background-color:#ff4d4d;color:white'
-                if (pd.notna(v) and pd.notna(hi) and pd.notna(lo) and (v > hi or v < lo))
-                else ''
-                for v, hi, lo in zip(
-                    df_view.get(self.COL_VAL, pd.Series(index=df_view.index)),
-                    df_view.get(self.COL_MAX, pd.Series(index=df_view.index)),
-                    df_view.get(self.COL_MIN, pd.Series(index=df_view.index)),
-                )
-            ]
-
-        def blue_route(_):
-            return [
-                'background-color:lightblue;color:black' if str(x).startswith("Preset") else ''
-                for x in df_view["Route"]
-            ] if "Route" in df_view.columns else []
-
         styled = (
-            df_view.style
-            .apply(gray_row, axis=1)
-            .apply(red_value, subset=[self.COL_VAL] if self.COL_VAL in df_view.columns else [])
-            .apply(blue_route, subset=["Route"] if "Route" in df_view.columns else [])
+            self.RULES.evaluate(df_view).style(df_view.style)
             .format({
                 self.COL_VAL: "{:.2f}%",
                 self.COL_MAX: "{:.2f}%",
@@ -141,8 +111,13 @@ class CPU_Analyzer:
         )
         return styled
 
-    # ---------- MAIN ----------
-    def process(self) -> pd.DataFrame:
+    # ---------- COMPUTE (ไม่มี st.* → memo ข้าม rerun ได้) ----------
+    def _memo_key(self) -> tuple:
+        ref_version = self._ref_version or memo.frame_digest(self.df_ref)
+        return ("cpu", self.VERSION, memo.frame_digest(self.df_cpu), ref_version)
+
+    def compute(self) -> dict:
+        """normalize → merge → abnormal + subset ต่อ board type (ผลใช้ร่วมกันทุก rerun ห้ามแก้ไข)"""
         # 1) Normalize
         self.df_cpu = self._normalize_columns(self.df_cpu)
         self.df_ref = self._normalize_columns(self.df_ref)
@@ -153,9 +128,10 @@ class CPU_Analyzer:
 
         # 3) Merge
         df_merged = self._merge_with_ref()
+        state = {"df_result": None, "df_unmatched": self.df_unmatched,
+                 "df_abnormal": pd.DataFrame(), "df_abnormal_by_type": {}}
         if df_merged.empty:
-            st.warning("No matching mapping found between CPU file and reference")
-            return pd.DataFrame()
+            return state
 
         # 4) Pick columns
         base_cols = [self.COL_ME, self.COL_MOBJ, self.COL_MAX, self.COL_MIN, self.COL_VAL, "order"]
@@ -165,7 +141,60 @@ class CPU_Analyzer:
         df_result = df_merged[show_cols].copy()
         df_result = df_result.sort_values("order").drop(columns=["order"]).reset_index(drop=True)
 
-        # 5) Cascading filter
+        # 5) Overall status + abnormal เก็บเหมือน FAN
+        ab_mask_all = self.RULES.evaluate(df_result).rows
+
+        # 6) Site-Obj column (ไม่ใส่ใน df_result → ตารางหลักแสดงคอลัมน์เหมือนเดิม)
+        df_sites = df_result.copy()
+        df_sites["Site-Obj"] = (
+            df_sites["Site Name"].astype(str) + " - " + df_sites[self.COL_MOBJ].astype(str)
+        )
+
+        # 7) Subsets
+        df_snp  = df_sites[df_sites[self.COL_MOBJ].str.contains(r"SNP\(E\)")].copy()
+        df_ncpm = df_sites[df_sites[self.COL_MOBJ].str.contains(r"NCPM")].copy()
+        df_ncpq = df_sites[df_sites[self.COL_MOBJ].str.contains(r"NCPQ")].copy()
+
+        # 8) CPU% (คูณ 100 เพราะไฟล์ต้นทางเป็น ratio)
+        for df_sub in [df_snp, df_ncpm, df_ncpq]:
+            df_sub["CPU%"] = pd.to_numeric(df_sub[self.COL_VAL], errors="coerce") * 100
+
+        # ✅ เก็บ abnormal แยกตาม type
+        subsets = {"SNP(E)": df_snp, "NCPM": df_ncpm, "NCPQ": df_ncpq}
+        by_type = {}
+        for btype, df_sub in subsets.items():
+            ab_mask = ab_mask_all[df_sub.index]
+            if ab_mask.any():
+                by_type[btype] = df_sub.loc[ab_mask].copy()
+
+        # 9) Global X scale
+        global_max = max(df_snp["CPU%"].max(), df_ncpm["CPU%"].max(), df_ncpq["CPU%"].max())
+
+        state.update({
+            "df_result": df_result,
+            "df_sites": df_sites,
+            "subsets": subsets,
+            "abn_count": int(ab_mask_all.sum()),
+            "status": "Abnormal" if ab_mask_all.any() else "Normal",
+            "df_abnormal": df_result.loc[ab_mask_all].copy(),
+            "df_abnormal_by_type": by_type,
+            "x_max": (global_max or 0) * 1.1,  # กันชน 10%
+        })
+        return state
+
+    # ---------- MAIN ----------
+    def process(self) -> pd.DataFrame:
+        state = memo.get_or_compute(self._memo_key(), self.compute)
+        self.df_unmatched = state["df_unmatched"]
+        self.df_abnormal = state["df_abnormal"]
+        self.df_abnormal_by_type = state["df_abnormal_by_type"]
+
+        df_result = state["df_result"]
+        if df_result is None:
+            st.warning("No matching mapping found between CPU file and reference")
+            return pd.DataFrame()
+
+        # 1) Cascading filter
         df_filtered, _sel = cascading_filter(
             df_result,
             cols=["Site Name", self.COL_ME, self.COL_MOBJ],
@@ -174,63 +203,25 @@ class CPU_Analyzer:
         )
         st.caption(f"CPU (showing {len(df_filtered)}/{len(df_result)} rows)")
 
-        # 6) Overall status + abnormal เก็บเหมือน FAN
-        val = pd.to_numeric(df_result[self.COL_VAL], errors="coerce")
-        hi  = pd.to_numeric(df_result[self.COL_MAX], errors="coerce")
-        lo  = pd.to_numeric(df_result[self.COL_MIN], errors="coerce")
-        ab_mask_all = (val > hi) | (val < lo)
-
-        st.session_state["cpu_abn_count"] = int(ab_mask_all.fillna(False).sum())
-        st.session_state["cpu_status"]    = "Abnormal" if ab_mask_all.any() else "Normal"
-
-        # ✅ เก็บ abnormal ทั้งหมด
-        self.df_abnormal = df_result.loc[ab_mask_all].copy()
+        st.session_state["cpu_abn_count"] = state["abn_count"]
+        st.session_state["cpu_status"]    = state["status"]
 
-        # 7) Styled main table
-        styled = self._style_dataframe(df_filtered.copy())
+        # 2) Styled main table (แบ่งหน้า → style เฉพาะหน้าที่เห็น)
         st.markdown("### CPU Performance")
-        st.write(styled)
+        paged_table(df_filtered, ns=self.ns, style=self._style_dataframe, file_name="cpu_performance.csv")
 
-        # 8) Summary banner
-        failed_rows = df_filtered.apply(
-            lambda r: self._row_has_issue(r, self.COL_VAL, self.COL_MIN, self.COL_MAX),
-            axis=1
-        )
+        # 3) Summary banner
+        failed = self.RULES.evaluate(df_filtered).any()
         st.markdown(
             "<div style='text-align:center; font-size:32px; font-weight:bold; color:{};'>CPU Performance {}</div>".format(
-                "red" if failed_rows.any() else "green",
-                "Warning" if failed_rows.any() else "Normal"
+                "red" if failed else "green",
+                "Warning" if failed else "Normal"
             ),
             unsafe_allow_html=True
         )
 
-        # 9) Site-Obj column
-        df_result["Site-Obj"] = (
-            df_result["Site Name"].astype(str) + " - " + df_result[self.COL_MOBJ].astype(str)
-        )
-
-        # 10) Subsets
-        df_snp  = df_result[df_result[self.COL_MOBJ].str.contains(r"SNP\(E\)")].copy()
-        df_ncpm = df_result[df_result[self.COL_MOBJ].str.contains(r"NCPM")].copy()
-        df_ncpq = df_result[df_result[self.COL_MOBJ].str.contains(r"NCPQ")].copy()
-
-        # 11) CPU% (คูณ 100 เพราะไฟล์ต้นทางเป็น ratio)
-        for df_sub in [df_snp, df_ncpm, df_ncpq]:
-            df_sub["CPU%"] = pd.to_numeric(df_sub[self.COL_VAL], errors="coerce") * 100
-
-        # ✅ เก็บ abnormal แยกตาม type
-        self.df_abnormal_by_type = {}
-        for btype, df_sub in {"SNP(E)": df_snp, "NCPM": df_ncpm, "NCPQ": df_ncpq}.items():
-            v  = pd.to_numeric(df_sub[self.COL_VAL], errors="coerce")
-            hi = pd.to_numeric(df_sub[self.COL_MAX], errors="coerce")
-            lo = pd.to_numeric(df_sub[self.COL_MIN], errors="coerce")
-            ab_mask = (v > hi) | (v < lo)
-            if ab_mask.any():
-                self.df_abnormal_by_type[btype] = df_sub.loc[ab_mask].copy()
-
-        # 12) Global X scale
-        global_max = max(df_snp["CPU%"].max(), df_ncpm["CPU%"].max(), df_ncpq["CPU%"].max())
-        x_max = (global_max or 0) * 1.1  # กันชน 10%
+        df_snp, df_ncpm, df_ncpq = (state["subsets"][t] for t in ("SNP(E)", "NCPM", "NCPQ"))
+        x_max = state["x_max"]
 
         # ---------- Helpers ----------
         def plot_chart(df_sub: pd.DataFrame, title: str, height: int):
@@ -266,7 +257,7 @@ class CPU_Analyzer:
             v  = pd.to_numeric(df_sub[self.COL_VAL], errors="coerce") * 100
             hi = pd.to_numeric(df_sub[self.COL_MAX], errors="coerce") * 100
             lo = pd.to_numeric(df_sub[self.COL_MIN], errors="coerce") * 100
-            ab_mask = (v > hi) | (v < lo)
+            ab_mask = self.RULES.evaluate(df_sub).rows
 
             if not ab_mask.any():
                 st.info("✅ No abnormal rows (Normal)")
@@ -290,24 +281,16 @@ class CPU_Analyzer:
             for col in percent_cols:
                 df_abn[col] = pd.to_numeric(df_abn[col], errors="coerce").round(1).astype(str) + "%"
 
-            # ✅ Highlight CPU utilization (%) เป็นสีแดง
-            def highlight_red(val):
-                try:
-                    v = float(val.strip('%'))
-                    return "background-color: #ff4d4d; color: white"
-                except:
-                    return ""
-
-            styled_abn = (
-                df_abn.style
-                .applymap(highlight_red, subset=["CPU utilization (%)"])
+            # ✅ Highlight CPU utilization (%) เป็นสีแดง (ทุกแถวในตารางนี้ผิดกฎอยู่แล้ว)
+            styled_abn = df_abn.style.set_properties(
+                subset=["CPU utilization (%)"], **{"background-color": "#ff4d4d", "color": "white"}
             )
 
             st.dataframe(styled_abn, use_container_width=True)
 
         # ---------- /Helpers ----------
 
-        # 13) SNP(E)
+        # 4) SNP(E)
         st.markdown(f"#### CPU Performance – SNP(E) Board")
 
         rows = len(df_snp)
@@ -326,7 +309,7 @@ class CPU_Analyzer:
         show_abnormal(df_snp, "SNP(E)")
         st.markdown("<br><br><br>", unsafe_allow_html=True)
 
-        # 14) NCPM
+        # 5) NCPM
         st.markdown(f"#### CPU Performance – NCPM Board")
         st.altair_chart(
             plot_chart(df_ncpm, "NCPM CPU Utilization (8 Boards)", 400),
@@ -335,17 +318,14 @@ class CPU_Analyzer:
         show_abnormal(df_ncpm, "NCPM")
         st.markdown("<br><br><br>", unsafe_allow_html=True)
 
-        # 15) NCPQ
+        # 6) NCPQ
         st.markdown(f"#### CPU Performance – NCPQ Board")
         st.altair_chart(plot_chart(df_ncpq, "NCPQ CPU Utilization (16 Boards)", 600),
                         use_container_width=True)
         show_abnormal(df_ncpq, "NCPQ")
         st.markdown("<br><br><br>", unsafe_allow_html=True)
 
-        # ✅ เก็บ analyzer object ลง session
-        st.session_state["cpu_analyzer"] = self
-
-        return df_result
+        return state["df_sites"]
 
 
     def prepare(self) -> None:
@@ -366,16 +346,15 @@ class CPU_Analyzer:
             return
 
         # 4) Detect abnormal
-        val = pd.to_numeric(df_merged[self.COL_VAL], errors="coerce")
-        hi  = pd.to_numeric(df_merged[self.COL_MAX], errors="coerce")
-        lo  = pd.to_numeric(df_merged[self.COL_MIN], errors="coerce")
-        ab_mask = (val > hi) | (val < lo)
+        ab_mask = self.RULES.evaluate(df_merged).rows
 
-        df_abn = df_merged.loc[ab_mask, [
-            "Site Name", self.COL_ME, self.COL_MOBJ,
-            self.COL_MAX, self.COL_MIN, self.COL_VAL
-        ]].copy()
+        cols = ["Site Name", self.COL_ME, self.COL_MOBJ, self.COL_MAX, self.COL_MIN, self.COL_VAL]
+        self.df_result = df_merged[cols].reset_index(drop=True)
+        df_abn = df_merged.loc[ab_mask, cols].copy()
 
         # 5) เก็บผล
         self.df_abnormal = df_abn
         self.df_abnormal_by_type = {"All": df_abn} if not df_abn.empty else {}
+
+
+rules.register("CPU", CPU_Analyzer.RULES)
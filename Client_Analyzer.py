@@ -1,6 +1,10 @@
 import pandas as pd
 import streamlit as st
 from utils.filters import cascading_filter
+from utils.table_view import paged_table
+from utils import memo, rules
+from utils.reference import ReferenceRegistry, get_registry, normalize_ascii_columns
+from utils.mapping import merge_on_mapping
 import plotly.graph_objects as go
 
 
@@ -41,14 +45,28 @@ class Client_Analyzer:
     COL_MAX_IN = "Maximum threshold(in)"
     COL_MIN_IN = "Minimum threshold(in)"
 
-    def __init__(self, df_client: pd.DataFrame, ref_path: str = "data/Client.xlsx"):
+    # กฎ abnormal (utils.rules) — ตาราง, banner, abnormal, Summary และ PDF ใช้ชุดเดียวกัน
+    # (เทียบแต่ละฝั่งแยกกัน: threshold ฝั่งไหนว่างก็ยังเช็คอีกฝั่ง)
+    RULES = rules.RuleSet([
+        rules.outside(COL_OUT, COL_MIN_OUT, COL_MAX_OUT, name="Output", need_both=False),
+        rules.outside(COL_IN, COL_MIN_IN, COL_MAX_IN, name="Input", need_both=False),
+    ])
+
+    # เพิ่มเมื่อแก้ตรรกะใน compute() → ผลใน utils.memo ของเวอร์ชันเก่าจะไม่ถูกใช้
+    VERSION = 1
+
+    def __init__(self, df_client: pd.DataFrame, ref_path: str = "data/Client.xlsx",
+                 registry: ReferenceRegistry | None = None):
         self.df_client_raw = df_client
         self.ref_path = ref_path
+        self.registry = registry or get_registry()
 
 
         # สถานะระหว่างทาง
         self.df_client = None
         self.df_ref = None
+        self._ref_index = None
+        self.df_unmatched = pd.DataFrame()  # key ที่ไม่เจอใน reference
         self.df_merged = None
         self.df_result = None
         self.df_filtered = None
@@ -73,50 +91,38 @@ class Client_Analyzer:
     @staticmethod
     def _normalize_ref_cols(df: pd.DataFrame) -> pd.DataFrame:
         # ตรงกับตรรกะเดิม: encode('ascii','ignore') → decode
-        df2 = df.copy()
-        df2.columns = (
-            df2.columns.astype(str)
-            .str.encode("ascii", "ignore").str.decode("utf-8")
-            .str.replace(r"\s+", " ", regex=True)
-            .str.strip()
-        )
-        return df2
+        return normalize_ascii_columns(df.copy())
 
     def _validate_client_cols(self, df: pd.DataFrame):
         if not self.REQ_CLIENT_COLS.issubset(df.columns):
-            st.error(f"Client file must contain columns: {', '.join(self.REQ_CLIENT_COLS)}")
-            st.stop()
+            raise ValueError(f"Client file must contain columns: {', '.join(self.REQ_CLIENT_COLS)}")
 
     def _validate_ref_cols(self, df: pd.DataFrame):
         if not self.REQ_REF_COLS.issubset(df.columns):
-            st.error(f"Reference file must contain columns: {', '.join(self.REQ_REF_COLS)}")
-            st.stop()
-
-    # -------------------- Step 2: Build Mapping & Load Reference --------------------
-    def _build_mapping_format(self, df: pd.DataFrame) -> pd.DataFrame:
-        df2 = df.copy()
-        df2["Mapping Format"] = df2["ME"].astype(str).str.strip() + df2["Measure Object"].astype(str).str.strip()
-        return df2
+            raise ValueError(f"Reference file must contain columns: {', '.join(self.REQ_REF_COLS)}")
 
+    # -------------------- Step 2: Load Reference --------------------
     def _load_reference(self) -> pd.DataFrame:
-        ref = pd.read_excel(self.ref_path)
-        ref = self._normalize_ref_cols(ref)
+        # registry normalize คอลัมน์ + strip Mapping + ใส่ order (ลำดับตามไฟล์) ไว้ให้แล้ว
+        table = self.registry.get("client", self.ref_path)
+        ref = table.frame()
         self._validate_ref_cols(ref)
-        ref["Mapping"] = ref["Mapping"].astype(str).str.strip()
-        ref["order"] = range(len(ref))  # รักษาลำดับตามไฟล์ reference
+        self._ref_index = table.mapping_index
         return ref
 
     # -------------------- Step 3: Merge & Prepare View --------------------
     def _merge(self, df_client: pd.DataFrame, df_ref: pd.DataFrame) -> pd.DataFrame:
-        df_merged = pd.merge(
+        # join ด้วย ME + Measure Object (ไม่ต้องสร้างคอลัมน์ Mapping Format ทั้งไฟล์)
+        df_merged, self.df_unmatched = merge_on_mapping(
             df_client,
-            df_ref[[
+            df_ref,
+            [
                 "Site Name", "Mapping",
                 self.COL_MAX_OUT, self.COL_MIN_OUT,
                 self.COL_MAX_IN, self.COL_MIN_IN,
                 "order"
-            ]],
-            left_on="Mapping Format", right_on="Mapping", how="inner",
+            ],
+            index=self._ref_index,
         )
         return df_merged
 
@@ -140,32 +146,10 @@ class Client_Analyzer:
         return df_filtered
 
     # -------------------- Step 5: Styling --------------------
-    def _row_has_issue(self, r: pd.Series) -> bool:
-        try:
-            return (
-                (r[self.COL_OUT] > r[self.COL_MAX_OUT]) or (r[self.COL_OUT] < r[self.COL_MIN_OUT]) or
-                (r[self.COL_IN] > r[self.COL_MAX_IN]) or (r[self.COL_IN] < r[self.COL_MIN_IN])
-            )
-        except Exception:
-            return False
-
-    def _highlight_critical_cells(self, val, colname, row) -> str:
-        try:
-            if colname == self.COL_OUT:
-                return 'background-color:#ff4d4d; color:white' if (val > row[self.COL_MAX_OUT] or val < row[self.COL_MIN_OUT]) else ''
-            elif colname == self.COL_IN:
-                return 'background-color:#ff4d4d; color:white' if (val > row[self.COL_MAX_IN] or val < row[self.COL_MIN_IN]) else ''
-            return ''
-        except Exception:
-            return ''
-
     def _style_dataframe(self, df_view: pd.DataFrame):
         styled_df = (
-            df_view.style
-            # เทาทั้งแถวเมื่อมีปัญหา
-            .apply(lambda r: ['background-color:#e6e6e6; color:black' if self._row_has_issue(r) else '' for _ in r], axis=1)
-            # แดงเฉพาะค่าที่ผิด (ทั้ง out/in)
-            .apply(lambda row: [self._highlight_critical_cells(row[colname], colname, row) for colname in df_view.columns], axis=1)
+            # เทาทั้งแถวเมื่อมีปัญหา + แดงเฉพาะค่าที่ผิด (ทั้ง out/in)
+            self.RULES.evaluate(df_view).style(df_view.style)
             .format({
                 self.COL_MAX_OUT: "{:.2f}",
                 self.COL_MIN_OUT: "{:.2f}",
@@ -179,11 +163,11 @@ class Client_Analyzer:
 
     # -------------------- Step 6: Banner --------------------
     def _render_status_banner(self, df_view: pd.DataFrame):
-        failed_rows = df_view.apply(self._row_has_issue, axis=1)
+        failed = self.RULES.evaluate(df_view).any()
         st.markdown(
             "<div style='text-align:center; font-size:32px; font-weight:bold; color:{};'>Client Performance {}</div>".format(
-                "red" if failed_rows.any() else "green",
-                "Warning" if failed_rows.any() else "Normal"
+                "red" if failed else "green",
+                "Warning" if failed else "Normal"
             ),
             unsafe_allow_html=True
         )
@@ -193,44 +177,55 @@ class Client_Analyzer:
         self._render_c2l_avg_slot_charts(df_view)
         self._render_c4r_avg_slot_charts(df_view)
 
-    # -------------------- VISUALIZATION --------------------
-    def process(self):
+    # -------------------- COMPUTE (ไม่มี st.* → memo ข้าม rerun ได้) --------------------
+    def _memo_key(self) -> tuple:
+        ref_version = self.registry.get("client", self.ref_path).version
+        return ("client", self.VERSION, memo.frame_digest(self.df_client_raw), ref_version)
+
+    def compute(self) -> dict:
+        """normalize → merge → เรียงตาม order → แปลงเป็นตัวเลข"""
         # 1) ทำความสะอาด & ตรวจคอลัมน์ client
         self.df_client = self._normalize_cols(self.df_client_raw)
         self._validate_client_cols(self.df_client)
 
-        # 2) สร้าง Mapping Format
-        self.df_client = self._build_mapping_format(self.df_client)
-
-        # 3) โหลด reference & merge
+        # 2-3) โหลด reference & merge ด้วย ME + Measure Object
         self.df_ref = self._load_reference()
         self.df_merged = self._merge(self.df_client, self.df_ref)
 
         if self.df_merged.empty:
-            st.warning("No matching mapping found between Client file and reference")
-            return
+            return {"df_result": None, "df_unmatched": self.df_unmatched}
 
         # 4) เรียงตาม order จาก ref + จัดคอลัมน์แสดงผล
         self.df_merged = self.df_merged.sort_values("order").reset_index(drop=True)
-        self.df_result = self.df_merged[[
+        df_result = self.df_merged[[
             "Site Name", "ME", "Measure Object",
             self.COL_MAX_OUT, self.COL_MIN_OUT, self.COL_OUT,
             self.COL_MAX_IN, self.COL_MIN_IN, self.COL_IN
         ]].copy()
 
         # 5) แปลงเป็นตัวเลขก่อนเทียบ
-        self.df_result = self._numeric_cast(
-            self.df_result,
+        df_result = self._numeric_cast(
+            df_result,
             [self.COL_OUT, self.COL_IN, self.COL_MAX_OUT, self.COL_MIN_OUT, self.COL_MAX_IN, self.COL_MIN_IN]
         )
+        return {"df_result": df_result, "df_unmatched": self.df_unmatched}
+
+    # -------------------- VISUALIZATION --------------------
+    def process(self):
+        state = memo.get_or_compute(self._memo_key(), self.compute)
+        self.df_unmatched = state["df_unmatched"]
+        self.df_result = state["df_result"]
+
+        if self.df_result is None:
+            st.warning("No matching mapping found between Client file and reference")
+            return
 
         # 6) Cascading filter
         self.df_filtered = self._apply_cascading_filter(self.df_result)
 
         # 7) เรนเดอร์ตาราง + แบนเนอร์
         st.markdown("### Client Performance")
-        styled_df = self._style_dataframe(self.df_filtered.copy())
-        st.dataframe(styled_df, use_container_width=True)
+        paged_table(self.df_filtered, ns="client", style=self._style_dataframe, file_name="client_performance.csv")
         self._render_status_banner(self.df_filtered)
 
     def _render_summary_kpi(self, df_view: pd.DataFrame) -> None:
@@ -370,14 +365,9 @@ class Client_Analyzer:
         x_index = list(range(len(agg)))
 
         # ---------------- Check abnormal ----------------
-        df_c2k["row_abnormal_in"] = (
-            df_c2k[self.COL_IN].notna()
-            & ((df_c2k[self.COL_IN] < df_c2k[self.COL_MIN_IN]) | (df_c2k[self.COL_IN] > df_c2k[self.COL_MAX_IN]))
-        )
-        df_c2k["row_abnormal_out"] = (
-            df_c2k[self.COL_OUT].notna()
-            & ((df_c2k[self.COL_OUT] < df_c2k[self.COL_MIN_OUT]) | (df_c2k[self.COL_OUT] > df_c2k[self.COL_MAX_OUT]))
-        )
+        violations = self.RULES.evaluate(df_c2k)
+        df_c2k["row_abnormal_in"] = violations.hit("Input")
+        df_c2k["row_abnormal_out"] = violations.hit("Output")
         slot_abnormal_in = (
             df_c2k.groupby(["Site Name", "Board Slot"])["row_abnormal_in"]
             .any().reset_index().rename(columns={"row_abnormal_in": "slot_abnormal_in"})
@@ -443,11 +433,7 @@ class Client_Analyzer:
 
             # ✅ ใช้ style ให้เน้นแดงเฉพาะค่าที่ผิด
             styled_abn = (
-                df_c2k_probs[cols_show].style
-                .apply(
-                    lambda row: [self._highlight_critical_cells(row[col], col, row) for col in df_c2k_probs[cols_show].columns],
-                    axis=1
-                )
+                self.RULES.evaluate(df_c2k_probs[cols_show]).style(df_c2k_probs[cols_show].style, row=None)
                 .format("{:.2f}", subset=[
                     self.COL_OUT, self.COL_IN,
                     self.COL_MAX_OUT, self.COL_MIN_OUT,
@@ -522,14 +508,9 @@ class Client_Analyzer:
         x_index = list(range(len(agg)))
 
         # ---------------- Check abnormal ----------------
-        df_c2l["row_abnormal_in"] = (
-            df_c2l[self.COL_IN].notna()
-            & ((df_c2l[self.COL_IN] < df_c2l[self.COL_MIN_IN]) | (df_c2l[self.COL_IN] > df_c2l[self.COL_MAX_IN]))
-        )
-        df_c2l["row_abnormal_out"] = (
-            df_c2l[self.COL_OUT].notna()
-            & ((df_c2l[self.COL_OUT] < df_c2l[self.COL_MIN_OUT]) | (df_c2l[self.COL_OUT] > df_c2l[self.COL_MAX_OUT]))
-        )
+        violations = self.RULES.evaluate(df_c2l)
+        df_c2l["row_abnormal_in"] = violations.hit("Input")
+        df_c2l["row_abnormal_out"] = violations.hit("Output")
         slot_abnormal_in = (
             df_c2l.groupby(["Site Name", "Board Slot"])["row_abnormal_in"]
             .any().reset_index().rename(columns={"row_abnormal_in": "slot_abnormal_in"})
@@ -594,11 +575,7 @@ class Client_Analyzer:
             ]
 
             styled_abn = (
-                df_c2l_probs[cols_show].style
-                .apply(lambda row: [
-                    self._highlight_critical_cells(row[col], col, row)
-                    for col in df_c2l_probs[cols_show].columns
-                ], axis=1)
+                self.RULES.evaluate(df_c2l_probs[cols_show]).style(df_c2l_probs[cols_show].style, row=None)
                 .format("{:.2f}", subset=[
                     self.COL_OUT, self.COL_IN,
                     self.COL_MAX_OUT, self.COL_MIN_OUT,
@@ -680,14 +657,9 @@ class Client_Analyzer:
         MAIN_MIN_OUT, MAIN_MAX_OUT = -0.27, 11.52
 
         # --- Abnormal จากค่าดิบรายลิงก์ (per-row) แยก In/Out ---
-        df_c4r["row_abnormal_in"] = (
-            df_c4r[self.COL_IN].notna() & df_c4r[self.COL_MIN_IN].notna() & df_c4r[self.COL_MAX_IN].notna()
-            & ((df_c4r[self.COL_IN] < df_c4r[self.COL_MIN_IN]) | (df_c4r[self.COL_IN] > df_c4r[self.COL_MAX_IN]))
-        )
-        df_c4r["row_abnormal_out"] = (
-            df_c4r[self.COL_OUT].notna() & df_c4r[self.COL_MIN_OUT].notna() & df_c4r[self.COL_MAX_OUT].notna()
-            & ((df_c4r[self.COL_OUT] < df_c4r[self.COL_MIN_OUT]) | (df_c4r[self.COL_OUT] > df_c4r[self.COL_MAX_OUT]))
-        )
+        violations = self.RULES.evaluate(df_c4r)
+        df_c4r["row_abnormal_in"] = violations.hit("Input")
+        df_c4r["row_abnormal_out"] = violations.hit("Output")
 
         slot_abnormal_in = (
             df_c4r.groupby(["Site Name", "Board Slot"], as_index=False)["row_abnormal_in"]
@@ -764,11 +736,7 @@ class Client_Analyzer:
             ]
 
             styled_abn = (
-                df_c4r_probs[cols_show].style
-                .apply(lambda row: [
-                    self._highlight_critical_cells(row[col], col, row)
-                    for col in df_c4r_probs[cols_show].columns
-                ], axis=1)
+                self.RULES.evaluate(df_c4r_probs[cols_show]).style(df_c4r_probs[cols_show].style, row=None)
                 .format("{:.2f}", subset=[
                     self.COL_OUT, self.COL_IN,
                     self.COL_MAX_OUT, self.COL_MIN_OUT,
@@ -788,19 +756,13 @@ class Client_Analyzer:
         self.df_client = self._normalize_cols(self.df_client_raw)
         self._validate_client_cols(self.df_client)
 
-        # 2) Build mapping
-        self.df_client = self._build_mapping_format(self.df_client)
-
-        # 3) Load reference & merge
+        # 2-3) Load reference & merge on ME + Measure Object
         self.df_ref = self._load_reference()
         self.df_merged = self._merge(self.df_client, self.df_ref)
 
         if self.df_merged.empty:
             self.df_abnormal = pd.DataFrame()
             self.df_abnormal_by_type = {}
-            st.session_state["client_analyzer"] = self
-            st.session_state["client_status"] = "No data"
-            st.session_state["client_abn_count"] = 0
             return
 
         # 4) Select important cols & numeric cast
@@ -816,10 +778,7 @@ class Client_Analyzer:
 
         # 5) Detect abnormal rows (per link)
         mask_abn = (
-            ((self.df_result[self.COL_OUT] > self.df_result[self.COL_MAX_OUT]) |
-            (self.df_result[self.COL_OUT] < self.df_result[self.COL_MIN_OUT]) |
-            (self.df_result[self.COL_IN] > self.df_result[self.COL_MAX_IN]) |
-            (self.df_result[self.COL_IN] < self.df_result[self.COL_MIN_IN]))
+            self.RULES.evaluate(self.df_result).rows
             & (self.df_result[self.COL_IN] != -60)
             & (self.df_result[self.COL_OUT] != -60)
         )
@@ -840,10 +799,5 @@ class Client_Analyzer:
             "C4R": df_c4r_abn
         }
 
-        # 8) Save status into session_state
-        st.session_state["client_analyzer"] = self
-        if self.df_abnormal.empty:
-            st.session_state["client_status"] = "Normal"
-        else:
-            st.session_state["client_status"] = "Abnormal"
-        st.session_state["client_abn_count"] = len(self.df_abnormal)
+
+rules.register("Client", Client_Analyzer.RULES)
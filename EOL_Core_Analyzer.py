@@ -1,9 +1,17 @@
 import math
+import numpy as np
 import streamlit as st
 import pandas as pd
               # ✅ เพิ่มบรรทัดนี้
 import plotly.express as px 
+from utils import memo
+from utils.reference import get_registry
 
+# สถานะของ link (ลำดับ = code ของ Categorical) — ตาราง, donut, Dashboard และ abnormal ใช้ชุดเดียวกัน
+EOL_STATUSES = ["EOL Normal", "EOL Excess Loss", "EOL Fiber Break"]
+CORE_STATUSES = ["Core Normal", "Core Loss Excess", "Core Fiber Break"]
+EOL_LIMIT = 2.5    # Loss current - Loss EOL ≥ ค่านี้ = Excess Loss
+CORE_LIMIT = 3     # Loss between core > ค่านี้ = Loss Excess
 
 
 # region Base Analyzer for Loss
@@ -15,26 +23,26 @@ class LossAnalyzer:
         ref_path: str | None = None,
     ):
         self.df_raw_data = df_raw_data
+        self._ref_version = None
         # ใช้ df_ref ถ้ามี, ถ้าไม่มีลองโหลดจาก ref_path, ไม่งั้น None
         if df_ref is not None:
             self.df_ref = df_ref
         elif ref_path:
-            self.df_ref = self._load_ref(ref_path)  # ← loader ในคลาส
+            table = self._load_ref(ref_path)  # ← loader ในคลาส
+            self.df_ref, self._ref_version = table.df, table.version
         else:
             self.df_ref = None
 
     # ---------- loader (cache) ----------
     @staticmethod
-    @st.cache_data(show_spinner=False)
-    def _load_ref(path: str) -> pd.DataFrame:
+    def _load_ref(path: str):
         """
-        อ่านไฟล์อ้างอิงจาก path → DataFrame
-        cache ไว้เพื่อไม่ต้องอ่านซ้ำเมื่อมี rerun ของ Streamlit
+        reference ของ path (ReferenceTable) ผ่าน reference registry
+        (อ่านครั้งเดียวต่อ process, reload เมื่อไฟล์เปลี่ยน) — frame ใช้ร่วมกัน ไม่ copy ต่อ analyzer
+        pipeline อ่านอย่างเดียว (extract_eol_ref copy ก่อนแก้)
         """
         try:
-            df = pd.read_excel(path)
-            df.columns = [str(c).strip() for c in df.columns]
-            return df
+            return get_registry().get("eol", path)
         except Exception as e:
             st.error(f"Cannot load reference file from '{path}': {e}")
             raise
@@ -48,6 +56,65 @@ class LossAnalyzer:
         except (ValueError, TypeError):
             return False
 
+    @classmethod
+    def fiber_break_remark(cls, values: pd.Series) -> pd.Series:
+        """
+        "Fiber Break" ถ้าค่า float() ไม่ได้ (เช่น "--", ว่าง) ไม่งั้น ""
+        to_numeric ทั้งคอลัมน์ครั้งเดียว แล้วเรียก is_castable_to_float เฉพาะ cell ที่แปลงไม่ได้
+        (NaN จริงยัง float ได้ → ไม่ใช่ Fiber Break เหมือนเดิม)
+        """
+        castable = pd.to_numeric(values, errors="coerce").notna()
+        rest = ~castable
+        if rest.any():
+            castable[rest] = values[rest].map(cls.is_castable_to_float).astype(bool)
+        return pd.Series(np.where(castable, "", "Fiber Break"), index=values.index, dtype=object)
+
+    @staticmethod
+    def status_counts(status: pd.Series) -> pd.DataFrame:
+        """Status / Count ของสถานะที่มีอย่างน้อยหนึ่ง link (ลำดับตาม categories) → donut"""
+        counts = status.value_counts(sort=False)
+        counts = counts[counts > 0]
+        return pd.DataFrame({"Status": counts.index.astype(str), "Count": counts.to_numpy()})
+
+    @staticmethod
+    def split_status(df: pd.DataFrame, status: pd.Series, names: list[str]) -> dict:
+        """{สถานะ: แถวของ df ที่มีสถานะนั้น} — df กับ status ต้องเรียงตรงกัน"""
+        return {name: df.loc[(status == name).to_numpy()].reset_index(drop=True) for name in names}
+
+    @staticmethod
+    def calculate_loss_between_core(df_result: pd.DataFrame) -> pd.DataFrame:
+        """
+        แถวคู่ (A→B, B→A) → |forward - reverse| ปัด 2 ตำแหน่ง ใส่ให้ทั้งสองแถวของคู่ ("--" ถ้าฝั่งใดไม่มีค่า)
+        link สุดท้ายที่ไม่มีคู่ได้ "--"
+        """
+        loss = pd.to_numeric(df_result["Loss current - Loss EOL"], errors="coerce").to_numpy()
+        pairs = len(loss) // 2
+        diff = np.round(np.abs(loss[0:2 * pairs:2] - loss[1:2 * pairs:2]), 2)
+        per_link = pd.Series(np.repeat(diff, 2), dtype=object).reindex(range(len(loss)))
+
+        df_loss_between_core = pd.DataFrame()
+        df_loss_between_core["Link Name"] = df_result["Link Name"].to_numpy()
+        df_loss_between_core["Loss between core"] = per_link.where(per_link.notna(), "--").to_numpy()
+        return df_loss_between_core
+
+    @staticmethod
+    def core_status(loss_values: pd.Series) -> pd.Series:
+        """
+        สถานะต่อ link (Categorical ตาม CORE_STATUSES) จากคอลัมน์ Loss between core
+        "--" → Core Fiber Break, > 3 → Core Loss Excess, อื่น ๆ → Core Normal
+        """
+        loss_values = pd.Series(loss_values).reset_index(drop=True)
+        broken = loss_values.astype(str).eq("--").to_numpy()
+        excess = (pd.to_numeric(loss_values, errors="coerce") > CORE_LIMIT).to_numpy()
+        codes = np.select([broken, excess], [2, 1], default=0)
+        return pd.Series(pd.Categorical.from_codes(codes, categories=CORE_STATUSES), name="Status")
+
+    @staticmethod
+    def _me_mask(df_result: pd.DataFrame, selected_me_name: str | None) -> pd.Series:
+        if not selected_me_name:
+            return pd.Series(True, index=df_result.index)
+        return df_result["Link Name"].astype(str).str.contains(selected_me_name, na=False)
+
     @staticmethod
     def countDay(df_ref: pd.DataFrame):
         days = (len(df_ref.columns) - 11) / 4
@@ -121,17 +188,19 @@ class LossAnalyzer:
 
 # region Analyzer for EOL
 class EOLAnalyzer(LossAnalyzer):
+    # เพิ่มเมื่อแก้ตรรกะใน _compute() → ผลใน utils.memo ของเวอร์ชันเก่าจะไม่ถูกใช้
+    VERSION = 1
+
     def extract_raw_data(self, df_raw_data: pd.DataFrame) -> pd.DataFrame:
-        df_raw_data.columns = df_raw_data.columns.str.strip()
+        # ไม่แก้ frame ต้นทาง (dataset จาก utils.result_store ใช้ร่วมกันทุก session)
+        df_raw_data = df_raw_data.set_axis(df_raw_data.columns.str.strip(), axis=1)
         df_atten = pd.DataFrame()
         source_port_col = df_raw_data["Source Port"]
         sink_port_col   = df_raw_data["Sink Port"]
 
         df_atten["Link Name"] = source_port_col + "_" + sink_port_col
         df_atten["Current Attenuation(dB)"] = df_raw_data["Optical Attenuation (dB)"]
-        df_atten["Remark"] = df_atten["Current Attenuation(dB)"].apply(
-            lambda x: "" if self.is_castable_to_float(x) else "Fiber Break"
-        )
+        df_atten["Remark"] = self.fiber_break_remark(df_atten["Current Attenuation(dB)"])
         return df_atten
 
     def calculate_eol_diff(self, df_eol: pd.DataFrame) -> pd.DataFrame:
@@ -153,17 +222,56 @@ class EOLAnalyzer(LossAnalyzer):
             df_result = self.calculate_eol_diff(joined_df)
             return df_result
         return pd.DataFrame()
-    
+
+    @staticmethod
+    def eol_status(df_result: pd.DataFrame) -> pd.Series:
+        """
+        สถานะต่อ link (Categorical ตาม EOL_STATUSES) แบบ vectorized
+        Remark ไม่ว่าง → EOL Fiber Break, Loss current - Loss EOL ≥ 2.5 → EOL Excess Loss, อื่น ๆ → EOL Normal
+        """
+        diff = pd.to_numeric(df_result["Loss current - Loss EOL"], errors="coerce")
+        remark = df_result["Remark"].fillna("").astype(str).str.strip()
+        codes = np.select([remark.ne("").to_numpy(), (diff >= EOL_LIMIT).to_numpy()], [2, 1], default=0)
+        return pd.Series(pd.Categorical.from_codes(codes, categories=EOL_STATUSES),
+                         index=df_result.index, name="Status")
+
+    # ---------- COMPUTE: attenuation pipeline (ไม่มี st.* → memo ข้าม rerun / หน้า / session ได้) ----------
+    def _memo_key(self) -> tuple:
+        ref_version = self._ref_version or memo.frame_digest(self.df_ref)
+        return ("atten", self.VERSION, memo.frame_digest(self.df_raw_data), ref_version)
+
+    def _compute(self) -> dict:
+        df_result = self.build_result_df()
+        if "Remark" in df_result.columns:
+            df_result["Remark"] = df_result["Remark"].fillna("")
+        if df_result.empty:
+            status = pd.Series(pd.Categorical([], categories=EOL_STATUSES), name="Status")
+        else:
+            status = self.eol_status(df_result)
+        df_core = self.calculate_loss_between_core(df_result) if not df_result.empty else \
+            pd.DataFrame(columns=["Link Name", "Loss between core"])
+        return {
+            "df_result": df_result,                                # merge กับ EOL reference + diff
+            "status": status,                                      # สถานะ EOL ต่อ link
+            "df_core": df_core,                                    # คู่ Loss between core
+            "core_status": self.core_status(df_core["Loss between core"]),
+        }
+
+    def compute(self) -> dict:
+        """
+        ผลของ attenuation pipeline: merge กับ reference ครั้งเดียวต่อ (dataset, version ของ EOL.xlsx)
+        แล้วได้ทั้ง EOL diff และคู่ Loss between core → หน้า EOL, หน้า Core, Dashboard และ Summary
+        (EOLAnalyzer / CoreAnalyzer) ใช้ผลชุดเดียวกันใน utils.memo — ห้ามแก้ไข frame ที่ได้
+        """
+        return memo.get_or_compute(self._memo_key(), self._compute)
+
     def get_me_names(self, df_result: pd.DataFrame) -> list[str]:
         link_names = df_result["Link Name"].astype(str).tolist()
         me_names = [name.split("-")[0] if "-" in name else name for name in link_names]
         return list(sorted(set(me_names)))  # ✅ unique + sorted
     
     def get_filtered_result(self, df_result: pd.DataFrame, selected_me_name: str) -> pd.DataFrame:
-        if not selected_me_name:
-            return df_result.reset_index(drop=True)
-        mask = df_result["Link Name"].astype(str).str.contains(selected_me_name, na=False)
-        return df_result[mask].reset_index(drop=True)
+        return df_result[self._me_mask(df_result, selected_me_name)].reset_index(drop=True)
     
     def get_selected_me_name(self, df_result):
         me_names = self.get_me_names(df_result)
@@ -178,17 +286,17 @@ class EOLAnalyzer(LossAnalyzer):
 
     def process(self, show_table: bool = True, enable_filter: bool = True):   # ✅ เพิ่ม enable_filter
         if self.df_ref is not None and self.df_raw_data is not None:
-            df_result = self.build_result_df()
+            state = self.compute()
+            df_result, status = state["df_result"], state["status"]
 
             if enable_filter:
                 selected_me_name = self.get_selected_me_name(df_result)
-                df_filtered = self.get_filtered_result(df_result, selected_me_name)
+                mask = self._me_mask(df_result, selected_me_name).to_numpy()
+                df_filtered = df_result[mask].reset_index(drop=True)
+                status = status[mask].reset_index(drop=True)
             else:
                 df_filtered = df_result
 
-            if "Remark" in df_filtered.columns:
-                df_filtered["Remark"] = df_filtered["Remark"].fillna("")
-
             # ---------- ตารางหลัก ----------
             if show_table:
                 st.dataframe(df_filtered.style.apply(self.isDiffError, axis=1), hide_index=True)
@@ -197,20 +305,7 @@ class EOLAnalyzer(LossAnalyzer):
             # ... (ส่วน KPI, Donut, Problem list เหมือนเดิม)
 
             # ---------- KPI ----------
-            status_list = []
-            for _, row in df_filtered.iterrows():
-                val = pd.to_numeric(row.get("Loss current - Loss EOL"), errors="coerce")
-                remark = str(row.get("Remark", "")).strip()
-
-                if remark != "":
-                    status_list.append("EOL Fiber Break")
-                elif pd.notna(val) and val >= 2.5:
-                    status_list.append("EOL Excess Loss")
-                else:
-                    status_list.append("EOL Normal")
-
-            df_status = pd.DataFrame({"Status": status_list})
-            summary_counts = df_status["Status"].value_counts()
+            summary_counts = status.value_counts()
 
             normal_cnt = int(summary_counts.get("EOL Normal", 0))
             excess_cnt = int(summary_counts.get("EOL Excess Loss", 0))
@@ -226,8 +321,9 @@ class EOLAnalyzer(LossAnalyzer):
 
             # ---------- Donut ----------
             fig = px.pie(
-                df_status,
+                self.status_counts(status),
                 names="Status",
+                values="Count",
                 hole=0.5,
                 color="Status",
                 color_discrete_map={
@@ -248,7 +344,8 @@ class EOLAnalyzer(LossAnalyzer):
 
             # ---------- Problem Links ----------
             st.subheader("EOL Excess Loss")
-            df_excess = df_filtered.loc[[s == "EOL Excess Loss" for s in status_list]].reset_index(drop=True)
+            tables = self.split_status(df_filtered, status, ["EOL Excess Loss", "EOL Fiber Break"])
+            df_excess = tables["EOL Excess Loss"]
             if df_excess.empty:
                 st.success("No EOL Excess Loss links found.")
             else:
@@ -264,7 +361,7 @@ class EOLAnalyzer(LossAnalyzer):
 
             # ---------------- EOL Fiber Break ----------------
             st.subheader("EOL Fiber Break")
-            df_break = df_filtered.loc[[s == "EOL Fiber Break" for s in status_list]].reset_index(drop=True)
+            df_break = tables["EOL Fiber Break"]
             if df_break.empty:
                 st.success("No EOL Fiber Break links found.")
             else:
@@ -279,10 +376,7 @@ class EOLAnalyzer(LossAnalyzer):
                     hide_index=True,
                     use_container_width=True
                 )
-            self.abnormal_tables = {
-                "EOL Excess Loss": df_excess,
-                "EOL Fiber Break": df_break,
-            }               
+            self.abnormal_tables = tables
 
     @property
     def df_abnormal(self):
@@ -304,43 +398,25 @@ class EOLAnalyzer(LossAnalyzer):
         โดยไม่ render UI
         """
         if self.df_ref is not None and self.df_raw_data is not None:
-            df_result = self.build_result_df()
+            state = self.compute()
+            df_result = state["df_result"]
             print("[DEBUG][EOL] build_result_df shape:", df_result.shape)
 
-            status_list = []
-            for _, row in df_result.iterrows():
-                val = pd.to_numeric(row.get("Loss current - Loss EOL"), errors="coerce")
-                remark = str(row.get("Remark", "")).strip()
-                if remark != "":
-                    status_list.append("EOL Fiber Break")
-                elif pd.notna(val) and val >= 2.5:
-                    status_list.append("EOL Excess Loss")
-                else:
-                    status_list.append("EOL Normal")
-
-            df_excess = df_result.loc[[s == "EOL Excess Loss" for s in status_list]].reset_index(drop=True)
-            df_break  = df_result.loc[[s == "EOL Fiber Break" for s in status_list]].reset_index(drop=True)
-
-            self.abnormal_tables = {
-                "EOL Excess Loss": df_excess,
-                "EOL Fiber Break": df_break,
-            }
+            self.abnormal_tables = self.split_status(df_result, state["status"], ["EOL Excess Loss", "EOL Fiber Break"])
 
-            print(f"[DEBUG][EOL] Excess={len(df_excess)}, Break={len(df_break)}")
+            print(f"[DEBUG][EOL] Excess={len(self.abnormal_tables['EOL Excess Loss'])}, "
+                  f"Break={len(self.abnormal_tables['EOL Fiber Break'])}")
 
 
 class CoreAnalyzer(EOLAnalyzer):
-    def calculate_loss_between_core(self, df_result: pd.DataFrame) -> pd.DataFrame:
-        forward_direction = df_result["Loss current - Loss EOL"].iloc[::2].values
-        reverse_direction = df_result["Loss current - Loss EOL"].iloc[1::2].values
-        loss_between_core = [abs(f - r) for f, r in zip(forward_direction, reverse_direction)]
-        loss_between_core = ["--" if pd.isna(value) else round(value, 2) for value in loss_between_core]
+    def core_tables(self, df_core: pd.DataFrame, status: pd.Series) -> dict:
+        """{Core Loss Excess, Core Fiber Break} จาก calculate_loss_between_core + core_status"""
+        tables = self.split_status(df_core, status, ["Core Loss Excess", "Core Fiber Break"])
+        excess = tables["Core Loss Excess"]
+        excess["Loss between core"] = pd.to_numeric(excess["Loss between core"], downcast="float")
+        tables["Core Fiber Break"]["Loss between core"] = "Fiber Break"
+        return tables
 
-        df_loss_between_core = pd.DataFrame()
-        df_loss_between_core["Link Name"] = df_result["Link Name"]
-        df_loss_between_core["Loss between core"] = [x for x in loss_between_core for _ in range(2)]
-        return df_loss_between_core
-    
     @staticmethod
     def getColorCondition(value, threshold=3) -> str:
         if value == "--":
@@ -405,16 +481,18 @@ class CoreAnalyzer(EOLAnalyzer):
 
     def process(self, show_table: bool = True, enable_filter: bool = True):   # ✅ เพิ่ม enable_filter
         if self.df_ref is not None and self.df_raw_data is not None:
-            df_result = self.build_result_df()
+            state = self.compute()
+            df_result = state["df_result"]
+            df_loss_between_core, status = state["df_core"], state["core_status"]
 
-            # ✅ เลือกว่าจะ filter หรือไม่
+            # ✅ เลือกว่าจะ filter หรือไม่ (คู่ของ Loss between core จับจากแถวที่เหลือหลัง filter)
             if enable_filter:
                 selected_me_name = self.get_selected_me_name(df_result)
-                df_filtered = self.get_filtered_result(df_result, selected_me_name)
-            else:
-                df_filtered = df_result
+                if selected_me_name:
+                    df_filtered = self.get_filtered_result(df_result, selected_me_name)
+                    df_loss_between_core = self.calculate_loss_between_core(df_filtered)
+                    status = self.core_status(df_loss_between_core["Loss between core"])
 
-            df_loss_between_core = self.calculate_loss_between_core(df_filtered)
             link_names  = df_loss_between_core["Link Name"].tolist()
             loss_values = df_loss_between_core["Loss between core"].tolist()
 
@@ -438,17 +516,7 @@ class CoreAnalyzer(EOLAnalyzer):
                 """, unsafe_allow_html=True)
 
             # ---------- KPI ----------
-            status_list = []
-            for v in loss_values:
-                if v == "--":
-                    status_list.append("Core Fiber Break")
-                elif pd.notna(v) and v > 3:
-                    status_list.append("Core Loss Excess")
-                else:
-                    status_list.append("Core Normal")
-
-            df_summary = pd.DataFrame({"Status": status_list})
-            summary_counts = df_summary["Status"].value_counts()
+            summary_counts = status.value_counts()
 
             ok_cnt    = int(summary_counts.get("Core Normal", 0))
             notok_cnt = int(summary_counts.get("Core Loss Excess", 0))
@@ -464,8 +532,9 @@ class CoreAnalyzer(EOLAnalyzer):
 
             # ---------- Donut ----------
             fig = px.pie(
-                df_summary, 
-                names="Status", 
+                self.status_counts(status),
+                names="Status",
+                values="Count",
                 hole=0.5, 
                 color="Status",
                 color_discrete_map={
@@ -487,11 +556,7 @@ class CoreAnalyzer(EOLAnalyzer):
             
             # ---------- Problem Links ----------
             st.markdown("### Problem Links")
-            df_problem = pd.DataFrame({
-                "Link Name": link_names,
-                "Loss between core": loss_values,
-                "Status": status_list
-            })
+            df_problem = df_loss_between_core.assign(Status=status.to_numpy())
 
             # ✅ สไตล์: สลับสีทั้งแถวเป็นคู่ (A→B, B→A)
             def style_pair(row):
@@ -509,10 +574,8 @@ class CoreAnalyzer(EOLAnalyzer):
            
             # ---------------- Core Loss Excess ----------------
             st.subheader("Core Loss Excess")
-            df_loss = pd.DataFrame({
-                "Link Name": [ln for ln, stt in zip(link_names, status_list) if stt == "Core Loss Excess"],
-                "Loss between core": [lv for lv, stt in zip(loss_values, status_list) if stt == "Core Loss Excess"]
-            }).reset_index(drop=True)
+            tables = self.core_tables(df_loss_between_core, status)
+            df_loss = tables["Core Loss Excess"]
 
             if df_loss.empty:
                 st.success("No Core Loss Excess links found.")
@@ -527,13 +590,7 @@ class CoreAnalyzer(EOLAnalyzer):
 
             # ---------------- Core Fiber Break ----------------
             st.subheader("Core Fiber Break")
-            df_break = pd.DataFrame({
-                "Link Name": [ln for ln, stt in zip(link_names, status_list) if stt == "Core Fiber Break"],
-                "Loss between core": [
-                    "Fiber Break" if lv == "--" else lv
-                    for lv, stt in zip(loss_values, status_list) if stt == "Core Fiber Break"
-                ]
-            }).reset_index(drop=True)
+            df_break = tables["Core Fiber Break"]
 
             if df_break.empty:
                 st.success("No Core Fiber Break links found.")
@@ -546,10 +603,7 @@ class CoreAnalyzer(EOLAnalyzer):
                     use_container_width=True
                 )
 
-            self.abnormal_tables = {
-                "Core Loss Excess": df_loss,
-                "Core Fiber Break": df_break,
-            }
+            self.abnormal_tables = tables
 
     @property
     def df_abnormal(self):
@@ -570,38 +624,10 @@ class CoreAnalyzer(EOLAnalyzer):
         โดยไม่ render UI
         """
         if self.df_ref is not None and self.df_raw_data is not None:
-            df_result = self.build_result_df()
-            print("[DEBUG][Core] build_result_df shape:", df_result.shape)
+            state = self.compute()
+            print("[DEBUG][Core] build_result_df shape:", state["df_result"].shape)
 
-            df_loss_between_core = self.calculate_loss_between_core(df_result)
-            link_names  = df_loss_between_core["Link Name"].tolist()
-            loss_values = df_loss_between_core["Loss between core"].tolist()
+            self.abnormal_tables = self.core_tables(state["df_core"], state["core_status"])
 
-            status_list = []
-            for v in loss_values:
-                if v == "--":
-                    status_list.append("Core Fiber Break")
-                elif pd.notna(v) and v > 3:
-                    status_list.append("Core Loss Excess")
-                else:
-                    status_list.append("Core Normal")
-
-            df_loss = pd.DataFrame({
-                "Link Name": [ln for ln, stt in zip(link_names, status_list) if stt == "Core Loss Excess"],
-                "Loss between core": [lv for lv, stt in zip(loss_values, status_list) if stt == "Core Loss Excess"]
-            }).reset_index(drop=True)
-
-            df_break = pd.DataFrame({
-                "Link Name": [ln for ln, stt in zip(link_names, status_list) if stt == "Core Fiber Break"],
-                "Loss between core": [
-                    "Fiber Break" if lv == "--" else lv
-                    for lv, stt in zip(loss_values, status_list) if stt == "Core Fiber Break"
-                ]
-            }).reset_index(drop=True)
-
-            self.abnormal_tables = {
-                "Core Loss Excess": df_loss,
-                "Core Fiber Break": df_break,
-            }
-
-            print(f"[DEBUG][Core] LossExcess={len(df_loss)}, Break={len(df_break)}")
+            print(f"[DEBUG][Core] LossExcess={len(self.abnormal_tables['Core Loss Excess'])}, "
+                  f"Break={len(self.abnormal_tables['Core Fiber Break'])}")
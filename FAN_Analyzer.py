@@ -1,6 +1,11 @@
+import numpy as np
 import pandas as pd
 import streamlit as st
 from utils.filters import cascading_filter
+from utils.table_view import paged_table
+from utils import memo, rules
+from utils.reference import ReferenceRegistry, get_registry, normalize_columns
+from utils.mapping import merge_on_mapping
 import altair as alt
 import re
 
@@ -16,13 +21,41 @@ class FAN_Analyzer:
       - สรุปสถานะ Warning/Normal
     """
 
-    def __init__(self, df_fan: pd.DataFrame, df_ref: pd.DataFrame, ns: str = "fan"):
+    # เพิ่มเมื่อแก้ตรรกะใน compute() → ผลใน utils.memo ของเวอร์ชันเก่าจะไม่ถูกใช้
+    VERSION = 2
+
+    COL_MOBJ = "Measure Object"
+    COL_VALUE = "Value of Fan Rotate Speed(Rps)"
+
+    # กฎ NOT OK: Measure Object มีคำว่า FanType → ความเร็วพัดลม (Rps) ต้องไม่เกินค่านี้
+    FAN_RULES = {"FCC": 120, "FCPP": 250, "FCPL": 120, "FCPS": 230}
+
+    # กฎ abnormal (utils.rules) — ตาราง, banner, abnormal, Summary และ PDF ใช้ชุดเดียวกัน
+    RULES = rules.RuleSet([
+        rules.where(COL_VALUE, lambda df: FAN_Analyzer._not_ok_mask(df), name="FAN"),
+    ])
+
+    # Board = ตัดช่วง "-Fan[...]" ออก, Port = ตัวเลขหลัง FanID: (extract ครั้งเดียวได้ทั้งคู่)
+    _BOARD_PORT_RE = r"^(?=(?:.*?FanID:(?P<port>\d+))?)(?:(?P<head>.*?)-Fan\[.*\](?P<tail>.*))?"
+
+    def __init__(self, df_fan: pd.DataFrame, df_ref: pd.DataFrame | None = None, ns: str = "fan",
+                 registry: ReferenceRegistry | None = None):
         self.df_fan = df_fan
+        # ไม่ส่ง df_ref มา → ใช้ reference จาก registry (อ่าน Excel ครั้งเดียวต่อ process)
+        # พร้อม index ของ Mapping ที่สร้างไว้แล้ว
+        self._ref_index = None
+        self._ref_version = None
+        if df_ref is None:
+            table = (registry or get_registry()).get("fan")
+            df_ref, self._ref_index = table.frame(), table.mapping_index
+            self._ref_version = table.version
         self.df_ref = df_ref
+        self.df_unmatched = pd.DataFrame()  # key ที่ไม่เจอใน reference
         self.ns = ns
 
         self.df_abnormal = pd.DataFrame()   # abnormal table
         self.df_abnormal_by_type = {}       # abnormal table แยกตาม FanType
+        self.df_result = None               # ทุกพัดลมหลัง merge (prepare) → utils.device_history
 
         # ชื่อคอลัมน์หลัก
         self.COL_ME = "ME"
@@ -34,14 +67,46 @@ class FAN_Analyzer:
         self.COL_MIN_TH = "Minimum threshold"
 
     # ---------- Utilities ----------
+    _normalize_columns = staticmethod(normalize_columns)
+
     @staticmethod
-    def _normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
-        df.columns = (
-            df.columns.astype(str)
-            .str.strip().str.replace(r"\s+", " ", regex=True)
-            .str.replace("\u00a0", " ")
-        )
-        return df
+    def _as_float(values: pd.Series) -> pd.Series:
+        """float(value) ทั้งคอลัมน์ (แปลงไม่ได้ → NaN)"""
+        if pd.api.types.is_numeric_dtype(values):
+            return values.astype(float)
+        num = pd.to_numeric(values, errors="coerce").astype(float)
+        # ค่าที่ to_numeric ไม่รับแต่ float() รับ (เช่น "1_000") → แปลงทีละค่าเฉพาะส่วนนี้
+        left = num.isna() & values.notna()
+        if left.any():
+            def _f(x):
+                try:
+                    return float(x)
+                except Exception:
+                    return float("nan")
+            num[left] = values[left].map(_f).astype(float)
+        return num
+
+    @classmethod
+    def _not_ok_mask(cls, df: pd.DataFrame) -> pd.Series:
+        """_is_not_ok_rule ทั้ง frame: หาเพดานต่อ Measure Object ที่ไม่ซ้ำ แล้วเทียบตัวเลขครั้งเดียว"""
+        codes, uniques = pd.factorize(df[cls.COL_MOBJ])
+        mo = pd.Series(uniques, dtype=object).astype(str)
+        limit = pd.Series(float("inf"), index=mo.index)
+        for kw, max_rps in cls.FAN_RULES.items():
+            limit[mo.str.contains(kw, regex=False)] = limit.clip(upper=max_rps)
+        row_limit = np.append(limit.to_numpy(), float("inf"))[codes]  # code -1 (NaN) → inf
+        return pd.Series(cls._as_float(df[cls.COL_VALUE]).to_numpy() > row_limit, index=df.index)
+
+    def _board_port(self, mobj: pd.Series) -> tuple[pd.Series, pd.Series]:
+        """extract_board / extract_port ทั้งคอลัมน์ (str.extract ครั้งเดียวบนค่าไม่ซ้ำ)"""
+        codes, uniques = pd.factorize(mobj)
+        u = pd.Series(uniques, dtype=object)
+        is_str = u.map(lambda x: isinstance(x, str)).astype(bool)
+        parts = u.where(is_str).str.extract(self._BOARD_PORT_RE)
+        board = (parts["head"] + parts["tail"]).where(parts["head"].notna(), u)
+        board = np.append(board.where(is_str, "").to_numpy(dtype=object), "")  # code -1 (NaN) → ""
+        port = np.append(parts["port"].where(is_str & parts["port"].notna(), "").to_numpy(dtype=object), "")
+        return pd.Series(board[codes], index=mobj.index), pd.Series(port[codes], index=mobj.index)
 
     @staticmethod
     def extract_board(mobj: str) -> str:
@@ -63,21 +128,12 @@ class FAN_Analyzer:
             raise ValueError(f"Uploaded file must contain columns: {', '.join(sorted(required_cols))}")
 
     def _merge_with_ref(self) -> pd.DataFrame:
-        self.df_fan["Mapping Format"] = (
-            self.df_fan[self.COL_ME].astype(str).str.strip()
-            + self.df_fan[self.COL_MOBJ].astype(str).str.strip()
-        )
-
         df_ref_subset = self.df_ref[["Mapping", "Site Name", self.COL_MAX_TH, self.COL_MIN_TH]].copy()
         df_ref_subset["Mapping"] = df_ref_subset["Mapping"].astype(str).str.strip()
         df_ref_subset["order"] = range(len(df_ref_subset))
 
-        df_merged = pd.merge(
-            self.df_fan,
-            df_ref_subset,
-            left_on="Mapping Format",
-            right_on="Mapping",
-            how="inner"
+        df_merged, self.df_unmatched = merge_on_mapping(
+            self.df_fan, df_ref_subset, list(df_ref_subset.columns), index=self._ref_index
         )
         return df_merged
 
@@ -89,38 +145,18 @@ class FAN_Analyzer:
             return False
 
         mo = str(measure_object)
-        if "FCC" in mo and v > 120:
-            return True
-        if "FCPP" in mo and v > 250:
-            return True
-        if "FCPL" in mo and v > 120:
-            return True
-        if "FCPS" in mo and v > 230:
-            return True
-        return False
+        return any(kw in mo and v > max_rps for kw, max_rps in FAN_Analyzer.FAN_RULES.items())
 
     def _style_dataframe(self, df_view: pd.DataFrame):
         if self.COL_VALUE in df_view.columns:
             df_view[self.COL_VALUE] = pd.to_numeric(df_view[self.COL_VALUE], errors="coerce")
 
-        highlight_mask = df_view.apply(
-            lambda r: self._is_not_ok_rule(r[self.COL_MOBJ], r[self.COL_VALUE]),
-            axis=1
-        )
-
-        def gray_row(r):
-            return ['background-color:#e6e6e6;color:black' if highlight_mask.iloc[r.name] else '' for _ in r]
-
-        def red_value(_):
-            return ['background-color:#ff4d4d;color:white' if m else '' for m in highlight_mask]
-
+        violations = self.RULES.evaluate(df_view)
         styled_df = (
-            df_view.style
-            .apply(gray_row, axis=1)
-            .apply(red_value, subset=[self.COL_VALUE] if self.COL_VALUE in df_view.columns else [])
+            violations.style(df_view.style)
             .format({self.COL_VALUE: "{:.2f}"})
         )
-        return styled_df, highlight_mask
+        return styled_df, violations.rows
 
     # ---------- Chart ----------
     def _plot_chart(self, df_sub: pd.DataFrame, ftype: str, height: int, th: float):
@@ -147,11 +183,13 @@ class FAN_Analyzer:
         )
         return chart_bar + chart_text
 
-    # ---------- MAIN ----------
-    def process(self) -> pd.DataFrame:
-        self.df_abnormal = pd.DataFrame()
-        self.df_abnormal_by_type = {}
+    # ---------- COMPUTE (ไม่มี st.* → memo ข้าม rerun ได้) ----------
+    def _memo_key(self) -> tuple:
+        ref_version = self._ref_version or memo.frame_digest(self.df_ref)
+        return ("fan", self.VERSION, memo.frame_digest(self.df_fan), ref_version)
 
+    def compute(self) -> dict:
+        """normalize → merge → FanType/Board/Port + ค่าเฉลี่ยต่อ board + abnormal ต่อ FanType"""
         # Normalize
         self.df_fan = self._normalize_columns(self.df_fan)
         self.df_ref = self._normalize_columns(self.df_ref)
@@ -161,9 +199,10 @@ class FAN_Analyzer:
 
         # Merge with reference
         df_merged = self._merge_with_ref()
+        state = {"df_result": None, "df_unmatched": self.df_unmatched,
+                 "df_abnormal": pd.DataFrame(), "df_abnormal_by_type": {}}
         if df_merged.empty:
-            st.info("No matching mapping found between FAN file and reference")
-            return pd.DataFrame()
+            return state
 
         # Build df_result
         df_result = df_merged[[
@@ -173,6 +212,66 @@ class FAN_Analyzer:
 
         df_result = df_result.sort_values("order").drop(columns=["order"]).reset_index(drop=True)
 
+        # Add FanType, Board, Port (แยก frame → ตารางหลักแสดงคอลัมน์เหมือนเดิม)
+        df_full = df_result.copy()
+        df_full["FanType"] = df_full[self.COL_MOBJ].str.extract(r"(FCC|FCPP|FCPL|FCPS)")
+        df_full["Board"], df_full["Port"] = self._board_port(df_full[self.COL_MOBJ])
+
+        # Average by group
+        df_avg = (
+            df_full
+            .groupby(["FanType", self.COL_ME, "Site Name", "Board"], as_index=False)[self.COL_VALUE]
+            .mean()
+            .rename(columns={self.COL_VALUE: "Avg Fan Speed (Rps)"})
+        )
+        df_avg["Site-Obj"] = df_avg["Site Name"].astype(str) + " - " + df_avg["Board"].astype(str)
+
+        # Abnormal table (per FanType ที่มีกราฟ)
+        ab_mask_all = self.RULES.evaluate(df_full).rows
+        df_abnormal = pd.DataFrame()
+        by_type = {}
+        for ftype in self.FAN_RULES:
+            if not (df_avg["FanType"] == ftype).any():
+                continue
+            df_main = df_full[df_full[self.COL_MOBJ].str.contains(ftype)]
+            ab_mask = ab_mask_all[df_main.index]
+            if not ab_mask.any():
+                continue
+
+            df_abn = df_main.loc[ab_mask, [
+                "Site Name", self.COL_ME, self.COL_MOBJ,
+                self.COL_MAX_TH, self.COL_MIN_TH, self.COL_VALUE
+            ]].copy()
+
+            df_abn[self.COL_VALUE] = pd.to_numeric(df_abn[self.COL_VALUE], errors="coerce").round(2)
+            df_abn[self.COL_MAX_TH] = pd.to_numeric(df_abn[self.COL_MAX_TH], errors="coerce").round(2)
+            df_abn[self.COL_MIN_TH] = pd.to_numeric(df_abn[self.COL_MIN_TH], errors="coerce").round(2)
+
+            # เก็บ abnormal
+            df_abnormal = pd.concat([df_abnormal, df_abn], ignore_index=True)
+            by_type[ftype] = df_abn.copy()
+
+        state.update({
+            "df_result": df_result,
+            "df_full": df_full,
+            "df_avg": df_avg,
+            "df_abnormal": df_abnormal,
+            "df_abnormal_by_type": by_type,
+        })
+        return state
+
+    # ---------- MAIN ----------
+    def process(self) -> pd.DataFrame:
+        state = memo.get_or_compute(self._memo_key(), self.compute)
+        self.df_unmatched = state["df_unmatched"]
+        self.df_abnormal = state["df_abnormal"]
+        self.df_abnormal_by_type = state["df_abnormal_by_type"]
+
+        df_result = state["df_result"]
+        if df_result is None:
+            st.info("No matching mapping found between FAN file and reference")
+            return pd.DataFrame()
+
         # Filtering
         df_filtered, _sel = cascading_filter(
             df_result,
@@ -182,82 +281,43 @@ class FAN_Analyzer:
         )
         st.caption(f"FAN (showing {len(df_filtered)}/{len(df_result)} rows)")
 
-        # Style table
-        styled_df, highlight_mask = self._style_dataframe(df_filtered.copy())
+        # Style table (แบ่งหน้า → style เฉพาะหน้าที่เห็น)
         st.markdown("### FAN Performance (Main Table)")
-        st.dataframe(styled_df, use_container_width=True)
+        paged_table(df_filtered, ns=self.ns, style=self._style_dataframe, file_name="fan_performance.csv")
 
         # Status text
+        failed = self.RULES.evaluate(df_filtered).any()
         st.markdown(
             "<div style='text-align:center; font-size:32px; font-weight:bold; color:{};'>FAN Performance {}</div>".format(
-                "red" if highlight_mask.any() else "green",
-                "Warning" if highlight_mask.any() else "Normal"
+                "red" if failed else "green",
+                "Warning" if failed else "Normal"
             ),
             unsafe_allow_html=True
         )
         st.markdown("<br><br>", unsafe_allow_html=True)
 
-        # Add FanType, Board, Port
-        df_result["FanType"] = df_result[self.COL_MOBJ].str.extract(r"(FCC|FCPP|FCPL|FCPS)")
-        df_result["Board"] = df_result[self.COL_MOBJ].apply(self.extract_board)
-        df_result["Port"] = df_result[self.COL_MOBJ].apply(self.extract_port)
-
-        # Average by group
-        df_avg = (
-            df_result
-            .groupby(["FanType", self.COL_ME, "Site Name", "Board"], as_index=False)[self.COL_VALUE]
-            .mean()
-            .rename(columns={self.COL_VALUE: "Avg Fan Speed (Rps)"})
-        )
-        df_avg["Site-Obj"] = df_avg["Site Name"].astype(str) + " - " + df_avg["Board"].astype(str)
-
-        # Thresholds
-        thresholds = {"FCC": 120, "FCPP": 250, "FCPL": 120, "FCPS": 230}
+        df_avg = state["df_avg"]
 
         # Abnormal table (per FanType)
-        def show_abnormal_from_main(df_main: pd.DataFrame, title: str):
-            st.markdown(f"#### {title} – Abnormal Rows")
-            ab_mask = df_main.apply(
-                lambda r: self._is_not_ok_rule(r[self.COL_MOBJ], r[self.COL_VALUE]),
-                axis=1
-            )
-
-            if not ab_mask.any():
+        def show_abnormal(ftype: str):
+            st.markdown(f"#### {ftype} – Abnormal Rows")
+            df_abn = self.df_abnormal_by_type.get(ftype)
+            if df_abn is None:
                 st.info(" No abnormal rows (Normal)")
                 return
 
-            df_abn = df_main.loc[ab_mask, [
-                "Site Name", self.COL_ME, self.COL_MOBJ,
-                self.COL_MAX_TH, self.COL_MIN_TH, self.COL_VALUE
-            ]].copy()
-
-            df_abn[self.COL_VALUE] = pd.to_numeric(df_abn[self.COL_VALUE], errors="coerce").round(2)
-            df_abn[self.COL_MAX_TH] = pd.to_numeric(df_abn[self.COL_MAX_TH], errors="coerce").round(2)
-            df_abn[self.COL_MIN_TH] = pd.to_numeric(df_abn[self.COL_MIN_TH], errors="coerce").round(2)
-
-            # เก็บ abnormal
-            self.df_abnormal = pd.concat([self.df_abnormal, df_abn], ignore_index=True)
-            self.df_abnormal_by_type[ftype] = df_abn.copy()
-
             st.write("DEBUG FAN_Analyzer df_abnormal_by_type keys:", list(self.df_abnormal_by_type.keys()))
 
-            # highlight Value column
-            def highlight_red(val):
-                try:
-                    v = float(val)
-                    return "background-color: #ff4d4d; color: white" if v > 0 else ""
-                except Exception:
-                    return ""
-
+            # highlight Value column (ทุกแถวในตารางนี้ผิดกฎอยู่แล้ว)
             styled_abn = (
                 df_abn.style
-                .applymap(highlight_red, subset=[self.COL_VALUE])
+                .set_properties(subset=[self.COL_VALUE], **{"background-color": "#ff4d4d", "color": "white"})
                 .format({self.COL_VALUE: "{:.2f}"})
             )
             st.dataframe(styled_abn, use_container_width=True)
 
         # Loop per FanType
-        for ftype, th in thresholds.items():
+        for ftype, th in self.FAN_RULES.items():
             df_sub = df_avg[df_avg["FanType"] == ftype].copy()
             if df_sub.empty:
                 continue
@@ -280,11 +340,11 @@ class FAN_Analyzer:
                                 use_container_width=True)
 
             # abnormal table
-            show_abnormal_from_main(df_result[df_result[self.COL_MOBJ].str.contains(ftype)], ftype)
+            show_abnormal(ftype)
             st.markdown("<br><br><br><br>", unsafe_allow_html=True)
 
         st.write("DEBUG df_abnormal", self.df_abnormal)
-        return df_result
+        return state["df_full"]
     
     def prepare(self) -> pd.DataFrame:
         """
@@ -313,30 +373,26 @@ class FAN_Analyzer:
 
         # 5) Add FanType, Board, Port
         df_result["FanType"] = df_result[self.COL_MOBJ].str.extract(r"(FCC|FCPP|FCPL|FCPS)")
-        df_result["Board"] = df_result[self.COL_MOBJ].apply(self.extract_board)
-        df_result["Port"] = df_result[self.COL_MOBJ].apply(self.extract_port)
+        df_result["Board"], df_result["Port"] = self._board_port(df_result[self.COL_MOBJ])
 
         # 6) Detect abnormal (รวมทั้งหมด)
-        ab_mask_all = df_result.apply(
-            lambda r: self._is_not_ok_rule(r[self.COL_MOBJ], r[self.COL_VALUE]),
-            axis=1
-        )
+        ab_mask_all = self.RULES.evaluate(df_result).rows
+        self.df_result = df_result
 
         self.df_abnormal = df_result.loc[ab_mask_all].copy()
 
         # 7) Detect abnormal แยกตาม FanType
         self.df_abnormal_by_type = {}
-        thresholds = {"FCC": 120, "FCPP": 250, "FCPL": 120, "FCPS": 230}
-        for ftype, th in thresholds.items():
+        for ftype in self.FAN_RULES:
             df_sub = df_result[df_result["FanType"] == ftype].copy()
             if df_sub.empty:
                 continue
 
-            ab_mask = df_sub.apply(
-                lambda r: self._is_not_ok_rule(r[self.COL_MOBJ], r[self.COL_VALUE]),
-                axis=1
-            )
+            ab_mask = ab_mask_all[df_sub.index]
             if ab_mask.any():
                 self.df_abnormal_by_type[ftype] = df_sub.loc[ab_mask].copy()
 
         return df_result
+
+
+rules.register("FAN", FAN_Analyzer.RULES)
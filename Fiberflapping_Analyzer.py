@@ -1,13 +1,94 @@
 import re
+from bisect import bisect_right
 from collections import OrderedDict  # NEW: สำหรับเก็บตารางรายวันแบบเรียงลำดับ
+import numpy as np
 import pandas as pd
 import streamlit as st
 import plotly.express as px
+from utils import flapping_store, memo
 from utils.filters import cascading_filter
+from utils.table_view import paged_table
+from utils.reference import ReferenceRegistry, get_registry
 
 # หมายเหตุ: ต้องมีฟังก์ชัน cascading_filter(df, cols, ns, labels=None, clear_text="...") อยู่ภายนอกให้เรียกใช้งานได้
 
 
+def _to_ns(values) -> tuple[np.ndarray, np.ndarray]:
+    """datetime → (int64 ns, mask ที่ไม่ใช่ NaT) — NaT เทียบกับอะไรก็ไม่ match"""
+    arr = pd.Series(values).to_numpy(dtype="datetime64[ns]")
+    return arr.view("int64"), ~np.isnat(arr)
+
+
+class _AlarmIndex:
+    """
+    FM alarm จัดกลุ่มตามข้อความ Link (Link เดียวกัน = code เดียว) สำหรับ find_nomatch
+      - links_with(text): code ของ Link ที่มี text เป็น substring (เหมือน str.contains(re.escape(text)))
+      - any_overlap(codes, begin, end): ต่อช่วงเวลา มี alarm ของ codes ที่ Occurrence <= end และ Clear >= begin ไหม
+    alarm ที่ Link ว่าง หรือ Occurrence/Clear เป็น NaT ไม่มีทาง match → ตัดทิ้งตั้งแต่ตอนสร้าง index
+    """
+
+    _SEP = "\x00"
+
+    def __init__(self, links: pd.Series, occurrence, clear):
+        codes, uniques = pd.factorize(links)
+        occ, occ_ok = _to_ns(occurrence)
+        clr, clr_ok = _to_ns(clear)
+        keep = (codes >= 0) & occ_ok & clr_ok
+        codes, occ, clr = codes[keep], occ[keep], clr[keep]
+
+        # เรียงตาม (Link, Occurrence) → alarm ของแต่ละ Link อยู่ติดกันและเรียงเวลาแล้ว
+        order = np.lexsort((occ, codes))
+        self.occ, self.clr = occ[order], clr[order]
+        self.bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+
+        # ต่อ Link ทุกตัวเป็นสตริงเดียว → หา substring ด้วย str.find ครั้งละตัว แทน regex ทั้งคอลัมน์
+        self.links = [str(u) for u in uniques]
+        self.starts = []
+        pos = 0
+        for link in self.links:
+            self.starts.append(pos)
+            pos += len(link) + 1
+        self.joined = self._SEP.join(self.links)
+        self._found: dict = {}
+
+    def links_with(self, text: str) -> np.ndarray:
+        hit = self._found.get(text)
+        if hit is not None:
+            return hit
+        if not text:
+            hit = np.arange(len(self.links))
+        elif self._SEP in text:
+            hit = np.array([i for i, link in enumerate(self.links) if text in link], dtype=np.intp)
+        else:
+            found, n = [], len(self.links)
+            pos = self.joined.find(text)
+            while pos >= 0:
+                i = bisect_right(self.starts, pos) - 1
+                found.append(i)
+                if i + 1 >= n:
+                    break
+                pos = self.joined.find(text, self.starts[i + 1])
+            hit = np.array(found, dtype=np.intp)
+        self._found[text] = hit
+        return hit
+
+    def any_overlap(self, codes: np.ndarray, begin: np.ndarray, end: np.ndarray) -> np.ndarray:
+        if len(codes) == 0:
+            return np.zeros(len(begin), dtype=bool)
+        parts = [slice(self.bounds[c], self.bounds[c + 1]) for c in codes]
+        occ = np.concatenate([self.occ[p] for p in parts])
+        clr = np.concatenate([self.clr[p] for p in parts])
+        if len(parts) > 1:
+            order = np.argsort(occ, kind="stable")
+            occ, clr = occ[order], clr[order]
+        if len(occ) == 0:
+            return np.zeros(len(begin), dtype=bool)
+        # alarm ที่ Occurrence <= end คือ occ[:idx] → มีตัวที่ Clear >= begin เมื่อ max(Clear) ของช่วงนั้น >= begin
+        max_clear = np.maximum.accumulate(clr)
+        idx = np.searchsorted(occ, end, side="right")
+        return (idx > 0) & (max_clear[np.maximum(idx - 1, 0)] >= begin)
+
+
 class FiberflappingAnalyzer:
     """
     จัดระเบียบ logic สำหรับ Fiber Flapping:
@@ -20,13 +101,21 @@ class FiberflappingAnalyzer:
     การใช้งาน:
         analyzer = FiberflappingAnalyzer(df_optical, df_fm, threshold=2.0)
         analyzer.process()
+
+    ผล find_nomatch ของแต่ละคู่ OSC+FM ถูก cache (utils.memo) และเก็บลง utils.flapping_store ครั้งเดียว
+    → กราฟ trend หลายสัปดาห์/หลายเดือนอ่านจาก store ไม่ต้องคำนวณวันเก่าใหม่
     """
 
-    def __init__(self, df_optical: pd.DataFrame, df_fm: pd.DataFrame, threshold: float = 2.0, ref_path: str = "data/Flapping.xlsx"):
+    # เพิ่มเมื่อแก้ตรรกะใน compute() → ผลใน utils.memo / flapping_store ของเวอร์ชันเก่าจะไม่ถูกใช้
+    VERSION = 1
+
+    def __init__(self, df_optical: pd.DataFrame, df_fm: pd.DataFrame, threshold: float = 2.0, ref_path: str = "data/Flapping.xlsx",
+                 registry: ReferenceRegistry | None = None):
         self.df_optical_raw = df_optical
         self.df_fm_raw = df_fm
         self.threshold = threshold
         self.ref_path = ref_path
+        self.registry = registry or get_registry()
         self.df_ref = None  # Reference data for site names
         self.daily_tables = None  # NEW: เก็บผลตารางรายวันสำหรับ export/report
 
@@ -34,33 +123,15 @@ class FiberflappingAnalyzer:
 
     # -------------------- Load Reference --------------------
     def _load_reference(self) -> pd.DataFrame:
-        """โหลดไฟล์ reference สำหรับ site names (ลองทั้ง Flapping.xlsx และ flapping.xlsx)"""
-        primary_path = self.ref_path
+        """โหลดไฟล์ reference สำหรับ site names (registry ลองทั้ง Flapping.xlsx และ flapping.xlsx ให้)"""
         try:
-            df_ref = pd.read_excel(primary_path)
-            df_ref.columns = df_ref.columns.str.strip()
-            return df_ref
-        except Exception as e_primary:
-            # fallback: toggle filename case for compatibility
-            alt_path = None
-            if primary_path.endswith("Flapping.xlsx"):
-                alt_path = primary_path.replace("Flapping.xlsx", "flapping.xlsx")
-            elif primary_path.endswith("flapping.xlsx"):
-                alt_path = primary_path.replace("flapping.xlsx", "Flapping.xlsx")
-
-            if alt_path:
-                try:
-                    df_ref = pd.read_excel(alt_path)
-                    df_ref.columns = df_ref.columns.str.strip()
-                    # อัปเดต ref_path เป็นไฟล์ที่อ่านได้สำเร็จ
-                    self.ref_path = alt_path
-                    return df_ref
-                except Exception as e_alt:
-                    st.warning(f"Could not load reference file {primary_path} or fallback {alt_path}: {e_alt}")
-                    return pd.DataFrame()
-            else:
-                st.warning(f"Could not load reference file {primary_path}: {e_primary}")
-                return pd.DataFrame()
+            table = self.registry.get("flapping", self.ref_path)
+            # อัปเดต ref_path เป็นไฟล์ที่อ่านได้สำเร็จ
+            self.ref_path = table.path
+            return table.frame()
+        except Exception as e:
+            st.warning(f"Could not load reference file {self.ref_path}: {e}")
+            return pd.DataFrame()
 
     # -------------------- Normalize / Prepare --------------------
     def normalize_optical(self) -> pd.DataFrame:
@@ -122,26 +193,75 @@ class FiberflappingAnalyzer:
         หาแถวใน df_filtered ที่ 'ไม่เจอ' alarm match:
           - Link column ใน FM ต้อง contains ทั้ง ME และ Target ME
           - และช่วงเวลา overlap: Occurrence <= End และ Clear >= Begin
+        ใช้ _AlarmIndex (Link → alarm เรียงตามเวลา) แทนการสแกน FM ทั้งไฟล์ด้วย regex ทุกแถว
+        """
+        if df_filtered.empty:
+            return pd.DataFrame()
+
+        # ค่าที่ใช้ค้นเป็นข้อความแบบเดียวกับ str(row.get(...)) เดิม (NaN → "nan")
+        def _text(col):
+            if col not in df_filtered.columns:
+                return [""] * len(df_filtered)
+            return [str(v) for v in df_filtered[col].tolist()]
+
+        def _times(col):
+            if col not in df_filtered.columns:
+                return np.zeros(len(df_filtered), dtype=np.int64), np.zeros(len(df_filtered), dtype=bool)
+            return _to_ns(df_filtered[col])
+
+        index = _AlarmIndex(
+            df_fm_norm[link_col].astype(str), df_fm_norm["Occurrence Time"], df_fm_norm["Clear Time"]
+        )
+        begin, begin_ok = _times("Begin Time")
+        end, end_ok = _times("End Time")
+        matched = np.zeros(len(df_filtered), dtype=bool)
+
+        # จัดกลุ่มตามคู่ (ME, Target ME) → หา Link ที่มีทั้งสองค่าครั้งเดียวต่อคู่
+        pairs = pd.DataFrame({"me": _text("ME"), "target": _text("Target ME")})
+        for (me, target), pos in pairs.groupby(["me", "target"], sort=False).indices.items():
+            codes = np.intersect1d(index.links_with(me), index.links_with(target))
+            matched[pos] = index.any_overlap(codes, begin[pos], end[pos])
+
+        matched &= begin_ok & end_ok
+        if matched.all():
+            return pd.DataFrame()
+        return df_filtered[~matched].copy()
+
+    # -------------------- Compute (memo + history store) --------------------
+    def _memo_key(self) -> tuple:
+        try:
+            ref_version = self.registry.get("flapping", self.ref_path).version
+        except Exception:
+            ref_version = None
+        return ("fiber", self.VERSION, memo.frame_digest(self.df_optical_raw), memo.frame_digest(self.df_fm_raw),
+                ref_version, float(self.threshold))
+
+    def compute(self) -> pd.DataFrame:
+        """normalize → กรอง threshold → หา no-match (ไม่ render)"""
+        df_optical_norm = self.normalize_optical()
+        df_fm_norm, link_col = self.normalize_fm()
+        df_filtered = self.filter_optical_by_threshold(df_optical_norm)
+        return self.find_nomatch(df_filtered, df_fm_norm, link_col)
+
+    def nomatch(self) -> pd.DataFrame:
+        """ผลของ compute() ที่ cache ข้าม rerun (ใช้ร่วมกัน → ห้ามแก้ไข frame)"""
+        return memo.get_or_compute(self._memo_key(), self.compute)
+
+    def source_key(self) -> str:
+        """
+        key ของคู่ OSC+FM นี้ใน utils.flapping_store = sha ของไฟล์ + ชื่อ member จาก tag ของ dataset
+        → หน้า Fiber (copy) / Dashboard / worker ได้ source เดียวกัน; frame ที่ไม่มี tag (CLI) ใช้ digest เนื้อหา
         """
-        result_rows = []
-        for _, row in df_filtered.iterrows():
-            me = re.escape(str(row.get("ME", "")))
-            target_me = re.escape(str(row.get("Target ME", "")))
-            begin_t = row.get("Begin Time", pd.NaT)
-            end_t = row.get("End Time", pd.NaT)
-
-            # เงื่อนไขเวลา (ถ้า NaT จะไม่ match)
-            matched = df_fm_norm[
-                df_fm_norm[link_col].astype(str).str.contains(me, na=False)
-                & df_fm_norm[link_col].astype(str).str.contains(target_me, na=False)
-                & (df_fm_norm["Occurrence Time"] <= end_t)
-                & (df_fm_norm["Clear Time"] >= begin_t)
-            ]
-
-            if matched.empty:
-                result_rows.append(row)
-
-        return pd.DataFrame(result_rows)
+        frames = tuple(memo.origin(df) or memo.frame_digest(df) for df in (self.df_optical_raw, self.df_fm_raw))
+        ref_version, threshold = self._memo_key()[4:]
+        return memo.text_digest(repr(("fiber", self.VERSION, *frames, ref_version, threshold)))
+
+    def ingest_history(self) -> str:
+        """เก็บ event ของคู่ OSC+FM นี้ลง flapping_store (ครั้งแรกเท่านั้น) แล้วคืน source key"""
+        source = self.source_key()
+        if not flapping_store.has_source(source):
+            flapping_store.ingest(source, self.nomatch())
+        return source
 
     # -------------------- View Preparation --------------------
     @staticmethod
@@ -188,14 +308,14 @@ class FiberflappingAnalyzer:
         # เตรียมตารางแสดงผล
         df_view = self.prepare_view(df_nomatch_filtered)
 
-        # Highlight เฉพาะคอลัมน์ "Max - Min (dB)" > threshold
-        if "Max - Min (dB)" in df_view.columns:
-            styled_df = (
-                df_view.style
+        # Highlight เฉพาะคอลัมน์ "Max - Min (dB)" > threshold (แบ่งหน้า → style เฉพาะหน้าที่เห็น)
+        def _style(df_page: pd.DataFrame):
+            return (
+                df_page.style
                 .apply(
                     lambda _:
                         ['background-color:#ff4d4d; color:white' if (v > self.threshold) else ''
-                         for v in df_view["Max - Min (dB)"]],
+                         for v in df_page["Max - Min (dB)"]],
                     subset=["Max - Min (dB)"]
                 )
                 .format({
@@ -205,11 +325,13 @@ class FiberflappingAnalyzer:
                     "Max - Min (dB)": "{:.2f}",
                 })
             )
-            st.write(styled_df)
-            
-        else:
-            st.dataframe(df_view, use_container_width=True)
-        
+
+        paged_table(
+            df_view, ns="fiber",
+            style=_style if "Max - Min (dB)" in df_view.columns else None,
+            file_name="fiber_flapping.csv",
+        )
+
         # คืนค่า view
         return df_view
 
@@ -296,6 +418,28 @@ class FiberflappingAnalyzer:
             fig.update_layout(xaxis_tickangle=-45)
             st.plotly_chart(fig, use_container_width=True)
 
+    # -------------------- Trend (history store) --------------------
+    def render_trend(self, ranges=(7, 30, 90)) -> None:
+        """Sites ที่ flapping ต่อวันจาก utils.flapping_store (ทุก upload ที่เคย ingest) + ตารางของวันที่เลือก"""
+        st.markdown("### Fiber Flapping Trend (History)")
+        days = st.radio("Range", list(ranges), format_func=lambda d: f"{d} days", horizontal=True,
+                        key="fiber_trend_days")
+        daily = flapping_store.daily_sites(days=days)
+        if daily.empty:
+            st.info("No Fiber Flapping history yet")
+            return
+
+        fig = px.bar(daily, x="Date", y="Sites", text="Sites",
+                     title=f"Fiber Flapping Sites per Day (last {days} days)")
+        fig.update_traces(textposition="outside")
+        fig.update_layout(xaxis_tickangle=-45)
+        st.plotly_chart(fig, use_container_width=True)
+
+        day = st.selectbox("Show details for", daily["Date"].tolist()[::-1], key="fiber_trend_day")
+        if day is not None:
+            events = flapping_store.load_events(start=day, end=day)
+            st.dataframe(self._select_view_columns(events), use_container_width=True)
+
     # -------------------- Export helper (NEW) --------------------
     @staticmethod
     def _select_view_columns(df: pd.DataFrame) -> pd.DataFrame:
@@ -340,15 +484,14 @@ class FiberflappingAnalyzer:
 
     # -------------------- Orchestration --------------------
     def process(self) -> None:
-        # 1) เตรียมข้อมูล
-        df_optical_norm = self.normalize_optical()
-        df_fm_norm, link_col = self.normalize_fm()
-
-        # 2) กรองตาม threshold
-        df_filtered = self.filter_optical_by_threshold(df_optical_norm)
+        # 1-3) normalize + กรอง threshold + หา no-match (cache ข้าม rerun)
+        df_nomatch = self.nomatch()
 
-        # 3) หา no-match
-        df_nomatch = self.find_nomatch(df_filtered, df_fm_norm, link_col)
+        # เก็บลง history (ครั้งแรกของคู่ OSC+FM นี้)
+        try:
+            self.ingest_history()
+        except Exception as e:
+            st.warning(f"Could not update Fiber Flapping history: {e}")
 
         # 4) ตารางหลัก
         self.render(df_nomatch)
@@ -356,19 +499,15 @@ class FiberflappingAnalyzer:
         # 5) Weekly Summary KPI + กราฟท้ายสุด
         self.render_weekly_summary(df_nomatch)
 
+        # 6) Trend หลายสัปดาห์จาก history
+        self.render_trend()
+
     def prepare(self) -> None:
         """
         เตรียมข้อมูลสำหรับ Summary/PDF (ไม่ render UI)
         """
-        # 1) เตรียมข้อมูล
-        df_optical_norm = self.normalize_optical()
-        df_fm_norm, link_col = self.normalize_fm()
-
-        # 2) กรองตาม threshold
-        df_filtered = self.filter_optical_by_threshold(df_optical_norm)
-
-        # 3) หา no-match
-        df_nomatch = self.find_nomatch(df_filtered, df_fm_norm, link_col)
+        # 1-3) normalize + กรอง threshold + หา no-match (cache ข้าม rerun)
+        df_nomatch = self.nomatch()
 
         # 4) สร้าง abnormal tables
         if not df_nomatch.empty:
@@ -1,11 +1,30 @@
 # line_analyzer.py
-import re
+import numpy as np
 import pandas as pd
 import streamlit as st
 from utils.filters import cascading_filter
+from utils.table_view import paged_table
+from utils import memo, rules, wason_log
+from utils.reference import ReferenceRegistry, get_registry, normalize_columns
+from utils.mapping import merge_on_mapping
 import plotly.express as px
 import plotly.graph_objects as go
 
+
+# power นอกช่วง Min/Max threshold ของแถวตัวเอง (ใช้ทุกชุดกฎของ Line)
+_POWER_RULES = [
+    rules.outside("Output Optical Power (dBm)", "Minimum threshold(out)", "Maximum threshold(out)", name="Output"),
+    rules.outside("Input Optical Power(dBm)", "Minimum threshold(in)", "Maximum threshold(in)", name="Input"),
+]
+
+
+def _ber_fail(df: pd.DataFrame) -> pd.Series:
+    """BER เกิน Threshold — เส้นที่ไม่มี Threshold ถือว่าผิดถ้า BER ≠ 0"""
+    ber = pd.to_numeric(df["Instant BER After FEC"], errors="coerce")
+    thr = pd.to_numeric(df["Threshold"], errors="coerce") if "Threshold" in df.columns else pd.Series(float("nan"), index=df.index)
+    return (thr.notna() & ber.notna() & (ber > thr)) | (thr.isna() & ber.notna() & (ber != 0))
+
+
 class Line_Analyzer:
     """
     ย้าย logic เดิมมารวมในคลาสเดียว:
@@ -21,52 +40,64 @@ class Line_Analyzer:
     - คงชื่อคอลัมน์และเงื่อนไขทั้งหมดให้เหมือนของเดิม
     """
 
+    # เพิ่มเมื่อแก้ตรรกะใน compute() → ผลใน utils.memo ของเวอร์ชันเก่าจะไม่ถูกใช้
+    VERSION = 1
+
+    # กฎ abnormal (utils.rules)
+    #   RULES       abnormal สำหรับ Summary/PDF และ drill-down: BER เกิน Threshold, power นอกช่วง
+    #   VIEW_RULES  ตารางดิบ: BER > 0 ก็ไฮไลต์ (ไม่เทียบ Threshold)
+    #   LINE_RULES  สถานะระดับเส้นหลังรวมแถว (ดู _ber_fail)
+    # Route ที่เป็น Preset ติดสีฟ้าอย่างเดียว ไม่นับเป็น abnormal
+    RULES = rules.RuleSet([
+        rules.above("Instant BER After FEC", "Threshold", name="BER"),
+        *_POWER_RULES,
+        rules.startswith("Route", "Preset", name="Preset"),
+    ])
+    VIEW_RULES = rules.RuleSet([
+        rules.above("Instant BER After FEC", 0, name="BER"),
+        *_POWER_RULES,
+        rules.startswith("Route", "Preset", name="Preset"),
+    ])
+    LINE_RULES = rules.RuleSet([
+        rules.where("Instant BER After FEC", _ber_fail, name="BER"),
+        *_POWER_RULES,
+    ])
+
     # ---------- พาร์เซพรีเซ็ตจาก WASON Log ----------
     @staticmethod
-    def get_preset_map(log_text: str) -> dict:
-        lines = log_text.splitlines()
-        ipmap = {
-            "30.10.90.6": "HYI-4",
-            "30.10.10.6": "Jasmine",
-            "30.10.30.6": "Phu Nga",
-            "30.10.50.6": "SNI-POI",
-            "30.10.70.6": "NKS",
-            "30.10.110.6": "PKT",
-        }
+    def get_preset_map(log, site_table: dict | None = None) -> dict:
+        """
+        Call ID → preset ที่ WORK--(USED)--(SUCCESS) หลัง [PreRout]: ของแต่ละ CALL
+        log: str (ใช้ผลของ utils.wason_log ที่ cache ตาม hash) หรือ file handle / generator ของบรรทัด
+             (อ่านแบบ streaming รอบเดียว ไม่ต้องโหลดทั้งไฟล์)
+        site_table: WASON IP → ชื่อไซต์ สำหรับ key "cid (site)" (default: wason_log.DEFAULT_SITE_TABLE)
+        """
+        if site_table is None:
+            site_table = wason_log.DEFAULT_SITE_TABLE
+        if isinstance(log, str):
+            presets = wason_log.parse(log).presets
+        else:
+            presets = wason_log.iter_presets(log)
         pmap = {}
-        i = 0
-        while i < len(lines):
-            line = lines[i]
-            m = re.search(r"\[CALL\s+\d+\]\s+\[([\d.]+)\s+[\d.]+\s+(\d+)\]", line)
-            if m:
-                ip = m.group(1).strip()
-                cid = m.group(2).strip().lstrip("0")
-                site = ipmap.get(ip, "Unknown")
-                key = f"{cid} ({site})"
-                j = i + 1
-                while j < len(lines):
-                    if "[CALL" in lines[j]:
-                        break
-                    if "[PreRout]:" in lines[j]:
-                        k = j + 1
-                        while k < len(lines):
-                            if "[CALL" in lines[k]:
-                                break
-                            m2 = re.search(r"--(\d+)--WORK--\(USED\)--\(SUCCESS\)", lines[k])
-                            if m2:
-                                preset = m2.group(1).strip()
-                                pmap[cid] = preset
-                                pmap.setdefault(key, preset)
-                                break
-                            k += 1
-                        break
-                    j += 1
-            i += 1
+        for cid, ip, preset in presets:
+            site = site_table.get(ip, "Unknown")
+            pmap[cid] = preset
+            pmap.setdefault(f"{cid} ({site})", preset)
         return pmap
 
-    def __init__(self, df_line: pd.DataFrame, df_ref: pd.DataFrame, pmap: dict | None = None, ns: str = "line"):
+    def __init__(self, df_line: pd.DataFrame, df_ref: pd.DataFrame | None = None, pmap: dict | None = None,
+                 ns: str = "line", registry: ReferenceRegistry | None = None):
         self.df_line = df_line
+        # ไม่ส่ง df_ref มา → ใช้ reference จาก registry (อ่าน Excel ครั้งเดียวต่อ process)
+        # พร้อม index ของ Mapping ที่สร้างไว้แล้ว
+        self._ref_index = None
+        self._ref_version = None
+        if df_ref is None:
+            table = (registry or get_registry()).get("line")
+            df_ref, self._ref_index = table.frame(), table.mapping_index
+            self._ref_version = table.version
         self.df_ref  = df_ref
+        self.df_unmatched = pd.DataFrame()  # key ที่ไม่เจอใน reference
         self.pmap    = pmap or {}
         self.ns      = ns  # namespace ใช้ร่วมกับ cascading_filter
 
@@ -82,17 +113,10 @@ class Line_Analyzer:
         # ---------- NEW: containers for Summary ----------
         self.df_abnormal = pd.DataFrame()
         self.df_abnormal_by_type = {}
+        self.df_result = None   # ทุกพอร์ตหลัง merge (prepare) → utils.device_history
 
     # ---------- Utilities ----------
-    @staticmethod
-    def _normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
-        df.columns = (
-            df.columns.astype(str)
-            .str.replace(r'\s+', ' ', regex=True)
-            .str.replace('\u00a0', ' ')
-            .str.strip()
-        )
-        return df
+    _normalize_columns = staticmethod(normalize_columns)
 
     def _check_required(self) -> None:
         required_cols = {
@@ -107,11 +131,6 @@ class Line_Analyzer:
         # เพิ่มลำดับ (ไว้เรียงภายหลัง)
         self.df_ref["order"] = range(len(self.df_ref))
 
-        # สร้าง key แม็พ
-        self.df_line["Mapping Format"] = (
-            self.df_line["ME"].astype(str).str.strip()
-            + self.df_line["Measure Object"].astype(str).str.strip()
-        )
         self.df_ref["Mapping"] = self.df_ref["Mapping"].astype(str).str.strip()
 
         # เลือกคอลัมน์จาก ref ที่ใช้จริง
@@ -120,12 +139,8 @@ class Line_Analyzer:
             self.col_max_out, self.col_min_out, self.col_max_in, self.col_min_in,
             "Route", "order"
         ]
-        df_merged = pd.merge(
-            self.df_line,
-            self.df_ref[cols_ref],
-            left_on="Mapping Format",
-            right_on="Mapping",
-            how="inner"
+        df_merged, self.df_unmatched = merge_on_mapping(
+            self.df_line, self.df_ref, cols_ref, index=self._ref_index
         )
         return df_merged
 
@@ -137,27 +152,6 @@ class Line_Analyzer:
         )
         return df
 
-    @staticmethod
-    def _row_has_issue(r: pd.Series,
-                       col_ber: str,
-                       col_out: str, col_max_out: str, col_min_out: str,
-                       col_in: str,  col_max_in: str,  col_min_in: str) -> bool:
-        def _num(x):
-            try:
-                return float(x)
-            except Exception:
-                return float("nan")
-
-        ber = _num(r.get(col_ber))
-        vout, hi_out, lo_out = _num(r.get(col_out)), _num(r.get(col_max_out)), _num(r.get(col_min_out))
-        vin,  hi_in,  lo_in  = _num(r.get(col_in)),  _num(r.get(col_max_in)),  _num(r.get(col_min_in))
-
-        return (
-            (pd.notna(ber) and ber > 0) or
-            (pd.notna(vout) and pd.notna(hi_out) and pd.notna(lo_out) and (vout > hi_out or vout < lo_out)) or
-            (pd.notna(vin)  and pd.notna(hi_in)  and pd.notna(lo_in)  and (vin  > hi_in  or vin  < lo_in))
-        )
-
     def _style_dataframe(self, df_view: pd.DataFrame) -> pd.io.formats.style.Styler:
         col_ber = "Instant BER After FEC"
 
@@ -168,57 +162,9 @@ class Line_Analyzer:
             if c in df_view.columns:
                 df_view[c] = pd.to_numeric(df_view[c], errors="coerce")
 
-        def _has_issue_row(r):
-            return self._row_has_issue(
-                r,
-                col_ber,
-                self.col_out, self.col_max_out, self.col_min_out,
-                self.col_in,  self.col_max_in,  self.col_min_in
-            )
-
         styled = (
-            df_view.style
-            # 🌑 ไฮไลต์ gray ถ้ามีปัญหา
-            .apply(lambda r: [
-                'background-color:#e6e6e6; color:black' if _has_issue_row(r) else ''
-                for _ in r
-            ], axis=1)
-
-            # 🔴 ไฮไลต์ BER abnormal
-            .apply(lambda _: [
-                'background-color:#ff4d4d; color:white'
-                if (pd.notna(v) and v > 0) else ''
-                for v in df_view[col_ber]
-            ], subset=[col_ber] if col_ber in df_view.columns else [])
-
-            # 🔴 ไฮไลต์ Output abnormal
-            .apply(lambda _: [
-                'background-color:#ff4d4d; color:white'
-                if (pd.notna(v) and pd.notna(hi) and pd.notna(lo) and (v > hi or v < lo)) else ''
-                for v, hi, lo in zip(
-                    df_view.get(self.col_out, []),
-                    df_view.get(self.col_max_out, []),
-                    df_view.get(self.col_min_out, []),
-                )
-            ], subset=[self.col_out] if self.col_out in df_view.columns else [])
-
-            # 🔴 ไฮไลต์ Input abnormal
-            .apply(lambda _: [
-                'background-color:#ff4d4d; color:white'
-                if (pd.notna(v) and pd.notna(hi) and pd.notna(lo) and (v > hi or v < lo)) else ''
-                for v, hi, lo in zip(
-                    df_view.get(self.col_in, []),
-                    df_view.get(self.col_max_in, []),
-                    df_view.get(self.col_min_in, []),
-                )
-            ], subset=[self.col_in] if self.col_in in df_view.columns else [])
-
-            # 🔵 ไฮไลต์ Route ที่เป็น Preset
-            .apply(lambda _: [
-                'background-color:lightblue; color:black'
-                if str(x).startswith("Preset") else ''
-                for x in df_view.get("Route", [])
-            ], subset=["Route"] if "Route" in df_view.columns else [])
+            # 🌑 เทาทั้งแถวที่มีปัญหา, 🔴 BER/Output/Input ที่ผิด, 🔵 Route ที่เป็น Preset
+            self.VIEW_RULES.evaluate(df_view).style(df_view.style)
 
             # ✅ กำหนดรูปแบบการแสดงผล
             .format({
@@ -243,57 +189,77 @@ class Line_Analyzer:
         - BER/Threshold: ดึงค่าจากแถว BER ถ้ามี
         - Power: รวมแบบ conservative range (min ใช้ค่ามากสุดของ mins, max ใช้ค่าน้อยสุดของ maxes)
         - Route: ถ้ามี 'Preset ...' ในกลุ่ม ให้เลือกอันนั้น มิฉะนั้นใช้ค่าแรก
+        (groupby aggregate ทั้งตาราง ไม่วนทีละกลุ่ม — ผลเท่าแบบเดิมทุกช่อง ดู bench/bench_line.py)
         """
         key_cols = ["Site Name", "ME", "Call ID"]
         if not set(key_cols).issubset(df.columns):
             return df.copy()
-
-        def _num(s):
-            return pd.to_numeric(s, errors="coerce")
-
-        rows = []
-        for (site, me, cid), g in df.groupby(key_cols, dropna=False):
-            g = g.copy()
-            routes = g.get("Route", pd.Series([], dtype=object)).astype(str).tolist()
-            route = next((r for r in routes if r.startswith("Preset")), routes[0] if routes else None)
-
-            power_cols = [self.col_in, self.col_out, self.col_min_in, self.col_max_in, self.col_min_out, self.col_max_out]
-            has_power = g[power_cols].notna().any(axis=1) if set(power_cols).issubset(g.columns) else pd.Series(False, index=g.index)
-            mo = (g.loc[has_power, "Measure Object"].iloc[0]
-                  if "Measure Object" in g.columns and has_power.any()
-                  else (g["Measure Object"].iloc[0] if "Measure Object" in g.columns and len(g) else None))
-
-            ber = _num(g.get("Instant BER After FEC", pd.Series(dtype=float))).dropna()
-            thr = _num(g.get("Threshold", pd.Series(dtype=float))).dropna()
-            ber_val = ber.iloc[0] if len(ber) else float("nan")
-            thr_val = thr.iloc[0] if len(thr) else float("nan")
-
-            vin_vals    = _num(g.get(self.col_in, pd.Series(dtype=float))).dropna()
-            vout_vals   = _num(g.get(self.col_out, pd.Series(dtype=float))).dropna()
-            min_in_vals = _num(g.get(self.col_min_in, pd.Series(dtype=float))).dropna()
-            max_in_vals = _num(g.get(self.col_max_in, pd.Series(dtype=float))).dropna()
-            min_out_vals= _num(g.get(self.col_min_out, pd.Series(dtype=float))).dropna()
-            max_out_vals= _num(g.get(self.col_max_out, pd.Series(dtype=float))).dropna()
-
-            vin   = vin_vals.iloc[0] if len(vin_vals) else float("nan")
-            vout  = vout_vals.iloc[0] if len(vout_vals) else float("nan")
-            min_in  = min_in_vals.max()  if len(min_in_vals) else float("nan")  # narrowest lower bound
-            max_in  = max_in_vals.min()  if len(max_in_vals) else float("nan")  # narrowest upper bound
-            min_out = min_out_vals.max() if len(min_out_vals) else float("nan")
-            max_out = max_out_vals.min() if len(max_out_vals) else float("nan")
-
-            rows.append({
-                "Site Name": site, "ME": me, "Call ID": str(cid),
-                "Measure Object": mo, "Route": route,
-                "Threshold": thr_val, "Instant BER After FEC": ber_val,
-                self.col_max_out: max_out, self.col_min_out: min_out, self.col_out: vout,
-                self.col_max_in:  max_in,  self.col_min_in:  min_in,  self.col_in:  vin,
-            })
-
-        return pd.DataFrame(rows)
-
-    # ---------- MAIN PIPELINE ----------
-    def process(self) -> None:
+        if df.empty:
+            return pd.DataFrame()
+
+        n = len(df)
+        nan_col = pd.Series(float("nan"), index=df.index)
+
+        def _num(col):
+            return pd.to_numeric(df[col], errors="coerce") if col in df.columns else nan_col
+
+        grouped = df.groupby(key_cols, dropna=False)
+        gid = grouped.ngroup().to_numpy()
+        by = pd.Series(gid, index=df.index)
+        # ตำแหน่งแถวแรกของแต่ละกลุ่ม (กลุ่มเรียงตาม key เหมือนการวน groupby เดิม)
+        _, first_pos = np.unique(gid, return_index=True)
+
+        out = grouped.size().index.to_frame(index=False)
+        out["Call ID"] = [str(c) for c in out["Call ID"]]
+
+        # Measure Object: แถวแรกที่มีค่า power สักคอลัมน์ ไม่มีเลยใช้แถวแรกของกลุ่ม
+        power_cols = [self.col_in, self.col_out, self.col_min_in, self.col_max_in, self.col_min_out, self.col_max_out]
+        if "Measure Object" in df.columns:
+            pick = first_pos.copy()
+            if set(power_cols).issubset(df.columns):
+                pos = np.flatnonzero(df[power_cols].notna().any(axis=1).to_numpy())
+                g_has, first_has = np.unique(gid[pos], return_index=True)
+                pick[g_has] = pos[first_has]
+            mo = df["Measure Object"].to_numpy(dtype=object)[pick]
+        else:
+            mo = [None] * len(out)
+        out["Measure Object"] = list(mo)
+
+        # Route: 'Preset ...' ตัวแรกในกลุ่ม ไม่มีใช้ค่าแรก
+        if "Route" in df.columns:
+            routes = df["Route"].astype(str)
+            route = routes.to_numpy(dtype=object)[first_pos]
+            preset = routes.where(routes.str.startswith("Preset", na=False)).groupby(by).first().dropna()
+            route[preset.index.to_numpy()] = preset.to_numpy(dtype=object)
+        else:
+            route = [None] * len(out)
+        out["Route"] = list(route)
+
+        nan = float("nan")
+
+        def _agg(col, how):
+            vals = _num(col).groupby(by).agg(how)  # first/max/min ข้าม NaN
+            return [nan if pd.isna(v) else v for v in vals.reindex(range(len(out))).tolist()]
+
+        out["Threshold"] = _agg("Threshold", "first")
+        out["Instant BER After FEC"] = _agg("Instant BER After FEC", "first")
+        out[self.col_max_out] = _agg(self.col_max_out, "min")  # narrowest upper bound
+        out[self.col_min_out] = _agg(self.col_min_out, "max")  # narrowest lower bound
+        out[self.col_out] = _agg(self.col_out, "first")
+        out[self.col_max_in] = _agg(self.col_max_in, "min")
+        out[self.col_min_in] = _agg(self.col_min_in, "max")
+        out[self.col_in] = _agg(self.col_in, "first")
+
+        # สร้าง frame จาก list เหมือนเดิม → dtype ที่ pandas infer ได้ตรงกับแบบวนทีละกลุ่ม
+        return pd.DataFrame({c: list(out[c]) for c in out.columns})
+
+    # ---------- COMPUTE (ไม่มี st.* → memo ข้าม rerun ได้) ----------
+    def _memo_key(self) -> tuple:
+        ref_version = self._ref_version or memo.frame_digest(self.df_ref)
+        return ("line", self.VERSION, memo.frame_digest(self.df_line), ref_version, memo.text_digest(self.pmap))
+
+    def compute(self) -> dict:
+        """normalize → merge → ใส่ Preset จาก pmap → เรียงตาม order"""
         # 1) Normalize columns
         self.df_line = self._normalize_columns(self.df_line)
         self.df_ref  = self._normalize_columns(self.df_ref)
@@ -304,8 +270,7 @@ class Line_Analyzer:
         # 3) Merge กับ reference
         df_merged = self._merge_with_ref()
         if df_merged.empty:
-            st.warning("No matching mapping found between Line file and reference")
-            return
+            return {"df_result": None, "df_unmatched": self.df_unmatched}
 
         # 4) เลือกคอลัมน์ที่จะแสดง (ตามของเดิม)
         self.main_cols = [
@@ -320,9 +285,41 @@ class Line_Analyzer:
 
         # 6) เรียงตาม order แล้วทิ้งคอลัมน์ช่วย
         df_result = df_result.sort_values("order").drop(columns=["order"]).reset_index(drop=True)
+        return {"df_result": df_result, "df_unmatched": self.df_unmatched, "main_cols": self.main_cols}
+
+    def _line_fail(self, row: pd.Series) -> bool:
+        ber = pd.to_numeric(pd.Series([row.get("Instant BER After FEC")]))[0]
+        thr = pd.to_numeric(pd.Series([row.get("Threshold")]))[0]
+        vin = pd.to_numeric(pd.Series([row.get(self.col_in)]))[0]
+        vout= pd.to_numeric(pd.Series([row.get(self.col_out)]))[0]
+        min_in  = pd.to_numeric(pd.Series([row.get(self.col_min_in)]))[0]
+        max_in  = pd.to_numeric(pd.Series([row.get(self.col_max_in)]))[0]
+        min_out = pd.to_numeric(pd.Series([row.get(self.col_min_out)]))[0]
+        max_out = pd.to_numeric(pd.Series([row.get(self.col_max_out)]))[0]
+
+        fail_ber  = (pd.notna(thr) and pd.notna(ber) and ber > thr) or (pd.isna(thr) and pd.notna(ber) and ber != 0)
+        fail_in   = (pd.notna(vin) and pd.notna(min_in) and pd.notna(max_in) and not (min_in <= vin <= max_in))
+        fail_out  = (pd.notna(vout) and pd.notna(min_out) and pd.notna(max_out) and not (min_out <= vout <= max_out))
+        return bool(fail_ber or fail_in or fail_out)
+
+    def _line_fail_mask(self, df: pd.DataFrame) -> pd.Series:
+        """_line_fail ทั้งตารางแบบ column mask (ผลเท่ากับ df.apply(self._line_fail, axis=1))"""
+        return self.LINE_RULES.evaluate(df).rows
+
+    # ---------- MAIN PIPELINE ----------
+    def process(self) -> None:
+        key = self._memo_key()
+        state = memo.get_or_compute(key, self.compute)
+        self.df_unmatched = state["df_unmatched"]
+
+        df_result = state["df_result"]
+        if df_result is None:
+            st.warning("No matching mapping found between Line file and reference")
+            return
+        self.main_cols = state["main_cols"]
 
         # 7) FILTER แบบ cascading
-        df_filtered, _sel = cascading_filter(
+        df_filtered, sel = cascading_filter(
             df_result,
             cols=["Site Name", "ME", "Measure Object", "Call ID", "Route"],
             ns=self.ns,
@@ -331,33 +328,17 @@ class Line_Analyzer:
         st.caption(f"Line Performance (showing {len(df_filtered)}/{len(df_result)} rows)")
 
 
-        # 8) สไตล์/ไฮไลต์ (ตารางดิบเพื่อการตรวจละเอียด)
-        styled = self._style_dataframe(df_filtered.copy())
-
-        # 9) แสดงผลตาราง
+        # 8-9) ตารางดิบเพื่อการตรวจละเอียด (แบ่งหน้า → สไตล์/ไฮไลต์เฉพาะหน้าที่เห็น)
         st.markdown("### Line Performance")
-        st.dataframe(styled, use_container_width=True)
-
-        # 10) รวมระดับ "เส้น" เพื่อใช้คำนวณ/กราฟให้ถูกต้อง
-        df_lines = self._collapse_by_line(df_filtered.copy())
-
-        # 11) สรุปสถานะหัวเรื่องจากระดับ "เส้น"
-        def _line_fail(row: pd.Series) -> bool:
-            ber = pd.to_numeric(pd.Series([row.get("Instant BER After FEC")]))[0]
-            thr = pd.to_numeric(pd.Series([row.get("Threshold")]))[0]
-            vin = pd.to_numeric(pd.Series([row.get(self.col_in)]))[0]
-            vout= pd.to_numeric(pd.Series([row.get(self.col_out)]))[0]
-            min_in  = pd.to_numeric(pd.Series([row.get(self.col_min_in)]))[0]
-            max_in  = pd.to_numeric(pd.Series([row.get(self.col_max_in)]))[0]
-            min_out = pd.to_numeric(pd.Series([row.get(self.col_min_out)]))[0]
-            max_out = pd.to_numeric(pd.Series([row.get(self.col_max_out)]))[0]
-
-            fail_ber  = (pd.notna(thr) and pd.notna(ber) and ber > thr) or (pd.isna(thr) and pd.notna(ber) and ber != 0)
-            fail_in   = (pd.notna(vin) and pd.notna(min_in) and pd.notna(max_in) and not (min_in <= vin <= max_in))
-            fail_out  = (pd.notna(vout) and pd.notna(min_out) and pd.notna(max_out) and not (min_out <= vout <= max_out))
-            return bool(fail_ber or fail_in or fail_out)
-
-        failed_lines = df_lines.apply(_line_fail, axis=1)
+        paged_table(df_filtered, ns=self.ns, style=self._style_dataframe, file_name="line_performance.csv")
+
+        # 10-11) รวมระดับ "เส้น" + สถานะต่อเส้น (memo ตาม selection ของ filter ด้วย)
+        def _lines():
+            df_lines = self._collapse_by_line(df_filtered.copy())
+            return df_lines, self._line_fail_mask(df_lines)
+
+        sel_key = tuple((c, tuple(v)) for c, v in sel.items())
+        df_lines, failed_lines = memo.get_or_compute(key + ("lines", sel_key), _lines)
         st.markdown(
             "<div style='text-align:center; font-size:32px; font-weight:bold; color:{};'>Line Performance {}</div>".format(
                 "red" if failed_lines.any() else "green",
@@ -473,62 +454,16 @@ class Line_Analyzer:
 
         
         # ----- Fail Details -----
-        fail_rows = df_view[
-            (pd.to_numeric(df_view["Instant BER After FEC"], errors="coerce") >
-            pd.to_numeric(df_view["Threshold"], errors="coerce"))
-        ][[
+        fail_rows = df_view[self.RULES.evaluate(df_view).hit("BER")][[
             "Site Name", "ME", "Call ID", "Measure Object", "Threshold", "Instant BER After FEC"
         ]]
 
-        # ---------- NEW: Save to state ----------
-
-        
         if not fail_rows.empty:
             st.markdown("**Problem Call IDs (BER above threshold)**")
-
-            def highlight_line_row(row):
-                styles = [""] * len(row)
-                col_map = {c: i for i, c in enumerate(fail_rows.columns)}
-
-                # ✅ BER check
-                try:
-                    ber = float(row["Instant BER After FEC"])
-                    thr = float(row["Threshold"])
-                    if pd.notna(ber) and pd.notna(thr) and ber > thr:
-                        styles[col_map["Instant BER After FEC"]] = "background-color:#ff4d4d; color:white"
-                except:
-                    pass
-
-                # ✅ Input check
-                if "Input Optical Power(dBm)" in row:
-                    try:
-                        v = float(row["Input Optical Power(dBm)"])
-                        lo = float(row["Minimum threshold(in)"])
-                        hi = float(row["Maximum threshold(in)"])
-                        if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                            styles[col_map["Input Optical Power(dBm)"]] = "background-color:#ff4d4d; color:white"
-                    except:
-                        pass
-
-                # ✅ Output check
-                if "Output Optical Power (dBm)" in row:
-                    try:
-                        v = float(row["Output Optical Power (dBm)"])
-                        lo = float(row["Minimum threshold(out)"])
-                        hi = float(row["Maximum threshold(out)"])
-                        if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                            styles[col_map["Output Optical Power (dBm)"]] = "background-color:#ff4d4d; color:white"
-                    except:
-                        pass
-
-                return styles
-
-           
             fail_rows = fail_rows.reset_index(drop=True)
 
             styled = (
-                fail_rows.style
-                .apply(highlight_line_row, axis=1)
+                self.RULES.evaluate(fail_rows).style(fail_rows.style, row=None, mark=None)
                 .format({
                     "Threshold": "{:.2E}",
                     "Instant BER After FEC": "{:.2E}"
@@ -585,16 +520,11 @@ class Line_Analyzer:
             ])
             # Input Power
             # ---------- เตรียมสีจุด Input ----------
-            vin_colors = [
-                "red" if (pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi)) else "orange"
-                for v, lo, hi in zip(vin, min_in, max_in)
-            ]
+            board_v = self.RULES.evaluate(df_board)
+            vin_colors = np.where(board_v.hit("Input"), "red", "orange").tolist()
 
             # ---------- เตรียมสีจุด Output ----------
-            vout_colors = [
-                "red" if (pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi)) else "blue"
-                for v, lo, hi in zip(vout, min_out, max_out)
-            ]
+            vout_colors = np.where(board_v.hit("Output"), "red", "blue").tolist()
 
             # ---------- Input Power ----------
             fig.add_trace(go.Scatter(
@@ -635,15 +565,8 @@ class Line_Analyzer:
 
 
             # ---------- Problem Lines: ดึงบรรทัดจริงจาก df_board_raw ----------
-            min_in   = pd.to_numeric(df_board_raw.get(self.col_min_in),  errors="coerce")
-            max_in   = pd.to_numeric(df_board_raw.get(self.col_max_in),  errors="coerce")
-            min_out  = pd.to_numeric(df_board_raw.get(self.col_min_out), errors="coerce")
-            max_out  = pd.to_numeric(df_board_raw.get(self.col_max_out), errors="coerce")
-
-            mask_problem = (
-                (vin_raw.notna()  & min_in.notna()  & max_in.notna()  & ((vin_raw  < min_in)  | (vin_raw  > max_in))) |
-                (vout_raw.notna() & min_out.notna() & max_out.notna() & ((vout_raw < min_out) | (vout_raw > max_out)))
-            )
+            power_rules = self.RULES.only("Input", "Output")
+            mask_problem = power_rules.evaluate(df_board_raw).rows
 
             df_problems = df_board_raw.loc[mask_problem] 
              # 👈 บรรทัดจริง 100%
@@ -653,35 +576,8 @@ class Line_Analyzer:
             if not df_problems.empty:
                 st.markdown(f"**⚠️ Problem Lines for {board_name}:**")
 
-                def highlight_line_row(row):
-                    styles = [""] * len(row)
-                    col_map = {c: i for i, c in enumerate(df_problems.columns)}
-
-                    # ✅ Input check
-                    try:
-                        v = float(row[self.col_in])
-                        lo = float(row[self.col_min_in])
-                        hi = float(row[self.col_max_in])
-                        if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                            styles[col_map[self.col_in]] = "background-color:#ff4d4d; color:white"
-                    except:
-                        pass
-
-                    # ✅ Output check
-                    try:
-                        v = float(row[self.col_out])
-                        lo = float(row[self.col_min_out])
-                        hi = float(row[self.col_max_out])
-                        if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                            styles[col_map[self.col_out]] = "background-color:#ff4d4d; color:white"
-                    except:
-                        pass
-
-                    return styles
-
                 styled = (
-                    df_problems.style
-                    .apply(highlight_line_row, axis=1)
+                    power_rules.evaluate(df_problems).style(df_problems.style, row=None)
                     .format({
                         "Threshold": "{:.2E}",
                         "Instant BER After FEC": "{:.2E}"
@@ -789,10 +685,6 @@ class Line_Analyzer:
             # reset containers
             self.df_abnormal = pd.DataFrame()
             self.df_abnormal_by_type = {}
-            # save to session_state #4
-            st.session_state["line_analyzer"] = self
-            st.session_state["line_status"]   = "No data"
-            st.session_state["line_abn_count"] = 0
             return
 
         # 4) Build result & apply preset
@@ -803,54 +695,27 @@ class Line_Analyzer:
             self.col_max_in, self.col_min_in, self.col_in
         ]].reset_index(drop=True)
         df_result = self._apply_preset_route(df_result)
+        self.df_result = df_result
 
-        # 5) Detect abnormal groups
+        # 5) Detect abnormal groups (ประเมินกฎครั้งเดียวทั้งตาราง)
+        violations = self.RULES.evaluate(df_result)
+        mask_power = violations.hit("Input") | violations.hit("Output")
+        mobj = df_result["Measure Object"].astype(str)
 
         # 5.1 BER abnormal (Instant BER After FEC > Threshold)
-        ber_val = pd.to_numeric(df_result["Instant BER After FEC"], errors="coerce")
-        thr_val = pd.to_numeric(df_result["Threshold"], errors="coerce")
-        mask_ber = (pd.notna(ber_val) & pd.notna(thr_val) & (ber_val > thr_val))
-        df_ber = df_result.loc[mask_ber, ["Site Name", "ME", "Call ID", "Measure Object", "Threshold", "Instant BER After FEC"]].copy()
-
-        # 5.2 LB2R abnormal (power out of range)
-        df_lb2r = df_result[df_result["Measure Object"].astype(str).str.contains("LB2R", na=False)].copy()
-        vin = pd.to_numeric(df_lb2r[self.col_in], errors="coerce")
-        vout = pd.to_numeric(df_lb2r[self.col_out], errors="coerce")
-        min_in = pd.to_numeric(df_lb2r[self.col_min_in], errors="coerce")
-        max_in = pd.to_numeric(df_lb2r[self.col_max_in], errors="coerce")
-        min_out = pd.to_numeric(df_lb2r[self.col_min_out], errors="coerce")
-        max_out = pd.to_numeric(df_lb2r[self.col_max_out], errors="coerce")
-        mask_lb2r = (
-            (vin.notna() & min_in.notna() & max_in.notna() & ((vin < min_in) | (vin > max_in))) |
-            (vout.notna() & min_out.notna() & max_out.notna() & ((vout < min_out) | (vout > max_out)))
-        )
-        df_lb2r = df_lb2r.loc[mask_lb2r, [
-            "Site Name", "ME", "Call ID", "Measure Object", "Threshold", "Instant BER After FEC",
-            self.col_max_out, self.col_min_out, self.col_out,
-            self.col_max_in, self.col_min_in, self.col_in, "Route"
-        ]].copy()
-
-        # 5.3 L4S abnormal (power out of range)
-        df_l4s = df_result[df_result["Measure Object"].astype(str).str.contains("L4S", na=False)].copy()
-        vin = pd.to_numeric(df_l4s[self.col_in], errors="coerce")
-        vout = pd.to_numeric(df_l4s[self.col_out], errors="coerce")
-        min_in = pd.to_numeric(df_l4s[self.col_min_in], errors="coerce")
-        max_in = pd.to_numeric(df_l4s[self.col_max_in], errors="coerce")
-        min_out = pd.to_numeric(df_l4s[self.col_min_out], errors="coerce")
-        max_out = pd.to_numeric(df_l4s[self.col_max_out], errors="coerce")
-        mask_l4s = (
-            (vin.notna() & min_in.notna() & max_in.notna() & ((vin < min_in) | (vin > max_in))) |
-            (vout.notna() & min_out.notna() & max_out.notna() & ((vout < min_out) | (vout > max_out)))
-        )
-        df_l4s = df_l4s.loc[mask_l4s, [
+        df_ber = df_result.loc[violations.hit("BER"), ["Site Name", "ME", "Call ID", "Measure Object", "Threshold", "Instant BER After FEC"]].copy()
+
+        # 5.2 LB2R / 5.3 L4S abnormal (power out of range)
+        power_cols = [
             "Site Name", "ME", "Call ID", "Measure Object", "Threshold", "Instant BER After FEC",
             self.col_max_out, self.col_min_out, self.col_out,
             self.col_max_in, self.col_min_in, self.col_in, "Route"
-        ]].copy()
+        ]
+        df_lb2r = df_result.loc[mask_power & mobj.str.contains("LB2R", na=False), power_cols].copy()
+        df_l4s = df_result.loc[mask_power & mobj.str.contains("L4S", na=False), power_cols].copy()
 
         # 5.4 Preset abnormal (Route startswith 'Preset')
-        df_preset = df_result[df_result["Route"].astype(str).str.startswith("Preset")].copy()
-        df_preset = df_preset[["Site Name", "ME", "Call ID", "Measure Object", "Route"]].copy()
+        df_preset = df_result.loc[violations.hit("Preset"), ["Site Name", "ME", "Call ID", "Measure Object", "Route"]].copy()
 
         # 6) Save results to properties 
         self.df_abnormal_by_type = {
@@ -864,7 +729,5 @@ class Line_Analyzer:
             ignore_index=True
         ) if any(not df.empty for df in self.df_abnormal_by_type.values()) else pd.DataFrame()
 
-        # 7) Save to session_state 
-        st.session_state["line_analyzer"] = self
-        st.session_state["line_status"]   = "Abnormal" if not self.df_abnormal.empty else "Normal"
-        st.session_state["line_abn_count"] = len(self.df_abnormal)
+
+rules.register("Line", Line_Analyzer.RULES)
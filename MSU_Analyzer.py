@@ -1,6 +1,10 @@
 import pandas as pd
 import streamlit as st
 from utils.filters import cascading_filter
+from utils.table_view import paged_table
+from utils import memo, rules
+from utils.reference import ReferenceRegistry, get_registry, normalize_columns
+from utils.mapping import merge_on_mapping
 
 class MSU_Analyzer:
     """
@@ -14,9 +18,27 @@ class MSU_Analyzer:
       - Visualization: Bar Chart
     """
 
-    def __init__(self, df_msu: pd.DataFrame, df_ref: pd.DataFrame, ns: str = "msu"):
+    # เพิ่มเมื่อแก้ตรรกะใน compute() → ผลใน utils.memo ของเวอร์ชันเก่าจะไม่ถูกใช้
+    VERSION = 1
+
+    # กฎ abnormal (utils.rules) — ตาราง, banner, abnormal, Summary และ PDF ใช้ชุดเดียวกัน
+    RULES = rules.RuleSet([
+        rules.above("Laser Bias Current(mA)", "Maximum threshold", name="MSU"),
+    ])
+
+    def __init__(self, df_msu: pd.DataFrame, df_ref: pd.DataFrame | None = None, ns: str = "msu",
+                 registry: ReferenceRegistry | None = None):
         self.df_msu = df_msu
+        # ไม่ส่ง df_ref มา → ใช้ reference จาก registry (อ่าน Excel ครั้งเดียวต่อ process)
+        # พร้อม index ของ Mapping ที่สร้างไว้แล้ว
+        self._ref_index = None
+        self._ref_version = None
+        if df_ref is None:
+            table = (registry or get_registry()).get("msu")
+            df_ref, self._ref_index = table.frame(), table.mapping_index
+            self._ref_version = table.version
         self.df_ref = df_ref
+        self.df_unmatched = pd.DataFrame()  # key ที่ไม่เจอใน reference
         self.ns     = ns
 
         # column name mapping
@@ -28,17 +50,10 @@ class MSU_Analyzer:
         # abnormal data containers
         self.df_abnormal = pd.DataFrame()
         self.df_abnormal_by_type = {}
+        self.df_result = None   # ทุกพอร์ตหลัง merge (prepare) → utils.device_history
 
     # ---------- Utilities ----------
-    @staticmethod
-    def _normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
-        df.columns = (
-            df.columns.astype(str)
-            .str.strip()
-            .str.replace(r"\s+", " ", regex=True)
-            .str.replace("\u00a0", " ")
-        )
-        return df
+    _normalize_columns = staticmethod(normalize_columns)
 
     def _check_required(self) -> None:
         required_cols = {self.COL_ME, self.COL_MOBJ, self.COL_LASER}
@@ -53,19 +68,12 @@ class MSU_Analyzer:
             raise ValueError(f"Reference file must contain columns: {', '.join(sorted(required_ref_cols))}")
 
     def _merge_with_ref(self) -> pd.DataFrame:
-        self.df_msu["Mapping Format"] = (
-            self.df_msu[self.COL_ME].astype(str).str.strip()
-            + self.df_msu[self.COL_MOBJ].astype(str).str.strip()
-        )
         self.df_ref["Mapping"] = self.df_ref["Mapping"].astype(str).str.strip()
         self.df_ref["order"]   = range(len(self.df_ref))
 
-        df_merged = pd.merge(
-            self.df_msu,
-            self.df_ref[["Site Name", "Mapping", self.COL_TH, "order"]],
-            left_on="Mapping Format",
-            right_on="Mapping",
-            how="inner"
+        df_merged, self.df_unmatched = merge_on_mapping(
+            self.df_msu, self.df_ref, ["Site Name", "Mapping", self.COL_TH, "order"],
+            index=self._ref_index,
         )
         return df_merged
 
@@ -75,21 +83,9 @@ class MSU_Analyzer:
             if c in df_view.columns:
                 df_view[c] = pd.to_numeric(df_view[c], errors="coerce")
 
-        # ✅ ไฮไลต์คอลัมน์ Laser ถ้าเกิน threshold
-        def red_value(_):
-            return [
-                "background-color:#ff4d4d;color:white"
-                if (pd.notna(v) and pd.notna(th) and v > th)
-                else ""
-                for v, th in zip(
-                    df_view.get(self.COL_LASER, pd.Series(index=df_view.index)),
-                    df_view.get(self.COL_TH, pd.Series(index=df_view.index)),
-                )
-            ]
-
+        # ✅ ไฮไลต์คอลัมน์ Laser ถ้าเกิน threshold (ไม่ทำแถวเทา)
         styled = (
-            df_view.style
-            .apply(red_value, subset=[self.COL_LASER] if self.COL_LASER in df_view.columns else [])
+            self.RULES.evaluate(df_view).style(df_view.style, row=None)
             .format({
                 self.COL_LASER: "{:.2f}",
                 self.COL_TH: "{:.2f}",
@@ -97,8 +93,13 @@ class MSU_Analyzer:
         )
         return styled
 
-    # ---------- MAIN ----------
-    def process(self) -> None:
+    # ---------- COMPUTE (ไม่มี st.* → memo ข้าม rerun ได้) ----------
+    def _memo_key(self) -> tuple:
+        ref_version = self._ref_version or memo.frame_digest(self.df_ref)
+        return ("msu", self.VERSION, memo.frame_digest(self.df_msu), ref_version)
+
+    def compute(self) -> dict:
+        """normalize → merge → Board/Status สำหรับกราฟ + abnormal"""
         # 1) Normalize
         self.df_msu = self._normalize_columns(self.df_msu)
         self.df_ref = self._normalize_columns(self.df_ref)
@@ -109,11 +110,10 @@ class MSU_Analyzer:
 
         # 3) Merge
         df_merged = self._merge_with_ref()
+        state = {"df_result": None, "df_unmatched": self.df_unmatched,
+                 "df_abnormal": pd.DataFrame(), "df_abnormal_by_type": {}}
         if df_merged.empty:
-            st.warning("No matching mapping found between MSU file and reference")
-            self.df_abnormal = pd.DataFrame()
-            self.df_abnormal_by_type = {}
-            return
+            return state
 
         # 4) Pick columns
         df_result = (
@@ -123,7 +123,50 @@ class MSU_Analyzer:
             .reset_index(drop=True)
         )
 
-        # 5) Cascading filter
+        # 5) Board / Status สำหรับกราฟ
+        df_board = df_result.copy()
+        df_board["Board"] = df_board["Site Name"].astype(str) + " | " + df_board[self.COL_MOBJ].astype(str)
+
+        df_board["Status"] = df_board.apply(
+            lambda r: "Normal" if r[self.COL_LASER] <= r[self.COL_TH] else "Abnormal", axis=1
+        )
+
+        # 6) Abnormal
+        ab_mask = self.RULES.evaluate(df_result).rows
+        df_abn = df_result.loc[ab_mask, [
+            "Site Name", self.COL_ME, self.COL_MOBJ,
+            self.COL_TH, self.COL_LASER
+        ]].copy()
+        if not df_abn.empty:
+            # ✅ round 2 decimal (ไม่มีหน่วย)
+            df_abn[self.COL_TH]    = pd.to_numeric(df_abn[self.COL_TH], errors="coerce").round(2)
+            df_abn[self.COL_LASER] = pd.to_numeric(df_abn[self.COL_LASER], errors="coerce").round(2)
+
+        state.update({
+            "df_result": df_result,
+            "df_board": df_board,
+            "total_ports": len(df_result),
+            "active_ports": (df_result[self.COL_LASER] > 0).sum(),
+            "abnormal_ports": ab_mask.sum(),
+            "df_abnormal": df_abn,
+            "df_abnormal_by_type": {"MSU": df_abn} if not df_abn.empty else {},
+        })
+        return state
+
+    # ---------- MAIN ----------
+    def process(self) -> None:
+        state = memo.get_or_compute(self._memo_key(), self.compute)
+        self.df_unmatched = state["df_unmatched"]
+        # เก็บ abnormal ลง property (ใช้ใน summary/PDF)
+        self.df_abnormal = state["df_abnormal"]
+        self.df_abnormal_by_type = state["df_abnormal_by_type"]
+
+        df_result = state["df_result"]
+        if df_result is None:
+            st.warning("No matching mapping found between MSU file and reference")
+            return
+
+        # 1) Cascading filter
         df_filtered, _sel = cascading_filter(
             df_result,
             cols=["Site Name", self.COL_ME, self.COL_MOBJ],
@@ -132,29 +175,23 @@ class MSU_Analyzer:
         )
         st.caption(f"MSU (showing {len(df_filtered)}/{len(df_result)} rows)")
 
-        # 6) Main table (ใช้ Styler + format 2 ตำแหน่ง)
-        styled_main = self._style_dataframe(df_filtered.copy())
+        # 2) Main table (ใช้ Styler + format 2 ตำแหน่ง, แบ่งหน้า → style เฉพาะหน้าที่เห็น)
         st.markdown("### MSU Performance")
-        st.write(styled_main)
+        paged_table(df_filtered, ns=self.ns, style=self._style_dataframe, file_name="msu_performance.csv")
 
-        # 7) Summary banner
-        failed_rows = df_filtered[self.COL_LASER] > df_filtered[self.COL_TH]
+        # 3) Summary banner
+        failed = self.RULES.evaluate(df_filtered).any()
         st.markdown(
             "<div style='text-align:center; font-size:32px; font-weight:bold; color:{};'>MSU Performance {}</div>".format(
-                "red" if failed_rows.any() else "green",
-                "Warning" if failed_rows.any() else "Normal"
+                "red" if failed else "green",
+                "Warning" if failed else "Normal"
             ),
             unsafe_allow_html=True
         )
 
-        # 8) Visualization ------------------
+        # 4) Visualization ------------------
         import plotly.express as px
-        df_board = df_result.copy()
-        df_board["Board"] = df_board["Site Name"].astype(str) + " | " + df_board[self.COL_MOBJ].astype(str)
-
-        df_board["Status"] = df_board.apply(
-            lambda r: "Normal" if r[self.COL_LASER] <= r[self.COL_TH] else "Abnormal", axis=1
-        )
+        df_board = state["df_board"]
 
         view_option = st.radio(
             "View Option:",
@@ -165,16 +202,12 @@ class MSU_Analyzer:
         if view_option == "Active Only (Laser > 0)":
             df_board = df_board[df_board[self.COL_LASER] > 0]
 
-        total_ports    = len(df_result)
-        active_ports   = (df_result[self.COL_LASER] > 0).sum()
-        abnormal_ports = (df_result[self.COL_LASER] > df_result[self.COL_TH]).sum()
-
         st.markdown(
             f"""
             <div style="text-align:center; font-size:18px; font-weight:bold;">
-                Total Ports: {total_ports} |
-                Active: {active_ports} |
-                Abnormal: {abnormal_ports}
+                Total Ports: {state["total_ports"]} |
+                Active: {state["active_ports"]} |
+                Abnormal: {state["abnormal_ports"]}
             </div>
             """,
             unsafe_allow_html=True
@@ -204,18 +237,9 @@ class MSU_Analyzer:
         )
         st.plotly_chart(fig_bar, use_container_width=True)
 
-        # 9) Abnormal Table ------------------
-        ab_mask = df_result[self.COL_LASER] > df_result[self.COL_TH]
-        df_abn = df_result.loc[ab_mask, [
-            "Site Name", self.COL_ME, self.COL_MOBJ,
-            self.COL_TH, self.COL_LASER
-        ]].copy()
-
+        # 5) Abnormal Table ------------------
+        df_abn = self.df_abnormal
         if not df_abn.empty:
-            # ✅ round 2 decimal (ไม่มีหน่วย)
-            df_abn[self.COL_TH]    = pd.to_numeric(df_abn[self.COL_TH], errors="coerce").round(2)
-            df_abn[self.COL_LASER] = pd.to_numeric(df_abn[self.COL_LASER], errors="coerce").round(2)
-
             # ✅ Highlight Laser Bias Current(mA)
             def highlight_red(val):
                 try:
@@ -237,10 +261,6 @@ class MSU_Analyzer:
         else:
             st.info("✅ No abnormal rows (Normal)")
 
-        # 10) เก็บ abnormal ลง property (ใช้ใน summary/PDF)
-        self.df_abnormal = df_abn
-        self.df_abnormal_by_type = {"MSU": df_abn} if not df_abn.empty else {}
-
  
 
     # ---------- PREPARE ----------
@@ -259,26 +279,18 @@ class MSU_Analyzer:
         if df_merged.empty:
             self.df_abnormal = pd.DataFrame()
             self.df_abnormal_by_type = {}
-            st.session_state["msu_analyzer"] = self
-            st.session_state["msu_status"]   = "No data"
-            st.session_state["msu_abn_count"] = 0
             return
 
         # 4) Detect abnormal
-        val = pd.to_numeric(df_merged[self.COL_LASER], errors="coerce")
-        th  = pd.to_numeric(df_merged[self.COL_TH], errors="coerce")
-        ab_mask = val > th
+        ab_mask = self.RULES.evaluate(df_merged).rows
 
-        df_abn = df_merged.loc[ab_mask, [
-            "Site Name", self.COL_ME, self.COL_MOBJ,
-            self.COL_TH, self.COL_LASER
-        ]].copy()
+        cols = ["Site Name", self.COL_ME, self.COL_MOBJ, self.COL_TH, self.COL_LASER]
+        self.df_result = df_merged[cols].reset_index(drop=True)
+        df_abn = df_merged.loc[ab_mask, cols].copy()
 
         # 5) เก็บผล
         self.df_abnormal = df_abn
         self.df_abnormal_by_type = {"MSU": df_abn} if not df_abn.empty else {}
 
-        # ✅ เก็บเข้า session_state
-        st.session_state["msu_analyzer"] = self
-        st.session_state["msu_status"]   = "Abnormal" if not df_abn.empty else "Normal"
-        st.session_state["msu_abn_count"] = len(df_abn)
+
+rules.register("MSU", MSU_Analyzer.RULES)
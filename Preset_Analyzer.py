@@ -1,53 +1,21 @@
 # preset_analyzer.py
 from __future__ import annotations
-from dataclasses import dataclass, field
 from typing import List, Dict, Any, Optional, Tuple, Callable
-import re
 import io
 import pandas as pd
 import streamlit as st
 
+from utils import wason_log
+# regex / CallBlock อยู่ที่ utils.wason_log (อ่าน log รอบเดียว ใช้ร่วมกับ APO และ Line preset map)
+from utils.wason_log import (
+    CALL_HEADER_RE, CONN_HAS_WR_RE, CONN_WR_NOALARM_RE, PREROUT_USED_RE, CallBlock,
+)
+
 # =========================
 # 1) แกน Preset (Regex + Parser + Evaluator)
 # =========================
-# Match: [WASON][CALL 8] [30.10.90.6 30.10.10.6 85] COPPER
-CALL_HEADER_RE = re.compile(r"\[WASON\]\[CALL\s+(\d+)\]\s+\[([^\]]+)\]")
-
-# Any Conn line that contains WR
-CONN_HAS_WR_RE = re.compile(r"\[WASON\]\s*\[Conn\s+\d+\].*\bWR\b", re.IGNORECASE)
-
-# Specifically "WR NO_ALARM"
-CONN_WR_NOALARM_RE = re.compile(
-    r"\[WASON\]\s*\[Conn\s+\d+\][^\n]*\bWR\s+NO_ALARM\b", re.IGNORECASE
-)
-
-# A preroute line like: --2--WORK--(USED)--(SUCCESS)-- (robust to trailing text)
-PREROUT_USED_RE = re.compile(
-    r"\[WASON\]--\s*(\d+)\s*--\s*WORK\s*--\s*\(USED\)\s*--\s*\((\w+)\).*",
-    re.IGNORECASE,
-)
-
-@dataclass
-class CallBlock:
-    call_id: int
-    ip: str
-    lines: List[str] = field(default_factory=list)
-
 def parse_calls(text: str) -> List[CallBlock]:
-    calls: List[CallBlock] = []
-    cur: Optional[CallBlock] = None
-    for raw in text.splitlines():
-        line = raw.rstrip("\n")
-        m = CALL_HEADER_RE.search(line)
-        if m:
-            if cur is not None:
-                calls.append(cur)
-            cur = CallBlock(call_id=int(m.group(1)), ip=m.group(2), lines=[])
-        if cur is not None:
-            cur.lines.append(line)
-    if cur is not None:
-        calls.append(cur)
-    return calls
+    return wason_log.parse(text).calls
 
 def evaluate_preset_status(cb: CallBlock) -> Dict[str, Any]:
     """
@@ -56,17 +24,12 @@ def evaluate_preset_status(cb: CallBlock) -> Dict[str, Any]:
     - ต้องมี 'WR NO_ALARM'
     - ใน PreRout ต้องมี 'WORK (USED) (SUCCESS)' จำนวน 1 บรรทัดพอดี
     """
-    has_wr = any(CONN_HAS_WR_RE.search(ln) for ln in cb.lines)
-    if not has_wr:
+    # WR / WR NO_ALARM / USED rows ถูกหาไว้แล้วตอน parse (utils.wason_log.tokenize)
+    if not cb.has_wr:
         return {"has_wr": False}
 
-    wr_no_alarm = any(CONN_WR_NOALARM_RE.search(ln) for ln in cb.lines)
-
-    used_rows = []
-    for ln in cb.lines:
-        m = PREROUT_USED_RE.search(ln)
-        if m:
-            used_rows.append({"index": int(m.group(1)), "result": m.group(2).upper(), "raw": ln})
+    wr_no_alarm = cb.wr_no_alarm
+    used_rows = cb.used_rows
 
     verdict = "FAIL"
     Restore = ""
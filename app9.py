@@ -1,11 +1,13 @@
 import os
+import hashlib
+import json
+import logging
 import sqlite3
 import uuid
 from datetime import datetime, date
 import pytz
 import streamlit as st
 from streamlit_calendar import calendar
-import io, zipfile
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
@@ -26,17 +28,21 @@ from APO_Analyzer import ApoRemnantAnalyzer
 from APO_Analyzer import apo_kpi
 # from viz import render_visualization, NetworkDashboardVisualizer  # Removed
 from table1 import SummaryTableReport
+import dashboard_kpi
 from supabase_config import get_supabase
+from utils import dataset_cache, jobs, kpi_history, memo, result_store
+from utils.ingest import CLASSIFIER_VERSION, build_manifest, classify
 
 
 # ====== CONFIG ======
 st.set_page_config(layout="wide")
-pd.set_option("styler.render.max_elements", 1_200_000)
 
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 DB_FILE = "files.db"
 
+logger = logging.getLogger(__name__)
+
 
 # ====== DB INIT ======
 def init_db():
@@ -51,8 +57,28 @@ def init_db():
         created_at TEXT
     )
     """)
+    # sha256 ของไฟล์ที่เก็บ → ใช้เป็น key ของ utils/dataset_cache
+    cols = [r[1] for r in c.execute("PRAGMA table_info(uploads)")]
+    if "sha256" not in cols:
+        c.execute("ALTER TABLE uploads ADD COLUMN sha256 TEXT")
+    # manifest ของ member ในแต่ละไฟล์ (สร้างตอนอัปโหลด) → Run Analysis เปิดเฉพาะ member ที่ต้องใช้
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS upload_members (
+        upload_id INTEGER,
+        seq INTEGER,
+        nesting TEXT,
+        member TEXT,
+        size INTEGER,
+        crc INTEGER,
+        kind TEXT,
+        classifier_version INTEGER,
+        PRIMARY KEY (upload_id, seq)
+    )
+    """)
     conn.commit()
     conn.close()
+    # คิวงานวิเคราะห์เบื้องหลัง (utils/jobs.py)
+    jobs.init_db(DB_FILE)
 
 init_db()
 
@@ -64,18 +90,107 @@ def save_file(upload_date: str, file):
     stored_path = os.path.join(UPLOAD_DIR, upload_date, stored_name)
     os.makedirs(os.path.dirname(stored_path), exist_ok=True)
 
+    buf = file.getbuffer()
     with open(stored_path, "wb") as f:
-        f.write(file.getbuffer())
+        f.write(buf)
+    sha = hashlib.sha256(buf).hexdigest()
 
     conn = sqlite3.connect(DB_FILE)
     c = conn.cursor()
     c.execute("""
-        INSERT INTO uploads (upload_date, orig_filename, stored_path, created_at)
-        VALUES (?, ?, ?, ?)
-    """, (upload_date, file.name, stored_path, datetime.now().isoformat()))
+        INSERT INTO uploads (upload_date, orig_filename, stored_path, created_at, sha256)
+        VALUES (?, ?, ?, ?, ?)
+    """, (upload_date, file.name, stored_path, datetime.now().isoformat(), sha))
+    upload_id = c.lastrowid
+    conn.commit()
+    conn.close()
+
+    try:
+        save_manifest(upload_id, build_manifest(stored_path, file.name))
+    except Exception:
+        # ไม่มี manifest ก็ยังใช้ได้ (Run Analysis ไล่ ZIP เอง) → แค่บันทึกไว้
+        logger.warning("manifest build failed for %s", file.name, exc_info=True)
+    return stored_path, sha
+
+def save_manifest(upload_id: int, rows: list):
+    conn = sqlite3.connect(DB_FILE)
+    c = conn.cursor()
+    c.execute("DELETE FROM upload_members WHERE upload_id=?", (upload_id,))
+    c.executemany("""
+        INSERT INTO upload_members (upload_id, seq, nesting, member, size, crc, kind, classifier_version)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (upload_id, r["seq"], json.dumps(r["nesting"]), r["member"], r["size"], r["crc"], r["kind"], CLASSIFIER_VERSION)
+        for r in rows
+    ])
     conn.commit()
     conn.close()
 
+def get_manifest(upload_id: int, stored_path: str, orig_filename: str) -> list:
+    """
+    manifest ของไฟล์ (list of dict) — สร้างให้ไฟล์เก่าที่ยังไม่มี
+    ถ้า classifier เปลี่ยนเวอร์ชัน คำนวณ kind ใหม่จากชื่อ member (ไม่ต้องเปิดไฟล์)
+    """
+    conn = sqlite3.connect(DB_FILE)
+    c = conn.cursor()
+    c.execute("""
+        SELECT seq, nesting, member, size, crc, kind, classifier_version
+        FROM upload_members WHERE upload_id=? ORDER BY seq
+    """, (upload_id,))
+    fetched = c.fetchall()
+    conn.close()
+
+    if not fetched:
+        rows = build_manifest(stored_path, orig_filename)
+        save_manifest(upload_id, rows)
+        return rows
+
+    rows = [
+        {"seq": seq, "nesting": json.loads(nesting), "member": member, "size": size, "crc": crc, "kind": kind}
+        for seq, nesting, member, size, crc, kind, _ in fetched
+    ]
+    if any(ver != CLASSIFIER_VERSION for *_, ver in fetched):
+        zipped = stored_path.lower().endswith(".zip")
+        for r in rows:
+            if not zipped:
+                r["kind"] = classify(stored_path)  # ไฟล์เดี่ยวจัดประเภทจาก stored_path (เหมือน load_stored_file)
+            elif not r["member"].lower().endswith(".zip"):
+                r["kind"] = classify(r["member"])
+        save_manifest(upload_id, rows)
+    return rows
+
+def list_kinds_by_date(upload_date: str) -> dict:
+    """{upload_id: [kind, ...]} จาก manifest (ไม่ต้องเปิดไฟล์)"""
+    conn = sqlite3.connect(DB_FILE)
+    c = conn.cursor()
+    c.execute("""
+        SELECT u.id, m.kind FROM uploads u
+        JOIN upload_members m ON m.upload_id = u.id
+        WHERE u.upload_date=? AND m.kind IS NOT NULL AND m.classifier_version=?
+        ORDER BY u.id, m.seq
+    """, (upload_date, CLASSIFIER_VERSION))
+    out = {}
+    for upload_id, kind in c.fetchall():
+        kinds = out.setdefault(upload_id, [])
+        if kind not in kinds:
+            kinds.append(kind)
+    conn.close()
+    return out
+
+def get_file_sha256(file_id: int, stored_path: str) -> str:
+    """คืน sha256 ของไฟล์ (คำนวณ + backfill ให้แถวเก่าที่ยังไม่มี)"""
+    conn = sqlite3.connect(DB_FILE)
+    c = conn.cursor()
+    c.execute("SELECT sha256 FROM uploads WHERE id=?", (file_id,))
+    row = c.fetchone()
+    sha = row[0] if row else None
+    if not sha:
+        sha = dataset_cache.file_sha256(stored_path)
+        c.execute("UPDATE uploads SET sha256=? WHERE id=?", (sha, file_id))
+        conn.commit()
+    conn.close()
+    return sha
+
 def list_files_by_date(upload_date: str):
     conn = sqlite3.connect(DB_FILE)
     c = conn.cursor()
@@ -87,7 +202,7 @@ def list_files_by_date(upload_date: str):
 def delete_file(file_id: int):
     conn = sqlite3.connect(DB_FILE)
     c = conn.cursor()
-    c.execute("SELECT stored_path FROM uploads WHERE id=?", (file_id,))
+    c.execute("SELECT stored_path, sha256 FROM uploads WHERE id=?", (file_id,))
     row = c.fetchone()
     if row:
         try:
@@ -95,6 +210,12 @@ def delete_file(file_id: int):
         except FileNotFoundError:
             pass
     c.execute("DELETE FROM uploads WHERE id=?", (file_id,))
+    c.execute("DELETE FROM upload_members WHERE upload_id=?", (file_id,))
+    # ลบ cache ถ้าไม่มีไฟล์อื่นที่เนื้อหาเหมือนกันเหลืออยู่
+    if row and row[1]:
+        c.execute("SELECT COUNT(*) FROM uploads WHERE sha256=?", (row[1],))
+        if c.fetchone()[0] == 0:
+            dataset_cache.remove(row[1])
     conn.commit()
     conn.close()
 
@@ -112,93 +233,105 @@ def clear_all_uploaded_data():
     st.session_state.clear()
 
 
-# ====== ZIP PARSER ======
-KW = {
-    "cpu": ("cpu",),
-    "fan": ("fan",),
-    "msu": ("msu",),
-    "client": ("client", "client board"),
-    "line":  ("line","line board"),       
-    "wason": ("wason","log"), 
-    "osc": ("osc","osc optical"),      
-    "fm":  ("fm","alarm","fault management"),
-    "atten": ("optical attenuation report", "optical_attenuation_report"),
-    "atten": ("optical attenuation report","optical attenuation"),
-    "preset": ("mobaxterm", "moba xterm", "moba"),
-}
-
-LOADERS = {
-    ".xlsx": pd.read_excel,
-    ".xls": pd.read_excel,
-    ".txt":  lambda f: f.read().decode("utf-8", errors="ignore"),
-}
-
-def _ext(name: str) -> str:
-    name = name.lower()
-    return next((e for e in LOADERS if name.endswith(e)), "")
-
-def _kind(name):
-    n = name.lower()
-    hits = [k for k, kws in KW.items() if any(s in n for s in kws)]
-
-    # ---- Priority ----
-    if "wason" in hits:
-        return "wason"
-    if "preset" in hits:
-        return "preset"
-
-    # ---- เช็คว่า line ต้องเป็น Excel เท่านั้น ----
-    if "line" in hits and (n.endswith(".xlsx") or n.endswith(".xls") or n.endswith(".xlsm")):
-        return "line"
-
-    # ---- อื่น ๆ ตามปกติ ----
-    for k in ("fan","cpu","msu","client","osc","fm","atten"):
-        if k in hits:
-            return k
-
-    return hits[0] if hits else None
-
-
-def find_in_zip(zip_file):
-    found = {k: None for k in KW}
-    def walk(zf):
-        for name in zf.namelist():
-            if all(found.values()): 
-                return
-            if name.endswith("/"): 
-                continue
-            lname = name.lower()
-            if lname.endswith(".zip"):
-                try:
-                    walk(zipfile.ZipFile(io.BytesIO(zf.read(name))))
-                except:
-                    pass
-                continue
-            ext = _ext(lname)
-            kind = _kind(lname)
-            if not ext or not kind or found[kind]:
-                continue
-            try:
-                with zf.open(name) as f:
-                    df = LOADERS[ext](f)
-                    print("DEBUG LOADED:", kind, type(df), name)
-
-                # ถ้าเป็น log (.txt) → เก็บเป็น string ใน key "wason_log"
-                if kind == "wason":
-                    found[kind] = (df, name)   # df = string
-                else:
-                    found[kind] = (df, name)   # df = DataFrame
-
-            except:
-                continue
-    walk(zipfile.ZipFile(zip_file))
-    return found
-
+def load_into_session(uploads: list, results: list) -> int:
+    """
+    รวม dataset ที่ parse แล้ว (ไฟล์หลังทับไฟล์ก่อน) ลง result_store แล้วเก็บแค่ analysis_id ใน session
+    uploads = [{"id", "name", "sha256", "upload_date"}] ตามลำดับที่เลือก, results = ผลของ dataset_cache.get_or_parse_many
+    → คืนจำนวนไฟล์ที่สำเร็จ
+    """
+    loaded = sum(1 for res in results if isinstance(res, dict))
+    if loaded:
+        select_analysis(result_store.save_datasets(uploads, results))
+    return loaded
+
+
+def select_analysis(aid: str) -> None:
+    """ให้ session นี้ใช้ analysis_id นี้ (+ ชื่อ member ของแต่ละ kind สำหรับ caption)"""
+    st.session_state["analysis_id"] = aid
+    for kind, zname in result_store.kinds(aid).items():
+        st.session_state[f"{kind}_file"] = zname
+
+
+def current_data(kind: str):
+    """dataset ของ analysis ที่เลือก (ใช้ร่วมกันทุก session → memo.copy() ก่อนแก้ไข)"""
+    return result_store.session_data(st.session_state, kind)
+
+
+def publish_kpi(*sections: str) -> None:
+    """เก็บ KPI snapshot ของ section ที่เพิ่งวิเคราะห์ (ถ้ายังไม่มี) → Dashboard ไม่ต้องคำนวณเอง"""
+    try:
+        dashboard_kpi.ensure(st.session_state.get("analysis_id"), sections)
+    except Exception:
+        # Dashboard สร้าง snapshot ที่ขาดเองตอนเปิด → หน้า analyzer ไม่ต้องล้มเพราะเรื่องนี้
+        logger.exception("KPI snapshot failed for %s", sections)
+
+
+def current_operator() -> str:
+    """เจ้าของ job ในคิว: email ของผู้ login (ถ้ามี) ไม่งั้นเป็น id ของ browser session นี้"""
+    user = (st.session_state.get("user_session") or {}).get("user") or {}
+    if user.get("email"):
+        return user["email"]
+    if "operator_id" not in st.session_state:
+        st.session_state["operator_id"] = f"session-{uuid.uuid4().hex[:8]}"
+    return st.session_state["operator_id"]
+
+
+def _fmt_seconds(sec: float | None) -> str:
+    if sec is None:
+        return "-"
+    sec = int(round(sec))
+    return f"{sec // 60}m {sec % 60:02d}s" if sec >= 60 else f"{sec}s"
+
+
+def render_jobs_panel():
+    """ตารางสถานะ job ล่าสุด (poll จาก files.db) + โหลดผลของ job ที่เสร็จเข้า session"""
+    me = current_operator()
+    job_list = jobs.list_jobs(limit=15)
+    if not job_list:
+        st.caption("No background jobs yet")
+        return
+    for job in job_list:
+        names = ", ".join(str(i) for i in job["upload_ids"])
+        who = "you" if job["owner"] == me else job["owner"]
+        c1, c2, c3 = st.columns([3, 3, 1.4])
+        with c1:
+            st.markdown(f"**Job #{job['id']}** · {job['status']} · by {who}")
+            st.caption(f"uploads {names} · queued {job['created_at']}")
+        with c2:
+            if job["status"] == "running":
+                st.progress(min(1.0, float(job["progress"] or 0)), text=job["message"] or "")
+                st.caption(f"elapsed {_fmt_seconds(jobs.elapsed(job))} · ETA {_fmt_seconds(jobs.eta(job))}")
+            elif job["status"] == "queued":
+                st.caption(f"⏳ {jobs.queue_position(job)} job(s) ahead in queue")
+            elif job["status"] == "failed":
+                st.caption(f"❌ {job['error'] or job['message']}")
+            else:
+                st.caption(f"{job['message'] or ''} ({_fmt_seconds(jobs.elapsed(job))})")
+        with c3:
+            if job["status"] == "queued" and job["owner"] == me:
+                if st.button("Cancel", key=f"job_cancel_{job['id']}"):
+                    jobs.cancel(job["id"])
+                    st.rerun()
+            elif job["status"] == "done":
+                if st.button("Load results", key=f"job_load_{job['id']}"):
+                    if not result_store.exists(job.get("analysis_id")):
+                        st.error("Result files of this job are missing")
+                    else:
+                        clear_all_uploaded_data()   # เหมือน Run Analysis: ไม่ให้ dataset ของรอบก่อนค้าง
+                        if me.startswith("session-"):
+                            st.session_state["operator_id"] = me
+                        select_analysis(job["analysis_id"])
+                        st.session_state["job_loaded"] = job["id"]
+        if job["status"] == "done" and st.session_state.get("job_loaded") == job["id"]:
+            st.success(f"Job #{job['id']} is loaded in this session — open the analysis pages")
+            kpi = result_store.kpis(job.get("analysis_id"))
+            if kpi:
+                st.dataframe(
+                    pd.DataFrame([(sec, k["status"], k["abnormal_rows"]) for sec, k in kpi.items()],
+                                 columns=["Section", "Status", "Abnormal rows"]),
+                    use_container_width=True, hide_index=True,
+                )
 
-def safe_copy(obj):
-    if isinstance(obj, pd.DataFrame):
-        return obj.copy()
-    return obj
 
 # ====== SIDEBAR ======
 menu = st.sidebar.radio("Select Activity", [
@@ -228,24 +361,36 @@ if menu == "Home":
             total_files = len(files)
             uploaded_count = 0
             
+            saved = []
             for i, file in enumerate(files):
                 # อัพเดท status
                 status_text.text(f"📤 Uploading {file.name}... ({i+1}/{total_files})")
                 
-                # อัพเดท progress bar
-                progress = (i + 1) / total_files
-                progress_bar.progress(progress)
-                
                 # อัปโหลดไฟล์
                 try:
-                    save_file(str(chosen_date), file)
+                    stored_path, sha = save_file(str(chosen_date), file)
+                    saved.append((stored_path, sha, file.name))
                     uploaded_count += 1
                 except Exception as e:
                     st.error(f"❌ Failed to upload {file.name}: {e}")
-                
-                # เพิ่ม delay เล็กน้อยเพื่อให้เห็น progress
-                import time
-                time.sleep(0.5)
+
+                # อัพเดท progress bar (ครึ่งแรก = เขียนไฟล์)
+                progress_bar.progress((i + 1) / total_files * 0.5)
+
+            # parse ครั้งเดียวตอนอัปโหลด (ทุกไฟล์พร้อมกัน) แล้วเก็บลง cache ให้ Run Analysis ใช้ต่อ
+            parsed = [0]
+            def _on_parsed(i, res):
+                parsed[0] += 1
+                if isinstance(res, Exception):
+                    st.warning(f"⚠️ Could not read {saved[i][2]}: {res}")
+                status_text.text(f"📦 Indexing {saved[i][2]}... ({parsed[0]}/{len(saved)})")
+                progress_bar.progress(0.5 + parsed[0] / len(saved) * 0.5)
+            try:
+                dataset_cache.get_or_parse_many(saved, on_done=_on_parsed)
+            except Exception as e:
+                # ไฟล์ถูกเก็บแล้ว แต่ cache ไม่ครบ (เช่น ดิสก์เต็ม) → Run Analysis จะ parse ใหม่
+                logger.exception("dataset cache fill failed")
+                st.warning(f"⚠️ Files were saved but could not be indexed: {e}")
             
             # เสร็จสิ้น
             progress_bar.progress(1.0)
@@ -258,7 +403,6 @@ if menu == "Home":
                 st.warning(f"⚠️ Uploaded {uploaded_count}/{total_files} files successfully")
             
             # รีเฟรชหน้า
-            time.sleep(2)
             st.rerun()
 
     st.subheader("Calendar")
@@ -302,12 +446,23 @@ if menu == "Home":
         st.info("No files for this date")
     else:
         selected_files = []
+        kinds_by_file = list_kinds_by_date(selected_date)
         for fid, fname, fpath in files_list:
+            if fid not in kinds_by_file:
+                # ไฟล์ที่อัปโหลดก่อนมี manifest → สร้างครั้งเดียว
+                try:
+                    kinds_by_file[fid] = list(dict.fromkeys(
+                        r["kind"] for r in get_manifest(fid, fpath, fname) if r["kind"]
+                    ))
+                except Exception:
+                    kinds_by_file[fid] = []
             col1, col2 = st.columns([4, 1])
             with col1:
                 checked = st.checkbox(fname, key=f"chk_{fid}")
                 if checked:
                     selected_files.append((fid, fname, fpath))
+                if kinds_by_file[fid]:
+                    st.caption("Contains: " + ", ".join(kinds_by_file[fid]))
             with col2:
                 if st.button("🗑️ Delete", key=f"del_{fid}"):
                     # แสดง Progress bar สำหรับการลบ
@@ -324,8 +479,6 @@ if menu == "Home":
                         st.success(f"🗑️ {fname} has been deleted")
                         
                         # รีเฟรชหน้า
-                        import time
-                        time.sleep(1)
                         st.rerun()
                         
                     except Exception as e:
@@ -334,7 +487,19 @@ if menu == "Home":
                         delete_status.text("❌ Delete failed")
 
         
-        if st.button("Run Analysis", key="analyze_btn"):
+        c_run, c_queue = st.columns([1, 1])
+        with c_queue:
+            # วิเคราะห์ใน worker process เบื้องหลัง → refresh/ปิดแท็บได้ งานไม่หาย (ดูสถานะที่ Background jobs)
+            if st.button("Queue in Background", key="queue_btn"):
+                if not selected_files:
+                    st.warning("Please select at least one file to analyze")
+                else:
+                    jobs.ensure_runner(DB_FILE)
+                    job_id = jobs.submit(current_operator(), [fid for fid, _, _ in selected_files], DB_FILE)
+                    st.success(f"📨 Job #{job_id} queued ({len(selected_files)} file(s))")
+        with c_run:
+            run_inline = st.button("Run Analysis", key="analyze_btn")
+        if run_inline:
             if not selected_files:
                 st.warning("Please select at least one file to analyze")
             else:
@@ -346,55 +511,37 @@ if menu == "Home":
                 processed_files = 0
                 
                 clear_all_uploaded_data()
-                
-                for i, (fid, fname, fpath) in enumerate(selected_files):
-                    # อัพเดท status
-                    analysis_status.text(f"🔍 Analyzing {fname}... ({i+1}/{total_files})")
-                    
-                    # อัพเดท progress bar
-                    progress = (i + 1) / total_files
-                    analysis_progress.progress(progress)
-                    
-                    try:
-                        lname = fpath.lower()
-                        if lname.endswith(".zip"):
-                            with open(fpath, "rb") as f:
-                                zip_bytes = io.BytesIO(f.read())
-                                res = find_in_zip(zip_bytes)
-                            # record results from zip
-                            for kind, pack in res.items():
-                                if not pack:
-                                    continue
-                                df, zname = pack
-                                if kind == "wason":
-                                    st.session_state["wason_log"] = df    # ✅ string log
-                                    st.session_state["wason_file"] = zname
-                                else:
-                                    st.session_state[f"{kind}_data"] = df # ✅ DataFrame
-                                    st.session_state[f"{kind}_file"] = zname
-                            processed_files += 1
-                        else:
-                            # Direct Excel/TXT file
-                            ext = _ext(lname)
-                            kind = _kind(lname)
-                            if not ext or not kind:
-                                raise ValueError("Unsupported file type or cannot infer kind")
-                            with open(fpath, "rb") as f:
-                                data = LOADERS[ext](f)
-                            if kind == "wason":
-                                st.session_state["wason_log"] = data
-                                st.session_state["wason_file"] = fname
-                            else:
-                                st.session_state[f"{kind}_data"] = data
-                                st.session_state[f"{kind}_file"] = fname
-                            processed_files += 1
-                        
-                    except Exception as e:
-                        st.error(f"❌ Failed to analyze {fname}: {e}")
-                    
-                    # เพิ่ม delay เล็กน้อยเพื่อให้เห็น progress
-                    import time
-                    time.sleep(0.3)
+
+                # decode ทุกไฟล์ (และทุก member ใน ZIP) พร้อมกันใน process pool
+                # progress ขยับทันทีที่แต่ละไฟล์เสร็จ (ลำดับเสร็จไม่แน่นอน)
+                done_count = [0]
+                def _on_done(i, res):
+                    done_count[0] += 1
+                    fname = selected_files[i][1]
+                    if isinstance(res, Exception):
+                        st.error(f"❌ Failed to analyze {fname}: {res}")
+                        analysis_status.text(f"❌ {fname} ({done_count[0]}/{total_files})")
+                    else:
+                        analysis_status.text(f"🔍 Analyzed {fname}: {', '.join(res) or '-'} ({done_count[0]}/{total_files})")
+                    analysis_progress.progress(done_count[0] / total_files)
+
+                analysis_status.text(f"🔍 Analyzing {total_files} file(s)...")
+                items, uploads = [], []
+                try:
+                    items = [(fpath, get_file_sha256(fid, fpath), fname) for fid, fname, fpath in selected_files]
+                    uploads = [{"id": fid, "name": fname, "sha256": sha, "upload_date": selected_date}
+                               for (fid, fname, _), (_, sha, _) in zip(selected_files, items)]
+                    manifests = [get_manifest(fid, fpath, fname) for fid, fname, fpath in selected_files]
+                    results = dataset_cache.get_or_parse_many(items, on_done=_on_done, manifests=manifests)
+                except Exception as e:
+                    st.error(f"❌ Failed to analyze files: {e}")
+                    results = []
+
+                try:
+                    processed_files = load_into_session(uploads, results)
+                except Exception as e:
+                    st.error(f"❌ Failed to store analysis data: {e}")
+                    processed_files = 0
                 
                 # เสร็จสิ้นการวิเคราะห์
                 analysis_progress.progress(1.0)
@@ -406,10 +553,6 @@ if menu == "Home":
                     st.info("📊 You can now navigate to individual analysis pages to view results")
                 else:
                     st.warning(f"⚠️ Analyzed {processed_files}/{total_files} files successfully")
-                
-                # รีเฟรชหน้า
-                time.sleep(2)
-                st.rerun()
         
         # ปุ่ม Clear All
         if files_list:
@@ -428,8 +571,6 @@ if menu == "Home":
                     clear_status.text("✅ All data cleared successfully!")
                     
                     # รีเฟรชหน้า
-                    import time
-                    time.sleep(1)
                     clear_progress.progress(1.0)
                     st.success("🎉 All uploaded data has been cleared!")
                     st.rerun()
@@ -440,38 +581,43 @@ if menu == "Home":
                     clear_status.text("❌ Clear operation failed")
 
 
+    # ====== Background jobs ======
+    st.markdown("---")
+    st.subheader("Background jobs")
+    jobs.ensure_runner(DB_FILE)
+    if hasattr(st, "fragment"):
+        # poll สถานะจาก DB ทุก 2 วินาทีเฉพาะส่วนนี้ (ไม่ rerun ทั้งหน้า) ระหว่างที่ยังมีงานค้าง
+        active = any(j["status"] in jobs.ACTIVE for j in jobs.list_jobs(limit=15))
+        st.fragment(run_every=2 if active else None)(render_jobs_panel)()
+    else:
+        st.button("🔄 Refresh jobs", key="jobs_refresh")
+        render_jobs_panel()
+
+
 elif menu == "CPU":
-    if st.session_state.get("cpu_data") is not None:
+    if current_data("cpu") is not None:
         # แสดง Progress bar สำหรับการวิเคราะห์ CPU
         cpu_progress = st.progress(0)
         cpu_status = st.empty()
         
         try:
-            cpu_status.text("📊 Loading CPU reference data...")
-            cpu_progress.progress(0.2)
-            
-            df_ref = pd.read_excel("data/CPU.xlsx")
-            cpu_progress.progress(0.4)
-            
             cpu_status.text("🔍 Initializing CPU analyzer...")
-            cpu_progress.progress(0.6)
+            cpu_progress.progress(0.4)
             
+            # ไม่ส่ง df_ref → ใช้ reference จาก registry (version ของไฟล์เป็นส่วนหนึ่งของ memo key)
             analyzer = CPU_Analyzer(
-                df_cpu=safe_copy(st.session_state.get("cpu_data")),
-                df_ref=df_ref.copy(),
+                df_cpu=memo.copy(current_data("cpu")),
                 ns="cpu"
             )
             cpu_progress.progress(0.8)
             
             cpu_status.text("⚙️ Processing CPU analysis...")
             analyzer.process()
+            publish_kpi("CPU")
             cpu_progress.progress(1.0)
             
             cpu_status.text("✅ CPU analysis completed!")
-            st.session_state["cpu_analyzer"] = analyzer
             
-            import time
-            time.sleep(1)
             
         except Exception as e:
             st.error(f"❌ An error occurred during CPU analysis: {e}")
@@ -482,17 +628,14 @@ elif menu == "CPU":
 
 
 elif menu == "FAN":
-    if st.session_state.get("fan_data") is not None:
+    if current_data("fan") is not None:
         try:
-            df_ref = pd.read_excel("data/FAN.xlsx")
             analyzer = FAN_Analyzer(
-                df_fan=safe_copy(st.session_state.get("fan_data")),
-                df_ref=df_ref.copy(),
+                df_fan=memo.copy(current_data("fan")),
                 ns="fan"  # namespace สำหรับ cascading_filter
             )
             analyzer.process()
-            st.session_state["fan_analyzer"] = analyzer
-            st.write("DEBUG set fan_analyzer", st.session_state["fan_analyzer"])
+            publish_kpi("FAN")
 
         except Exception as e:
             st.error(f"An error occurred during processing: {e}")
@@ -501,16 +644,14 @@ elif menu == "FAN":
 
 
 elif menu == "MSU":
-    if st.session_state.get("msu_data") is not None:
+    if current_data("msu") is not None:
         try:
-            df_ref = pd.read_excel("data/MSU.xlsx")
             analyzer = MSU_Analyzer(
-                df_msu=safe_copy(st.session_state.get("msu_data")),
-                df_ref=df_ref.copy(),
+                df_msu=memo.copy(current_data("msu")),
                 ns="msu"
             )
             analyzer.process()
-            st.session_state["msu_analyzer"] = analyzer
+            publish_kpi("MSU")
         except Exception as e:
             st.error(f"An error occurred during processing: {e}")
     else:
@@ -520,8 +661,8 @@ elif menu == "MSU":
 elif menu == "Line board":
     st.markdown("### Line Cards Performance")
 
-    df_line = st.session_state.get("line_data")      # ✅ DataFrame
-    log_txt = st.session_state.get("wason_log")     # ✅ String
+    df_line = current_data("line")      # ✅ DataFrame
+    log_txt = current_data("wason")     # ✅ String
 
     # gen pmap จาก TXT ถ้ามี
     if log_txt:
@@ -530,14 +671,13 @@ elif menu == "Line board":
 
     if df_line is not None:
         try:
-            df_ref = pd.read_excel("data/Line.xlsx")
             analyzer = Line_Analyzer(
-                df_line=df_line.copy(),   # ✅ ต้องเป็น DataFrame
-                df_ref=df_ref.copy(),
+                df_line=memo.copy(df_line),   # ✅ ต้องเป็น DataFrame (copy ถือ tag เดิม → memo ไม่ต้อง hash)
                 pmap=pmap,
                 ns="line",
             )
             analyzer.process()
+            publish_kpi("Line")
             st.caption(
                 f"Using LINE file: {st.session_state.get('line_file')}  "
                 f"{'(with WASON log)' if log_txt else '(no WASON log)'}"
@@ -551,18 +691,15 @@ elif menu == "Line board":
 
 elif menu == "Client board":
     st.markdown("### Client Board")
-    if st.session_state.get("client_data") is not None:
+    if current_data("client") is not None:
         try:
-            # โหลด Reference
-            df_ref = pd.read_excel("data/Client.xlsx")
-            
             # สร้าง Analyzer
             analyzer = Client_Analyzer(
-                df_client=st.session_state.client_data.copy(),
+                df_client=memo.copy(current_data("client")),
                 ref_path="data/Client.xlsx"   # ✅ ให้ class โหลดเอง
             )
             analyzer.process()
-            st.session_state["client_analyzer"] = analyzer
+            publish_kpi("Client")
             st.caption(f"Using CLIENT file: {st.session_state.get('client_file')}")
         except Exception as e:
             st.error(f"An error occurred during processing: {e}")
@@ -573,18 +710,19 @@ elif menu == "Client board":
 elif menu == "Fiber Flapping":
     st.markdown("### Fiber Flapping (OSC + FM)")
 
-    df_osc = st.session_state.get("osc_data")   # จาก ZIP: .xlsx → DataFrame
-    df_fm  = st.session_state.get("fm_data")    # จาก ZIP: .xlsx → DataFrame
+    df_osc = current_data("osc")   # จาก ZIP: .xlsx → DataFrame
+    df_fm  = current_data("fm")    # จาก ZIP: .xlsx → DataFrame
 
     if (df_osc is not None) and (df_fm is not None):
         try:
             analyzer = FiberflappingAnalyzer(
-                df_optical=df_osc.copy(),
-                df_fm=df_fm.copy(),
+                df_optical=memo.copy(df_osc),
+                df_fm=memo.copy(df_fm),
                 threshold=2.0,   # คงเดิม
                 ref_path="data/Flapping.xlsx"  # ใช้ชื่อไฟล์ตัวใหญ่ และมี fallback ภายใน
             )
             analyzer.process()
+            publish_kpi("Fiber")
             st.caption(
                 f"Using OSC: {st.session_state.get('osc_file')} | "
                 f"FM: {st.session_state.get('fm_file')}"
@@ -598,16 +736,16 @@ elif menu == "Fiber Flapping":
 
 elif menu == "Loss between EOL":
     st.markdown("### Loss between EOL")
-    df_raw = st.session_state.get("atten_data")   # ใช้ atten_data ที่โหลดมา
+    df_raw = current_data("atten")   # ใช้ atten_data ที่โหลดมา
     if df_raw is not None:
         try:
             analyzer = EOLAnalyzer(
                 df_ref=None,
-                df_raw_data=df_raw.copy(),
+                df_raw_data=memo.copy(df_raw),   # copy ถือ tag เดิม → key เดียวกับ Dashboard / Summary
                 ref_path="data/EOL.xlsx",
             )
             analyzer.process()   # ⬅ ตรงนี้ทำให้โชว์ทันที
-            st.session_state["eol_analyzer"] = analyzer
+            publish_kpi("EOL")
             st.caption(f"Using RAW file: {st.session_state.get('atten_file')}")
         except Exception as e:
             st.error(f"An error occurred during EOL analysis: {e}")
@@ -617,16 +755,16 @@ elif menu == "Loss between EOL":
 
 elif menu == "Loss between Core":
     st.markdown("### Loss between Core")
-    df_raw = st.session_state.get("atten_data")   # ใช้ atten_data เหมือนกัน
+    df_raw = current_data("atten")   # ใช้ atten_data เหมือนกัน
     if df_raw is not None:
         try:
             analyzer = CoreAnalyzer(
                 df_ref=None,
-                df_raw_data=df_raw.copy(),
+                df_raw_data=memo.copy(df_raw),   # copy ถือ tag เดิม → key เดียวกับ Dashboard / Summary
                 ref_path="data/EOL.xlsx",
             )
             analyzer.process()   # ⬅ ตรงนี้ทำให้โชว์ทันที
-            st.session_state["core_analyzer"] = analyzer
+            publish_kpi("Core")
             st.caption(f"Using RAW file: {st.session_state.get('atten_file')}")
         except Exception as e:
             st.error(f"An error occurred during Core analysis: {e}")
@@ -656,6 +794,19 @@ elif menu == "Dashboard":
         
        
 
+        # KPI snapshot ของ analysis นี้ (สร้างครั้งแรกครั้งเดียว แล้วอ่านจาก uploads/.results)
+        snaps = dashboard_kpi.ensure(st.session_state.get("analysis_id"))
+
+        def snapshot(section: str, label: str):
+            """snapshot ของ section หรือ None (แสดงข้อความแทนแล้ว)"""
+            snap = snaps.get(section)
+            if snap is None:
+                st.info(f"Upload {label} file and run analysis to populate {label} dashboard.")
+            elif "error" in snap:
+                st.warning(f"{label} dashboard could not be rendered: {snap['error']}")
+                return None
+            return snap
+
         # ==============================
         # CPU Section (SNP, NCPM, NCPQ)
         # ==============================
@@ -671,33 +822,28 @@ elif menu == "Dashboard":
             unsafe_allow_html=True,
         )
 
-        def render_cpu_status(title: str, row: pd.Series | None):
-            if row is None or row.empty:
+        def render_cpu_status(title: str, board: dict | None):
+            if not board:
                 st.markdown(f"#### {title}")
                 st.info("No data")
                 return
 
-            site = str(row.get("Site Name", "-"))
-            board = str(row.get("Measure Object", "-"))
-            cpu_pct = pd.to_numeric(row.get("CPU utilization ratio"), errors="coerce")
-            if pd.notna(cpu_pct) and cpu_pct <= 1:
-                cpu_pct = cpu_pct * 100.0
-
-            cpu_text = f"{cpu_pct:.2f}%" if pd.notna(cpu_pct) else "-"
+            cpu_pct = board["value"]
+            cpu_text = f"{cpu_pct:.2f}%" if cpu_pct is not None else "-"
 
             # Threshold coloring
             status = "normal"
             color = "green"
             label = "Normal"
-            if pd.notna(cpu_pct) and cpu_pct > 90:
+            if cpu_pct is not None and cpu_pct > 90:
                 status = "red critical"
                 color = "red"
                 label = "red critical >= 90%"
-            elif pd.notna(cpu_pct) and cpu_pct >= 70:
+            elif cpu_pct is not None and cpu_pct >= 70:
                 status = "orange major"
                 color = "orange"
                 label = "Orenge Major >=70%"
-            elif pd.notna(cpu_pct) and cpu_pct >= 60:
+            elif cpu_pct is not None and cpu_pct >= 60:
                 status = "yellow minor"
                 color = "#d1a000"  # dark yellow
                 label = "yellow Minor >=60%"
@@ -709,7 +855,7 @@ elif menu == "Dashboard":
             msg_color = "red" if status != "normal" else "green"
             st.markdown(
                 f"<div style='font-weight:600;color:{msg_color};'>"
-                f"{site} — {board} — {cpu_text}"
+                f"{board['site']} — {board['board']} — {cpu_text}"
                 f"</div>",
                 unsafe_allow_html=True,
             )
@@ -720,61 +866,12 @@ elif menu == "Dashboard":
                 unsafe_allow_html=True,
             )
 
-        def compute_max_cpu_per_type(df_merged: pd.DataFrame, pattern: str) -> pd.Series | None:
-            if df_merged.empty:
-                return None
-            df_type = df_merged[df_merged["Measure Object"].astype(str).str.contains(pattern, na=False)].copy()
-            if df_type.empty:
-                return None
-            # convert to percent if needed
-            val = pd.to_numeric(df_type["CPU utilization ratio"], errors="coerce")
-            if pd.notna(val.max()) and val.max() <= 1:
-                val = val * 100.0
-            df_type["CPU%"] = val
-            df_type = df_type.sort_values("CPU%", ascending=False)
-            return df_type.iloc[0] if not df_type.empty else None
-
-        # Build merged CPU (from session if available)
-        try:
-            if st.session_state.get("cpu_data") is not None:
-                cpu_df = st.session_state["cpu_data"].copy()
-                ref = pd.read_excel("data/CPU.xlsx")
-
-                # Normalize columns
-                cpu_df.columns = (
-                    cpu_df.columns.astype(str).str.strip().str.replace(r"\s+", " ", regex=True).str.replace("\u00a0", " ")
-                )
-                ref.columns = (
-                    ref.columns.astype(str).str.strip().str.replace(r"\s+", " ", regex=True).str.replace("\u00a0", " ")
-                )
-
-                # Merge
-                cpu_df["Mapping Format"] = (
-                    cpu_df["ME"].astype(str).str.strip() + cpu_df["Measure Object"].astype(str).str.strip()
-                )
-                ref["Mapping"] = ref["Mapping"].astype(str).str.strip()
-                merged = pd.merge(
-                    cpu_df,
-                    ref[["Mapping", "Maximum threshold", "Minimum threshold", "Site Name"]],
-                    left_on="Mapping Format",
-                    right_on="Mapping",
-                    how="inner",
-                )
-                merged = merged[[
-                    "Site Name", "ME", "Measure Object", "CPU utilization ratio", "Maximum threshold", "Minimum threshold"
-                ]].copy()
-
-                c1, c2, c3 = st.columns(3)
-                with c1:
-                    render_cpu_status("SNP", compute_max_cpu_per_type(merged, r"SNP\(E\)"))
-                with c2:
-                    render_cpu_status("NCPM", compute_max_cpu_per_type(merged, r"NCPM"))
-                with c3:
-                    render_cpu_status("NCPQ", compute_max_cpu_per_type(merged, r"NCPQ"))
-            else:
-                st.info("Upload CPU file and run analysis to populate CPU dashboard.")
-        except Exception as e:
-            st.warning(f"CPU dashboard could not be rendered: {e}")
+        snap = snapshot("CPU", "CPU")
+        if snap is not None:
+            c1, c2, c3 = st.columns(3)
+            for col, title in zip((c1, c2, c3), dashboard_kpi.CPU_TYPES):
+                with col:
+                    render_cpu_status(title, snap.get(title))
 
         # ==============================
         # FAN Section (FCC, FCPL, FCPS, FCPP)
@@ -791,16 +888,13 @@ elif menu == "Dashboard":
             unsafe_allow_html=True,
         )
 
-        def render_fan_gauge(title: str, row: pd.Series | None, threshold: float, vmax: float):
+        def render_fan_gauge(title: str, board: dict | None, threshold: float, vmax: float):
             st.markdown(f"#### {title}")
-            if row is None or row.empty:
+            if not board:
                 st.info("No data")
                 return
 
-            site = str(row.get("Site Name", "-"))
-            board = str(row.get("Measure Object", "-"))
-            rps = pd.to_numeric(row.get("Value of Fan Rotate Speed(Rps)"), errors="coerce")
-            value = float(rps) if pd.notna(rps) else 0.0
+            value = board["value"] if board["value"] is not None else 0.0
 
             # Bands relative to threshold (green/yellow/orange/red)
             g1 = 0.60 * threshold
@@ -834,7 +928,7 @@ elif menu == "Dashboard":
             # Text lines below gauge
             msg_color = "red" if value > threshold else "green"
             st.markdown(
-                f"<div style='color:{msg_color};font-weight:600'>{site} — {board}</div>",
+                f"<div style='color:{msg_color};font-weight:600'>{board['site']} — {board['board']}</div>",
                 unsafe_allow_html=True,
             )
             st.markdown(
@@ -844,83 +938,19 @@ elif menu == "Dashboard":
                 unsafe_allow_html=True,
             )
 
-        def compute_max_fan_per_type(df_merged: pd.DataFrame, type_token: str) -> pd.Series | None:
-            if df_merged.empty:
-                return None
-            df_type = df_merged[df_merged["Measure Object"].astype(str).str.contains(type_token, na=False)].copy()
-            if df_type.empty:
-                return None
-            val = pd.to_numeric(df_type["Value of Fan Rotate Speed(Rps)"], errors="coerce")
-            df_type["RpsVal"] = val
-            df_type = df_type.sort_values("RpsVal", ascending=False)
-            return df_type.iloc[0] if not df_type.empty else None
-
-        try:
-            if st.session_state.get("fan_data") is not None:
-                fan_df = st.session_state["fan_data"].copy()
-                ref = pd.read_excel("data/FAN.xlsx")
-
-                # Normalize columns
-                fan_df.columns = (
-                    fan_df.columns.astype(str).str.strip().str.replace(r"\s+", " ", regex=True).str.replace("\u00a0", " ")
-                )
-                ref.columns = (
-                    ref.columns.astype(str).str.strip().str.replace(r"\s+", " ", regex=True).str.replace("\u00a0", " ")
-                )
-
-                # Merge with reference
-                fan_df["Mapping Format"] = (
-                    fan_df["ME"].astype(str).str.strip() + fan_df["Measure Object"].astype(str).str.strip()
-                )
-                ref["Mapping"] = ref["Mapping"].astype(str).str.strip()
-                merged = pd.merge(
-                    fan_df,
-                    ref[["Mapping", "Site Name", "Maximum threshold", "Minimum threshold"]],
-                    left_on="Mapping Format",
-                    right_on="Mapping",
-                    how="inner",
-                )
-                merged = merged[[
-                    "Site Name", "ME", "Measure Object", "Value of Fan Rotate Speed(Rps)",
-                    "Maximum threshold", "Minimum threshold"
-                ]].copy()
-
-                # Thresholds
-                thresholds = {"FCC": 120.0, "FCPL": 120.0, "FCPS": 230.0, "FCPP": 250.0}
-
-                c1, c2, c3, c4 = st.columns(4)
-                with c1:
-                    render_fan_gauge(
-                        "FCC",
-                        compute_max_fan_per_type(merged, "FCC"),
-                        thresholds["FCC"],
-                        vmax= max(150.0, thresholds["FCC"] * 1.2),
-                    )
-                with c2:
-                    render_fan_gauge(
-                        "FCPL",
-                        compute_max_fan_per_type(merged, "FCPL"),
-                        thresholds["FCPL"],
-                        vmax= max(150.0, thresholds["FCPL"] * 1.2),
-                    )
-                with c3:
-                    render_fan_gauge(
-                        "FCPS",
-                        compute_max_fan_per_type(merged, "FCPS"),
-                        thresholds["FCPS"],
-                        vmax= max(280.0, thresholds["FCPS"] * 1.15),
-                    )
-                with c4:
-                    render_fan_gauge(
-                        "FCPP",
-                        compute_max_fan_per_type(merged, "FCPP"),
-                        thresholds["FCPP"],
-                        vmax= max(300.0, thresholds["FCPP"] * 1.15),
-                    )
-            else:
-                st.info("Upload FAN file and run analysis to populate FAN dashboard.")
-        except Exception as e:
-            st.warning(f"FAN dashboard could not be rendered: {e}")
+        snap = snapshot("FAN", "FAN")
+        if snap is not None:
+            # Thresholds / ช่วงของ gauge
+            gauges = {
+                "FCC": (120.0, 150.0, 1.2),
+                "FCPL": (120.0, 150.0, 1.2),
+                "FCPS": (230.0, 280.0, 1.15),
+                "FCPP": (250.0, 300.0, 1.15),
+            }
+            cols = st.columns(4)
+            for col, (ftype, (threshold, vmin, k)) in zip(cols, gauges.items()):
+                with col:
+                    render_fan_gauge(ftype, snap.get(ftype), threshold, vmax=max(vmin, threshold * k))
 
         # ==============================
         # MSU Section
@@ -928,239 +958,66 @@ elif menu == "Dashboard":
         st.markdown("---")
         st.markdown("## MSU")
 
-        try:
-            if st.session_state.get("msu_data") is not None:
-                msu_df = st.session_state["msu_data"].copy()
-                ref = pd.read_excel("data/MSU.xlsx")
-
-                # Normalize
-                for df_ in (msu_df, ref):
-                    df_.columns = (
-                        df_.columns.astype(str)
-                        .str.strip().str.replace(r"\s+", " ", regex=True).str.replace("\u00a0", " ")
+        snap = snapshot("MSU", "MSU")
+        if snap is not None:
+            c = st.columns(3)
+            with c[0]:
+                st.markdown("#### MSU Max mA")
+                board = snap["max"]
+                if not board:
+                    st.info("No data")
+                else:
+                    mA = board["value"] if board["value"] is not None else float("nan")
+                    msg_color = "red" if pd.notna(mA) and mA > dashboard_kpi.MSU_LIMIT else "green"
+                    st.markdown(
+                        f"<div style='font-weight:600;color:{msg_color};'>{board['site']} — {board['board']} — {mA:.2f} mA</div>",
+                        unsafe_allow_html=True,
                     )
+                    st.markdown("<div style='color:gray;'>Normal < 1100, Abnormal > 1100</div>", unsafe_allow_html=True)
 
-                # Merge with reference for Site Name
-                msu_df["Mapping Format"] = (
-                    msu_df["ME"].astype(str).str.strip() + msu_df["Measure Object"].astype(str).str.strip()
-                )
-                ref["Mapping"] = ref["Mapping"].astype(str).str.strip()
-                merged = pd.merge(
-                    msu_df,
-                    ref[["Mapping", "Site Name"]],
-                    left_on="Mapping Format",
-                    right_on="Mapping",
-                    how="inner",
-                )
-
-                merged = merged[[
-                    "Site Name", "ME", "Measure Object", "Laser Bias Current(mA)"
-                ]].copy()
-
-                merged["Laser Bias Current(mA)"] = pd.to_numeric(
-                    merged["Laser Bias Current(mA)"], errors="coerce"
-                )
-
-                # Find maximum mA row
-                row_max = merged.sort_values("Laser Bias Current(mA)", ascending=False).iloc[0] if not merged.empty else None
-
-                c = st.columns(3)
-                with c[0]:
-                    st.markdown("#### MSU Max mA")
-                    if row_max is None:
-                        st.info("No data")
-                    else:
-                        site = str(row_max.get("Site Name", "-"))
-                        board = str(row_max.get("Measure Object", "-"))
-                        mA = float(row_max.get("Laser Bias Current(mA)", float("nan")))
-                        msg_color = "red" if pd.notna(mA) and mA > 1100 else "green"
-                        st.markdown(
-                            f"<div style='font-weight:600;color:{msg_color};'>{site} — {board} — {mA:.2f} mA</div>",
-                            unsafe_allow_html=True,
-                        )
-                        st.markdown("<div style='color:gray;'>Normal < 1100, Abnormal > 1100</div>", unsafe_allow_html=True)
-
-                # Counts
-                vals = pd.to_numeric(merged["Laser Bias Current(mA)"], errors="coerce")
-                abn_cnt = int((vals > 1100).sum())
-                ok_cnt = int((vals < 1100).sum())
-                total = int(vals.notna().sum())
-
-                with c[1]:
-                    st.metric("Normal", f"{ok_cnt}")
-                with c[2]:
-                    st.metric("Abnormal", f"{abn_cnt}", f"Total {total}")
-            else:
-                st.info("Upload MSU file and run analysis to populate MSU dashboard.")
-        except Exception as e:
-            st.warning(f"MSU dashboard could not be rendered: {e}")
+            with c[1]:
+                st.metric("Normal", f"{snap['normal']}")
+            with c[2]:
+                st.metric("Abnormal", f"{snap['abnormal']}", f"Total {snap['total']}")
 
         # ==============================
         # Line Section Summary
         # ==============================
         st.markdown("---")
         st.markdown("## Line")
-        try:
-            if st.session_state.get("line_data") is not None:
-                df_line = st.session_state["line_data"].copy()
-                ref = pd.read_excel("data/Line.xlsx")
-
-                # Normalize
-                for df_ in (df_line, ref):
-                    df_.columns = (
-                        df_.columns.astype(str)
-                        .str.strip().str.replace(r"\s+", " ", regex=True).str.replace("\u00a0", " ")
-                    )
-
-                # Merge
-                df_line["Mapping Format"] = (
-                    df_line["ME"].astype(str).str.strip() + df_line["Measure Object"].astype(str).str.strip()
-                )
-                ref["Mapping"] = ref["Mapping"].astype(str).str.strip()
-                merged = pd.merge(
-                    df_line,
-                    ref[["Mapping", "Site Name", "Threshold",
-                         "Maximum threshold(out)", "Minimum threshold(out)",
-                         "Maximum threshold(in)",  "Minimum threshold(in)",
-                         "Route"]],
-                    left_on="Mapping Format",
-                    right_on="Mapping",
-                    how="inner",
-                )
-
-                # Cast
-                ber = pd.to_numeric(merged.get("Instant BER After FEC"), errors="coerce")
-                thr = pd.to_numeric(merged.get("Threshold"), errors="coerce")
-                vin = pd.to_numeric(merged.get("Input Optical Power(dBm)"), errors="coerce")
-                vout = pd.to_numeric(merged.get("Output Optical Power (dBm)"), errors="coerce")
-                min_in = pd.to_numeric(merged.get("Minimum threshold(in)"), errors="coerce")
-                max_in = pd.to_numeric(merged.get("Maximum threshold(in)"), errors="coerce")
-                min_out = pd.to_numeric(merged.get("Minimum threshold(out)"), errors="coerce")
-                max_out = pd.to_numeric(merged.get("Maximum threshold(out)"), errors="coerce")
-
-                total = int(len(merged))
-                ber_abn = int(((thr.notna()) & (ber.notna()) & (ber > thr)).sum())
-                in_abn = int(((vin.notna() & min_in.notna() & max_in.notna()) & ((vin < min_in) | (vin > max_in))).sum())
-                out_abn = int(((vout.notna() & min_out.notna() & max_out.notna()) & ((vout < min_out) | (vout > max_out))).sum())
-
-                c = st.columns(4)
-                c[0].metric("Total", f"{total}")
-                c[1].metric("BER Abnormal", f"{ber_abn}")
-                c[2].metric("Input Abnormal", f"{in_abn}")
-                c[3].metric("Output Abnormal", f"{out_abn}")
-
-                # Preset quick card
-                preset_mask = merged.get("Route", pd.Series([], dtype=object)).astype(str).str.startswith("Preset")
-                preset_total = int(preset_mask.sum())
-                preset_df = merged.loc[preset_mask].copy()
-                p_ber_abn = int(((pd.to_numeric(preset_df.get("Instant BER After FEC"), errors="coerce") > pd.to_numeric(preset_df.get("Threshold"), errors="coerce"))).sum())
-                p_in_abn = int(((pd.to_numeric(preset_df.get("Input Optical Power(dBm)"), errors="coerce") < pd.to_numeric(preset_df.get("Minimum threshold(in)"), errors="coerce")) |
-                                (pd.to_numeric(preset_df.get("Input Optical Power(dBm)"), errors="coerce") > pd.to_numeric(preset_df.get("Maximum threshold(in)"), errors="coerce"))).sum())
-                p_out_abn = int(((pd.to_numeric(preset_df.get("Output Optical Power (dBm)"), errors="coerce") < pd.to_numeric(preset_df.get("Minimum threshold(out)"), errors="coerce")) |
-                                 (pd.to_numeric(preset_df.get("Output Optical Power (dBm)"), errors="coerce") > pd.to_numeric(preset_df.get("Maximum threshold(out)"), errors="coerce"))).sum())
-
-                st.markdown("#### Preset")
-                pc = st.columns(4)
-                pc[0].metric("Preset Total", f"{preset_total}")
-                pc[1].metric("BER Abn (Preset)", f"{p_ber_abn}")
-                pc[2].metric("Input Abn (Preset)", f"{p_in_abn}")
-                pc[3].metric("Output Abn (Preset)", f"{p_out_abn}")
-
-                # Preset usage table with status label (OK/Abnormal) per Preset
-                if not preset_df.empty:
-                    preset_df = preset_df.copy()
-                    preset_df["PresetNo"] = preset_df["Route"].astype(str).str.extract(r"Preset\s*(\\d+)")
-                    # Determine abnormal for each row
-                    pber = pd.to_numeric(preset_df.get("Instant BER After FEC"), errors="coerce")
-                    pthr = pd.to_numeric(preset_df.get("Threshold"), errors="coerce")
-                    pinv = pd.to_numeric(preset_df.get("Input Optical Power(dBm)"), errors="coerce")
-                    pinL = pd.to_numeric(preset_df.get("Minimum threshold(in)"), errors="coerce")
-                    pinH = pd.to_numeric(preset_df.get("Maximum threshold(in)"), errors="coerce")
-                    pout = pd.to_numeric(preset_df.get("Output Optical Power (dBm)"), errors="coerce")
-                    poutL= pd.to_numeric(preset_df.get("Minimum threshold(out)"), errors="coerce")
-                    poutH= pd.to_numeric(preset_df.get("Maximum threshold(out)"), errors="coerce")
-
-                    row_abn = (
-                        (pber.notna() & pthr.notna() & (pber > pthr)) |
-                        (pinv.notna() & pinL.notna() & pinH.notna() & ((pinv < pinL) | (pinv > pinH))) |
-                        (pout.notna() & poutL.notna() & poutH.notna() & ((pout < poutL) | (pout > poutH)))
-                    )
-                    preset_df["RowAbn"] = row_abn
-
-                    preset_usage = (
-                        preset_df.groupby("PresetNo").agg(
-                            usage=("PresetNo", "count"),
-                            abn=("RowAbn", "any"),
-                        ).reset_index()
-                    )
-                    preset_usage["Status"] = preset_usage["abn"].map(lambda x: "Abnormal" if x else "Normal")
-                    preset_usage = preset_usage[["PresetNo", "usage", "Status"]]
-                    preset_usage = preset_usage.rename(columns={"PresetNo": "Preset", "usage": "Usage"})
-
-                    st.markdown("#### Preset Usage • Status")
-                    st.dataframe(preset_usage.reset_index(drop=True), use_container_width=True)
-            else:
-                st.info("Upload Line file and run analysis to populate Line dashboard.")
-        except Exception as e:
-            st.warning(f"Line dashboard could not be rendered: {e}")
+        snap = snapshot("Line", "Line")
+        if snap is not None:
+            c = st.columns(4)
+            c[0].metric("Total", f"{snap['total']}")
+            c[1].metric("BER Abnormal", f"{snap['ber_abn']}")
+            c[2].metric("Input Abnormal", f"{snap['in_abn']}")
+            c[3].metric("Output Abnormal", f"{snap['out_abn']}")
+
+            # Preset quick card
+            preset = snap["preset"]
+            st.markdown("#### Preset")
+            pc = st.columns(4)
+            pc[0].metric("Preset Total", f"{preset['total']}")
+            pc[1].metric("BER Abn (Preset)", f"{preset['ber_abn']}")
+            pc[2].metric("Input Abn (Preset)", f"{preset['in_abn']}")
+            pc[3].metric("Output Abn (Preset)", f"{preset['out_abn']}")
+
+            # Preset usage table with status label (OK/Abnormal) per Preset
+            if snap["preset_usage"]:
+                st.markdown("#### Preset Usage • Status")
+                st.dataframe(pd.DataFrame(snap["preset_usage"]), use_container_width=True)
 
         # ==============================
         # Client Section Summary
         # ==============================
         st.markdown("---")
         st.markdown("## Client")
-        try:
-            if st.session_state.get("client_data") is not None:
-                df_client = st.session_state["client_data"].copy()
-                ref = pd.read_excel("data/Client.xlsx")
-
-                # Normalize
-                for df_ in (df_client, ref):
-                    df_.columns = (
-                        df_.columns.astype(str)
-                        .str.strip().str.replace(r"\s+", " ", regex=True).str.replace("\u00a0", " ")
-                    )
-
-                df_client["Mapping Format"] = (
-                    df_client["ME"].astype(str).str.strip() + df_client["Measure Object"].astype(str).str.strip()
-                )
-                ref["Mapping"] = ref["Mapping"].astype(str).str.strip()
-                merged = pd.merge(
-                    df_client,
-                    ref[[
-                        "Mapping", "Site Name",
-                        "Maximum threshold(out)", "Minimum threshold(out)",
-                        "Maximum threshold(in)",  "Minimum threshold(in)",
-                    ]],
-                    left_on="Mapping Format",
-                    right_on="Mapping",
-                    how="inner",
-                )
-
-                vin = pd.to_numeric(merged.get("Input Optical Power(dBm)"), errors="coerce")
-                vout = pd.to_numeric(merged.get("Output Optical Power (dBm)"), errors="coerce")
-                min_in = pd.to_numeric(merged.get("Minimum threshold(in)"), errors="coerce")
-                max_in = pd.to_numeric(merged.get("Maximum threshold(in)"), errors="coerce")
-                min_out = pd.to_numeric(merged.get("Minimum threshold(out)"), errors="coerce")
-                max_out = pd.to_numeric(merged.get("Maximum threshold(out)"), errors="coerce")
-
-                # Exclude invalid -60
-                mask_valid = (vin != -60) & (vout != -60)
-                vin = vin.where(mask_valid)
-                vout = vout.where(mask_valid)
-
-                total = int(len(merged))
-                in_abn = int(((vin.notna() & min_in.notna() & max_in.notna()) & ((vin < min_in) | (vin > max_in))).sum())
-                out_abn = int(((vout.notna() & min_out.notna() & max_out.notna()) & ((vout < min_out) | (vout > max_out))).sum())
-
-                c = st.columns(3)
-                c[0].metric("Total", f"{total}")
-                c[1].metric("Input Abnormal", f"{in_abn}")
-                c[2].metric("Output Abnormal", f"{out_abn}")
-            else:
-                st.info("Upload Client file and run analysis to populate Client dashboard.")
-        except Exception as e:
-            st.warning(f"Client dashboard could not be rendered: {e}")
+        snap = snapshot("Client", "Client")
+        if snap is not None:
+            c = st.columns(3)
+            c[0].metric("Total", f"{snap['total']}")
+            c[1].metric("Input Abnormal", f"{snap['in_abn']}")
+            c[2].metric("Output Abnormal", f"{snap['out_abn']}")
 
         # ==============================
         # EOL / Core / APO – Circle Charts
@@ -1169,146 +1026,85 @@ elif menu == "Dashboard":
         st.markdown("## EOL • Core • APO")
 
         cols = st.columns(3)
-
-        # EOL Donut
-        try:
-            df_raw = st.session_state.get("atten_data")
-            if df_raw is not None:
-                eol = EOLAnalyzer(df_ref=None, df_raw_data=df_raw.copy(), ref_path="data/EOL.xlsx")
-                df_result = eol.build_result_df()
-                if not df_result.empty:
-                    vals = pd.to_numeric(df_result.get("Loss current - Loss EOL"), errors="coerce")
-                    remark = df_result.get("Remark").astype(str).fillna("")
-                    status = []
-                    for v, r in zip(vals, remark):
-                        if r.strip() != "":
-                            status.append("EOL Fiber Break")
-                        elif pd.notna(v) and v >= 2.5:
-                            status.append("EOL Excess Loss")
-                        else:
-                            status.append("EOL Normal")
-                    with cols[0]:
-                        fig = px.pie(pd.DataFrame({"Status": status}), names="Status", hole=0.5,
-                                     color="Status",
-                                     color_discrete_map={"EOL Normal": "green", "EOL Excess Loss": "red", "EOL Fiber Break": "gold"})
-                        fig.update_traces(textinfo="value+label")
-                        st.plotly_chart(fig, use_container_width=True)
-                else:
-                    with cols[0]:
-                        st.info("No EOL data")
-            else:
-                with cols[0]:
-                    st.info("No EOL data")
-        except Exception as e:
-            with cols[0]:
-                st.warning(f"EOL chart error: {e}")
-
-        # Core Donut
-        try:
-            df_raw = st.session_state.get("atten_data")
-            if df_raw is not None:
-                core = CoreAnalyzer(df_ref=None, df_raw_data=df_raw.copy(), ref_path="data/EOL.xlsx")
-                df_res = core.build_result_df()
-                if not df_res.empty:
-                    df_loss_between_core = core.calculate_loss_between_core(df_res)
-                    vals = df_loss_between_core["Loss between core"].tolist()
-                    status = []
-                    for v in vals:
-                        if v == "--":
-                            status.append("Core Fiber Break")
-                        elif pd.notna(v) and v > 3:
-                            try:
-                                status.append("Core Loss Excess" if float(v) > 3 else "Core Normal")
-                            except Exception:
-                                status.append("Core Normal")
-                        else:
-                            status.append("Core Normal")
-                    with cols[1]:
-                        fig = px.pie(pd.DataFrame({"Status": status}), names="Status", hole=0.5,
-                                     color="Status",
-                                     color_discrete_map={"Core Normal": "green", "Core Loss Excess": "red", "Core Fiber Break": "gold"})
-                        fig.update_traces(textinfo="value+label")
-                        st.plotly_chart(fig, use_container_width=True)
+        donuts = [
+            ("EOL", "No EOL data", {"EOL Normal": "green", "EOL Excess Loss": "red", "EOL Fiber Break": "gold"}),
+            ("Core", "No Core data", {"Core Normal": "green", "Core Loss Excess": "red", "Core Fiber Break": "gold"}),
+            ("APO", "No APO log", {"No APO Remnant": "green", "APO Remnant": "red"}),
+        ]
+        for col, (section, empty_text, colors) in zip(cols, donuts):
+            snap = snaps.get(section)
+            with col:
+                if snap is None:
+                    st.info(empty_text)
+                elif "error" in snap:
+                    st.warning(f"{section} chart error: {snap['error']}")
                 else:
-                    with cols[1]:
-                        st.info("No Core data")
-            else:
-                with cols[1]:
-                    st.info("No Core data")
-        except Exception as e:
-            with cols[1]:
-                st.warning(f"Core chart error: {e}")
-
-        # APO Donut
-        try:
-            wason = st.session_state.get("wason_log")
-            if wason:
-                apo = ApoRemnantAnalyzer(wason)
-                apo.parse(); apo.analyze()
-                rendered = apo.rendered
-                apo_sites = sum(1 for x in rendered if x[2])
-                noapo_sites = sum(1 for x in rendered if not x[2])
-                df_summary = pd.DataFrame({
-                    "Status": (["No APO Remnant"] * noapo_sites) + (["APO Remnant"] * apo_sites)
-                })
-                with cols[2]:
-                    fig = px.pie(df_summary, names="Status", hole=0.5,
-                                 color="Status",
-                                 color_discrete_map={"No APO Remnant": "green", "APO Remnant": "red"})
+                    df_status = pd.DataFrame({"Status": list(snap.keys()), "Count": list(snap.values())})
+                    fig = px.pie(df_status[df_status["Count"] > 0], names="Status", values="Count", hole=0.5,
+                                 color="Status", color_discrete_map=colors)
                     fig.update_traces(textinfo="value+label")
                     st.plotly_chart(fig, use_container_width=True)
-            else:
-                with cols[2]:
-                    st.info("No APO log")
-        except Exception as e:
-            with cols[2]:
-                st.warning(f"APO chart error: {e}")
 
         # ==============================
         # Fiber Flapping — Daily Sites Bar
         # ==============================
         st.markdown("---")
         st.markdown("## Fiber Flapping")
-        try:
-            df_osc = st.session_state.get("osc_data")
-            df_fm  = st.session_state.get("fm_data")
-            if (df_osc is not None) and (df_fm is not None):
-                # Build minimal pipeline to get unmatched flapping per day
-                analyzer_ff = FiberflappingAnalyzer(
-                    df_optical=df_osc.copy(),
-                    df_fm=df_fm.copy(),
-                    threshold=2.0,
-                    ref_path="data/Flapping.xlsx",
-                )
-                df_opt = analyzer_ff.normalize_optical()
-                df_fm_norm, link_col = analyzer_ff.normalize_fm()
-                df_filtered = analyzer_ff.filter_optical_by_threshold(df_opt)
-                df_nomatch = analyzer_ff.find_nomatch(df_filtered, df_fm_norm, link_col)
+        snap = snaps.get("Fiber")
+        if snap is None:
+            st.info("Upload ZIP that includes OSC and FM for Fiber Flapping dashboard.")
+        elif "error" in snap:
+            st.warning(f"Fiber Flapping chart error: {snap['error']}")
+        elif not snap["daily"]:
+            st.success("No unmatched fiber flapping records.")
+        else:
+            daily_counts = pd.DataFrame(snap["daily"])
+            fig = px.bar(daily_counts, x="Date", y="Sites", text="Sites",
+                         title="No Fiber Break Alarm Match (Fiber Flapping)")
+            fig.update_traces(textposition="outside")
+            fig.update_layout(xaxis_tickangle=-45)
+            st.plotly_chart(fig, use_container_width=True)
 
-                if df_nomatch.empty:
-                    st.success("No unmatched fiber flapping records.")
-                else:
-                    df_nomatch = df_nomatch.copy()
-                    df_nomatch["Date"] = pd.to_datetime(df_nomatch["Begin Time"]).dt.date
-                    daily_counts = (
-                        df_nomatch.groupby("Date")["ME"].nunique().reset_index().rename(columns={"ME": "Sites"})
-                    )
-                    fig = px.bar(daily_counts, x="Date", y="Sites", text="Sites",
-                                 title="No Fiber Break Alarm Match (Fiber Flapping)")
-                    fig.update_traces(textposition="outside")
-                    fig.update_layout(xaxis_tickangle=-45)
-                    st.plotly_chart(fig, use_container_width=True)
+        # ==============================
+        # KPI Trend — history ของทุกวันตรวจ (utils/kpi_history)
+        # ==============================
+        st.markdown("---")
+        st.markdown("## KPI Trend")
+        all_metrics = kpi_history.metrics()
+        if not all_metrics:
+            st.info("No KPI history yet — analyze uploads from more inspection dates to build the trend.")
+        else:
+            c1, c2, c3 = st.columns([1, 1, 1])
+            with c1:
+                period = st.radio("Granularity", list(kpi_history.PERIODS), index=1, horizontal=True,
+                                  format_func=kpi_history.PERIODS.get, key="kpi_trend_period")
+            with c2:
+                agg = st.radio("Value", list(kpi_history.AGGREGATES), horizontal=True, key="kpi_trend_agg")
+            with c3:
+                months = st.selectbox("Range", [3, 6, 12, 24], index=1, format_func=lambda m: f"{m} months",
+                                      key="kpi_trend_months")
+            picked = st.multiselect(
+                "Metrics", all_metrics,
+                default=[m for m in all_metrics if m.startswith("CPU max %")][:3] or all_metrics[:1],
+                key="kpi_trend_metrics",
+            )
+            end = kpi_history.span()[1]
+            start = date.fromisoformat(end) - pd.DateOffset(months=months)
+            trend = kpi_history.series(picked, period=period, start=start.date(), end=end)
+            if trend.empty:
+                st.info("No history for the selected metrics in this range")
             else:
-                st.info("Upload ZIP that includes OSC and FM for Fiber Flapping dashboard.")
-        except Exception as e:
-            st.warning(f"Fiber Flapping chart error: {e}")
+                fig = px.line(trend, x="Date", y=agg, color="Metric", markers=True,
+                              hover_data=["min", "max", "avg", "n"])
+                fig.update_layout(yaxis_title=agg, legend_title_text="")
+                st.plotly_chart(fig, use_container_width=True)
     else:
         st.error("❌ Cannot connect to Supabase Database")
         st.info("Please check your Supabase configuration in Streamlit secrets.")
 
 elif menu == "Preset status":
     st.markdown("### Preset Status Analysis")
-    if st.session_state.get("wason_log") is not None:
+    if current_data("wason") is not None:
         try:
             # สร้าง Progress bar สำหรับการวิเคราะห์ Preset
             preset_progress = st.progress(0)
@@ -1317,7 +1113,7 @@ elif menu == "Preset status":
             preset_status.text("📊 Loading Preset analyzer...")
             preset_progress.progress(0.3)
             
-            analyzer = PresetStatusAnalyzer(st.session_state["wason_log"])
+            analyzer = PresetStatusAnalyzer(current_data("wason"))
             preset_progress.progress(0.6)
             
             preset_status.text("🔍 Parsing WASON log...")
@@ -1334,11 +1130,6 @@ elif menu == "Preset status":
             df, summary = analyzer.to_dataframe()
             render_preset_ui(df, summary)
             
-            # บันทึก analyzer ใน session state
-            st.session_state["preset_analyzer"] = analyzer
-            
-            import time
-            time.sleep(1)
             
         except Exception as e:
             st.error(f"❌ An error occurred during Preset analysis: {e}")
@@ -1349,7 +1140,7 @@ elif menu == "Preset status":
 
 elif menu == "APO Remnant":
     st.markdown("### APO Remnant Analysis")
-    if st.session_state.get("wason_log") is not None:
+    if current_data("wason") is not None:
         try:
             # สร้าง Progress bar สำหรับการวิเคราะห์ APO
             apo_progress = st.progress(0)
@@ -1358,7 +1149,7 @@ elif menu == "APO Remnant":
             apo_status.text("📊 Loading APO analyzer...")
             apo_progress.progress(0.3)
             
-            analyzer = ApoRemnantAnalyzer(st.session_state["wason_log"])
+            analyzer = ApoRemnantAnalyzer(current_data("wason"))
             apo_progress.progress(0.6)
             
             apo_status.text("🔍 Parsing WASON log...")
@@ -1374,12 +1165,8 @@ elif menu == "APO Remnant":
             # แสดงผล KPI และ UI
             apo_kpi(analyzer.rendered)
             analyzer.render_streamlit()
+            publish_kpi("APO")
             
-            # บันทึก analyzer ใน session state
-            st.session_state["apo_analyzer"] = analyzer
-            
-            import time
-            time.sleep(1)
             
         except Exception as e:
             st.error(f"❌ An error occurred during APO analysis: {e}")
@@ -1390,4 +1177,13 @@ elif menu == "APO Remnant":
 
 elif menu == "Summary table & report":
     summary = SummaryTableReport()
-    summary.render()
\ No newline at end of file
+    summary.render()
+
+    # KPI ของแต่ละ section → ตาราง analysis_results ใน Supabase (ครั้งเดียวต่อ section ต่อ analysis — จดไว้ใน result_store)
+    aid = st.session_state.get("analysis_id")
+    if aid:
+        try:
+            result_store.mirror_summary(aid, get_supabase())
+        except Exception:
+            # Supabase ล่ม / ไม่มี network → ตาราง Summary ยังใช้ได้ แค่ไม่ได้ mirror
+            logger.warning("analysis summary mirror failed for %s", aid, exc_info=True)
@@ -0,0 +1,306 @@
+"""
+Batch analysis (ไม่ต้องเปิด Streamlit) — สำหรับรันผ่าน cron บน server
+
+ตัวอย่าง:
+    python batch_analyze.py uploads/2025-09-24 -o reports/2025-09-24
+    python batch_analyze.py a.zip b.zip -o out --format parquet --no-pdf
+
+อ่านไฟล์ที่อัปโหลด (ZIP / Excel / TXT หรือทั้งโฟลเดอร์ uploads/<date>) แล้วรัน compute path
+ของทุก analyzer (prepare()) + APO Remnant + Preset status
+ผลลัพธ์: ตาราง abnormal แยกไฟล์ (CSV/Parquet), summary.csv และ PDF จาก report.generate_report
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from utils import dataset_cache, memo
+from utils.ingest import parse_files
+from utils.reference import get_registry
+
+from CPU_Analyzer import CPU_Analyzer
+from FAN_Analyzer import FAN_Analyzer
+from MSU_Analyzer import MSU_Analyzer
+from Line_Analyzer import Line_Analyzer
+from Client_Analyzer import Client_Analyzer
+from Fiberflapping_Analyzer import FiberflappingAnalyzer
+from EOL_Core_Analyzer import EOLAnalyzer, CoreAnalyzer
+from APO_Analyzer import ApoRemnantAnalyzer
+from Preset_Analyzer import PresetStatusAnalyzer
+
+INPUT_EXTS = (".zip", ".xlsx", ".xls", ".xlsm", ".txt")
+
+# ลำดับ section เดียวกับ Summary table / PDF
+REPORT_SECTIONS = ["CPU", "FAN", "MSU", "Line", "Client", "Fiber", "EOL", "Core"]
+
+
+# ====== Input ======
+def collect_inputs(paths: list[str]) -> list[str]:
+    """ขยายโฟลเดอร์เป็นรายการไฟล์ (เรียงตามชื่อ) ข้าม uploads/.cache"""
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            for root, dirs, names in os.walk(p):
+                dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+                for n in sorted(names):
+                    if n.lower().endswith(INPUT_EXTS):
+                        files.append(os.path.join(root, n))
+        elif os.path.isfile(p):
+            files.append(p)
+        else:
+            raise FileNotFoundError(p)
+    return files
+
+
+def load_datasets(files: list[str], use_cache: bool = True, log=print) -> dict:
+    """
+    อ่านทุกไฟล์ (พร้อมกันผ่าน process pool) แล้วรวมเป็น {kind: (data, source_name)}
+    ไฟล์หลังทับไฟล์ก่อน (พฤติกรรมเดียวกับปุ่ม Run Analysis)
+    """
+    t0 = time.perf_counter()
+
+    def _done(i, found):
+        if isinstance(found, Exception):
+            log(f"[skip] {files[i]}: {found}")
+        else:
+            log(f"[load] {files[i]}: {', '.join(found) or '-'} ({time.perf_counter() - t0:.2f}s)")
+
+    if use_cache:
+        results = dataset_cache.get_or_parse_many([(p, None, None) for p in files], on_done=_done)
+    else:
+        results = parse_files([(p, None) for p in files], on_done=_done)
+
+    datasets = {}
+    for found in results:
+        if isinstance(found, dict):
+            datasets.update(found)
+    return datasets
+
+
+# ====== Analysis ======
+def _copy(datasets: dict, kind: str):
+    pack = datasets.get(kind)
+    if not pack:
+        return None
+    return memo.copy(pack[0])   # ถือ tag ของ dataset ไปด้วย (ถ้ามี) → key ของ memo ไม่ต้อง hash
+
+
+def planned_sections(datasets: dict) -> list[str]:
+    """section ที่ analyze_datasets จะรันกับ datasets นี้ (ตามลำดับ) → ใช้คำนวณ progress"""
+    out = [section for section, kind in
+           (("CPU", "cpu"), ("FAN", "fan"), ("MSU", "msu"), ("Line", "line"), ("Client", "client"))
+           if datasets.get(kind)]
+    if datasets.get("osc") and datasets.get("fm"):
+        out.append("Fiber")
+    if datasets.get("atten"):
+        out += ["EOL", "Core"]
+    if datasets.get("wason") and datasets["wason"][0]:
+        out += ["APO", "Preset"]
+    return out
+
+
+def analyze_datasets(datasets: dict, log=print, on_section=None) -> dict:
+    """
+    รัน compute path ของทุก analyzer ที่มีข้อมูล
+    on_section(section, ok) ถูกเรียกหลังแต่ละ section เสร็จ (ลำดับเดียวกับ planned_sections)
+    คืนค่า {
+        "abnormal": {section: {type: DataFrame}}   → ส่งต่อให้ report.generate_report ได้เลย
+        "tables":   {section: DataFrame}           → df_abnormal ทั้งหมดของ section (utils/result_store)
+        "measured": {section: DataFrame}           → ทุกอุปกรณ์ของ section (df_result) → utils/device_history
+        "extra":    {section: {name: DataFrame}}   → APO / Preset / unmatched mapping
+        "errors":   {section: message}
+    }
+    """
+    registry = get_registry()
+    abnormal: dict = {}
+    tables: dict = {}
+    measured: dict = {}
+    extra: dict = {}
+    errors: dict = {}
+
+    def run(section: str, fn):
+        t0 = time.perf_counter()
+        try:
+            fn()
+            log(f"[run]  {section} ({time.perf_counter() - t0:.2f}s)")
+        except Exception as e:
+            errors[section] = str(e)
+            log(f"[fail] {section}: {e}")
+        if on_section is not None:
+            on_section(section, section not in errors)
+
+    def keep(section: str, analyzer):
+        abnormal[section] = analyzer.df_abnormal_by_type or {}
+        tables[section] = getattr(analyzer, "df_abnormal", None)
+        if isinstance(getattr(analyzer, "df_result", None), pd.DataFrame):
+            measured[section] = analyzer.df_result
+        unmatched = getattr(analyzer, "df_unmatched", None)
+        if unmatched is not None and not unmatched.empty:
+            extra.setdefault(section, {})["Unmatched Mapping"] = unmatched
+
+    log_txt = _copy(datasets, "wason")
+    pmap = Line_Analyzer.get_preset_map(log_txt) if log_txt else {}
+
+    simple = [
+        ("CPU", "cpu", lambda df: CPU_Analyzer(df_cpu=df, ns="cpu", registry=registry)),
+        ("FAN", "fan", lambda df: FAN_Analyzer(df_fan=df, ns="fan", registry=registry)),
+        ("MSU", "msu", lambda df: MSU_Analyzer(df_msu=df, ns="msu", registry=registry)),
+        ("Line", "line", lambda df: Line_Analyzer(df_line=df, pmap=pmap, ns="line", registry=registry)),
+        ("Client", "client", lambda df: Client_Analyzer(df_client=df, registry=registry)),
+    ]
+    for section, kind, make in simple:
+        df = _copy(datasets, kind)
+        if df is None:
+            continue
+
+        def _do(section=section, make=make, df=df):
+            a = make(df)
+            a.prepare()
+            keep(section, a)
+        run(section, _do)
+
+    df_osc, df_fm = _copy(datasets, "osc"), _copy(datasets, "fm")
+    if df_osc is not None and df_fm is not None:
+        def _fiber():
+            a = FiberflappingAnalyzer(df_optical=df_osc, df_fm=df_fm, threshold=2.0, registry=registry)
+            a.prepare()
+            keep("Fiber", a)
+            a.ingest_history()  # สะสม event ลง uploads/flapping.db ให้กราฟ trend หลายสัปดาห์
+        run("Fiber", _fiber)
+
+    if datasets.get("atten"):
+        # EOL กับ Core ใช้ attenuation pipeline เดียวกัน (merge ครั้งเดียว — Core ได้ผลจาก utils.memo)
+        df_atten = datasets["atten"][0]
+
+        def _loss(section, cls):
+            a = cls(df_ref=None, df_raw_data=df_atten, ref_path="data/EOL.xlsx")
+            a.prepare()
+            keep(section, a)
+        run("EOL", lambda: _loss("EOL", EOLAnalyzer))
+        run("Core", lambda: _loss("Core", CoreAnalyzer))
+
+    if log_txt:
+        def _apo():
+            a = ApoRemnantAnalyzer(log_txt)
+            a.parse()
+            a.analyze()
+            df = pd.DataFrame(
+                [(ip, site, has_mismatch) for ip, _, has_mismatch, site in a.rendered],
+                columns=["WASON IP", "Site Name", "APO Remnant"],
+            )
+            extra["APO"] = {"Sites": df, "APO Remnant": df[df["APO Remnant"]]}
+
+        def _preset():
+            a = PresetStatusAnalyzer(log_txt)
+            a.parse()
+            a.analyze()
+            df, _ = a.to_dataframe()
+            df = df.drop(columns=["Raw"], errors="ignore")
+            extra["Preset"] = {"Calls": df, "FAIL": df[df["Verdict"] == "FAIL"]}
+
+        run("APO", _apo)
+        run("Preset", _preset)
+
+    return {"abnormal": abnormal, "tables": tables, "measured": measured, "extra": extra, "errors": errors}
+
+
+# ====== Output ======
+def _safe_name(text: str) -> str:
+    return re.sub(r"[^0-9A-Za-z]+", "_", str(text)).strip("_") or "table"
+
+
+def _write_table(df: pd.DataFrame, path_no_ext: str, fmt: str) -> str:
+    if fmt == "parquet":
+        path = path_no_ext + ".parquet"
+        try:
+            df.to_parquet(path, index=False)
+        except Exception:
+            # คอลัมน์ object ที่ปนตัวเลข/ข้อความ (เช่น "--") Arrow เขียนไม่ได้ → แปลงเป็น string
+            obj_cols = df.select_dtypes(include="object").columns
+            df.astype({c: str for c in obj_cols}).to_parquet(path, index=False)
+    else:
+        path = path_no_ext + ".csv"
+        df.to_csv(path, index=False, encoding="utf-8-sig")
+    return path
+
+
+def summarize(results: dict) -> pd.DataFrame:
+    rows = []
+    for section in REPORT_SECTIONS:
+        by_type = results["abnormal"].get(section)
+        if section in results["errors"]:
+            rows.append((section, "Error", 0, results["errors"][section]))
+        elif by_type is None:
+            rows.append((section, "No data", 0, ""))
+        else:
+            n = sum(len(df) for df in by_type.values() if isinstance(df, pd.DataFrame))
+            rows.append((section, "Abnormal" if n else "Normal", n, ""))
+    for section in ("APO", "Preset"):
+        tables = results["extra"].get(section)
+        if section in results["errors"]:
+            rows.append((section, "Error", 0, results["errors"][section]))
+        elif tables is None:
+            rows.append((section, "No data", 0, ""))
+        else:
+            n = len(tables["APO Remnant" if section == "APO" else "FAIL"])
+            rows.append((section, "Abnormal" if n else "Normal", n, ""))
+    return pd.DataFrame(rows, columns=["Section", "Status", "Abnormal rows", "Error"])
+
+
+def write_outputs(results: dict, out_dir: str, fmt: str = "csv", pdf: bool = True, log=print) -> list[str]:
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    groups = list(results["abnormal"].items()) + list(results["extra"].items())
+    for section, tables in groups:
+        for name, df in tables.items():
+            if isinstance(df, pd.DataFrame):
+                base = os.path.join(out_dir, f"{_safe_name(section)}__{_safe_name(name)}")
+                written.append(_write_table(df, base, fmt))
+
+    written.append(_write_table(summarize(results), os.path.join(out_dir, "summary"), "csv"))
+
+    if pdf:
+        from report import generate_report  # reportlab/matplotlib โหลดเฉพาะตอนต้องใช้
+        pdf_bytes = generate_report(all_abnormal=results["abnormal"])
+        path = os.path.join(out_dir, f"Network_Inspection_Report_{datetime.now():%Y%m%d_%H%M%S}.pdf")
+        with open(path, "wb") as f:
+            f.write(pdf_bytes)
+        written.append(path)
+
+    for p in written:
+        log(f"[out]  {p}")
+    return written
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Run all 3BB inspection analyzers without the Streamlit UI.")
+    parser.add_argument("inputs", nargs="+", help="stored ZIP/Excel/TXT files or uploads/<date> directories")
+    parser.add_argument("-o", "--out", default=None, help="output directory (default: reports/<timestamp>)")
+    parser.add_argument("--format", choices=("csv", "parquet"), default="csv", help="format of the abnormal tables")
+    parser.add_argument("--no-pdf", action="store_true", help="skip the PDF report")
+    parser.add_argument("--no-cache", action="store_true", help="always re-parse the inputs (skip uploads/.cache)")
+    parser.add_argument("-q", "--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    log = (lambda *_: None) if args.quiet else (lambda msg: print(msg, file=sys.stderr))
+    out_dir = args.out or os.path.join("reports", datetime.now().strftime("%Y%m%d_%H%M%S"))
+
+    files = collect_inputs(args.inputs)
+    if not files:
+        log("no input files found")
+        return 2
+
+    datasets = load_datasets(files, use_cache=not args.no_cache, log=log)
+    results = analyze_datasets(datasets, log=log)
+    write_outputs(results, out_dir, fmt=args.format, pdf=not args.no_pdf, log=log)
+
+    print(summarize(results).to_string(index=False))
+    return 1 if results["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
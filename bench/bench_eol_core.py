@@ -0,0 +1,158 @@
+"""
+Benchmark: สถานะ EOL / Core แบบ vectorized (Categorical ครั้งเดียวใน compute) เทียบกับแบบเดิม
+(iterrows / loop ทีละค่าของ loss_values + list comprehension boolean และ apply(is_castable_to_float) ทีละ cell)
+
+    python bench/bench_eol_core.py [--links 200000] [--repeat 3]
+
+สร้าง attenuation report + EOL reference จำลอง (link เป็นคู่ A→B / B→A, ค่าแปลก ๆ เช่น "--", None, NaN,
+" 12.5 ", "1_0", link ใน reference ที่ไม่มีใน report) แล้วตรวจว่า Remark, สถานะต่อ link,
+Loss between core และตาราง abnormal ทุกชนิดเท่ากับแบบเดิมทุกแถว
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore")
+
+import numpy as np
+import pandas as pd
+
+from EOL_Core_Analyzer import CoreAnalyzer, EOLAnalyzer, LossAnalyzer
+
+COL_ATTEN = "Optical Attenuation (dB)"
+
+
+def synthetic_atten(links: int, seed: int = 0) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """(df_ref, df_raw_data) — links คู่ละสองทิศ, reference มี link ที่ไม่อยู่ใน report ปนอยู่"""
+    rng = np.random.default_rng(seed)
+    pairs = links // 2
+    a = pd.Series([f"ME{i:05d}-1-LB2R-1(IN/OUT)" for i in range(pairs)])
+    b = pd.Series([f"ME{i + 1:05d}-2-LB2R-1(IN/OUT)" for i in range(pairs)])
+    source = pd.concat([a, b]).sort_index(kind="stable").reset_index(drop=True)
+    sink = pd.concat([b, a]).sort_index(kind="stable").reset_index(drop=True)
+
+    eol = rng.uniform(5, 25, len(source)).round(2)
+    atten = pd.Series((eol + rng.normal(1.5, 1.5, len(source))).round(2), dtype=object)
+    odd = rng.choice(len(source), size=max(len(source) // 50, 8), replace=False)
+    odd_value = ["--", None, float("nan"), " 12.5 ", "1_0", "NA", "", 40]
+    for i, pos in enumerate(odd):
+        atten.iat[pos] = odd_value[i % len(odd_value)]
+
+    df_raw = pd.DataFrame({"Source Port": source, "Sink Port": sink, COL_ATTEN: atten})
+    df_ref = pd.DataFrame({"Link Name": source + "_" + sink, "EOL(dB)": eol})
+    # link ใน reference ที่ report ไม่มี (join แล้ว Current Attenuation / Remark เป็น NaN)
+    missing = rng.choice(len(df_raw), size=max(len(df_raw) // 200, 2), replace=False)
+    df_raw = df_raw.drop(index=missing).reset_index(drop=True)
+    return df_ref, df_raw
+
+
+# ---------- ตรรกะเดิม (ใช้เป็นค่าอ้างอิง) ----------
+def remark_rowwise(values: pd.Series) -> pd.Series:
+    return values.apply(lambda x: "" if LossAnalyzer.is_castable_to_float(x) else "Fiber Break")
+
+
+def eol_status_rowwise(df_result: pd.DataFrame) -> list[str]:
+    status_list = []
+    for _, row in df_result.iterrows():
+        val = pd.to_numeric(row.get("Loss current - Loss EOL"), errors="coerce")
+        remark = str(row.get("Remark", "")).strip()
+        if remark != "":
+            status_list.append("EOL Fiber Break")
+        elif pd.notna(val) and val >= 2.5:
+            status_list.append("EOL Excess Loss")
+        else:
+            status_list.append("EOL Normal")
+    return status_list
+
+
+def core_loss_rowwise(df_result: pd.DataFrame) -> list:
+    forward_direction = df_result["Loss current - Loss EOL"].iloc[::2].values
+    reverse_direction = df_result["Loss current - Loss EOL"].iloc[1::2].values
+    loss_between_core = [abs(f - r) for f, r in zip(forward_direction, reverse_direction)]
+    loss_between_core = ["--" if pd.isna(value) else round(value, 2) for value in loss_between_core]
+    return [x for x in loss_between_core for _ in range(2)]
+
+
+def core_status_rowwise(loss_values: list) -> list[str]:
+    status_list = []
+    for v in loss_values:
+        if v == "--":
+            status_list.append("Core Fiber Break")
+        elif pd.notna(v) and v > 3:
+            status_list.append("Core Loss Excess")
+        else:
+            status_list.append("Core Normal")
+    return status_list
+
+
+def best_of(fn, repeat: int):
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--links", type=int, default=200_000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    df_ref, df_raw = synthetic_atten(args.links)
+    eol = EOLAnalyzer(df_ref=df_ref, df_raw_data=df_raw.copy())
+    core = CoreAnalyzer(df_ref=df_ref, df_raw_data=df_raw.copy())
+
+    # 1) Remark (Fiber Break ถ้า float() ไม่ได้)
+    values = df_raw[COL_ATTEN]
+    t_old_rm, old_rm = best_of(lambda: remark_rowwise(values), 1)
+    t_new_rm, new_rm = best_of(lambda: LossAnalyzer.fiber_break_remark(values), args.repeat)
+    assert new_rm.tolist() == old_rm.tolist(), "Remark differs"
+
+    # 2) สถานะ EOL (ตรรกะของหน้า Loss between EOL: Remark ว่างถ้า link ไม่อยู่ใน report)
+    state = eol.compute()
+    df_result = state["df_result"]
+    t_old_eol, old_eol = best_of(lambda: eol_status_rowwise(df_result), 1)
+    t_new_eol, new_eol = best_of(lambda: EOLAnalyzer.eol_status(df_result), args.repeat)
+    assert new_eol.astype(str).tolist() == old_eol, "EOL status differs"
+    tables = EOLAnalyzer.split_status(df_result, new_eol, ["EOL Excess Loss", "EOL Fiber Break"])
+    for name, df in tables.items():
+        ref = df_result.loc[[s == name for s in old_eol]].reset_index(drop=True)
+        pd.testing.assert_frame_equal(df, ref, obj=name)
+
+    # หน้า EOL / หน้า Core / Dashboard ได้ผล pipeline ชุดเดียวกัน (utils.memo) ไม่ merge ซ้ำ
+    assert core.compute() is state, "EOL and Core should share one attenuation pipeline result"
+
+    # 3) Loss between core + สถานะ Core
+    t_old_loss, old_loss = best_of(lambda: core_loss_rowwise(df_result), 1)
+    t_new_loss, df_core = best_of(lambda: core.calculate_loss_between_core(df_result), args.repeat)
+    new_loss = df_core["Loss between core"].tolist()
+    assert len(new_loss) == len(old_loss) and all(
+        (n == "--") if o == "--" else (n != "--" and float(n) == float(o)) for n, o in zip(new_loss, old_loss)
+    ), "Loss between core differs"
+
+    t_old_core, old_core = best_of(lambda: core_status_rowwise(old_loss), 1)
+    t_new_core, new_core = best_of(lambda: CoreAnalyzer.core_status(df_core["Loss between core"]), args.repeat)
+    assert new_core.astype(str).tolist() == old_core, "Core status differs"
+    core_tables = core.core_tables(df_core, new_core)
+    assert core_tables["Core Loss Excess"]["Link Name"].tolist() == [
+        ln for ln, s in zip(df_core["Link Name"], old_core) if s == "Core Loss Excess"], "Core Loss Excess differs"
+    assert core_tables["Core Fiber Break"]["Link Name"].tolist() == [
+        ln for ln, s in zip(df_core["Link Name"], old_core) if s == "Core Fiber Break"], "Core Fiber Break differs"
+
+    counts = new_eol.value_counts()
+    print(f"{len(df_result):,} links: " + ", ".join(f"{k} {v:,}" for k, v in counts.items()))
+    print(f"  Remark        apply    {t_old_rm:7.3f}s  vectorized {t_new_rm:7.3f}s  x{t_old_rm / t_new_rm:,.0f}")
+    print(f"  EOL status    iterrows {t_old_eol:7.3f}s  vectorized {t_new_eol:7.3f}s  x{t_old_eol / t_new_eol:,.0f}")
+    print(f"  Core loss     loop     {t_old_loss:7.3f}s  vectorized {t_new_loss:7.3f}s  x{t_old_loss / t_new_loss:,.0f}")
+    print(f"  Core status   loop     {t_old_core:7.3f}s  vectorized {t_new_core:7.3f}s  x{t_old_core / t_new_core:,.0f}")
+    print("OK: outputs identical")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
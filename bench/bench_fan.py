@@ -0,0 +1,101 @@
+"""
+Benchmark: ตรวจ FAN abnormal + แยก Board/Port แบบ vectorized เทียบกับแบบเดิม (apply ทีละแถว)
+
+    python bench/bench_fan.py [--rows 500000] [--repeat 3]
+
+สร้าง FAN export จำลอง (FCC/FCPP/FCPL/FCPS + ค่าแปลก ๆ เช่น "--", NaN, Measure Object ว่าง)
+แล้วเทียบ FAN_Analyzer._not_ok_mask / _board_port กับ _is_not_ok_rule / extract_board /
+extract_port ที่เรียกผ่าน apply และตรวจว่าผลเท่ากันทุกแถว
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore")
+
+import numpy as np
+import pandas as pd
+
+from FAN_Analyzer import FAN_Analyzer
+
+COL_MOBJ = "Measure Object"
+COL_VALUE = "Value of Fan Rotate Speed(Rps)"
+
+
+def synthetic_fan(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    types = np.array(["FCC", "FCPP", "FCPL", "FCPS", "PIU"])
+    mobj = pd.Series(
+        [f"{t}[0-{s}-{b}]-Fan[FanID:{f}]" for t, s, b, f in zip(
+            types[rng.integers(0, len(types), rows)],
+            rng.integers(1, 9, rows),
+            rng.choice([100, 101], rows),
+            rng.integers(1, 13, rows),
+        )],
+        dtype=object,
+    )
+    value = pd.Series(rng.normal(150, 60, rows).round(2), dtype=object)
+
+    # ค่าขอบ ๆ ที่เจอใน export จริง
+    odd = rng.choice(rows, size=max(rows // 100, 8), replace=False)
+    odd_mobj = [None, "FCC[0-1-1]", "X-Fan[a]b]c", "FanID:7 FCPS", "FCPP-Fan[FanID:2]-Fan[3]", "",
+                "fcc[0-1-1]-Fan[FanID:1]", "FCC[0-2-1]-Fan[FanID:]"]
+    odd_value = ["--", None, "250.5", " 121 ", "1_000", float("nan"), "NA", 300]
+    for i, pos in enumerate(odd):
+        mobj.iat[pos] = odd_mobj[i % len(odd_mobj)]
+        value.iat[pos] = odd_value[i % len(odd_value)]
+
+    return pd.DataFrame({"ME": "ME-" + pd.Series(rng.integers(0, 500, rows)).astype(str),
+                         COL_MOBJ: mobj, COL_VALUE: value})
+
+
+def best_of(fn, repeat: int):
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=500_000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    a = FAN_Analyzer(df_fan=pd.DataFrame(), df_ref=pd.DataFrame())
+    cases = {
+        "object values": synthetic_fan(args.rows),
+    }
+    numeric = cases["object values"].copy()
+    numeric[COL_VALUE] = pd.to_numeric(numeric[COL_VALUE], errors="coerce")
+    numeric[COL_MOBJ] = numeric[COL_MOBJ].astype("str")
+    cases["numeric values"] = numeric
+
+    for label, df in cases.items():
+        t_old_mask, old_mask = best_of(lambda: df.apply(
+            lambda r: a._is_not_ok_rule(r[COL_MOBJ], r[COL_VALUE]), axis=1), 1)
+        t_new_mask, new_mask = best_of(lambda: a._not_ok_mask(df), args.repeat)
+        assert new_mask.equals(old_mask.astype(bool)), f"{label}: abnormal mask differs"
+
+        def old_board_port():
+            return df[COL_MOBJ].apply(a.extract_board), df[COL_MOBJ].apply(a.extract_port)
+
+        t_old_bp, (old_board, old_port) = best_of(old_board_port, 1)
+        t_new_bp, (new_board, new_port) = best_of(lambda: a._board_port(df[COL_MOBJ]), args.repeat)
+        assert new_board.equals(old_board) and new_board.dtype == old_board.dtype, f"{label}: Board differs"
+        assert new_port.equals(old_port) and new_port.dtype == old_port.dtype, f"{label}: Port differs"
+
+        print(f"{label}: {len(df):,} rows, {int(new_mask.sum()):,} abnormal")
+        print(f"  abnormal mask  apply {t_old_mask:7.3f}s  vectorized {t_new_mask:7.3f}s  x{t_old_mask / t_new_mask:,.0f}")
+        print(f"  Board/Port     apply {t_old_bp:7.3f}s  vectorized {t_new_bp:7.3f}s  x{t_old_bp / t_new_bp:,.0f}")
+    print("OK: outputs identical")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
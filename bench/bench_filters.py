@@ -0,0 +1,116 @@
+"""
+Benchmark: cascading_filter แบบ FilterIndex (code ต่อคอลัมน์ + lookup + bincount + cache ต่อ prefix)
+เทียบกับแบบเดิม (astype(str).unique + sorted ทุกชั้น และ astype(str).isin ต่อคอลัมน์ทุก rerun)
+
+    python bench/bench_filters.py [--lines 400000] [--repeat 3]
+
+ใช้ตาราง Line จำลองจาก bench_line (ค่า NaN / ตัวเลขปนข้อความ) กับคอลัมน์ filter ชุดเดียวกับ Line_Analyzer
+แล้วจำลองลำดับการเลือกของผู้ใช้ (เลือกทีละชั้น / เปลี่ยนชั้นบน / ล้าง) ตรวจว่าตัวเลือกทุกชั้น
+selection ที่เหลือ และแถวผลลัพธ์เท่ากับแบบเดิมทุกขั้น
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore")
+
+import pandas as pd
+
+from bench_line import synthetic_lines
+from utils.filters import FilterIndex
+
+COLS = ["Site Name", "ME", "Measure Object", "Call ID", "Route"]
+
+
+def cascade_reference(df: pd.DataFrame, cols, selected):
+    """ตรรกะเดิมของ cascading_filter (ไม่รวม widget) ใช้เป็นค่าอ้างอิง"""
+    mask = pd.Series(True, index=df.index)
+    options, valid = {}, {}
+    for c in cols:
+        opts = sorted(df.loc[mask, c].dropna().astype(str).unique())
+        options[c] = opts
+        valid[c] = [x for x in selected.get(c, []) if x in opts]
+        if valid[c]:
+            mask = mask & df[c].astype(str).isin(valid[c])
+    final = pd.Series(True, index=df.index)
+    for c in cols:
+        if valid[c]:
+            final &= df[c].astype(str).isin(valid[c])
+    return options, valid, df[final].reset_index(drop=True)
+
+
+def cascade_index(df: pd.DataFrame, idx: FilterIndex, selected):
+    options, valid, mask = idx.cascade(selected)
+    _o, _v, mask = idx.cascade(valid)  # rerun หลัง prune เหมือนใน cascading_filter
+    out = df.reset_index(drop=True) if mask is None else df[mask].reset_index(drop=True)
+    return options, valid, out
+
+
+def scenario(df: pd.DataFrame):
+    """ลำดับ selection แบบที่ผู้ใช้คลิกจริง"""
+    site = sorted(df["Site Name"].dropna().astype(str).unique())
+    sub = df[df["Site Name"].astype(str) == site[0]]
+    me = sorted(sub["ME"].dropna().astype(str).unique())
+    mo = sorted(sub[sub["ME"].astype(str) == me[0]]["Measure Object"].dropna().astype(str).unique())
+    steps = [
+        {},
+        {"Site Name": [site[0]]},
+        {"Site Name": [site[0]], "ME": me[:2]},
+        {"Site Name": [site[0]], "ME": me[:2], "Measure Object": mo[:1]},
+        {"Site Name": [site[0]], "ME": me[:2], "Measure Object": mo[:1], "Route": ["Original"]},
+        {"Site Name": [site[0], site[1]], "ME": me[:2], "Measure Object": mo[:1]},
+        {"Site Name": [site[1]], "ME": me[:2]},  # ME ของ site เดิมถูก prune
+        {"Call ID": ["7", "12"], "Route": ["Preset 3"]},
+        {},
+    ]
+    return steps
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lines", type=int, default=400_000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    df = synthetic_lines(args.lines, seed=3)
+    steps = scenario(df)
+    print(f"{len(df):,} rows, filter cols {COLS}")
+
+    t0 = time.perf_counter()
+    idx = FilterIndex(df, COLS)
+    t_build = time.perf_counter() - t0
+
+    t_old = t_new = t_warm = 0.0
+    for sel in steps:
+        t0 = time.perf_counter()
+        ref = cascade_reference(df, COLS, sel)
+        t_old += time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        new = cascade_index(df, idx, sel)
+        t_new += time.perf_counter() - t0
+
+        best = float("inf")
+        for _ in range(args.repeat):  # rerun ด้วย selection เดิม (เช่น เปลี่ยนหน้า/เรียงตาราง)
+            t0 = time.perf_counter()
+            cascade_index(df, idx, sel)
+            best = min(best, time.perf_counter() - t0)
+        t_warm += best
+
+        assert new[0] == ref[0], f"options differ for {sel}"
+        assert new[1] == ref[1], f"pruned selection differs for {sel}"
+        assert new[2].equals(ref[2]), f"filtered rows differ for {sel}"
+
+    k = len(steps)
+    print(f"  build index once     {t_build:7.3f}s")
+    print(f"  per selection change astype/isin {t_old / k:7.3f}s  index {t_new / k:7.3f}s  x{t_old / t_new:,.0f}")
+    print(f"  per rerun (same sel)                      index {t_warm / k:7.3f}s")
+    print("OK: options, selections and rows identical")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
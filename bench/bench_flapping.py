@@ -0,0 +1,152 @@
+"""
+Benchmark: Fiber Flapping find_nomatch แบบ index (Link → alarm เรียงตามเวลา) เทียบกับแบบเดิม
+(iterrows + str.contains ทั้งคอลัมน์ Link ทุกแถว)
+
+    python bench/bench_flapping.py [--alarms 1000000] [--sites 400] [--days 7] [--old-rows 30]
+
+สร้าง FM alarm จำลอง 1 เดือน + OSC optical 1 สัปดาห์ (granularity 15 นาที)
+  - เทียบผลทุกแถวกับแบบเดิมบนชุดเล็ก (alarm/OSC ส่วนหนึ่ง)
+  - ชุดเต็ม: แบบเดิมช้าเกินจะรันทั้งหมด → จับเวลาแค่ --old-rows แถวแล้วประมาณทั้งชุด
+"""
+import argparse
+import os
+import re
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore")
+
+import numpy as np
+import pandas as pd
+
+from Fiberflapping_Analyzer import FiberflappingAnalyzer
+
+
+def find_nomatch_rowwise(df_filtered, df_fm_norm, link_col):
+    """ตรรกะเดิมของ FiberflappingAnalyzer.find_nomatch (ใช้เป็นค่าอ้างอิง)"""
+    result_rows = []
+    for _, row in df_filtered.iterrows():
+        me = re.escape(str(row.get("ME", "")))
+        target_me = re.escape(str(row.get("Target ME", "")))
+        begin_t = row.get("Begin Time", pd.NaT)
+        end_t = row.get("End Time", pd.NaT)
+        matched = df_fm_norm[
+            df_fm_norm[link_col].astype(str).str.contains(me, na=False)
+            & df_fm_norm[link_col].astype(str).str.contains(target_me, na=False)
+            & (df_fm_norm["Occurrence Time"] <= end_t)
+            & (df_fm_norm["Clear Time"] >= begin_t)
+        ]
+        if matched.empty:
+            result_rows.append(row)
+    return pd.DataFrame(result_rows)
+
+
+def synthetic(alarms: int, sites: int, days: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    # ชื่อ ME บางตัวเป็น substring ของตัวอื่น (เช่น BKK-1 / BKK-10) → ทดสอบ contains แบบเดิม
+    names = np.array([f"{p}-{i}" for i, p in zip(range(sites), np.resize(["BKK", "CNX", "HKT", "KKN"], sites))])
+    a, b = rng.integers(0, sites, sites * 3), rng.integers(0, sites, sites * 3)
+    spans = [(names[x], names[y]) for x, y in zip(a, b) if x != y]
+
+    start = pd.Timestamp("2025-09-01")
+    month = pd.Timedelta(days=30)
+    pick = rng.integers(0, len(spans), alarms)
+    occ = start + pd.to_timedelta(rng.integers(0, int(month.total_seconds()), alarms), unit="s")
+    dur = pd.to_timedelta(rng.exponential(1800, alarms).astype(int), unit="s")
+    link = pd.Series(
+        [f"{spans[i][0]}-1-{s}-OL2(RX)<-->{spans[i][1]}-1-{s}-OL2(TX)" for i, s in zip(pick, rng.integers(1, 9, alarms))],
+        dtype=object,
+    )
+    df_fm = pd.DataFrame({
+        "Alarm Name": "R_LOS",
+        "Occurrence Time": occ.astype(str),
+        "Clear Time": (occ + dur).astype(str),
+        "Link": link,
+    })
+    bad = rng.choice(alarms, size=max(alarms // 200, 4), replace=False)
+    df_fm.loc[bad[0::3], "Clear Time"] = "--"  # ยังไม่ clear
+    df_fm.loc[bad[1::3], "Link"] = None
+
+    slots = pd.date_range(start + pd.Timedelta(days=23), periods=days * 96, freq="15min")
+    ports = spans[: sites * 2]
+    n = len(slots) * len(ports)
+    port_idx = np.repeat(np.arange(len(ports)), len(slots))
+    begin = np.tile(slots.to_numpy(), len(ports))
+    mx = rng.normal(-18, 0.5, n)
+    mn = mx - np.where(rng.random(n) < 0.03, rng.uniform(2, 8, n), rng.uniform(0, 1.5, n))
+    df_osc = pd.DataFrame({
+        "Begin Time": pd.Series(begin).astype(str),
+        "End Time": (pd.Series(begin) + pd.Timedelta(minutes=15)).astype(str),
+        "Granularity": "15 Minutes",
+        "ME": [ports[i][0] for i in port_idx],
+        "ME IP": "10.0.0.1",
+        "Measure Object": [f"OSC-1({ports[i][1]})" if i % 17 else "OSC-1" for i in port_idx],
+        "Max Value of Input Optical Power(dBm)": mx,
+        "Min Value of Input Optical Power(dBm)": mn,
+        "Input Optical Power(dBm)": (mx + mn) / 2,
+    })
+    return df_osc, df_fm
+
+
+def prepared(df_osc, df_fm):
+    a = FiberflappingAnalyzer(df_optical=df_osc, df_fm=df_fm, threshold=2.0)
+    a._load_reference = lambda: pd.DataFrame()  # ไม่ต้องใช้ Site Name จาก data/
+    df_filtered = a.filter_optical_by_threshold(a.normalize_optical())
+    df_fm_norm, link_col = a.normalize_fm()
+    return a, df_filtered, df_fm_norm, link_col
+
+
+def same(new: pd.DataFrame, old: pd.DataFrame) -> bool:
+    """
+    เทียบค่าทุกช่อง + index (ไม่เทียบ dtype: แบบเดิมสร้าง frame ใหม่จากแถวของ iterrows
+    คอลัมน์ที่เป็น NaN ทั้งหมดในผลจึงกลายเป็น float64 ส่วนแบบใหม่คง dtype ของต้นฉบับ)
+    """
+    if old.empty:
+        return new.empty and new.columns.empty
+    return (list(new.columns) == list(old.columns) and new.index.equals(old.index)
+            and new.astype(object).equals(old.astype(object)))
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--alarms", type=int, default=1_000_000)
+    ap.add_argument("--sites", type=int, default=400)
+    ap.add_argument("--days", type=int, default=7)
+    ap.add_argument("--old-rows", type=int, default=30)
+    args = ap.parse_args()
+
+    # 1) ผลต้องเท่ากันทุกแถว (ชุดเล็กพอให้แบบเดิมรันครบ)
+    df_osc, df_fm = synthetic(alarms=20_000, sites=40, days=1, seed=1)
+    a, df_filtered, df_fm_norm, link_col = prepared(df_osc, df_fm)
+    old = find_nomatch_rowwise(df_filtered, df_fm_norm, link_col)
+    new = a.find_nomatch(df_filtered, df_fm_norm, link_col)
+    assert same(new, old), "find_nomatch differs from the row-wise version"
+    print(f"check: {len(df_filtered):,} flapping rows vs {len(df_fm):,} alarms → {len(new):,} unmatched (identical)")
+
+    # 2) ชุดเต็ม
+    t0 = time.perf_counter()
+    df_osc, df_fm = synthetic(args.alarms, args.sites, args.days)
+    a, df_filtered, df_fm_norm, link_col = prepared(df_osc, df_fm)
+    print(f"data:  {len(df_fm):,} FM alarms, {len(df_osc):,} OSC rows, {len(df_filtered):,} over threshold "
+          f"({time.perf_counter() - t0:.1f}s to build)")
+
+    t0 = time.perf_counter()
+    new = a.find_nomatch(df_filtered, df_fm_norm, link_col)
+    t_new = time.perf_counter() - t0
+
+    sample = df_filtered.iloc[: args.old_rows]
+    t0 = time.perf_counter()
+    old = find_nomatch_rowwise(sample, df_fm_norm, link_col)
+    t_old = (time.perf_counter() - t0) / max(len(sample), 1) * len(df_filtered)
+    assert same(a.find_nomatch(sample, df_fm_norm, link_col), old), "sample differs from the row-wise version"
+
+    print(f"find_nomatch  row-wise ~{t_old:8.1f}s (est. from {len(sample)} rows)  indexed {t_new:6.2f}s  "
+          f"x{t_old / t_new:,.0f}  → {len(new):,} unmatched")
+    print("OK: outputs identical")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+Benchmark: utils.flapping_store — ingest upload รายสัปดาห์ (ช่วงวันทับกัน) แล้ว query trend 90 วัน
+
+    python bench/bench_flapping_store.py [--weeks 13] [--events-per-day 3000] [--sites 1500]
+
+สร้าง df_nomatch จำลองต่อ upload (7 วัน, upload ถัดไปเลื่อน 1 สัปดาห์ + ทับวันสุดท้ายของ upload ก่อนหน้า)
+ตรวจว่า ingest ซ้ำไม่เขียนใหม่, event ที่ซ้ำกันไม่ถูกนับซ้ำ และจับเวลา daily_sites / load_events
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore")
+
+import numpy as np
+import pandas as pd
+
+from utils import flapping_store
+
+
+def synthetic_nomatch(start: pd.Timestamp, days: int, per_day: int, sites: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    n = days * per_day
+    # จัด slot 15 นาทีตาม ME → (ME, Measure Object, Begin Time) ไม่ซ้ำกันภายใน upload
+    me = rng.integers(0, sites, n)
+    slot = rng.integers(0, days * 96, n)
+    df = pd.DataFrame({"me": me, "slot": slot}).drop_duplicates()
+    begin = start + pd.to_timedelta(df["slot"].to_numpy() * 15, unit="min")
+    mx = rng.normal(-18, 0.5, len(df))
+    mn = mx - rng.uniform(2, 8, len(df))
+    return pd.DataFrame({
+        "Begin Time": begin,
+        "End Time": begin + pd.Timedelta(minutes=15),
+        "Granularity": "15 Minutes",
+        "Site Name": [f"Site-{m % 300}" for m in df["me"]],
+        "ME": [f"ME-{m}" for m in df["me"]],
+        "ME IP": "10.0.0.1",
+        "Measure Object": [f"OSC-1(ME-{(m * 7) % sites})" for m in df["me"]],
+        "Max Value of Input Optical Power(dBm)": mx,
+        "Min Value of Input Optical Power(dBm)": mn,
+        "Input Optical Power(dBm)": (mx + mn) / 2,
+        "Max - Min (dB)": mx - mn,
+    })
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--weeks", type=int, default=13)
+    ap.add_argument("--events-per-day", type=int, default=3000)
+    ap.add_argument("--sites", type=int, default=1500)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "flapping.db")
+        start = pd.Timestamp("2025-06-01")
+        total, t_ingest = 0, 0.0
+        for w in range(args.weeks):
+            # upload ที่ w เริ่มวันสุดท้ายของ upload ก่อนหน้า (ทับกัน 1 วัน)
+            df = synthetic_nomatch(start + pd.Timedelta(days=6 * w), 7, args.events_per_day, args.sites, seed=w)
+            t0 = time.perf_counter()
+            total += flapping_store.ingest(f"week-{w}", df, path=path)
+            t_ingest += time.perf_counter() - t0
+            assert flapping_store.ingest(f"week-{w}", df, path=path) == 0, "re-ingest must be skipped"
+
+        t0 = time.perf_counter()
+        daily = flapping_store.daily_sites(days=90, path=path)
+        t_daily = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        week = flapping_store.load_events(days=7, path=path)
+        t_week = time.perf_counter() - t0
+
+        all_events = flapping_store.load_events(days=10_000, path=path)
+        assert not all_events.duplicated(["ME", "Measure Object", "Begin Time"]).any(), "duplicate events"
+        expect = (all_events.assign(Date=all_events["Begin Time"].dt.date)
+                  .groupby("Date")["ME"].nunique().tail(90).reset_index(drop=True))
+        assert daily["Sites"].reset_index(drop=True).equals(expect.rename("Sites")), "daily_sites differs"
+
+        print(f"ingest      {args.weeks} uploads, {total:,} rows written ({t_ingest:.2f}s), "
+              f"{len(all_events):,} distinct events, db {os.path.getsize(path) / 1e6:.1f} MB")
+        print(f"daily_sites 90 days → {len(daily)} days  {t_daily * 1000:7.1f} ms")
+        print(f"load_events 7 days  → {len(week):,} rows {t_week * 1000:7.1f} ms")
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
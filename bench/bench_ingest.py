@@ -0,0 +1,102 @@
+"""
+Benchmark: เวลา parse Excel ต่อ kind จาก ZIP ตัวอย่างใน uploads/
+
+    python bench/bench_ingest.py [uploads] [--repeat 5] [--scale 50]
+
+เทียบ pd.read_excel เดิม กับทุก backend ใน utils/excel_reader (ทั้งแบบอ่านทุกคอลัมน์ และแบบ
+projection + numeric hints ตาม KIND_COLUMNS) และตรวจว่าแบบอ่านทุกคอลัมน์ได้ DataFrame เท่ากับของเดิม
+"""
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+import warnings
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore")
+
+import pandas as pd
+
+from utils import excel_reader
+from utils.ingest import KIND_COLUMNS, KIND_NUMERIC, open_nested, plan_zip
+
+
+def sample_members(root: str) -> dict:
+    """kind → (ชื่อ member, bytes) ตัวแรกที่เจอ (Excel เท่านั้น)"""
+    out = {}
+    for path in sorted(glob.glob(os.path.join(root, "**", "*.zip"), recursive=True)):
+        if os.sep + ".cache" in path:
+            continue
+        with zipfile.ZipFile(path) as zf:
+            for chain, name, kind, ext in plan_zip(zf):
+                if kind in out or ext == ".txt":
+                    continue
+                z = zf
+                opened = []
+                for inner in chain:
+                    cm = open_nested(z, inner)
+                    z = cm.__enter__()
+                    opened.append(cm)
+                out[kind] = (name, z.read(name))
+                for cm in reversed(opened):
+                    cm.__exit__(None, None, None)
+    return out
+
+
+def scaled(data: bytes, factor: int) -> bytes:
+    """workbook ใหม่ที่ซ้ำแถวข้อมูล factor เท่า (จำลอง export ขนาดจริงของทั้ง region)"""
+    df = pd.read_excel(io.BytesIO(data))
+    buf = io.BytesIO()
+    pd.concat([df] * factor, ignore_index=True).to_excel(buf, index=False)
+    return buf.getvalue()
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("root", nargs="?", default="uploads")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--scale", type=int, default=1, help="repeat the sample rows N times")
+    args = ap.parse_args()
+
+    members = sample_members(args.root)
+    if args.scale > 1:
+        members = {k: (n, scaled(d, args.scale)) for k, (n, d) in members.items()}
+    backends = [b for b in excel_reader.available_backends() if b != "pandas"]
+    rows = []
+    for kind, (name, data) in sorted(members.items()):
+        base = pd.read_excel(io.BytesIO(data))
+        row = {"kind": kind, "rows": len(base), "cols": len(base.columns),
+               "read_excel": best_of(lambda: pd.read_excel(io.BytesIO(data)), args.repeat)}
+        for b in backends:
+            full = excel_reader.read_excel(io.BytesIO(data), backend=b)
+            pd.testing.assert_frame_equal(full, base)
+            row[b] = best_of(lambda: excel_reader.read_excel(io.BytesIO(data), backend=b), args.repeat)
+            cols, num = KIND_COLUMNS.get(kind), KIND_NUMERIC.get(kind)
+            row[f"{b}+proj"] = best_of(
+                lambda: excel_reader.read_excel(io.BytesIO(data), cols, num, backend=b), args.repeat
+            )
+        rows.append(row)
+
+    df = pd.DataFrame(rows).set_index("kind")
+    for b in backends:
+        df[f"speedup {b}+proj"] = (df["read_excel"] / df[f"{b}+proj"]).round(2)
+    with pd.option_context("display.float_format", "{:.4f}".format, "display.width", 200):
+        print(df)
+    print("\nall backends match pd.read_excel (full columns)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
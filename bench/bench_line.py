@@ -0,0 +1,161 @@
+"""
+Benchmark: Line_Analyzer รวมแถวระดับ "เส้น" + สถานะต่อเส้น แบบ groupby/mask เทียบกับแบบเดิม
+(วน groupby ทีละกลุ่ม + apply(_line_fail, axis=1))
+
+    python bench/bench_line.py [--lines 10000] [--repeat 3]
+
+สร้างตาราง Line หลัง merge กับ reference จำลอง (1-4 แถวต่อเส้น: แถว BER + แถว power LB2R/L4S,
+Route ปน 'Preset n', ค่าแปลก ๆ เช่น "--", NaN, key ว่าง) แล้วตรวจว่าผลเท่ากันทุกช่องรวมถึง dtype
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore")
+
+import numpy as np
+import pandas as pd
+import pandas.io.formats.style  # noqa: F401  (Line_Analyzer ใช้ Styler ใน type hint ตอนสร้าง class)
+
+from Line_Analyzer import Line_Analyzer
+
+COL_IN, COL_OUT = "Input Optical Power(dBm)", "Output Optical Power (dBm)"
+COL_MIN_IN, COL_MAX_IN = "Minimum threshold(in)", "Maximum threshold(in)"
+COL_MIN_OUT, COL_MAX_OUT = "Minimum threshold(out)", "Maximum threshold(out)"
+
+
+def collapse_by_line_rowwise(df: pd.DataFrame) -> pd.DataFrame:
+    """ตรรกะเดิมของ Line_Analyzer._collapse_by_line (ใช้เป็นค่าอ้างอิง)"""
+    key_cols = ["Site Name", "ME", "Call ID"]
+    if not set(key_cols).issubset(df.columns):
+        return df.copy()
+
+    def _num(s):
+        return pd.to_numeric(s, errors="coerce")
+
+    rows = []
+    for (site, me, cid), g in df.groupby(key_cols, dropna=False):
+        g = g.copy()
+        routes = g.get("Route", pd.Series([], dtype=object)).astype(str).tolist()
+        route = next((r for r in routes if r.startswith("Preset")), routes[0] if routes else None)
+
+        power_cols = [COL_IN, COL_OUT, COL_MIN_IN, COL_MAX_IN, COL_MIN_OUT, COL_MAX_OUT]
+        has_power = g[power_cols].notna().any(axis=1) if set(power_cols).issubset(g.columns) else pd.Series(False, index=g.index)
+        mo = (g.loc[has_power, "Measure Object"].iloc[0]
+              if "Measure Object" in g.columns and has_power.any()
+              else (g["Measure Object"].iloc[0] if "Measure Object" in g.columns and len(g) else None))
+
+        ber = _num(g.get("Instant BER After FEC", pd.Series(dtype=float))).dropna()
+        thr = _num(g.get("Threshold", pd.Series(dtype=float))).dropna()
+        ber_val = ber.iloc[0] if len(ber) else float("nan")
+        thr_val = thr.iloc[0] if len(thr) else float("nan")
+
+        vin_vals = _num(g.get(COL_IN, pd.Series(dtype=float))).dropna()
+        vout_vals = _num(g.get(COL_OUT, pd.Series(dtype=float))).dropna()
+        min_in_vals = _num(g.get(COL_MIN_IN, pd.Series(dtype=float))).dropna()
+        max_in_vals = _num(g.get(COL_MAX_IN, pd.Series(dtype=float))).dropna()
+        min_out_vals = _num(g.get(COL_MIN_OUT, pd.Series(dtype=float))).dropna()
+        max_out_vals = _num(g.get(COL_MAX_OUT, pd.Series(dtype=float))).dropna()
+
+        rows.append({
+            "Site Name": site, "ME": me, "Call ID": str(cid),
+            "Measure Object": mo, "Route": route,
+            "Threshold": thr_val, "Instant BER After FEC": ber_val,
+            COL_MAX_OUT: max_out_vals.min() if len(max_out_vals) else float("nan"),
+            COL_MIN_OUT: min_out_vals.max() if len(min_out_vals) else float("nan"),
+            COL_OUT: vout_vals.iloc[0] if len(vout_vals) else float("nan"),
+            COL_MAX_IN: max_in_vals.min() if len(max_in_vals) else float("nan"),
+            COL_MIN_IN: min_in_vals.max() if len(min_in_vals) else float("nan"),
+            COL_IN: vin_vals.iloc[0] if len(vin_vals) else float("nan"),
+        })
+    return pd.DataFrame(rows)
+
+
+def synthetic_lines(lines: int, seed: int = 0, messy: bool = True) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    sites = np.array(["Jasmine_Z-E33", "HYI-4_Z-E33", "SNI-POI_Z-E33", "PKT_Z-E33", "NKS_Z-E33", "Phu Nga_Z-E33"])
+    per = rng.integers(1, 5, lines)
+    n = int(per.sum())
+    line_id = np.repeat(np.arange(lines), per)
+    site = sites[line_id % len(sites)]
+    me = np.array([f"BK_WCO_{i % 997:04d}_3Z_R" for i in line_id])
+    cid = np.array([str(i % 120 + 1) for i in line_id])
+    is_ber = rng.random(n) < 0.4
+    board = np.where(rng.random(n) < 0.7, "LB2Rx5", "L4S")
+    mo = np.array([f"{b}[0-33-{i % 40}]-OTUC_Bi:1-OTUC2:1" for b, i in zip(board, line_id)])
+
+    def power(center, spread):
+        v = rng.normal(center, spread, n)
+        return np.where(is_ber, np.nan, v)
+
+    df = pd.DataFrame({
+        "Site Name": site, "ME": me, "Call ID": cid, "Measure Object": mo,
+        "Threshold": np.where(is_ber, 1e-5, np.nan),
+        "Instant BER After FEC": np.where(is_ber, np.where(rng.random(n) < 0.05, 2e-5, 0.0), np.nan),
+        COL_MAX_OUT: power(5, 0.5), COL_MIN_OUT: power(-5, 0.5), COL_OUT: power(0, 3),
+        COL_MAX_IN: power(3, 0.5), COL_MIN_IN: power(-18, 0.5), COL_IN: power(-8, 6),
+        "Route": np.where(rng.random(n) < 0.1, "Preset " + pd.Series(rng.integers(1, 9, n)).astype(str), "Original"),
+    })
+    if messy:
+        odd = rng.choice(n, size=max(n // 50, 12), replace=False)
+        df = df.astype({c: object for c in ["Threshold", "Instant BER After FEC", COL_IN, COL_MIN_OUT]})
+        for i, pos in enumerate(odd):
+            k = i % 6
+            if k == 0:
+                df.iat[pos, df.columns.get_loc(COL_IN)] = "--"
+            elif k == 1:
+                df.iat[pos, df.columns.get_loc("Instant BER After FEC")] = "1.5E-4"
+            elif k == 2:
+                df.iat[pos, df.columns.get_loc("Site Name")] = None
+            elif k == 3:
+                df.iat[pos, df.columns.get_loc("Measure Object")] = None
+            elif k == 4:
+                df.iat[pos, df.columns.get_loc(COL_MIN_OUT)] = " -4.5 "
+            else:
+                df.iat[pos, df.columns.get_loc("Threshold")] = 0
+    return df
+
+
+def best_of(fn, repeat: int):
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def same(new: pd.DataFrame, old: pd.DataFrame) -> bool:
+    return (list(new.columns) == list(old.columns) and (new.dtypes == old.dtypes).all()
+            and new.index.equals(old.index) and new.equals(old))
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lines", type=int, default=10_000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    a = Line_Analyzer(df_line=pd.DataFrame(), df_ref=pd.DataFrame())
+    cases = {"clean": synthetic_lines(args.lines, messy=False), "messy": synthetic_lines(args.lines, seed=1)}
+    for label, df in cases.items():
+        t_old, old = best_of(lambda: collapse_by_line_rowwise(df.copy()), 1)
+        t_new, new = best_of(lambda: a._collapse_by_line(df.copy()), args.repeat)
+        assert same(new, old), f"{label}: collapsed lines differ"
+
+        t_old_f, old_fail = best_of(lambda: old.apply(a._line_fail, axis=1), 1)
+        t_new_f, new_fail = best_of(lambda: a._line_fail_mask(new), args.repeat)
+        assert new_fail.equals(old_fail.astype(bool)), f"{label}: line status differs"
+
+        print(f"{label}: {len(df):,} rows → {len(new):,} lines, {int(new_fail.sum()):,} failed")
+        print(f"  collapse   groupby loop {t_old:7.3f}s  vectorized {t_new:7.3f}s  x{t_old / t_new:,.0f}")
+        print(f"  line fail  apply        {t_old_f:7.3f}s  vectorized {t_new_f:7.3f}s  x{t_old_f / t_new_f:,.0f}")
+    print("OK: outputs identical")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
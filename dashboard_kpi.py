@@ -0,0 +1,294 @@
+"""
+KPI snapshot ของหน้า Dashboard — คำนวณครั้งเดียวต่อ analysis แล้วเก็บใน utils/result_store
+
+เดิมหน้า Dashboard merge CPU/FAN/MSU/Line/Client กับ reference, สร้าง EOLAnalyzer / CoreAnalyzer ใหม่,
+parse WASON log ผ่าน ApoRemnantAnalyzer และรัน Fiber Flapping ทั้ง pipeline ทุกครั้งที่เปิดหน้า
+ตอนนี้แต่ละ section มี builder ที่คืน dict เล็ก ๆ (JSON) ตัวเดียว:
+    CPU     {type: {"site", "board", "value"}}                         max CPU% ต่อ SNP(E) / NCPM / NCPQ
+    FAN     {type: {"site", "board", "value"}}                         max Rps ต่อ FCC / FCPL / FCPS / FCPP
+    MSU     {"max": {...}, "normal", "abnormal", "total"}
+    Line    {"total", "ber_abn", "in_abn", "out_abn", "preset": {...}, "preset_usage": [...]}
+    Client  {"total", "in_abn", "out_abn"}
+    EOL / Core / APO  {status: count}
+    Fiber   {"daily": [{"Date", "Sites"}]}                             ME ที่ flapping ต่อวัน
+None = section นี้ไม่มีข้อมูลใน analysis นี้
+
+การใช้งาน:
+    snaps = dashboard_kpi.ensure(aid)      # สร้างเฉพาะ section ที่ยังไม่มี snapshot แล้วคืนทั้งหมด
+worker ของ background job เรียก ensure หลังวิเคราะห์เสร็จ → เปิด Dashboard ครั้งแรกก็อ่านจาก JSON อย่างเดียว
+
+snapshot ใหม่ถูกแปลงเป็นค่าตัวเลขแบนราบ (metrics) แล้วบันทึกลง utils/kpi_history ตามวันตรวจของ analysis
+→ กราฟ trend ของ Dashboard ดูย้อนหลังหลายเดือนได้โดยไม่ต้องเปิด ZIP เก่า
+"""
+import pandas as pd
+
+from utils import kpi_history, result_store
+from utils.mapping import merge_on_mapping
+from utils.reference import get_registry, normalize_columns
+
+from Fiberflapping_Analyzer import FiberflappingAnalyzer
+from EOL_Core_Analyzer import EOLAnalyzer, CoreAnalyzer
+from APO_Analyzer import ApoRemnantAnalyzer
+
+CPU_TYPES = {"SNP": r"SNP\(E\)", "NCPM": r"NCPM", "NCPQ": r"NCPQ"}
+FAN_TYPES = ("FCC", "FCPL", "FCPS", "FCPP")
+MSU_LIMIT = 1100.0
+
+
+def _num(v):
+    v = pd.to_numeric(v, errors="coerce")
+    return None if pd.isna(v) else float(v)
+
+
+def _max_row(df: pd.DataFrame, pattern: str, value_col: str) -> pd.Series | None:
+    """แถวที่ค่า value_col สูงสุดของ Measure Object ที่ตรง pattern (ค่า NaN อยู่ท้าย เหมือน sort_values)"""
+    df_type = df[df["Measure Object"].astype(str).str.contains(pattern, na=False)]
+    if df_type.empty:
+        return None
+    vals = pd.to_numeric(df_type[value_col], errors="coerce")
+    return df_type.loc[vals.idxmax()] if vals.notna().any() else df_type.iloc[0]
+
+
+def _board(row: pd.Series | None, value) -> dict | None:
+    if row is None:
+        return None
+    return {"site": str(row.get("Site Name", "-")), "board": str(row.get("Measure Object", "-")), "value": value}
+
+
+def _merged(data, kind: str, ref_cols: list) -> pd.DataFrame | None:
+    df = data(kind)
+    if df is None:
+        return None
+    ref = get_registry().get(kind)
+    merged, _ = merge_on_mapping(normalize_columns(df.copy()), ref.df, ref_cols, index=ref.mapping_index)
+    return merged
+
+
+def _range_abn(v: pd.Series, lo: pd.Series, hi: pd.Series, need_both: bool = True) -> pd.Series:
+    """v นอกช่วง [lo, hi] — need_both=False: threshold ฝั่งเดียวก็นับ (เหมือน rules.outside)"""
+    out = (v < lo) | (v > hi)
+    return v.notna() & lo.notna() & hi.notna() & out if need_both else out
+
+
+# ====== Builders (data(kind) → DataFrame / str / None) ======
+def cpu(data):
+    merged = _merged(data, "cpu", ["Mapping", "Maximum threshold", "Minimum threshold", "Site Name"])
+    if merged is None:
+        return None
+    out = {}
+    for title, pattern in CPU_TYPES.items():
+        row = _max_row(merged, pattern, "CPU utilization ratio")
+        pct = _num(row.get("CPU utilization ratio")) if row is not None else None
+        if pct is not None and pct <= 1:
+            pct *= 100.0
+        out[title] = _board(row, pct)
+    return out
+
+
+def fan(data):
+    merged = _merged(data, "fan", ["Mapping", "Site Name", "Maximum threshold", "Minimum threshold"])
+    if merged is None:
+        return None
+    out = {}
+    for ftype in FAN_TYPES:
+        row = _max_row(merged, ftype, "Value of Fan Rotate Speed(Rps)")
+        out[ftype] = _board(row, _num(row.get("Value of Fan Rotate Speed(Rps)")) if row is not None else None)
+    return out
+
+
+def msu(data):
+    merged = _merged(data, "msu", ["Mapping", "Site Name"])
+    if merged is None:
+        return None
+    vals = pd.to_numeric(merged["Laser Bias Current(mA)"], errors="coerce")
+    row = merged.loc[vals.idxmax()] if vals.notna().any() else (merged.iloc[0] if not merged.empty else None)
+    return {
+        "max": _board(row, _num(row.get("Laser Bias Current(mA)")) if row is not None else None),
+        "normal": int((vals < MSU_LIMIT).sum()),
+        "abnormal": int((vals > MSU_LIMIT).sum()),
+        "total": int(vals.notna().sum()),
+    }
+
+
+def line(data):
+    merged = _merged(data, "line", [
+        "Mapping", "Site Name", "Threshold",
+        "Maximum threshold(out)", "Minimum threshold(out)",
+        "Maximum threshold(in)", "Minimum threshold(in)",
+        "Route",
+    ])
+    if merged is None:
+        return None
+
+    def col(name):
+        return pd.to_numeric(merged.get(name, pd.Series(index=merged.index, dtype=float)), errors="coerce")
+
+    ber, thr = col("Instant BER After FEC"), col("Threshold")
+    ber_abn = ber.notna() & thr.notna() & (ber > thr)
+    vin, lo_in, hi_in = col("Input Optical Power(dBm)"), col("Minimum threshold(in)"), col("Maximum threshold(in)")
+    vout, lo_out, hi_out = col("Output Optical Power (dBm)"), col("Minimum threshold(out)"), col("Maximum threshold(out)")
+    in_abn = _range_abn(vin, lo_in, hi_in)
+    out_abn = _range_abn(vout, lo_out, hi_out)
+
+    route = merged.get("Route", pd.Series(index=merged.index, dtype=object)).astype(str)
+    preset = route.str.startswith("Preset")
+    usage = pd.DataFrame({
+        "Preset": route[preset].str.extract(r"Preset\s*(\d+)", expand=False),
+        "abn": (ber_abn | in_abn | out_abn)[preset],
+    }).dropna(subset=["Preset"])
+    usage = usage.groupby("Preset").agg(Usage=("abn", "size"), abn=("abn", "any")).reset_index()
+    usage["Status"] = usage["abn"].map(lambda x: "Abnormal" if x else "Normal")
+
+    return {
+        "total": int(len(merged)),
+        "ber_abn": int(ber_abn.sum()),
+        "in_abn": int(in_abn.sum()),
+        "out_abn": int(out_abn.sum()),
+        "preset": {
+            "total": int(preset.sum()),
+            "ber_abn": int(ber_abn[preset].sum()),
+            # ตัวนับของ Preset เดิมไม่เช็คว่า threshold ครบสองฝั่ง → คงไว้ให้ตัวเลขตรงกับก่อนย้ายมา snapshot
+            "in_abn": int(_range_abn(vin, lo_in, hi_in, need_both=False)[preset].sum()),
+            "out_abn": int(_range_abn(vout, lo_out, hi_out, need_both=False)[preset].sum()),
+        },
+        "preset_usage": usage[["Preset", "Usage", "Status"]].to_dict("records"),
+    }
+
+
+def client(data):
+    merged = _merged(data, "client", [
+        "Mapping", "Site Name",
+        "Maximum threshold(out)", "Minimum threshold(out)",
+        "Maximum threshold(in)", "Minimum threshold(in)",
+    ])
+    if merged is None:
+        return None
+
+    def col(name):
+        return pd.to_numeric(merged.get(name, pd.Series(index=merged.index, dtype=float)), errors="coerce")
+
+    vin, vout = col("Input Optical Power(dBm)"), col("Output Optical Power (dBm)")
+    valid = (vin != -60) & (vout != -60)   # -60 = ไม่มีสัญญาณ ไม่นับ
+    vin, vout = vin.where(valid), vout.where(valid)
+    return {
+        "total": int(len(merged)),
+        "in_abn": int(_range_abn(vin, col("Minimum threshold(in)"), col("Maximum threshold(in)")).sum()),
+        "out_abn": int(_range_abn(vout, col("Minimum threshold(out)"), col("Maximum threshold(out)")).sum()),
+    }
+
+
+def _histogram(status) -> dict:
+    return {str(k): int(v) for k, v in pd.Series(status, dtype=object).value_counts().items()}
+
+
+def eol(data):
+    df_raw = data("atten")
+    if df_raw is None:
+        return None
+    state = EOLAnalyzer(df_ref=None, df_raw_data=df_raw, ref_path="data/EOL.xlsx").compute()
+    if state["df_result"].empty:
+        return None
+    return _histogram(state["status"])
+
+
+def core(data):
+    df_raw = data("atten")
+    if df_raw is None:
+        return None
+    state = CoreAnalyzer(df_ref=None, df_raw_data=df_raw, ref_path="data/EOL.xlsx").compute()
+    if state["df_result"].empty:
+        return None
+    return _histogram(state["core_status"])
+
+
+def apo(data):
+    wason = data("wason")
+    if not wason:
+        return None
+    analyzer = ApoRemnantAnalyzer(wason)
+    analyzer.parse()
+    analyzer.analyze()
+    flagged = sum(1 for x in analyzer.rendered if x[2])
+    return {"No APO Remnant": len(analyzer.rendered) - flagged, "APO Remnant": flagged}
+
+
+def fiber(data):
+    df_osc, df_fm = data("osc"), data("fm")
+    if df_osc is None or df_fm is None:
+        return None
+    # unmatched flapping ต่อวันของคู่ OSC+FM นี้เอง (nomatch() memo ไว้แล้ว) — store ใช้แค่กราฟ trend ข้าม upload
+    analyzer = FiberflappingAnalyzer(df_optical=df_osc, df_fm=df_fm, threshold=2.0, ref_path="data/Flapping.xlsx")
+    analyzer.ingest_history()
+    df = analyzer.nomatch()
+    if df is None or df.empty or "Begin Time" not in df.columns:
+        return {"daily": []}
+    day = pd.to_datetime(df["Begin Time"], errors="coerce").dt.strftime("%Y-%m-%d")
+    me = df["ME"].fillna("").astype(str) if "ME" in df.columns else pd.Series("", index=df.index)
+    daily = me[day.notna()].groupby(day[day.notna()]).nunique().sort_index()
+    return {"daily": [{"Date": d, "Sites": int(n)} for d, n in daily.items()]}
+
+BUILDERS = {
+    "CPU": cpu, "FAN": fan, "MSU": msu, "Line": line, "Client": client,
+    "EOL": eol, "Core": core, "APO": apo, "Fiber": fiber,
+}
+
+
+def metrics(snaps: dict) -> dict:
+    """{metric: ค่า} ของ snapshot (ชื่อ metric คงที่ → ใช้เป็น key ของ kpi_history)"""
+    out = {}
+
+    def ok(section):
+        snap = snaps.get(section)
+        return snap if snap and "error" not in snap else None
+
+    if ok("CPU"):
+        for t in CPU_TYPES:
+            out[f"CPU max % {t}"] = (ok("CPU").get(t) or {}).get("value")
+    if ok("FAN"):
+        for t in FAN_TYPES:
+            out[f"FAN max Rps {t}"] = (ok("FAN").get(t) or {}).get("value")
+    if ok("MSU"):
+        out["MSU abnormal"] = ok("MSU")["abnormal"]
+        out["MSU max mA"] = (ok("MSU")["max"] or {}).get("value")
+    if ok("Line"):
+        out["Line BER abnormal"] = ok("Line")["ber_abn"]
+        out["Line Input abnormal"] = ok("Line")["in_abn"]
+        out["Line Output abnormal"] = ok("Line")["out_abn"]
+    if ok("Client"):
+        out["Client Input abnormal"] = ok("Client")["in_abn"]
+        out["Client Output abnormal"] = ok("Client")["out_abn"]
+    for section, statuses in (("EOL", ("EOL Excess Loss", "EOL Fiber Break")),
+                              ("Core", ("Core Loss Excess", "Core Fiber Break")),
+                              ("APO", ("APO Remnant",))):
+        if ok(section):
+            for status in statuses:
+                out[status] = ok(section).get(status, 0)
+    if ok("Fiber"):
+        out["Fiber flapping sites (max/day)"] = max((d["Sites"] for d in ok("Fiber")["daily"]), default=0)
+    return out
+
+
+def ensure(aid: str | None, sections=None) -> dict:
+    """
+    {section: snapshot} ของ analysis — section ที่ยังไม่มี snapshot สร้างแล้วเก็บลง result_store
+    builder ที่พังคืน {"error": ข้อความ} (ไม่เก็บ → ลองใหม่รอบหน้า)
+    """
+    if not result_store.exists(aid):
+        return {}
+    snaps = result_store.snapshots(aid)
+    built = {}
+    for section in sections or BUILDERS:
+        if section in snaps:
+            continue
+        try:
+            snap = BUILDERS[section](lambda kind: result_store.dataset(aid, kind))
+        except Exception as e:
+            snaps[section] = {"error": str(e)}
+            continue
+        result_store.save_snapshot(aid, section, snap)
+        snaps[section] = built[section] = snap
+
+    day = result_store.inspection_date(aid)
+    if built and day:
+        kpi_history.record(day, metrics(built), source=aid)
+    return snaps
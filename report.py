@@ -12,10 +12,26 @@ from reportlab.graphics.charts.barcharts import VerticalBarChart
 
 import io
 from datetime import datetime
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+from CPU_Analyzer import CPU_Analyzer
+from FAN_Analyzer import FAN_Analyzer
+from MSU_Analyzer import MSU_Analyzer
+from Line_Analyzer import Line_Analyzer
+from Client_Analyzer import Client_Analyzer
+
+# กฎ abnormal ของแต่ละ section (อ้างตรง ไม่พึ่ง utils.rules registry ที่เต็มก็ต่อเมื่อมีคน import analyzer ก่อน)
+SECTION_RULES = {
+    "CPU": CPU_Analyzer.RULES,
+    "FAN": FAN_Analyzer.RULES,
+    "MSU": MSU_Analyzer.RULES,
+    "Line": Line_Analyzer.RULES,
+    "Client": Client_Analyzer.RULES,
+}
+
 def _df_to_wrapped_table(df: pd.DataFrame, style: ParagraphStyle) -> list[list]:
     """Convert a DataFrame to a table data matrix using Paragraph cells to allow word wrapping."""
     headers = [Paragraph(str(c), style) for c in df.columns]
@@ -202,6 +218,8 @@ def generate_report(all_abnormal: dict, include_charts: bool = True):
             elements.append(Spacer(1, 6))
 
             df_show = df.copy()
+            # เช็คกฎกับ frame เต็มก่อนตัดคอลัมน์ → กฎที่อ่านคอลัมน์ที่ไม่ได้แสดง (เช่น threshold) ยังติดสี
+            violations = SECTION_RULES[section_name].evaluate(df) if section_name in SECTION_RULES else None
 
             # ===== Filter columns =====
             if section_name == "FAN":
@@ -291,101 +309,12 @@ def generate_report(all_abnormal: dict, include_charts: bool = True):
             ]
 
             # ===== Highlight logic =====
-            if section_name == "CPU" and "CPU utilization ratio" in cols_to_show:
-                col_idx = cols_to_show.index("CPU utilization ratio")
-                if col_idx < len(df_show.columns):
-                    style_cmds.append(("BACKGROUND", (col_idx, 1), (col_idx, -1), light_red))
-                    style_cmds.append(("TEXTCOLOR", (col_idx, 1), (col_idx, -1), text_black))
-
-            elif section_name == "FAN" and "Value of Fan Rotate Speed(Rps)" in cols_to_show:
-                col_idx = cols_to_show.index("Value of Fan Rotate Speed(Rps)")
-                if col_idx < len(df_show.columns):
-                    style_cmds.append(("BACKGROUND", (col_idx, 1), (col_idx, -1), light_red))
-                    style_cmds.append(("TEXTCOLOR", (col_idx, 1), (col_idx, -1), text_black))
-
-            elif section_name == "MSU" and "Laser Bias Current(mA)" in cols_to_show:
-                col_idx = cols_to_show.index("Laser Bias Current(mA)")
-                if col_idx < len(df_show.columns):
-                    style_cmds.append(("BACKGROUND", (col_idx, 1), (col_idx, -1), light_red))
-                    style_cmds.append(("TEXTCOLOR", (col_idx, 1), (col_idx, -1), text_black))
-
-          
-          
-            elif section_name == "Client":
-                nrows = len(df_show) + 1   # header + data
-                ncols = len(df_show.columns)
-                col_map = {c: i for i, c in enumerate(df_show.columns)}  # ✅ สร้าง map คอลัมน์จริง
-
-                for ridx, row in df_show.iterrows():
-                    # Output check
-                    try:
-                        v = float(row.get("Output Optical Power (dBm)", float("nan")))
-                        lo = float(row.get("Minimum threshold(out)", float("nan")))
-                        hi = float(row.get("Maximum threshold(out)", float("nan")))
-                        if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                            cidx = col_map.get("Output Optical Power (dBm)")
-                            if cidx is not None and 0 <= cidx < ncols and 0 <= ridx+1 < nrows:
-                                style_cmds.append(("BACKGROUND", (cidx, ridx+1), (cidx, ridx+1), light_red))
-                                style_cmds.append(("TEXTCOLOR", (cidx, ridx+1), (cidx, ridx+1), text_black))
-                    except:
-                        pass
-
-                    # Input check
-                    try:
-                        v = float(row.get("Input Optical Power(dBm)", float("nan")))
-                        lo = float(row.get("Minimum threshold(in)", float("nan")))
-                        hi = float(row.get("Maximum threshold(in)", float("nan")))
-                        if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                            cidx = col_map.get("Input Optical Power(dBm)")
-                            if cidx is not None and 0 <= cidx < ncols and 0 <= ridx+1 < nrows:
-                                style_cmds.append(("BACKGROUND", (cidx, ridx+1), (cidx, ridx+1), light_red))
-                                style_cmds.append(("TEXTCOLOR", (cidx, ridx+1), (cidx, ridx+1), text_black))
-                    except:
-                        pass
-
-            elif section_name == "Line":
-                nrows = len(df_show) + 1   # header + data
-                ncols = len(df_show.columns)
-                col_map = {c: i for i, c in enumerate(df_show.columns)}
-
-                for ridx, row in df_show.iterrows():
-                    # BER check
-                    try:
-                        ber = float(row.get("Instant BER After FEC", float("nan")))
-                        thr = float(row.get("Threshold", float("nan")))
-                        if pd.notna(ber) and pd.notna(thr) and ber > thr:
-                            cidx = col_map.get("Instant BER After FEC")
-                            if cidx is not None and 0 <= cidx < ncols and 0 <= ridx+1 < nrows:
-                                style_cmds.append(("BACKGROUND", (cidx, ridx+1), (cidx, ridx+1), light_red))
-                                style_cmds.append(("TEXTCOLOR", (cidx, ridx+1), (cidx, ridx+1), text_black))
-                    except:
-                        pass
-
-                    # Input check
-                    try:
-                        v = float(row.get("Input Optical Power(dBm)", float("nan")))
-                        lo = float(row.get("Minimum threshold(in)", float("nan")))
-                        hi = float(row.get("Maximum threshold(in)", float("nan")))
-                        if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                            cidx = col_map.get("Input Optical Power(dBm)")
-                            if cidx is not None and 0 <= cidx < ncols and 0 <= ridx+1 < nrows:
-                                style_cmds.append(("BACKGROUND", (cidx, ridx+1), (cidx, ridx+1), light_red))
-                                style_cmds.append(("TEXTCOLOR", (cidx, ridx+1), (cidx, ridx+1), text_black))
-                    except:
-                        pass
-
-                    # Output check
-                    try:
-                        v = float(row.get("Output Optical Power (dBm)", float("nan")))
-                        lo = float(row.get("Minimum threshold(out)", float("nan")))
-                        hi = float(row.get("Maximum threshold(out)", float("nan")))
-                        if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                            cidx = col_map.get("Output Optical Power (dBm)")
-                            if cidx is not None and 0 <= cidx < ncols and 0 <= ridx+1 < nrows:
-                                style_cmds.append(("BACKGROUND", (cidx, ridx+1), (cidx, ridx+1), light_red))
-                                style_cmds.append(("TEXTCOLOR", (cidx, ridx+1), (cidx, ridx+1), text_black))
-                    except:
-                        pass
+            if violations is not None:
+                # cell ที่ผิดกฎของ analyzer (utils.rules) → ตำแหน่งใน Table (แถว 0 = header)
+                cells = violations.cells[list(df_show.columns)].to_numpy()
+                for ridx, cidx in zip(*np.nonzero(cells)):
+                    style_cmds.append(("BACKGROUND", (int(cidx), int(ridx) + 1), (int(cidx), int(ridx) + 1), light_red))
+                    style_cmds.append(("TEXTCOLOR", (int(cidx), int(ridx) + 1), (int(cidx), int(ridx) + 1), text_black))
 
             elif section_name == "Fiber" and "Max - Min (dB)" in cols_to_show:
                 col_idx = cols_to_show.index("Max - Min (dB)")
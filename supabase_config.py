@@ -104,7 +104,7 @@ class SupabaseManager:
             return []
     
     # ===== ANALYSIS RESULTS =====
-    def save_analysis_result(self, analysis_type: str, data: Dict[str, Any], file_id: int) -> Optional[int]:
+    def save_analysis_result(self, analysis_type: str, data: Dict[str, Any], file_id: Optional[int]) -> Optional[int]:
         """บันทึกผลการวิเคราะห์"""
         if not self.is_connected():
             return None
@@ -11,102 +11,116 @@ from Line_Analyzer import Line_Analyzer
 from Client_Analyzer import Client_Analyzer
 from Fiberflapping_Analyzer import FiberflappingAnalyzer
 from EOL_Core_Analyzer import EOLAnalyzer, CoreAnalyzer
+from utils import device_history, result_store, rules
+from utils.reference import get_registry
 
 # ==============================
-# Helper: auto-create analyzer
+# Helper: auto-create section results
 # ==============================
+# key ของ analyzer → ชื่อ section ใน utils/result_store (ชื่อเดียวกับ report / batch_analyze)
+SECTIONS = {
+    "cpu": "CPU", "fan": "FAN", "msu": "MSU", "line": "Line", "client": "Client",
+    "fiber": "Fiber", "eol": "EOL", "core": "Core",
+}
+
+# task ใน Summary table → section (ประวัติรายอุปกรณ์มีเฉพาะ section ใน device_history.SECTIONS)
+TASK_SECTIONS = {
+    "CPU board": "CPU", "FAN board": "FAN", "MSU board": "MSU",
+    "Line board": "Line", "Client board": "Client",
+}
+
+
 def _ensure_analyzer(key: str, analyzer_cls, ref_file: str, ns: str):
     """
-    ตรวจสอบและสร้าง analyzer อัตโนมัติถ้ายังไม่มี
-    key = 'cpu' หรือ 'fan' หรือ 'msu' หรือ 'line' หรือ 'client' หรือ 'eol' หรือ 'core'
+    ตรวจสอบและสร้างผล abnormal ของ section อัตโนมัติถ้ายังไม่มีใน result_store
+    key = 'cpu' หรือ 'fan' หรือ 'msu' หรือ 'line' หรือ 'client' หรือ 'fiber' หรือ 'eol' หรือ 'core'
     """
-    analyzer_key = f"{key}_analyzer"
-    data_key = f"{key}_data"
-
-    if st.session_state.get(analyzer_key) is None and st.session_state.get(data_key) is not None:
-        try:
-            df_ref = pd.read_excel(ref_file)
-
-            if key == "cpu":
-                analyzer = analyzer_cls(
-                    df_cpu=st.session_state[data_key].copy(),
-                    df_ref=df_ref.copy(),
-                    ns=ns
-                )
-            elif key == "fan":
-                analyzer = analyzer_cls(
-                    df_fan=st.session_state[data_key].copy(),
-                    df_ref=df_ref.copy(),
-                    ns=ns
-                )
-            elif key == "msu":
-                analyzer = analyzer_cls(
-                    df_msu=st.session_state[data_key].copy(),
-                    df_ref=df_ref.copy(),
-                    ns=ns
-                )
-            elif key == "line":
-                analyzer = analyzer_cls(
-                    df_line=st.session_state[data_key].copy(),
-                    df_ref=df_ref.copy(),
-                    ns=ns
-                )
-            elif key == "client":
-                analyzer = analyzer_cls(
-                    df_client=st.session_state[data_key].copy(),
-                    ref_path=ref_file
-                )
-            elif key == "fiber":
-                # FiberflappingAnalyzer ต้องการ df_optical และ df_fm
-                df_optical = st.session_state.get("osc_data")
-                df_fm = st.session_state.get("fm_data")
-                if df_optical is not None and df_fm is not None:
-                    analyzer = analyzer_cls(
-                        df_optical=df_optical.copy(),
-                        df_fm=df_fm.copy(),
-                        threshold=2.0,
-                        ref_path=ref_file
-                    )
-                else:
-                    return
-            elif key == "eol":
-                # EOLAnalyzer ต้องการ df_raw_data และ df_ref
-                df_raw_data = st.session_state.get("eol_data")
-                if df_raw_data is not None:
-                    analyzer = analyzer_cls(
-                        df_raw_data=df_raw_data.copy(),
-                        ref_path=ref_file
-                    )
-                else:
-                    return
-            elif key == "core":
-                # CoreAnalyzer ต้องการ df_raw_data และ df_ref
-                df_raw_data = st.session_state.get("eol_data")  # Core ใช้ข้อมูลเดียวกับ EOL
-                if df_raw_data is not None:
-                    analyzer = analyzer_cls(
-                        df_raw_data=df_raw_data.copy(),
-                        ref_path=ref_file
-                    )
-                else:
-                    return
-            else:
+    aid = st.session_state.get("analysis_id")
+    section = SECTIONS[key]
+    if not result_store.exists(aid) or result_store.load_section(aid, section) is not None:
+        return
+
+    available = result_store.kinds(aid)
+
+    def data(kind: str):
+        df = result_store.dataset(aid, kind)
+        return df.copy() if df is not None else None
+
+    try:
+        if key == "cpu" and "cpu" in available:
+            analyzer = analyzer_cls(
+                df_cpu=data("cpu"),
+                df_ref=get_registry().frame(key, ref_file),
+                ns=ns
+            )
+        elif key == "fan" and "fan" in available:
+            analyzer = analyzer_cls(
+                df_fan=data("fan"),
+                df_ref=get_registry().frame(key, ref_file),
+                ns=ns
+            )
+        elif key == "msu" and "msu" in available:
+            analyzer = analyzer_cls(
+                df_msu=data("msu"),
+                df_ref=get_registry().frame(key, ref_file),
+                ns=ns
+            )
+        elif key == "line" and "line" in available:
+            analyzer = analyzer_cls(
+                df_line=data("line"),
+                df_ref=get_registry().frame(key, ref_file),
+                ns=ns
+            )
+        elif key == "client" and "client" in available:
+            analyzer = analyzer_cls(
+                df_client=data("client"),
+                ref_path=ref_file
+            )
+        elif key == "fiber":
+            # FiberflappingAnalyzer ต้องการ df_optical และ df_fm
+            if "osc" not in available or "fm" not in available:
+                return
+            analyzer = analyzer_cls(
+                df_optical=data("osc"),
+                df_fm=data("fm"),
+                threshold=2.0,
+                ref_path=ref_file
+            )
+        elif key in ("eol", "core"):
+            # EOL / Core ใช้ attenuation report เดียวกัน
+            if "atten" not in available:
                 return
+            # attenuation pipeline ไม่แก้ frame → ใช้ dataset ตรง ๆ ให้ memo key ตรงกับหน้า EOL / Core / Dashboard
+            analyzer = analyzer_cls(
+                df_raw_data=result_store.dataset(aid, "atten"),
+                ref_path=ref_file
+            )
+        else:
+            return
 
-            analyzer.prepare()  # ✅ ใช้ prepare() (ไม่ render UI)
-            st.session_state[analyzer_key] = analyzer
+        analyzer.prepare()  # ✅ ใช้ prepare() (ไม่ render UI)
+        result_store.save_section(aid, section, analyzer.df_abnormal, analyzer.df_abnormal_by_type)
+        device_history.ingest(aid, result_store.inspection_date(aid), section,
+                              getattr(analyzer, "df_result", None), analyzer.df_abnormal)
 
-            st.write(
-                f"DEBUG: Analyzer {key} created. "
-                f"df_abnormal rows = {len(analyzer.df_abnormal) if analyzer.df_abnormal is not None else 'None'}"
-            )
-        except Exception as e:
-            st.warning(f"Auto-create {key.upper()} analyzer failed: {e}")
+        st.write(
+            f"DEBUG: Section {section} stored. "
+            f"df_abnormal rows = {len(analyzer.df_abnormal) if analyzer.df_abnormal is not None else 'None'}"
+        )
+    except Exception as e:
+        st.warning(f"Auto-create {key.upper()} analyzer failed: {e}")
 
 
 
 # ==============================
 # Styler Helper
 # ==============================
+def _highlight_abnormal(section: str, df_abn: pd.DataFrame):
+    """ไฮไลต์ cell ที่ผิดกฎของ analyzer (utils.rules ที่ register ไว้) ในตาราง drill-down"""
+    violations = rules.registered(section).evaluate(df_abn)
+    return violations.style(df_abn.style, row=None, cell=rules.PINK, mark=None)
+
+
 #def _style_abnormal_table(df_abn: pd.DataFrame, value_col: str) -> "pd.io.formats.style.Styler":
     #"""ไฮไลต์ abnormal column (df_abn เป็น abnormal rows อยู่แล้ว)"""
     #def highlight_red(_):
@@ -114,6 +128,45 @@ def _ensure_analyzer(key: str, analyzer_cls, ref_file: str, ns: str):
     #return df_abn.style.applymap(highlight_red, subset=[value_col])
 
 
+def _render_device_history(section: str, df_abn: pd.DataFrame, value_col: str, ns: str) -> None:
+    """sparkline ของแต่ละอุปกรณ์ในตาราง abnormal (utils.device_history) + เลือกดูประวัติเต็มรายตัว"""
+    if section not in device_history.SECTIONS or df_abn is None or df_abn.empty:
+        return
+    if not {"ME", "Measure Object"} <= set(df_abn.columns):
+        return
+
+    devices = df_abn[["ME", "Measure Object"]].astype(str).drop_duplicates().reset_index(drop=True)
+    values, flagged = device_history.sparklines(section, devices, value_col)
+    if not any(len(v) > 1 for v in values):
+        st.caption("📈 Device history appears here once more inspection dates have been analyzed.")
+        return
+
+    devices["Inspections"] = [len(v) for v in values]
+    devices["Times abnormal"] = flagged
+    devices["History"] = values
+    st.markdown(f"##### History — {value_col}")
+    st.dataframe(
+        devices,
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "History": st.column_config.LineChartColumn("History", help="Value at each inspection date (oldest → latest)"),
+        },
+    )
+
+    labels = (devices["ME"] + " | " + devices["Measure Object"]).tolist()
+    pick = st.selectbox("Drill down device", ["-"] + labels, key=f"{ns}_device_history")
+    if pick == "-":
+        return
+    row = devices.iloc[labels.index(pick)]
+    hist = device_history.history(row["ME"], row["Measure Object"], section)
+    if hist.empty:
+        st.info("No history for this device")
+        return
+    st.line_chart(hist.pivot_table(index="Date", columns="Metric", values="Value", aggfunc="last"))
+    st.dataframe(hist, use_container_width=True, hide_index=True)
+
+
 # ==============================
 # SummaryTableReport (รวมทุก Analyzer)
 # ==============================
@@ -124,16 +177,15 @@ class SummaryTableReport:
         self.sections = []  # เก็บ summary ของแต่ละ analyzer
 
     def _get_summary(self, key: str, analyzer_cls, details: str, value_col: str):
-        """ดึง analyzer จาก session และคืนค่า (status, details, df_abn, df_abn_by_type)"""
-        analyzer = st.session_state.get(f"{key}_analyzer")
+        """ดึงผลของ section จาก result_store และคืนค่า (status, details, df_abn, df_abn_by_type)"""
+        stored = result_store.load_section(st.session_state.get("analysis_id"), SECTIONS[key])
 
-        if analyzer is None:
-            st.write(f"DEBUG: Analyzer {key} not found in session_state")
+        if stored is None:
+            st.write(f"DEBUG: Section {key} not found in result store")
             return ("No data", details, None, {})
 
-        df_abn = getattr(analyzer, "df_abnormal", None)
+        df_abn, df_abn_by_type = stored
         st.write(f"DEBUG: {key} df_abnormal type={type(df_abn)}, size={(len(df_abn) if df_abn is not None else 'None')}")
-        df_abn_by_type = getattr(analyzer, "df_abnormal_by_type", {})
         status = "Normal"
         if df_abn is not None and not df_abn.empty:
             status = "Abnormal"
@@ -351,12 +403,8 @@ class SummaryTableReport:
                     for c in numeric_cols:
                         df_abn[c] = pd.to_numeric(df_abn[c], errors="coerce")
 
-                    styled = (
-                        df_abn.style
-                        .format({c: "{:.2f}" for c in numeric_cols}, na_rep="-")
-                        .applymap(lambda v: "background-color:#ff9999; color:black"
-                                if isinstance(v, (int, float)) and pd.notna(v) and v > 0 else "",
-                                subset=["CPU utilization ratio"])
+                    styled = _highlight_abnormal("CPU", df_abn).format(
+                        {c: "{:.2f}" for c in numeric_cols}, na_rep="-"
                     )
                     st.dataframe(styled, use_container_width=True)
 
@@ -370,12 +418,8 @@ class SummaryTableReport:
                     for c in numeric_cols:
                         df_abn[c] = pd.to_numeric(df_abn[c], errors="coerce")
 
-                    styled = (
-                        df_abn.style
-                        .format({c: "{:.2f}" for c in numeric_cols}, na_rep="-")
-                        .applymap(lambda v: "background-color:#ff9999; color:black"
-                                if isinstance(v, (int, float)) and pd.notna(v) and v > 0 else "",
-                                subset=["Value of Fan Rotate Speed(Rps)"])
+                    styled = _highlight_abnormal("FAN", df_abn).format(
+                        {c: "{:.2f}" for c in numeric_cols}, na_rep="-"
                     )
                     st.dataframe(styled, use_container_width=True)
 
@@ -389,12 +433,8 @@ class SummaryTableReport:
                     for c in numeric_cols:
                         df_abn[c] = pd.to_numeric(df_abn[c], errors="coerce")
 
-                    styled = (
-                        df_abn.style
-                        .format({c: "{:.2f}" for c in numeric_cols}, na_rep="-")
-                        .applymap(lambda v: "background-color:#ff9999; color:black"
-                                if isinstance(v, (int, float)) and pd.notna(v) and v > 0 else "",
-                                subset=["Laser Bias Current(mA)"])
+                    styled = _highlight_abnormal("MSU", df_abn).format(
+                        {c: "{:.2f}" for c in numeric_cols}, na_rep="-"
                     )
                     st.dataframe(styled, use_container_width=True)
 
@@ -413,36 +453,8 @@ class SummaryTableReport:
                     for c in numeric_cols:
                         df_abn[c] = pd.to_numeric(df_abn[c], errors="coerce")
 
-                    def highlight_line_row(row):
-                        styles = [""] * len(row)
-                        col_map = {c: i for i, c in enumerate(df_abn.columns)}
-
-                        try:
-                            ber, thr = row["Instant BER After FEC"], row["Threshold"]
-                            if pd.notna(ber) and pd.notna(thr) and ber > thr:
-                                styles[col_map["Instant BER After FEC"]] = "background-color:#ff9999; color:black"
-                        except:
-                            pass
-
-                        try:
-                            v, lo, hi = row["Input Optical Power(dBm)"], row["Minimum threshold(in)"], row["Maximum threshold(in)"]
-                            if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                                styles[col_map["Input Optical Power(dBm)"]] = "background-color:#ff9999; color:black"
-                        except:
-                            pass
-
-                        try:
-                            v, lo, hi = row["Output Optical Power (dBm)"], row["Minimum threshold(out)"], row["Maximum threshold(out)"]
-                            if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                                styles[col_map["Output Optical Power (dBm)"]] = "background-color:#ff9999; color:black"
-                        except:
-                            pass
-
-                        return styles
-
                     styled = (
-                        df_abn.style
-                        .apply(highlight_line_row, axis=1)
+                        _highlight_abnormal("Line", df_abn)
                         .format({
                             "Threshold": "{:.2E}",
                             "Instant BER After FEC": "{:.2E}",
@@ -459,29 +471,12 @@ class SummaryTableReport:
                     ]
                     df_abn = df_abn[[c for c in cols_to_show if c in df_abn.columns]].copy()
 
-                    def highlight_client_row(row):
-                        styles = [""] * len(row)
-                        col_map = {c: i for i, c in enumerate(df_abn.columns)}
-
-                        try:
-                            v, lo, hi = row["Output Optical Power (dBm)"], row["Minimum threshold(out)"], row["Maximum threshold(out)"]
-                            if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                                styles[col_map["Output Optical Power (dBm)"]] = "background-color:#ff9999; color:black"
-                        except:
-                            pass
-
-                        try:
-                            v, lo, hi = row["Input Optical Power(dBm)"], row["Minimum threshold(in)"], row["Maximum threshold(in)"]
-                            if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                                styles[col_map["Input Optical Power(dBm)"]] = "background-color:#ff9999; color:black"
-                        except:
-                            pass
-
-                        return styles
-
-                    styled = df_abn.style.apply(highlight_client_row, axis=1)
+                    styled = _highlight_abnormal("Client", df_abn)
                     st.dataframe(styled, use_container_width=True)
 
+                if task_name in TASK_SECTIONS:
+                    _render_device_history(TASK_SECTIONS[task_name], df_abn, value_col, key_state)
+
             elif status == "Normal":
                 st.info(f"✅ All {task_name} values are within normal range.")
             else:
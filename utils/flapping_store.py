@@ -0,0 +1,200 @@
+# utils/flapping_store.py
+"""
+ที่เก็บ Fiber Flapping event (แถวที่ไม่เจอ alarm match) ข้ามหลายวัน/หลายสัปดาห์ — SQLite ไฟล์เดียว
+
+เดิมหน้า Fiber Flapping / Dashboard เห็นแค่ OSC+FM คู่ล่าสุดใน session และคำนวณ find_nomatch ใหม่ทุก rerun
+ตอนนี้แต่ละคู่ OSC+FM ถูก ingest ครั้งเดียว (key = source จาก FiberflappingAnalyzer.source_key())
+แล้วหน้า trend อ่านจาก store อย่างเดียว (ไม่ต้อง normalize / match วันเก่าใหม่)
+
+ตาราง:
+    flapping_sources  source ที่ ingest แล้ว + ช่วงวันที่ + จำนวน event
+    flapping_events   หนึ่งแถวต่อ (ME, Measure Object, Begin Time) — upload ที่ช่วงวันทับกันไม่ทำให้นับซ้ำ
+                      (ค่าล่าสุดทับค่าเดิม ไม่มีการลบวันเก่า)
+
+การใช้งาน:
+    from utils import flapping_store
+    flapping_store.ingest(source, df_nomatch)            # ข้ามถ้า source นี้ ingest แล้ว
+    flapping_store.daily_sites(days=90)                  # Date / Sites ย้อนหลังจากวันล่าสุดใน store
+    flapping_store.load_events("2025-09-01", "2025-09-07")
+"""
+import os
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+STORE_PATH = os.path.join("uploads", "flapping.db")
+
+# เพิ่มเมื่อเปลี่ยน schema / ตรรกะที่ใช้สร้าง event → source เดิมจะถูก ingest ใหม่
+STORE_VERSION = 1
+
+# คอลัมน์ของ event (ชื่อเดียวกับ df_nomatch) → ชื่อคอลัมน์ใน SQLite
+COLUMNS = {
+    "Begin Time": "begin_time",
+    "End Time": "end_time",
+    "Granularity": "granularity",
+    "Site Name": "site_name",
+    "ME": "me",
+    "ME IP": "me_ip",
+    "Measure Object": "measure_object",
+    "Max Value of Input Optical Power(dBm)": "max_in",
+    "Min Value of Input Optical Power(dBm)": "min_in",
+    "Input Optical Power(dBm)": "input_power",
+    "Max - Min (dB)": "delta_db",
+}
+_NUMERIC = ("max_in", "min_in", "input_power", "delta_db")
+_KEY = ("me", "measure_object", "begin_time")
+
+_lock = threading.Lock()
+
+
+def _connect(path: str | None = None) -> sqlite3.Connection:
+    path = path or STORE_PATH
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path)
+    cols = ",\n        ".join(f"{c} {'REAL' if c in _NUMERIC else 'TEXT'}" for c in COLUMNS.values())
+    conn.executescript(f"""
+    CREATE TABLE IF NOT EXISTS flapping_sources (
+        source TEXT PRIMARY KEY,
+        version INTEGER,
+        ingested_at TEXT,
+        day_min TEXT,
+        day_max TEXT,
+        events INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS flapping_events (
+        day TEXT NOT NULL,
+        {cols},
+        source TEXT,
+        PRIMARY KEY (me, measure_object, begin_time)
+    );
+    CREATE INDEX IF NOT EXISTS flapping_events_day ON flapping_events (day, me);
+    """)
+    return conn
+
+
+def has_source(source: str, path: str | None = None) -> bool:
+    conn = _connect(path)
+    try:
+        row = conn.execute(
+            "SELECT 1 FROM flapping_sources WHERE source=? AND version=?", (source, STORE_VERSION)
+        ).fetchone()
+    finally:
+        conn.close()
+    return row is not None
+
+
+def source_days(source: str, path: str | None = None):
+    """(day_min, day_max) ของ source ที่ ingest แล้ว (None ถ้าไม่มี event หรือยังไม่ ingest)"""
+    conn = _connect(path)
+    try:
+        row = conn.execute(
+            "SELECT day_min, day_max FROM flapping_sources WHERE source=? AND version=?", (source, STORE_VERSION)
+        ).fetchone()
+    finally:
+        conn.close()
+    return (row[0], row[1]) if row and row[0] else None
+
+
+def _records(df: pd.DataFrame) -> list:
+    out = pd.DataFrame(index=df.index)
+    begin = pd.to_datetime(df["Begin Time"], errors="coerce")
+    out["day"] = begin.dt.strftime("%Y-%m-%d")
+    for col, name in COLUMNS.items():
+        if col not in df.columns:
+            out[name] = None
+        elif name in ("begin_time", "end_time"):
+            out[name] = pd.to_datetime(df[col], errors="coerce").dt.strftime("%Y-%m-%d %H:%M:%S")
+        elif name in _NUMERIC:
+            out[name] = pd.to_numeric(df[col], errors="coerce")
+        else:
+            out[name] = df[col].astype(object).where(df[col].notna(), None).map(
+                lambda v: v if v is None else str(v)
+            )
+    out = out[out["day"].notna()]
+    # NULL ใน primary key ของ SQLite ไม่ซ้ำกันเอง → ใช้ "" แทน
+    for name in _KEY:
+        out[name] = out[name].fillna("")
+    out = out.astype(object).where(out.notna(), None)
+    return list(out.itertuples(index=False, name=None))
+
+
+def ingest(source: str, df_nomatch: pd.DataFrame, force: bool = False, path: str | None = None) -> int:
+    """
+    เก็บ event ของ source (คืนจำนวนแถวที่เขียน, 0 ถ้า source นี้ ingest ไปแล้ว)
+    df_nomatch: ผลของ FiberflappingAnalyzer.find_nomatch (คอลัมน์ตาม COLUMNS, อย่างน้อยต้องมี Begin Time)
+    """
+    with _lock:
+        if not force and has_source(source, path):
+            return 0
+        rows = _records(df_nomatch) if df_nomatch is not None and not df_nomatch.empty else []
+        names = ["day", *COLUMNS.values()]
+        days = [r[0] for r in rows]
+        conn = _connect(path)
+        try:
+            with conn:
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO flapping_events ({', '.join(names)}, source) "
+                    f"VALUES ({', '.join('?' * (len(names) + 1))})",
+                    [(*r, source) for r in rows],
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO flapping_sources (source, version, ingested_at, day_min, day_max, events) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (source, STORE_VERSION, datetime.now().isoformat(),
+                     min(days) if days else None, max(days) if days else None, len(rows)),
+                )
+        finally:
+            conn.close()
+        return len(rows)
+
+
+def _range(conn, start, end, days):
+    """ช่วงวัน [start, end] เป็นสตริง — ไม่ระบุ end ใช้วันล่าสุดใน store, ไม่ระบุ start ใช้ end - days + 1"""
+    if end is None:
+        end = conn.execute("SELECT MAX(day) FROM flapping_events").fetchone()[0]
+        if end is None:
+            return None
+    end = str(end)[:10]
+    if start is None:
+        start = (date.fromisoformat(end) - timedelta(days=max(int(days or 1), 1) - 1)).isoformat()
+    return str(start)[:10], end
+
+
+def daily_sites(days: int = 7, start=None, end=None, path: str | None = None) -> pd.DataFrame:
+    """จำนวน ME ที่มี flapping ต่อวัน (Date, Sites) — ใช้ index (day, me) ไม่ต้องอ่าน event ทั้งแถว"""
+    conn = _connect(path)
+    try:
+        rng = _range(conn, start, end, days)
+        if rng is None:
+            return pd.DataFrame(columns=["Date", "Sites"])
+        df = pd.read_sql_query(
+            "SELECT day AS Date, COUNT(DISTINCT me) AS Sites FROM flapping_events "
+            "WHERE day BETWEEN ? AND ? GROUP BY day ORDER BY day",
+            conn, params=rng,
+        )
+    finally:
+        conn.close()
+    df["Date"] = pd.to_datetime(df["Date"]).dt.date
+    return df
+
+
+def load_events(start=None, end=None, days: int = 7, path: str | None = None) -> pd.DataFrame:
+    """event ในช่วงวัน (คอลัมน์เหมือน df_nomatch) → ส่งต่อ render_weekly_summary / build_daily_tables ได้เลย"""
+    conn = _connect(path)
+    try:
+        rng = _range(conn, start, end, days)
+        if rng is None:
+            return pd.DataFrame()
+        df = pd.read_sql_query(
+            f"SELECT {', '.join(COLUMNS.values())} FROM flapping_events "
+            "WHERE day BETWEEN ? AND ? ORDER BY begin_time, me, measure_object",
+            conn, params=rng,
+        )
+    finally:
+        conn.close()
+    df = df.rename(columns={v: k for k, v in COLUMNS.items()})
+    df["Begin Time"] = pd.to_datetime(df["Begin Time"])
+    df["End Time"] = pd.to_datetime(df["End Time"])
+    return df
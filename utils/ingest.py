@@ -0,0 +1,441 @@
+# utils/ingest.py
+import io
+import multiprocessing
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import zipfile
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import pandas as pd
+
+from utils import excel_reader
+
+# เพิ่มเลขนี้ทุกครั้งที่แก้ KW / _kind / LOADERS / KIND_COLUMNS
+# (cache ใน utils/dataset_cache.py ผูกกับเวอร์ชันนี้ → ของเก่าจะถูกทิ้งเอง)
+CLASSIFIER_VERSION = 3
+
+
+# ====== ZIP PARSER ======
+KW = {
+    "cpu": ("cpu",),
+    "fan": ("fan",),
+    "msu": ("msu",),
+    "client": ("client", "client board"),
+    "line":  ("line","line board"),
+    "wason": ("wason","log"),
+    "osc": ("osc","osc optical"),
+    "fm":  ("fm","alarm","fault management"),
+    "atten": ("optical attenuation report","optical attenuation"),
+    "preset": ("mobaxterm", "moba xterm", "moba"),
+}
+
+# คอลัมน์ที่ analyzer ใช้จริง (projection ตอน parse) — kind ที่ไม่มีในนี้อ่านทุกคอลัมน์
+ID_COLS = ("Begin Time", "End Time", "Granularity", "ME", "ME IP", "Measure Object")
+POWER_COLS = (
+    "Input Optical Power(dBm)", "Max Value of Input Optical Power(dBm)", "Min Value of Input Optical Power(dBm)",
+    "Output Optical Power (dBm)", "Max Value of Output Optical Power(dBm)", "Min Value of Output Optical Power(dBm)",
+)
+BER_COLS = (
+    "Instant BER After FEC", "Max Instant BER After FEC", "Min Instant BER After FEC",
+    "Instant BER Before FEC", "Max Instant BER Before FEC", "Min Instant BER Before FEC",
+)
+KIND_NUMERIC = {
+    "cpu":    ("CPU utilization ratio", "Max CPU utilization ratio", "Min CPU utilization ratio"),
+    "fan":    ("Value of Fan Rotate Speed(Rps)", "Max Value of Fan Rotate Speed(Rps)", "Min Value of Fan Rotate Speed(Rps)"),
+    "msu":    ("Laser Bias Current(mA)", "Max Value of Laser Bias Current(mA)", "Min Value of Laser Bias Current(mA)"),
+    "line":   BER_COLS + POWER_COLS,
+    "client": POWER_COLS,
+}
+KIND_COLUMNS = {kind: ID_COLS + cols for kind, cols in KIND_NUMERIC.items()}
+
+
+def _load_excel(f, kind=None):
+    return excel_reader.read_excel(f, KIND_COLUMNS.get(kind), KIND_NUMERIC.get(kind))
+
+
+LOADERS = {
+    ".xlsx": _load_excel,
+    ".xls": _load_excel,
+    ".txt":  lambda f, kind=None: f.read().decode("utf-8", errors="ignore"),
+}
+
+def _ext(name: str) -> str:
+    name = name.lower()
+    return next((e for e in LOADERS if name.endswith(e)), "")
+
+def _kind(name):
+    n = name.lower()
+    hits = [k for k, kws in KW.items() if any(s in n for s in kws)]
+
+    # ---- Priority ----
+    if "wason" in hits:
+        return "wason"
+    if "preset" in hits:
+        return "preset"
+
+    # ---- เช็คว่า line ต้องเป็น Excel เท่านั้น ----
+    if "line" in hits and (n.endswith(".xlsx") or n.endswith(".xls") or n.endswith(".xlsm")):
+        return "line"
+
+    # ---- อื่น ๆ ตามปกติ ----
+    for k in ("fan","cpu","msu","client","osc","fm","atten"):
+        if k in hits:
+            return k
+
+    return hits[0] if hits else None
+
+
+def classify(name: str):
+    """kind ของไฟล์/member จากชื่อ (None ถ้าไม่มี loader หรือจัดประเภทไม่ได้)"""
+    lname = name.lower()
+    return _kind(lname) if _ext(lname) else None
+
+
+# kind ที่มีหน้า/analyzer ใช้จริง (preset = MobaXterm ยังจัดประเภทไว้ แต่ไม่มีใครอ่าน → ไม่ decode)
+DECODE_KINDS = ("cpu", "fan", "msu", "client", "line", "wason", "osc", "fm", "atten")
+
+SPOOL_MAX_BYTES = 64 * 1024 ** 2   # ZIP ซ้อนที่ถูกบีบอัด: เกินนี้จึงพักลงดิสก์
+_CHUNK = 1024 * 1024
+
+
+class _MemberSlice(io.RawIOBase):
+    """
+    file object แบบ seek ได้ ที่ชี้ไปยังช่วง byte ของ member แบบ STORED ใน ZIP แม่
+    (ไม่ copy ข้อมูล: อ่านตรงจากไฟล์บนดิสก์ / slice ชั้นนอก)
+    """
+
+    def __init__(self, raw, start: int, size: int):
+        self._raw = raw
+        self._start = start
+        self._size = size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        else:
+            pos = self._size + offset
+        self._pos = max(0, min(pos, self._size))
+        return self._pos
+
+    def readinto(self, b):
+        n = min(len(b), self._size - self._pos)
+        if n <= 0:
+            return 0
+        # raw อาจถูก ZipFile ชั้นนอกใช้ร่วม → seek ทุกครั้งก่อนอ่าน
+        self._raw.seek(self._start + self._pos)
+        data = self._raw.read(n)
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+def _stored_data_offset(zf: zipfile.ZipFile, info: zipfile.ZipInfo) -> int:
+    """ตำแหน่งเริ่มข้อมูลของ member (ข้าม local file header)"""
+    zf.fp.seek(info.header_offset)
+    header = zf.fp.read(zipfile.sizeFileHeader)
+    fields = struct.unpack(zipfile.structFileHeader, header)
+    name_len = fields[zipfile._FH_FILENAME_LENGTH]
+    extra_len = fields[zipfile._FH_EXTRA_FIELD_LENGTH]
+    return info.header_offset + zipfile.sizeFileHeader + name_len + extra_len
+
+
+@contextmanager
+def open_nested(zf: zipfile.ZipFile, name: str):
+    """
+    เปิด ZIP ซ้อนโดยไม่อ่านทั้งก้อนเข้า memory
+      - STORED   → slice ตรงจากไฟล์แม่
+      - DEFLATED → stream ลง SpooledTemporaryFile (ล้นลงดิสก์เมื่อเกิน SPOOL_MAX_BYTES)
+    """
+    info = zf.getinfo(name)
+    if info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+        fh = _MemberSlice(zf.fp, _stored_data_offset(zf, info), info.file_size)
+    else:
+        fh = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        with zf.open(info) as src:
+            shutil.copyfileobj(src, fh, _CHUNK)
+        fh.seek(0)
+    try:
+        with zipfile.ZipFile(fh) as inner:
+            yield inner
+    finally:
+        fh.close()
+
+
+def find_in_zip(zip_file, kinds=DECODE_KINDS):
+    """
+    zip_file = path หรือ file object ที่ seek ได้
+    decode เฉพาะ member แรกของแต่ละ kind ใน kinds แล้วหยุดทันทีเมื่อครบ
+    """
+    wanted = set(kinds)
+    found = {k: None for k in KW}
+    def walk(zf):
+        for name in zf.namelist():
+            if all(found[k] for k in wanted):
+                return
+            if name.endswith("/"):
+                continue
+            lname = name.lower()
+            if lname.endswith(".zip"):
+                try:
+                    with open_nested(zf, name) as inner:
+                        walk(inner)
+                except:
+                    pass
+                continue
+            ext = _ext(lname)
+            kind = _kind(lname)
+            if not ext or kind not in wanted or found[kind]:
+                continue
+            try:
+                with zf.open(name) as f:
+                    df = LOADERS[ext](f, kind)
+
+                # ถ้าเป็น log (.txt) → df เป็น string, นอกนั้นเป็น DataFrame
+                found[kind] = (df, name)
+
+            except:
+                continue
+    with zipfile.ZipFile(zip_file) as zf:
+        walk(zf)
+    return found
+
+
+def load_stored_file(path: str, display_name: str | None = None):
+    """
+    อ่านไฟล์ที่เก็บใน uploads/ (ZIP หรือ Excel/TXT เดี่ยว)
+    คืนค่า dict {kind: (data, member_name)} เฉพาะ kind ที่เจอ
+    """
+    lname = path.lower()
+    if lname.endswith(".zip"):
+        res = find_in_zip(path)
+        return {k: v for k, v in res.items() if v}
+
+    ext = _ext(lname)
+    kind = _kind(lname)
+    if not ext or not kind:
+        raise ValueError("Unsupported file type or cannot infer kind")
+    with open(path, "rb") as f:
+        data = LOADERS[ext](f, kind)
+    return {kind: (data, display_name or os.path.basename(path))}
+
+
+
+# ====== Parallel decode (หลายไฟล์ × หลาย member ใน process pool) ======
+# ใช้ spawn เพื่อไม่ fork process ของ Streamlit ที่มีหลาย thread อยู่แล้ว
+# pool สร้างครั้งเดียวต่อ process แล้วใช้ซ้ำทุกครั้งที่กด Run Analysis
+MAX_WORKERS = int(os.environ.get("INGEST_WORKERS", 0)) or min(8, os.cpu_count() or 1)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def _reset_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _run_inline(fn, *args) -> Future:
+    fut = Future()
+    try:
+        fut.set_result(fn(*args))
+    except Exception as e:
+        fut.set_exception(e)
+    return fut
+
+
+def plan_zip(zf: zipfile.ZipFile, chain: tuple = ()) -> list:
+    """
+    ไล่ member ใน ZIP (รวม ZIP ซ้อน) ตามลำดับเดียวกับ find_in_zip
+    คืน [(chain, name, kind, ext)] โดย chain = ชื่อ ZIP ซ้อนที่ต้องเปิดก่อนถึง member
+    """
+    out = []
+    for name in zf.namelist():
+        if name.endswith("/"):
+            continue
+        lname = name.lower()
+        if lname.endswith(".zip"):
+            try:
+                with open_nested(zf, name) as inner:
+                    out.extend(plan_zip(inner, chain + (name,)))
+            except Exception:
+                pass
+            continue
+        ext = _ext(lname)
+        kind = _kind(lname)
+        if ext and kind in DECODE_KINDS:
+            out.append((chain, name, kind, ext))
+    return out
+
+
+def build_manifest(path: str, display_name: str | None = None) -> list:
+    """
+    รายการ member ทั้งหมด (รวม ZIP ซ้อน) ตามลำดับที่ find_in_zip เดิน — อ่านแค่ central directory
+    คืน [{"seq", "nesting", "member", "size", "crc", "kind"}]
+    """
+    if not path.lower().endswith(".zip"):
+        return [{
+            "seq": 0, "nesting": [], "member": display_name or os.path.basename(path),
+            "size": os.path.getsize(path), "crc": None, "kind": classify(path),
+        }]
+
+    rows = []
+    def walk(zf, chain):
+        for info in zf.infolist():
+            if info.filename.endswith("/"):
+                continue
+            is_zip = info.filename.lower().endswith(".zip")
+            rows.append({
+                "seq": len(rows), "nesting": list(chain), "member": info.filename,
+                "size": info.file_size, "crc": info.CRC,
+                "kind": None if is_zip else classify(info.filename),
+            })
+            if is_zip:
+                try:
+                    with open_nested(zf, info.filename) as inner:
+                        walk(inner, chain + (info.filename,))
+                except Exception:
+                    pass
+    with zipfile.ZipFile(path) as zf:
+        walk(zf, ())
+    return rows
+
+
+def plan_from_manifest(rows: list) -> list:
+    """แปลง manifest เป็น plan แบบเดียวกับ plan_zip (kind คำนวณใหม่จากชื่อ → ตาม classifier ปัจจุบัน)"""
+    plan = []
+    for r in sorted(rows, key=lambda r: r["seq"]):
+        lname = r["member"].lower()
+        if lname.endswith(".zip"):
+            continue
+        kind = classify(lname)
+        if kind in DECODE_KINDS:
+            plan.append((tuple(r["nesting"]), r["member"], kind, _ext(lname)))
+    return plan
+
+
+def decode_member(path: str, chain: tuple, name: str, ext: str, kind: str | None = None):
+    """(worker) เปิด ZIP จาก path → ZIP ซ้อนตาม chain → decode member"""
+    with ExitStack() as stack:
+        zf = stack.enter_context(zipfile.ZipFile(path))
+        for inner in chain:
+            zf = stack.enter_context(open_nested(zf, inner))
+        with zf.open(name) as f:
+            return LOADERS[ext](f, kind)
+
+
+def decode_file(path: str, ext: str, kind: str | None = None):
+    """(worker) decode Excel/TXT เดี่ยว"""
+    with open(path, "rb") as f:
+        return LOADERS[ext](f, kind)
+
+
+def parse_files(items: list, on_done=None, max_workers: int | None = None, manifests: list | None = None) -> list:
+    """
+    parse หลายไฟล์พร้อมกัน: member ที่ต้องใช้ของทุกไฟล์เป็นงานแยกใน process pool
+    items     = [(path, display_name)]
+    on_done   = callback(i, result) เรียกทันทีที่ไฟล์ที่ i parse เสร็จ (ใน thread ที่เรียก)
+    manifests = (ถ้ามี) manifest จาก build_manifest ตามลำดับ items → เปิดเฉพาะ member ที่ต้องใช้
+                โดยไม่ต้องไล่ ZIP ใหม่
+    คืน list ของ {kind: (data, member_name)} หรือ Exception ตามลำดับ items
+
+    ผลเหมือน load_stored_file: แต่ละ kind ใช้ member แรกตามลำดับใน ZIP ที่ decode สำเร็จ
+    """
+    results: list = [None] * len(items)
+    candidates: dict = {}      # (i, kind) → member ที่เหลือให้ลองถ้าตัวก่อนหน้า decode ไม่ได้
+    pending = [0] * len(items)
+    jobs = []                  # (i, kind, fn, args, member_name)
+
+    def finish(i):
+        if isinstance(results[i], dict):
+            results[i] = {k: results[i][k] for k in KW if k in results[i]}
+        if on_done is not None:
+            on_done(i, results[i])
+
+    for i, (path, display_name) in enumerate(items):
+        lname = path.lower()
+        try:
+            if lname.endswith(".zip"):
+                if manifests and manifests[i]:
+                    plan = plan_from_manifest(manifests[i])
+                else:
+                    with zipfile.ZipFile(path) as zf:
+                        plan = plan_zip(zf)
+                mine = {}
+                for chain, name, kind, ext in plan:
+                    mine.setdefault(kind, []).append((chain, name, ext))
+                for kind, members in mine.items():
+                    chain, name, ext = members.pop(0)
+                    candidates[(i, kind)] = members
+                    jobs.append((i, kind, decode_member, (path, chain, name, ext, kind), name))
+                pending[i] = len(mine)
+            else:
+                ext = _ext(lname)
+                kind = _kind(lname)
+                if not ext or not kind:
+                    raise ValueError("Unsupported file type or cannot infer kind")
+                jobs.append((i, kind, decode_file, (path, ext, kind), display_name or os.path.basename(path)))
+                pending[i] = 1
+            results[i] = {}
+        except Exception as e:
+            results[i] = e
+        if pending[i] == 0:
+            finish(i)
+
+    if len(jobs) <= 1 or (max_workers or MAX_WORKERS) <= 1:
+        submit = _run_inline  # งานเดียว → ไม่คุ้มส่งข้าม process
+    else:
+        submit = _get_pool().submit
+
+    running = {submit(fn, *args): (i, kind, name) for i, kind, fn, args, name in jobs}
+    while running:
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for fut in done:
+            i, kind, name = running.pop(fut)
+            try:
+                data = fut.result()
+            except BrokenProcessPool:
+                _reset_pool()
+                raise
+            except Exception as e:
+                rest = candidates.get((i, kind))
+                if rest:
+                    chain, name, ext = rest.pop(0)
+                    running[submit(decode_member, items[i][0], chain, name, ext, kind)] = (i, kind, name)
+                    continue
+                if (i, kind) not in candidates:
+                    results[i] = e  # ไฟล์เดี่ยวอ่านไม่ได้
+            else:
+                results[i][kind] = (data, name)
+            pending[i] -= 1
+            if pending[i] == 0:
+                finish(i)
+    return results
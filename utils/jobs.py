@@ -0,0 +1,381 @@
+# utils/jobs.py
+"""
+คิวงานวิเคราะห์เบื้องหลัง — Run Analysis ไม่ต้องรันใน thread ของ Streamlit script
+
+เดิมปุ่ม Run Analysis parse + วิเคราะห์ inline ระหว่างที่ผู้ใช้ดู progress bar และผลอยู่ใน session
+ของ browser เท่านั้น → refresh / ปิดแท็บ = งานหาย และ operator หลายคนแย่ง CPU ของ process เดียวกัน
+ตอนนี้:
+    job_id = jobs.submit(owner, [upload_id, ...])   # เพิ่มแถวในตาราง jobs (files.db) สถานะ queued
+    jobs.ensure_runner()                            # thread dispatcher + process pool (ครั้งเดียวต่อ process)
+    jobs.list_jobs()                                # สถานะ / progress / ETA สำหรับ UI (poll จาก DB)
+    jobs.load_result(job)                           # ผลของ batch_analyze.analyze_datasets ที่เก็บไว้
+    job["analysis_id"]                              # dataset + ตาราง abnormal ใน utils/result_store
+
+worker (process แยก) ทำงานเดียวกับ batch_analyze.py:
+    dataset_cache.get_or_parse_many → analyze_datasets (prepare() ของทุก analyzer) → write_outputs
+    ผลอยู่ใน uploads/.jobs/<job_id>/ (results.pkl, ตาราง abnormal CSV, summary.csv, PDF)
+    และใน result_store (analysis_id) → หน้า analysis อ่านต่อได้โดยไม่ต้อง parse / วิเคราะห์ใหม่
+    และ progress/ข้อความถูกเขียนกลับลงตาราง jobs ระหว่างทำงาน
+
+การจัดคิว: ทุกครั้งที่มี worker ว่าง เลือก job ของ owner ที่มีงานกำลังรันน้อยที่สุดก่อน
+(เท่ากัน → job ที่รอนานสุด) → operator ที่ queue หลายงานไม่ทำให้อีกคนต้องรอจนงานของตัวเองหมดคิว
+job ที่ค้างสถานะ running จาก process ที่ตายไปแล้ว (เช่น restart server) ถูกนำกลับเข้าคิวตอน runner เริ่ม
+"""
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+DB_FILE = "files.db"
+JOBS_DIR = os.path.join("uploads", ".jobs")
+
+MAX_WORKERS = int(os.environ.get("JOB_WORKERS", 0)) or max(1, min(4, (os.cpu_count() or 2) // 2))
+POLL_SECONDS = 1.0
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = ("queued", "running")
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def _connect(db_file: str | None = None) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_file or DB_FILE, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def init_db(db_file: str | None = None) -> None:
+    conn = _connect(db_file)
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        owner TEXT,
+        upload_ids TEXT,
+        status TEXT,
+        progress REAL,
+        message TEXT,
+        created_at TEXT,
+        started_at TEXT,
+        finished_at TEXT,
+        runner_pid INTEGER,
+        result_dir TEXT,
+        error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+    """)
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(jobs)")]
+    if "analysis_id" not in cols:
+        conn.execute("ALTER TABLE jobs ADD COLUMN analysis_id TEXT")
+    conn.commit()
+    conn.close()
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _row(row: sqlite3.Row | None) -> dict | None:
+    if row is None:
+        return None
+    job = dict(row)
+    job["upload_ids"] = json.loads(job["upload_ids"] or "[]")
+    return job
+
+
+# ====== API สำหรับ UI ======
+def submit(owner: str, upload_ids: list[int], db_file: str | None = None) -> int:
+    """เพิ่ม job "วิเคราะห์ upload เหล่านี้" (ลำดับ = ลำดับที่ไฟล์หลังทับไฟล์ก่อน เหมือน Run Analysis)"""
+    if not upload_ids:
+        raise ValueError("No uploads selected")
+    conn = _connect(db_file)
+    cur = conn.execute(
+        "INSERT INTO jobs (owner, upload_ids, status, progress, message, created_at) VALUES (?, ?, 'queued', 0, ?, ?)",
+        (owner, json.dumps([int(i) for i in upload_ids]), "Waiting for a worker", _now()),
+    )
+    conn.commit()
+    job_id = cur.lastrowid
+    conn.close()
+    return job_id
+
+
+def get(job_id: int, db_file: str | None = None) -> dict | None:
+    conn = _connect(db_file)
+    row = conn.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+    conn.close()
+    return _row(row)
+
+
+def list_jobs(owner: str | None = None, limit: int = 20, db_file: str | None = None) -> list[dict]:
+    """job ล่าสุด (ทุก owner ถ้า owner=None) เรียงจากใหม่ไปเก่า"""
+    conn = _connect(db_file)
+    if owner is None:
+        rows = conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    else:
+        rows = conn.execute("SELECT * FROM jobs WHERE owner=? ORDER BY id DESC LIMIT ?", (owner, limit)).fetchall()
+    conn.close()
+    return [_row(r) for r in rows]
+
+
+def queue_position(job: dict, db_file: str | None = None) -> int:
+    """จำนวน job ที่ queued ก่อนหน้า job นี้ (0 = ตัวถัดไป ถ้า owner ไม่ต่างกัน)"""
+    conn = _connect(db_file)
+    n = conn.execute(
+        "SELECT COUNT(*) FROM jobs WHERE status='queued' AND id < ?", (job["id"],)
+    ).fetchone()[0]
+    conn.close()
+    return int(n)
+
+
+def cancel(job_id: int, db_file: str | None = None) -> bool:
+    """ยกเลิก job ที่ยังไม่เริ่ม (job ที่กำลังรันปล่อยให้จบ)"""
+    conn = _connect(db_file)
+    cur = conn.execute(
+        "UPDATE jobs SET status='cancelled', message='Cancelled', finished_at=? WHERE id=? AND status='queued'",
+        (_now(), job_id),
+    )
+    conn.commit()
+    conn.close()
+    return cur.rowcount == 1
+
+
+def elapsed(job: dict) -> float | None:
+    if not job.get("started_at"):
+        return None
+    end = datetime.fromisoformat(job["finished_at"]) if job.get("finished_at") else datetime.now()
+    return max(0.0, (end - datetime.fromisoformat(job["started_at"])).total_seconds())
+
+
+def eta(job: dict) -> float | None:
+    """วินาทีที่เหลือโดยประมาณ (เวลาที่ใช้ไป × สัดส่วนงานที่เหลือ) — None ถ้ายังประมาณไม่ได้"""
+    spent = elapsed(job)
+    p = job.get("progress") or 0.0
+    if job.get("status") != "running" or spent is None or p < 0.05:
+        return None
+    return spent * (1 - p) / p
+
+
+def load_result(job: dict) -> dict | None:
+    """{"abnormal", "extra", "errors", "uploads"} ที่ worker เก็บไว้ (None ถ้ายังไม่เสร็จ / ไฟล์หาย)"""
+    if job.get("status") != "done" or not job.get("result_dir"):
+        return None
+    path = os.path.join(job["result_dir"], "results.pkl")
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+# ====== Worker (รันใน process pool) ======
+def _update(db_file: str, job_id: int, **fields) -> None:
+    conn = _connect(db_file)
+    conn.execute(
+        f"UPDATE jobs SET {', '.join(f'{k}=?' for k in fields)} WHERE id=?",
+        (*fields.values(), job_id),
+    )
+    conn.commit()
+    conn.close()
+
+
+def _uploads(db_file: str, upload_ids: list[int]) -> list[tuple]:
+    conn = _connect(db_file)
+    rows = {
+        r["id"]: (r["id"], r["orig_filename"], r["stored_path"], r["sha256"], r["upload_date"])
+        for r in conn.execute(
+            f"SELECT id, orig_filename, stored_path, sha256, upload_date FROM uploads WHERE id IN ({','.join('?' * len(upload_ids))})",
+            upload_ids,
+        )
+    }
+    conn.close()
+    missing = [i for i in upload_ids if i not in rows]
+    if missing:
+        raise ValueError(f"Upload(s) no longer exist: {missing}")
+    return [rows[i] for i in upload_ids]
+
+
+def run_job(job_id: int, db_file: str | None = None) -> None:
+    """
+    ทำ job หนึ่งงาน: parse (ผ่าน dataset cache) → analyze_datasets → เขียนผล
+    progress: โหลดไฟล์ 0–40%, วิเคราะห์ทีละ section 40–90%, เขียนผล 90–100%
+    """
+    import batch_analyze  # analyzer / reportlab โหลดเฉพาะใน worker
+    import dashboard_kpi
+    import pandas as pd
+    from utils import dataset_cache, device_history, memo, result_store
+
+    db_file = db_file or DB_FILE
+    job = get(job_id, db_file)
+    out_dir = os.path.join(JOBS_DIR, str(job_id))
+    try:
+        uploads = [
+            (uid, name, path, sha or dataset_cache.file_sha256(path), day)   # แถวเก่าที่ยังไม่มี sha256
+            for uid, name, path, sha, day in _uploads(db_file, job["upload_ids"])
+        ]
+        items = [(path, sha, name) for _, name, path, sha, _ in uploads]
+
+        loaded = [0]
+
+        def _loaded(i, res):
+            loaded[0] += 1
+            state = "failed" if isinstance(res, Exception) else "loaded"
+            _update(db_file, job_id, progress=0.4 * loaded[0] / len(items),
+                    message=f"{state} {items[i][2]} ({loaded[0]}/{len(items)})")
+
+        _update(db_file, job_id, message=f"Loading {len(items)} file(s)")
+        # worker เป็น process ใน pool ของ _Runner อยู่แล้ว → parse ในตัว ไม่เปิด decode pool ซ้อนอีกชุดต่อ worker
+        parsed = dataset_cache.get_or_parse_many(items, on_done=_loaded, max_workers=1)
+        datasets, errors = {}, {}
+        for (_, sha, name), res in zip(items, parsed):
+            if isinstance(res, dict):
+                # tag เดียวกับ result_store.dataset → memo key / source ของ flapping_store ตรงกับหน้า analyzer
+                for kind, (data, zname) in res.items():
+                    if isinstance(data, pd.DataFrame):
+                        memo.tag(data, result_store.dataset_digest(sha, kind, zname))
+                datasets.update(res)     # ไฟล์หลังทับไฟล์ก่อน
+            else:
+                errors[name] = str(res)
+
+        sections = batch_analyze.planned_sections(datasets)
+        done = [0]
+
+        def _section(section, ok):
+            done[0] += 1
+            _update(db_file, job_id, progress=0.4 + 0.5 * done[0] / max(1, len(sections)),
+                    message=f"{'analyzed' if ok else 'failed'} {section} ({done[0]}/{len(sections)})")
+
+        results = batch_analyze.analyze_datasets(datasets, log=lambda *_: None, on_section=_section)
+        results["uploads"] = [
+            {"id": uid, "name": name, "path": path, "sha256": sha, "upload_date": day}
+            for uid, name, path, sha, day in uploads
+        ]
+        results["load_errors"] = errors
+
+        _update(db_file, job_id, progress=0.9, message="Writing results")
+        aid = result_store.save_datasets(results["uploads"], parsed)
+        result_store.save_results(aid, results)
+        dashboard_kpi.ensure(aid)   # Dashboard ของ analysis นี้อ่านจาก snapshot อย่างเดียว
+        # ค่าของทุกอุปกรณ์ → ประวัติรายบอร์ด (ไม่เก็บใน results.pkl — ไฟล์ผลมีแค่ตาราง abnormal)
+        device_history.ingest_results(aid, result_store.inspection_date(aid), results)
+        results.pop("measured", None)
+        results["analysis_id"] = aid
+        os.makedirs(out_dir, exist_ok=True)
+        batch_analyze.write_outputs(results, out_dir, pdf=True, log=lambda *_: None)
+        tmp = os.path.join(out_dir, "results.pkl.tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, os.path.join(out_dir, "results.pkl"))
+
+        failed = len(results["errors"]) + len(errors)
+        _update(db_file, job_id, status="done", progress=1.0, finished_at=_now(), result_dir=out_dir, analysis_id=aid,
+                message=f"{len(sections)} section(s) analyzed" + (f", {failed} failed" if failed else ""))
+    except Exception as e:
+        _update(db_file, job_id, status="failed", finished_at=_now(), message="Failed", error=str(e))
+
+
+# ====== Dispatcher (thread ใน process ของ Streamlit) ======
+def _pid_alive(pid: int | None) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def _requeue_orphans(db_file: str) -> None:
+    conn = _connect(db_file)
+    rows = conn.execute("SELECT id, runner_pid FROM jobs WHERE status='running'").fetchall()
+    for r in rows:
+        if r["runner_pid"] == os.getpid() or not _pid_alive(r["runner_pid"]):
+            conn.execute(
+                "UPDATE jobs SET status='queued', progress=0, runner_pid=NULL, started_at=NULL, "
+                "message='Re-queued after restart' WHERE id=? AND status='running'",
+                (r["id"],),
+            )
+    conn.commit()
+    conn.close()
+
+
+def _claim_next(db_file: str) -> int | None:
+    """
+    เลือก job ถัดไปแบบแบ่งกันระหว่าง owner แล้ว claim แบบ atomic (queued → running)
+    คืน job_id หรือ None ถ้าไม่มีงานรอ
+    """
+    conn = _connect(db_file)
+    try:
+        rows = conn.execute("""
+            SELECT q.id FROM jobs q
+            LEFT JOIN (SELECT owner, COUNT(*) AS n FROM jobs WHERE status='running' GROUP BY owner) r
+                   ON r.owner = q.owner
+            WHERE q.status='queued'
+            ORDER BY COALESCE(r.n, 0), q.created_at, q.id
+            LIMIT 8
+        """).fetchall()
+        for r in rows:
+            cur = conn.execute(
+                "UPDATE jobs SET status='running', started_at=?, runner_pid=?, message='Starting' "
+                "WHERE id=? AND status='queued'",
+                (_now(), os.getpid(), r["id"]),
+            )
+            conn.commit()
+            if cur.rowcount == 1:
+                return r["id"]
+        return None
+    finally:
+        conn.close()
+
+
+class _Runner:
+    def __init__(self, db_file: str, workers: int):
+        self.db_file = db_file
+        self.workers = workers
+        self.pool = self._new_pool()
+        self.running: dict = {}     # future → job_id
+        _requeue_orphans(db_file)
+        self.thread = threading.Thread(target=self._loop, name="job-runner", daemon=True)
+        self.thread.start()
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _loop(self) -> None:
+        while True:
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("job runner tick failed")
+            time.sleep(POLL_SECONDS)
+
+    def tick(self) -> None:
+        for fut in [f for f in self.running if f.done()]:
+            job_id = self.running.pop(fut)
+            exc = fut.exception()
+            if exc is not None:
+                # worker ตาย (เช่น หน่วยความจำไม่พอ) → run_job ไม่ได้บันทึกสถานะเอง
+                _update(self.db_file, job_id, status="failed", finished_at=_now(), message="Failed",
+                        error=f"{type(exc).__name__}: {exc}")
+                if isinstance(exc, BrokenProcessPool):
+                    self.pool = self._new_pool()
+        while len(self.running) < self.workers:
+            job_id = _claim_next(self.db_file)
+            if job_id is None:
+                break
+            self.running[self.pool.submit(run_job, job_id, self.db_file)] = job_id
+
+
+def ensure_runner(db_file: str | None = None, workers: int | None = None) -> None:
+    """เริ่ม dispatcher ครั้งเดียวต่อ process (เรียกซ้ำได้ทุก rerun)"""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            init_db(db_file)
+            _runner = _Runner(db_file or DB_FILE, workers or MAX_WORKERS)
@@ -0,0 +1,200 @@
+# utils/kpi_history.py
+"""
+Time-series ของ KPI ต่อวันตรวจ (upload_date ใน files.db) — SQLite ไฟล์เดียว + rollup รายวัน/สัปดาห์/เดือน
+
+เดิม KPI ของ Dashboard (max CPU% ต่อ SNP(E)/NCPM/NCPQ, max Rps ต่อ FCC/FCPL/FCPS/FCPP,
+จำนวน MSU / Line / Client abnormal ...) คำนวณแล้วทิ้งทุกครั้งที่ render → ดูแนวโน้มหลายสัปดาห์ไม่ได้
+ตอนนี้ dashboard_kpi บันทึกค่าของแต่ละ analysis ลง store นี้ (วันเดียวกันหลาย analysis = หลายจุด, rollup รวมให้)
+แล้วกราฟ trend อ่าน rollup อย่างเดียว (ไม่ต้องเปิด ZIP เก่า)
+
+ตาราง:
+    kpi_points   หนึ่งแถวต่อ (day, metric, source) — ค่าดิบของวันตรวจจากแต่ละ analysis
+                 analysis เดิมบันทึกซ้ำ = ทับค่าของตัวเอง, analysis อื่นในวันเดียวกันไม่ถูกทับ
+    kpi_rollup   หนึ่งแถวต่อ (period, bucket, metric) — min / max / avg / last / n
+                 period: "D" รายวัน, "W" รายสัปดาห์ (bucket = วันจันทร์), "M" รายเดือน (bucket = วันที่ 1)
+                 รวมทุก source ใน bucket (last = ค่าที่บันทึกล่าสุดของวันล่าสุด)
+                 คำนวณใหม่เฉพาะ bucket ที่มีวันถูกเขียน → อ่านกราฟหลายเดือนได้จากไม่กี่ร้อยแถว
+
+การใช้งาน:
+    from utils import kpi_history
+    kpi_history.record("2025-09-24", {"CPU max % SNP": 71.5, ...}, source=analysis_id)
+    kpi_history.series(["CPU max % SNP"], period="W", start="2025-06-01")
+    kpi_history.metrics()
+"""
+import os
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+STORE_PATH = os.path.join("uploads", "kpi_history.db")
+
+PERIODS = {"D": "Daily", "W": "Weekly", "M": "Monthly"}
+AGGREGATES = ("max", "avg", "min", "last")
+
+_lock = threading.Lock()
+
+
+def _connect(path: str | None = None) -> sqlite3.Connection:
+    path = path or STORE_PATH
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS kpi_points (
+        day TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        value REAL,
+        source TEXT NOT NULL DEFAULT '',
+        recorded_at TEXT,
+        PRIMARY KEY (day, metric, source)
+    );
+    CREATE TABLE IF NOT EXISTS kpi_rollup (
+        period TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        min REAL,
+        max REAL,
+        avg REAL,
+        last REAL,
+        n INTEGER,
+        PRIMARY KEY (period, metric, bucket)
+    );
+    """)
+    # store เดิม key ด้วย (day, metric) → analysis หลังของวันทับ analysis ก่อน: ย้ายแถวเดิมมาตาราง key ใหม่
+    pk = [r[1] for r in sorted(conn.execute("PRAGMA table_info(kpi_points)"), key=lambda r: r[5]) if r[5]]
+    if "source" not in pk:
+        with conn:
+            conn.execute("ALTER TABLE kpi_points RENAME TO kpi_points_v1")
+            conn.execute("""
+            CREATE TABLE kpi_points (
+                day TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                value REAL,
+                source TEXT NOT NULL DEFAULT '',
+                recorded_at TEXT,
+                PRIMARY KEY (day, metric, source)
+            )""")
+            conn.execute("INSERT INTO kpi_points SELECT day, metric, value, COALESCE(source, ''), recorded_at "
+                         "FROM kpi_points_v1")
+            conn.execute("DROP TABLE kpi_points_v1")
+    return conn
+
+
+def bucket(day, period: str) -> tuple[str, str]:
+    """(วันแรก, วันสุดท้าย) ของ bucket ที่ day อยู่"""
+    d = date.fromisoformat(str(day)[:10])
+    if period == "D":
+        return d.isoformat(), d.isoformat()
+    if period == "W":
+        start = d - timedelta(days=d.weekday())
+        return start.isoformat(), (start + timedelta(days=6)).isoformat()
+    if period == "M":
+        start = d.replace(day=1)
+        nxt = (start + timedelta(days=32)).replace(day=1)
+        return start.isoformat(), (nxt - timedelta(days=1)).isoformat()
+    raise ValueError(f"Unknown period: {period}")
+
+
+def _refresh(conn: sqlite3.Connection, day: str, metrics: list) -> None:
+    for period in PERIODS:
+        start, end = bucket(day, period)
+        for metric in metrics:
+            row = conn.execute(
+                "SELECT MIN(value), MAX(value), AVG(value), COUNT(value) FROM kpi_points "
+                "WHERE metric=? AND day BETWEEN ? AND ?",
+                (metric, start, end),
+            ).fetchone()
+            if not row[3]:
+                conn.execute("DELETE FROM kpi_rollup WHERE period=? AND metric=? AND bucket=?",
+                             (period, metric, start))
+                continue
+            last = conn.execute(
+                "SELECT value FROM kpi_points WHERE metric=? AND day BETWEEN ? AND ? AND value IS NOT NULL "
+                "ORDER BY day DESC, recorded_at DESC LIMIT 1",
+                (metric, start, end),
+            ).fetchone()[0]
+            conn.execute(
+                "INSERT OR REPLACE INTO kpi_rollup (period, bucket, metric, min, max, avg, last, n) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (period, start, metric, row[0], row[1], row[2], last, row[3]),
+            )
+
+
+def record(day, values: dict, source: str | None = None, path: str | None = None) -> int:
+    """
+    บันทึก KPI ของวันตรวจ day จาก analysis source (ค่าเดิมของ source เดียวกันถูกทับ) แล้วอัปเดต rollup
+    values = {metric: float | None} — None ข้าม → คืนจำนวน metric ที่เขียน
+    """
+    day = str(day)[:10]
+    rows = [(day, m, float(v), source or "") for m, v in values.items() if v is not None and not pd.isna(v)]
+    if not rows:
+        return 0
+    now = datetime.now().isoformat(timespec="seconds")
+    with _lock:
+        conn = _connect(path)
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO kpi_points (day, metric, value, source, recorded_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(*r, now) for r in rows],
+                )
+                _refresh(conn, day, [r[1] for r in rows])
+        finally:
+            conn.close()
+    return len(rows)
+
+
+def has_source(source: str, path: str | None = None) -> bool:
+    conn = _connect(path)
+    try:
+        row = conn.execute("SELECT 1 FROM kpi_points WHERE source=? LIMIT 1", (source,)).fetchone()
+    finally:
+        conn.close()
+    return row is not None
+
+
+def metrics(path: str | None = None) -> list[str]:
+    conn = _connect(path)
+    try:
+        rows = conn.execute("SELECT DISTINCT metric FROM kpi_rollup WHERE period='D' ORDER BY metric").fetchall()
+    finally:
+        conn.close()
+    return [r[0] for r in rows]
+
+
+def series(metric_names: list, period: str = "D", start=None, end=None, path: str | None = None) -> pd.DataFrame:
+    """rollup ของ metric ที่เลือก (Date, Metric, min, max, avg, last, n) เรียงตามวัน"""
+    cols = ["Date", "Metric", "min", "max", "avg", "last", "n"]
+    if not metric_names:
+        return pd.DataFrame(columns=cols)
+    sql = (
+        f"SELECT bucket, metric, min, max, avg, last, n FROM kpi_rollup "
+        f"WHERE period=? AND metric IN ({','.join('?' * len(metric_names))})"
+    )
+    params = [period, *metric_names]
+    if start is not None:
+        sql += " AND bucket >= ?"
+        params.append(bucket(start, period)[0])
+    if end is not None:
+        sql += " AND bucket <= ?"
+        params.append(str(end)[:10])
+    conn = _connect(path)
+    try:
+        df = pd.read_sql_query(sql + " ORDER BY bucket, metric", conn, params=params)
+    finally:
+        conn.close()
+    df.columns = cols
+    df["Date"] = pd.to_datetime(df["Date"]).dt.date
+    return df
+
+
+def span(path: str | None = None):
+    """(วันแรก, วันสุดท้าย) ที่มีข้อมูล — None ถ้า store ว่าง"""
+    conn = _connect(path)
+    try:
+        row = conn.execute("SELECT MIN(day), MAX(day) FROM kpi_points").fetchone()
+    finally:
+        conn.close()
+    return (row[0], row[1]) if row and row[0] else None
@@ -0,0 +1,132 @@
+# utils/mapping.py
+"""
+Join engine สำหรับจับคู่ข้อมูล PM กับ reference ด้วย Mapping (= ME + Measure Object)
+
+แทนที่:
+    df["Mapping Format"] = df["ME"].astype(str).str.strip() + df["Measure Object"].astype(str).str.strip()
+    pd.merge(df, ref[cols], left_on="Mapping Format", right_on="Mapping", how="inner")
+
+ด้วยการ factorize ME / Measure Object เป็น code แล้วสร้าง key string เฉพาะคู่ที่ไม่ซ้ำ
+(จำนวน board ไม่ซ้ำ << จำนวนแถว) จากนั้น lookup กับ index ของ reference ที่สร้างไว้ล่วงหน้า
+ผลลัพธ์เหมือน pd.merge แบบ inner ทุกประการ (ลำดับแถวตาม left, คอลัมน์ซ้ำได้ suffix _x/_y)
+และคืนรายการ key ที่หาไม่เจอใน reference (unmatched) เพื่อดู reference drift
+"""
+from typing import List, NamedTuple
+import numpy as np
+import pandas as pd
+
+
+class MappingIndex:
+    """index ของคอลัมน์ Mapping ใน reference: key → ตำแหน่งแถว (รองรับ key ซ้ำ)"""
+
+    def __init__(self, ref: pd.DataFrame, key: str = "Mapping"):
+        codes, uniques = pd.factorize(ref[key])
+        self.n_rows = len(ref)
+        self.keys = pd.Index(uniques)
+        valid = codes >= 0
+        # ตำแหน่งแถวเรียงตาม group (stable → คงลำดับในไฟล์ reference)
+        self.positions = np.argsort(np.where(valid, codes, len(uniques)), kind="stable")[: int(valid.sum())]
+        self.counts = np.bincount(codes[valid], minlength=len(uniques))
+        self.starts = np.concatenate(([0], np.cumsum(self.counts)[:-1])) if len(uniques) else np.array([], dtype=np.int64)
+
+    def lookup(self, keys) -> np.ndarray:
+        """คืน group id ของแต่ละ key (-1 = ไม่เจอ)"""
+        return self.keys.get_indexer(keys)
+
+
+class JoinResult(NamedTuple):
+    merged: pd.DataFrame
+    unmatched: pd.DataFrame
+
+
+def _unique_keys(s: pd.Series):
+    """factorize แล้วแปลงเป็น string เฉพาะค่าไม่ซ้ำ (ตรรกะเดียวกับ astype(str).str.strip())"""
+    codes, uniques = pd.factorize(s, use_na_sentinel=False)
+    keys = pd.Series(uniques, dtype=s.dtype).astype(str).str.strip()
+    return codes, keys
+
+
+def _first_rows(codes: np.ndarray, n_codes: int) -> np.ndarray:
+    """ตำแหน่งแถวแรกของแต่ละ code (assignment ซ้ำ → ค่าสุดท้ายชนะ จึงไล่จากท้าย)"""
+    first = np.zeros(n_codes, dtype=np.int64)
+    first[codes[::-1]] = np.arange(len(codes) - 1, -1, -1)
+    return first
+
+
+def build_keys(df: pd.DataFrame, me_col: str = "ME", mobj_col: str = "Measure Object"):
+    """
+    คืน (pair_codes, pair_keys): code ของคู่ (ME, Measure Object) ต่อแถว
+    และ Mapping string ของแต่ละคู่ไม่ซ้ำ
+    """
+    me_codes, me_keys = _unique_keys(df[me_col])
+    mo_codes, mo_keys = _unique_keys(df[mobj_col])
+    combined = me_codes.astype(np.int64) * max(len(mo_keys), 1) + mo_codes
+    pair_codes, pair_uniques = pd.factorize(combined)
+    me_u = pair_uniques // max(len(mo_keys), 1)
+    mo_u = pair_uniques % max(len(mo_keys), 1)
+    pair_keys = (
+        me_keys.take(me_u).reset_index(drop=True)
+        + mo_keys.take(mo_u).reset_index(drop=True)
+    ).to_numpy()
+    return pair_codes, pair_keys
+
+
+def merge_on_mapping(
+    df: pd.DataFrame,
+    ref: pd.DataFrame,
+    ref_cols: List[str],
+    *,
+    index: MappingIndex | None = None,
+    me_col: str = "ME",
+    mobj_col: str = "Measure Object",
+    key_name: str = "Mapping Format",
+    ref_key: str = "Mapping",
+) -> JoinResult:
+    """
+    inner join df กับ ref ด้วย Mapping โดยไม่สร้างคอลัมน์ string ทั้งคอลัมน์
+    คอลัมน์ผลลัพธ์: คอลัมน์ของ df + key_name + ref_cols (เหมือน pd.merge เดิม)
+    """
+    if index is None or index.n_rows != len(ref):
+        index = MappingIndex(ref, ref_key)
+
+    pair_codes, pair_keys = build_keys(df, me_col, mobj_col)
+    pair_group = index.lookup(pair_keys)
+    row_group = pair_group[pair_codes] if len(pair_codes) else np.array([], dtype=np.int64)
+
+    # ขยายแถว left ตามจำนวนแถว ref ที่ match (รองรับ Mapping ซ้ำใน reference)
+    left_idx = np.flatnonzero(row_group >= 0)
+    grp = row_group[left_idx]
+    cnt = index.counts[grp]
+    left_rep = np.repeat(left_idx, cnt)
+    offs = np.arange(len(left_rep)) - np.repeat(np.cumsum(cnt) - cnt, cnt)
+    right_pos = index.positions[np.repeat(index.starts[grp], cnt) + offs]
+
+    left = df.take(left_rep)
+    right = ref[ref_cols].take(right_pos)
+    key_vals = ref[ref_key].take(right_pos)
+
+    # suffix คอลัมน์ที่ชื่อซ้ำ แบบเดียวกับ pd.merge
+    left_cols = list(df.columns) + [key_name]
+    overlap = set(left_cols) & set(ref_cols)
+    out = {}
+    for c in df.columns:
+        out[f"{c}_x" if c in overlap else c] = left[c].reset_index(drop=True)
+    out[f"{key_name}_x" if key_name in overlap else key_name] = key_vals.reset_index(drop=True)
+    for c in ref_cols:
+        out[f"{c}_y" if c in overlap else c] = right[c].reset_index(drop=True)
+    merged = pd.DataFrame(out)
+
+    # key ที่ไม่เจอใน reference (หนึ่งแถวต่อคู่ ME/Measure Object)
+    miss = np.flatnonzero(pair_group < 0)
+    if len(miss):
+        rows = np.bincount(pair_codes, minlength=len(pair_keys))
+        first = _first_rows(pair_codes, len(pair_keys))
+        unmatched = pd.DataFrame({
+            me_col: df[me_col].take(first[miss]).to_numpy(),
+            mobj_col: df[mobj_col].take(first[miss]).to_numpy(),
+            key_name: pair_keys[miss],
+            "Rows": rows[miss],
+        })
+    else:
+        unmatched = pd.DataFrame(columns=[me_col, mobj_col, key_name, "Rows"])
+    return JoinResult(merged, unmatched)
@@ -0,0 +1,118 @@
+# utils/memo.py
+"""
+Memo ของผล compute ของ analyzer (merge กับ reference + หา abnormal) ข้าม Streamlit rerun
+
+Streamlit รันสคริปต์ใหม่ทุกครั้งที่กด filter/radio → เดิม analyzer merge + คำนวณใหม่ทุกรอบ
+ตอนนี้ process() เรียก get_or_compute(key, self.compute) แล้ว filter/render จากผลที่ cache ไว้
+
+key = (ชื่อ analyzer, VERSION ของ analyzer, digest ของข้อมูล, version ของ reference, ...)
+  - digest ของข้อมูล: frame_digest(df) → ใช้ tag ที่ตั้งไว้ตอนโหลด (sha ของไฟล์ที่อัปโหลด)
+    tag ใช้ได้เฉพาะกับ object ที่ถูก tag เอง (frame ที่ใช้ร่วมกันใน result_store ซึ่งห้ามแก้)
+    copy / frame อื่นที่ได้ attrs ตามมา หรือ shape/คอลัมน์ไม่ตรง → hash เนื้อหาทั้ง frame
+    หน้า analyzer ส่ง memo.copy(df) → copy ถูก tag ใหม่ตอน copy (เนื้อหาเท่าต้นฉบับ) จึงได้ key เดิม
+    โดยไม่ hash ส่วน .copy() ธรรมดาแล้วแก้ค่าในที่ → hash ใหม่ ไม่ได้ digest ค้างของต้นฉบับ
+  - version ของ reference: ReferenceTable.version (mtime/size) หรือ frame_digest ของ df_ref
+  - แก้ตรรกะ compute ของ analyzer → เพิ่ม VERSION ของ class นั้น
+
+ผลใน cache ใช้ร่วมกันทุก rerun/session → ฝั่ง render ต้อง .copy() ก่อนแก้ไข frame
+"""
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
+import pandas as pd
+
+MAX_ENTRIES = 32
+
+_TAG = "memo_digest"
+
+_cache: "OrderedDict[tuple, object]" = OrderedDict()
+_lock = threading.Lock()
+# id(frame) → frame ที่ถูก tag (pandas copy attrs ไปกับ .copy() ด้วย → ต้องเช็คว่าเป็น object เดิม)
+_owners: "weakref.WeakValueDictionary[int, pd.DataFrame]" = weakref.WeakValueDictionary()
+
+
+def _shape_key(df: pd.DataFrame) -> tuple:
+    return (df.shape, tuple(map(str, df.columns)))
+
+
+def tag(df: pd.DataFrame, digest: str) -> pd.DataFrame:
+    """ผูก digest ที่รู้อยู่แล้ว (เช่น sha ของไฟล์) ไว้กับ frame นี้ (ไม่รวม copy) → ไม่ต้อง hash เนื้อหา"""
+    df.attrs[_TAG] = (str(digest), _shape_key(df))
+    with _lock:
+        _owners[id(df)] = df
+    return df
+
+
+def tagged(df) -> str | None:
+    """digest ที่ tag ไว้กับ frame นี้ (None ถ้าไม่ได้ tag, เป็น copy ธรรมดา หรือ shape/คอลัมน์เปลี่ยน)"""
+    if not isinstance(df, pd.DataFrame):
+        return None
+    info = df.attrs.get(_TAG)
+    with _lock:
+        owned = _owners.get(id(df)) is df
+    return info[0] if info and owned and info[1] == _shape_key(df) else None
+
+
+def origin(df) -> str | None:
+    """
+    tag ที่ติดมากับ frame (รวม copy ที่ได้ attrs ตามมา) = มาจากไฟล์ / member ไหน
+    ใช้ระบุที่มา (เช่น source ของ flapping_store) ไม่ใช่ digest ของเนื้อหา → key ของ memo ใช้ frame_digest
+    """
+    info = df.attrs.get(_TAG) if isinstance(df, pd.DataFrame) else None
+    return info[0] if info else None
+
+
+def copy(df):
+    """
+    .copy() ที่ tag digest ของต้นฉบับให้ copy ด้วย (เนื้อหาเท่ากันตอน copy) → ส่งให้ analyzer แก้ได้
+    โดย key ของ memo ยังเป็น sha ของไฟล์ ไม่ต้อง hash ทั้ง frame ทุก rerun
+    ที่ไม่ใช่ DataFrame (เช่น WASON log / None) คืนตัวเดิม
+    """
+    if not isinstance(df, pd.DataFrame):
+        return df
+    digest = tagged(df)
+    out = df.copy()
+    return tag(out, digest) if digest is not None else out
+
+
+def frame_digest(df: pd.DataFrame | None) -> str:
+    if df is None:
+        return "-"
+    digest = tagged(df)
+    if digest is not None:
+        return digest
+    h = hashlib.sha1()
+    h.update(repr(_shape_key(df)).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def text_digest(obj) -> str:
+    """digest ของ str / dict (เช่น WASON log, pmap) — dict เรียง key ก่อน"""
+    if obj is None:
+        return "-"
+    if isinstance(obj, dict):
+        obj = repr(sorted(obj.items(), key=lambda kv: repr(kv[0])))
+    return hashlib.sha1(str(obj).encode("utf-8", "ignore")).hexdigest()
+
+
+def get_or_compute(key: tuple, fn):
+    """คืนผลของ fn() ที่ cache ไว้ด้วย key (LRU, MAX_ENTRIES รายการต่อ process)"""
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    value = fn()
+    with _lock:
+        _cache[key] = value
+        _cache.move_to_end(key)
+        while len(_cache) > MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return value
+
+
+def clear() -> None:
+    with _lock:
+        _cache.clear()
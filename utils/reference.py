@@ -0,0 +1,143 @@
+# utils/reference.py
+"""
+Registry ของไฟล์ reference ใน data/*.xlsx (หนึ่งชุดต่อ process)
+  - อ่าน Excel ครั้งเดียว แล้ว normalize ชื่อคอลัมน์ครั้งเดียว
+  - เตรียม Mapping (strip) + order + mapping_index ไว้ล่วงหน้า
+  - reload เฉพาะเมื่อ mtime/size ของไฟล์เปลี่ยน
+
+การใช้งาน:
+    from utils.reference import get_registry
+    df_ref = get_registry().frame("cpu")      # สำเนา → analyzer แก้ไขได้อิสระ
+"""
+import os
+import threading
+import pandas as pd
+
+from utils.mapping import MappingIndex
+
+
+# ---------- Column normalizers ----------
+def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """strip + ยุบช่องว่างซ้ำ + nbsp → space (ตรรกะเดียวกับ _normalize_columns ของทุก analyzer)"""
+    df.columns = (
+        df.columns.astype(str)
+        .str.strip()
+        .str.replace(r"\s+", " ", regex=True)
+        .str.replace("\u00a0", " ")
+    )
+    return df
+
+
+def normalize_ascii_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """แบบ Client: encode('ascii','ignore') → decode แล้วยุบช่องว่าง"""
+    df.columns = (
+        df.columns.astype(str)
+        .str.encode("ascii", "ignore").str.decode("utf-8")
+        .str.replace(r"\s+", " ", regex=True)
+        .str.strip()
+    )
+    return df
+
+
+def strip_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """แบบ EOL / Flapping: strip อย่างเดียว"""
+    df.columns = [str(c).strip() for c in df.columns]
+    return df
+
+
+# name → (default path, normalizer)
+REFERENCE_SPECS = {
+    "cpu":      ("data/CPU.xlsx", normalize_columns),
+    "fan":      ("data/FAN.xlsx", normalize_columns),
+    "msu":      ("data/MSU.xlsx", normalize_columns),
+    "line":     ("data/Line.xlsx", normalize_columns),
+    "client":   ("data/Client.xlsx", normalize_ascii_columns),
+    "eol":      ("data/EOL.xlsx", strip_columns),
+    "flapping": ("data/Flapping.xlsx", strip_columns),
+}
+
+
+def _resolve_path(path: str) -> str:
+    """ถ้าไม่เจอไฟล์ ลองสลับตัวพิมพ์ของชื่อไฟล์ (เช่น Flapping.xlsx ↔ flapping.xlsx)"""
+    if os.path.exists(path):
+        return path
+    folder, base = os.path.split(path)
+    try:
+        for cand in os.listdir(folder or "."):
+            if cand.lower() == base.lower():
+                return os.path.join(folder, cand)
+    except FileNotFoundError:
+        pass
+    return path
+
+
+class ReferenceTable:
+    """reference ที่ normalize แล้ว + index ของคอลัมน์ Mapping"""
+
+    def __init__(self, name: str, path: str, df: pd.DataFrame, signature: tuple):
+        self.name = name
+        self.path = path
+        self.df = df
+        self.signature = signature
+        # Mapping → ตำแหน่งแถว (ใช้ร่วมกับ utils.mapping.merge_on_mapping)
+        self.mapping_index = MappingIndex(df) if "Mapping" in df.columns else None
+
+    @property
+    def version(self) -> str:
+        """string สั้น ๆ ที่เปลี่ยนเมื่อไฟล์เปลี่ยน (ใช้เป็น cache key)"""
+        return f"{self.name}:{self.signature[0]}:{self.signature[1]}"
+
+    def frame(self) -> pd.DataFrame:
+        return self.df.copy()
+
+
+class ReferenceRegistry:
+    def __init__(self, specs: dict | None = None):
+        self.specs = dict(REFERENCE_SPECS if specs is None else specs)
+        self._tables: dict[tuple, ReferenceTable] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _signature(path: str) -> tuple:
+        st_ = os.stat(path)
+        return (st_.st_mtime_ns, st_.st_size)
+
+    def _load(self, name: str, path: str, signature: tuple) -> ReferenceTable:
+        _, normalizer = self.specs[name]
+        df = normalizer(pd.read_excel(path))
+        if "Mapping" in df.columns:
+            df["Mapping"] = df["Mapping"].astype(str).str.strip()
+            df["order"] = range(len(df))  # รักษาลำดับตามไฟล์ reference
+        return ReferenceTable(name, path, df, signature)
+
+    def get(self, name: str, path: str | None = None) -> ReferenceTable:
+        if name not in self.specs:
+            raise KeyError(f"Unknown reference table: {name}")
+        path = _resolve_path(path or self.specs[name][0])
+        signature = self._signature(path)
+        key = (name, os.path.abspath(path))
+        with self._lock:
+            table = self._tables.get(key)
+            if table is None or table.signature != signature:
+                table = self._load(name, path, signature)
+                self._tables[key] = table
+            return table
+
+    def frame(self, name: str, path: str | None = None) -> pd.DataFrame:
+        return self.get(name, path).frame()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._tables.clear()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ReferenceRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ReferenceRegistry()
+        return _registry
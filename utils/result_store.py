@@ -0,0 +1,404 @@
+# utils/result_store.py
+"""
+ที่เก็บผลวิเคราะห์ต่อชุด upload (analysis) บนดิสก์ — session เก็บแค่ analysis_id
+
+เดิม cpu_data / line_data / wason_log / cpu_analyzer ... อยู่ใน st.session_state ของแต่ละ browser
+→ ทุก session ถือสำเนา DataFrame ใหญ่ของตัวเอง และ reconnect แล้วต้องโหลด/คำนวณใหม่ทั้งหมด
+ตอนนี้:
+    aid = result_store.save_datasets(uploads, parsed)      # dataset ที่ parse แล้ว (ไฟล์หลังทับไฟล์ก่อน)
+    st.session_state["analysis_id"] = aid                  # สิ่งเดียวที่ต้องอยู่ใน session
+    result_store.session_data(st.session_state, "cpu")     # frame ที่โหลดแล้วใช้ร่วมกันทุก session (LRU)
+    result_store.save_section(aid, "CPU", df_abn, by_type) # ตาราง abnormal + KPI ของแต่ละ section
+    result_store.kpis(aid)                                 # {section: {"status", "abnormal_rows", ...}}
+
+โครงสร้างบนดิสก์:
+    uploads/.results/<analysis_id>/
+        meta.json                   uploads (id, name, sha256, upload_date) + {kind: {"file", "sha", "format"}}
+        data/<kind>.parquet|pkl|txt normalized frame ของแต่ละ kind / WASON log
+        sections/<section>/         section.json (KPI + ชื่อไฟล์ของแต่ละตาราง) + ตาราง abnormal
+        snapshots/<section>.json    KPI ย่อสำหรับหน้า Dashboard (dashboard_kpi.py)
+        mirrored.json               section ที่ส่งไป Supabase analysis_results แล้ว (mirror_summary)
+
+ตารางเขียนเป็น Parquet (columnar) ถ้ามี pyarrow/fastparquet — frame ที่ Arrow เขียนไม่ได้
+(เช่น object column ที่ปนตัวเลขกับ "--") และเครื่องที่ไม่มี engine ใช้ pickle แทน (dtype เหมือนเดิม)
+ผลของ section ผูกกับ version ของ reference (data/*.xlsx) → แก้ reference แล้ว section เดิมถือว่าหมดอายุ
+"""
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+import pandas as pd
+
+from utils import memo
+from utils.ingest import CLASSIFIER_VERSION
+
+RESULTS_DIR = os.path.join("uploads", ".results")
+MAX_AGE_DAYS = 60
+
+# เพิ่มเมื่อเปลี่ยนรูปแบบที่เก็บ → analysis เดิมถูกสร้างใหม่
+STORE_VERSION = 1
+
+# section → reference ใน utils.reference (version ของไฟล์เป็นส่วนหนึ่งของ stamp)
+SECTION_REFS = {
+    "CPU": "cpu", "FAN": "fan", "MSU": "msu", "Line": "line", "Client": "client",
+    "Fiber": "flapping", "EOL": "eol", "Core": "eol",
+}
+
+MAX_FRAMES = 24
+
+_frames: "OrderedDict[tuple, object]" = OrderedDict()
+_lock = threading.Lock()
+_mirror_lock = threading.Lock()
+
+
+def columnar() -> bool:
+    return any(importlib.util.find_spec(m) is not None for m in ("pyarrow", "fastparquet"))
+
+
+def analysis_id(shas: list[str], day: str | None = None) -> str:
+    """
+    id ของชุดไฟล์ตามลำดับที่เลือก (ลำดับต่าง = ผลต่าง เพราะไฟล์หลังทับไฟล์ก่อน) + วันตรวจ
+    ZIP เดิม (sha เดียวกัน) ที่อัปโหลดซ้ำในวันตรวจใหม่ = analysis ใหม่ → kpi_history / device_history ได้จุดของวันนั้น
+    """
+    h = hashlib.sha1(f"v{STORE_VERSION}:c{CLASSIFIER_VERSION}".encode())
+    for sha in shas:
+        h.update(b"|" + str(sha).encode())
+    if day:
+        h.update(b"@" + str(day)[:10].encode())
+    return h.hexdigest()[:20]
+
+
+def _inspection_day(uploads: list[dict]) -> str | None:
+    days = [str(u["upload_date"])[:10] for u in uploads if u.get("upload_date")]
+    return max(days) if days else None
+
+
+def _dir(aid: str) -> str:
+    return os.path.join(RESULTS_DIR, aid)
+
+
+def _safe_name(text: str) -> str:
+    return re.sub(r"[^0-9A-Za-z]+", "_", str(text)).strip("_") or "table"
+
+
+def _write_json(path: str, obj) -> None:
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, default=str)
+    os.replace(tmp, path)
+
+
+def _read_json(path: str):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_frame(df: pd.DataFrame, path_no_ext: str) -> str:
+    """เขียน frame แล้วคืนนามสกุลที่ใช้ ("parquet" | "pkl")"""
+    if columnar():
+        tmp = f"{path_no_ext}.{uuid.uuid4().hex}.tmp"
+        try:
+            df.to_parquet(tmp)
+            os.replace(tmp, path_no_ext + ".parquet")
+            return "parquet"
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    tmp = f"{path_no_ext}.{uuid.uuid4().hex}.tmp"
+    df.to_pickle(tmp)
+    os.replace(tmp, path_no_ext + ".pkl")
+    return "pkl"
+
+
+def _read_frame(path_no_ext: str, fmt: str) -> pd.DataFrame:
+    path = f"{path_no_ext}.{fmt}"
+    return pd.read_parquet(path) if fmt == "parquet" else pd.read_pickle(path)
+
+
+def _cached(key: tuple, fn):
+    """frame ที่อ่านจากดิสก์แล้ว (LRU ต่อ process ใช้ร่วมกันทุก session → ฝั่งผู้ใช้ต้อง .copy() ก่อนแก้)"""
+    with _lock:
+        if key in _frames:
+            _frames.move_to_end(key)
+            return _frames[key]
+    value = fn()
+    with _lock:
+        _frames[key] = value
+        _frames.move_to_end(key)
+        while len(_frames) > MAX_FRAMES:
+            _frames.popitem(last=False)
+    return value
+
+
+# ====== Datasets ======
+def save_datasets(uploads: list[dict], parsed: list) -> str:
+    """
+    uploads = [{"id", "name", "sha256", "upload_date", ...}] ตามลำดับที่เลือก, parsed = ผลของ dataset_cache.get_or_parse_many
+    รวม dataset (ไฟล์หลังทับไฟล์ก่อน) แล้วเขียนครั้งเดียวต่อ analysis_id → คืน analysis_id
+    """
+    aid = analysis_id([u["sha256"] for u in uploads], _inspection_day(uploads))
+    if exists(aid):
+        os.utime(os.path.join(_dir(aid), "meta.json"))
+        return aid
+
+    merged = {}
+    for u, res in zip(uploads, parsed):
+        if isinstance(res, dict):
+            for kind, (data, zname) in res.items():
+                merged[kind] = (data, zname, u["sha256"])
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    tmp = os.path.join(RESULTS_DIR, f".tmp-{uuid.uuid4().hex}")
+    os.makedirs(os.path.join(tmp, "data"))
+    try:
+        datasets = {}
+        for kind, (data, zname, sha) in merged.items():
+            base = os.path.join(tmp, "data", kind)
+            if isinstance(data, str):
+                with open(base + ".txt", "w", encoding="utf-8", newline="") as f:
+                    f.write(data)
+                fmt = "txt"
+            else:
+                fmt = _write_frame(data, base)
+            datasets[kind] = {"file": zname, "sha": sha, "format": fmt}
+        _write_json(os.path.join(tmp, "meta.json"), {
+            "uploads": [{k: u.get(k) for k in ("id", "name", "sha256", "upload_date")} for u in uploads],
+            "datasets": datasets,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+        })
+        os.rename(tmp, _dir(aid))
+        evict()
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if exists(aid):
+            return aid  # อีก session / worker เขียน analysis เดียวกันเสร็จก่อน
+        raise           # เช่น ดิสก์เต็ม / ไม่มีสิทธิ์เขียน → ไม่คืน aid ที่ไม่มีข้อมูล
+    return aid
+
+
+def exists(aid: str | None) -> bool:
+    return bool(aid) and os.path.exists(os.path.join(_dir(aid), "meta.json"))
+
+
+def meta(aid: str | None) -> dict:
+    if not exists(aid):
+        return {}
+    return _cached(("meta", aid), lambda: _read_json(os.path.join(_dir(aid), "meta.json")) or {})
+
+
+def inspection_date(aid: str | None) -> str | None:
+    """วันตรวจของ analysis = upload_date ล่าสุดของไฟล์ในชุด (None ถ้าไม่รู้ เช่น รันจาก CLI)"""
+    return _inspection_day(meta(aid).get("uploads", []))
+
+
+def kinds(aid: str | None) -> dict:
+    """{kind: member_name} ของ dataset ใน analysis นี้"""
+    return {kind: info["file"] for kind, info in meta(aid).get("datasets", {}).items()}
+
+
+def dataset_digest(sha: str, kind: str, member: str) -> str:
+    """tag ของ dataset (sha ของไฟล์ที่อัปโหลด + kind + member) — worker ของ utils/jobs tag แบบเดียวกัน"""
+    return f"{sha}:{kind}:{member}"
+
+
+def dataset(aid: str | None, kind: str):
+    """DataFrame (หรือ str ของ wason) ของ kind นี้ — None ถ้าไม่มี"""
+    info = meta(aid).get("datasets", {}).get(kind)
+    if info is None:
+        return None
+
+    def _load():
+        base = os.path.join(_dir(aid), "data", kind)
+        if info["format"] == "txt":
+            with open(base + ".txt", "r", encoding="utf-8", newline="") as f:
+                return f.read()
+        df = _read_frame(base, info["format"])
+        # digest เดิมของไฟล์ → memo ของ analyzer hit ข้าม session / หลัง reconnect
+        return memo.tag(df, dataset_digest(info["sha"], kind, info["file"]))
+
+    try:
+        return _cached(("data", aid, kind), _load)
+    except (OSError, ValueError):
+        return None
+
+
+def session_data(state, kind: str):
+    """dataset ของ analysis ที่ session นี้เลือกไว้ (state = st.session_state)"""
+    return dataset(state.get("analysis_id"), kind)
+
+
+# ====== Sections (abnormal tables + KPI) ======
+def _stamp(section: str) -> str:
+    ref = SECTION_REFS.get(section)
+    if ref is None:
+        return "-"
+    try:
+        from utils.reference import get_registry
+        return get_registry().get(ref).version
+    except Exception:
+        return "-"
+
+
+def _section_dir(aid: str, section: str) -> str:
+    return os.path.join(_dir(aid), "sections", _safe_name(section))
+
+
+def section_kpi(df_abnormal, by_type: dict | None) -> dict:
+    by_type = by_type or {}
+    if df_abnormal is None:
+        return {"status": "No data", "abnormal_rows": 0, "by_type": {}}
+    counts = {str(t): int(len(df)) for t, df in by_type.items() if isinstance(df, pd.DataFrame)}
+    n = int(len(df_abnormal))
+    return {"status": "Abnormal" if n else "Normal", "abnormal_rows": n, "by_type": counts}
+
+
+def save_section(aid: str | None, section: str, df_abnormal, by_type: dict | None, extra: dict | None = None) -> None:
+    """เก็บ df_abnormal + df_abnormal_by_type ของ section (เขียนทับของเดิม)"""
+    if not exists(aid):
+        return
+    out = _section_dir(aid, section)
+    os.makedirs(out, exist_ok=True)
+    info = {"section": section, "stamp": _stamp(section), "kpi": section_kpi(df_abnormal, by_type), "types": {}, "table": None,
+            "saved_at": datetime.now().isoformat(timespec="seconds")}
+    if isinstance(df_abnormal, pd.DataFrame):
+        info["table"] = _write_frame(df_abnormal, os.path.join(out, "_table"))
+    for i, (name, df) in enumerate((by_type or {}).items()):
+        if isinstance(df, pd.DataFrame):
+            stem = f"t{i}_{_safe_name(name)}"
+            info["types"][str(name)] = [stem, _write_frame(df, os.path.join(out, stem))]
+    if extra:
+        info["kpi"].update(extra)
+    _write_json(os.path.join(out, "section.json"), info)
+
+
+def load_section(aid: str | None, section: str):
+    """(df_abnormal, by_type) ที่เก็บไว้ — None ถ้ายังไม่มีหรือ reference เปลี่ยนไปแล้ว"""
+    if not exists(aid):
+        return None
+    out = _section_dir(aid, section)
+    info = _read_json(os.path.join(out, "section.json"))
+    if info is None or info.get("stamp") != _stamp(section):
+        return None
+
+    def _load():
+        table = _read_frame(os.path.join(out, "_table"), info["table"]) if info.get("table") else None
+        by_type = {name: _read_frame(os.path.join(out, stem), fmt) for name, (stem, fmt) in info["types"].items()}
+        return table, by_type
+
+    try:
+        return _cached(("section", aid, section, info.get("saved_at")), _load)
+    except (OSError, ValueError):
+        return None
+
+
+def save_results(aid: str | None, results: dict) -> None:
+    """เก็บผลของ batch_analyze.analyze_datasets ทุก section (worker / CLI)"""
+    tables = results.get("tables", {})
+    for section, by_type in results.get("abnormal", {}).items():
+        df_abn = tables.get(section)
+        if df_abn is None:
+            frames = [df for df in by_type.values() if isinstance(df, pd.DataFrame)]
+            df_abn = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        save_section(aid, section, df_abn, by_type)
+    for section, named in results.get("extra", {}).items():
+        if section in ("APO", "Preset"):
+            flagged = named["APO Remnant" if section == "APO" else "FAIL"]
+            save_section(aid, section, flagged, named)
+
+
+def kpis(aid: str | None) -> dict:
+    """{section: kpi} ของ section ที่เก็บไว้แล้ว (ไม่อ่านตาราง)"""
+    out = {}
+    root = os.path.join(_dir(aid), "sections") if aid else None
+    if not root or not os.path.isdir(root):
+        return out
+    for name in sorted(os.listdir(root)):
+        info = _read_json(os.path.join(root, name, "section.json"))
+        if info is not None:
+            out[info.get("section", name)] = info["kpi"]
+    return out
+
+
+def save_snapshot(aid: str | None, section: str, snap) -> None:
+    """เก็บ KPI snapshot (dict ที่ JSON ได้ หรือ None = section นี้ไม่มีข้อมูล) ของ section"""
+    if not exists(aid):
+        return
+    out = os.path.join(_dir(aid), "snapshots")
+    os.makedirs(out, exist_ok=True)
+    _write_json(os.path.join(out, f"{_safe_name(section)}.json"),
+                {"section": section, "stamp": _stamp(section), "snapshot": snap})
+
+
+def snapshots(aid: str | None) -> dict:
+    """{section: snapshot} ที่ยังไม่หมดอายุ (reference ไม่เปลี่ยนตั้งแต่ตอนสร้าง)"""
+    out = {}
+    root = os.path.join(_dir(aid), "snapshots") if aid else None
+    if not root or not os.path.isdir(root):
+        return out
+    for name in os.listdir(root):
+        if not name.endswith(".json"):
+            continue
+        info = _read_json(os.path.join(root, name))
+        if info is not None and info.get("stamp") == _stamp(info["section"]):
+            out[info["section"]] = info["snapshot"]
+    return out
+
+
+def mirror_summary(aid: str | None, supabase) -> int:
+    """
+    ส่ง KPI ของ section ที่ยังไม่เคยส่งไปตาราง analysis_results ของ Supabase (SupabaseManager.save_analysis_result)
+    section ที่ส่งแล้วจดไว้ใน mirrored.json ของ analysis → session ใหม่ / restart ไม่ insert ซ้ำ
+    file_id = None: id ใน uploads ของ files.db ไม่ใช่ id ของตาราง uploads ใน Supabase (upload ไม่ได้ mirror)
+    → id ของ files.db อยู่ใน data["uploads"] แทน; คืนจำนวนแถวที่ส่งสำเร็จ
+    """
+    if not exists(aid) or supabase is None or not supabase.is_connected():
+        return 0
+    path = os.path.join(_dir(aid), "mirrored.json")
+    uploads = meta(aid).get("uploads", [])
+    sent = 0
+    with _mirror_lock:
+        done = set(_read_json(path) or [])
+        for section, kpi in kpis(aid).items():
+            if section in done:
+                continue
+            data = {"analysis_id": aid, "uploads": [u.get("id") for u in uploads], **kpi}
+            if supabase.save_analysis_result(section.lower(), data, None) is not None:
+                done.add(section)
+                sent += 1
+        if sent:
+            _write_json(path, sorted(done))
+    return sent
+
+
+# ====== Housekeeping ======
+def remove(aid: str) -> None:
+    shutil.rmtree(_dir(aid), ignore_errors=True)
+    with _lock:
+        for key in [k for k in _frames if k[1] == aid]:
+            _frames.pop(key, None)
+
+
+def evict(max_age_days: float = MAX_AGE_DAYS) -> None:
+    """ลบ analysis ที่ไม่ได้เปิดเกิน max_age_days (mtime ของ meta.json = ใช้งานล่าสุด)"""
+    if not os.path.isdir(RESULTS_DIR):
+        return
+    cutoff = time.time() - max_age_days * 86400
+    for name in os.listdir(RESULTS_DIR):
+        p = os.path.join(RESULTS_DIR, name)
+        if name.startswith(".tmp-") and os.path.getmtime(p) >= cutoff:
+            continue
+        meta_path = os.path.join(p, "meta.json")
+        mtime = os.path.getmtime(meta_path) if os.path.exists(meta_path) else 0
+        if os.path.isdir(p) and mtime < cutoff:
+            remove(name)
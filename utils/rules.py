@@ -0,0 +1,176 @@
+# utils/rules.py
+"""
+กฎ abnormal แบบ declarative → mask ราย cell ครั้งเดียว (vectorized) แล้วทุกที่อ่านจาก mask เดียวกัน
+
+เดิมแต่ละ analyzer เขียนเงื่อนไข threshold ซ้ำหลายที่ (df_abnormal, _row_has_issue, gray_row/red_value
+ใน Styler, banner, table1._render_row, report.py) และ Styler เรียก lambda ทีละแถว/ทีละ cell
+ตอนนี้ analyzer ประกาศกฎเป็น RuleSet แล้ว:
+    v = RULES.evaluate(df)     # Violations: cells (bool ต่อ cell), rows, marked, hit(name)
+    v.style(df.style)          # Styler.apply(axis=None) ครั้งเดียวด้วย CSS frame ที่สร้างจาก mask
+    v.any(), v.count()         # banner / จำนวน abnormal
+    v.hit("BER")               # mask รายแถวของกฎชื่อนั้น (แยก abnormal ตามชนิด)
+
+กฎ:
+    above(col, limit)              col > limit            (limit = ชื่อคอลัมน์หรือตัวเลข, ค่า NaN ไม่ผิด)
+    below(col, limit)              col < limit
+    outside(col, lo, hi)           col < lo หรือ col > hi (need_both=False → เช็คแต่ละฝั่งแยกกัน)
+    where(col, test)               test(df) → bool Series (เงื่อนไขเฉพาะ เช่น เพดานต่อ Measure Object)
+    startswith(col, prefix)        ติดสี (mark) อย่างเดียว ไม่นับเป็น abnormal เช่น Route ที่เป็น Preset
+
+ค่าในคอลัมน์ตัวเลขแปลงด้วย pd.to_numeric(errors="coerce") — แปลงไม่ได้ = NaN = ไม่ผิดกฎ
+คอลัมน์ที่ไม่มีใน df → กฎนั้นไม่ติด (เหมือน subset=[] ของ Styler เดิม)
+
+Registry (สำหรับ Summary/PDF ที่มีแค่ df_abnormal ไม่มี analyzer):
+    rules.register("CPU", CPU_Analyzer.RULES)
+    rules.registered("CPU")        # RuleSet ว่างถ้ายังไม่ register
+"""
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+GRAY = "background-color:#e6e6e6;color:black"
+RED = "background-color:#ff4d4d;color:white"
+PINK = "background-color:#ff9999;color:black"
+BLUE = "background-color:lightblue;color:black"
+
+
+@dataclass(frozen=True)
+class Rule:
+    name: str
+    cell: str
+    test: Callable[[pd.DataFrame], pd.Series]
+    mark: bool = False
+
+
+def _num(df: pd.DataFrame, ref) -> pd.Series:
+    if isinstance(ref, str):
+        if ref not in df.columns:
+            return pd.Series(float("nan"), index=df.index)
+        return pd.to_numeric(df[ref], errors="coerce")
+    return pd.Series(float(ref), index=df.index)
+
+
+def above(col: str, limit, name: str | None = None) -> Rule:
+    def test(df):
+        v, lim = _num(df, col), _num(df, limit)
+        return v.notna() & lim.notna() & (v > lim)
+    return Rule(name or col, col, test)
+
+
+def below(col: str, limit, name: str | None = None) -> Rule:
+    def test(df):
+        v, lim = _num(df, col), _num(df, limit)
+        return v.notna() & lim.notna() & (v < lim)
+    return Rule(name or col, col, test)
+
+
+def outside(col: str, lo, hi, name: str | None = None, need_both: bool = True) -> Rule:
+    def test(df):
+        v, low, high = _num(df, col), _num(df, lo), _num(df, hi)
+        out = (v < low) | (v > high)
+        return (v.notna() & low.notna() & high.notna() & out) if need_both else out
+    return Rule(name or col, col, test)
+
+
+def where(col: str, test: Callable[[pd.DataFrame], pd.Series], name: str | None = None) -> Rule:
+    return Rule(name or col, col, test)
+
+
+def startswith(col: str, prefix: str, name: str | None = None) -> Rule:
+    def test(df):
+        return df[col].astype(str).str.startswith(prefix)
+    return Rule(name or col, col, test, mark=True)
+
+
+class Violations:
+    """ผลของ RuleSet.evaluate — frame bool ขนาดเท่า df (index/columns เดียวกัน)"""
+
+    def __init__(self, df: pd.DataFrame, hits: dict, cells: np.ndarray, marked: np.ndarray):
+        self.index, self.columns = df.index, df.columns
+        self._hits = hits
+        self._cells = cells
+        self._marked = marked
+        self._rows = cells.any(axis=1)
+
+    @property
+    def cells(self) -> pd.DataFrame:
+        return pd.DataFrame(self._cells, index=self.index, columns=self.columns)
+
+    @property
+    def marked(self) -> pd.DataFrame:
+        return pd.DataFrame(self._marked, index=self.index, columns=self.columns)
+
+    @property
+    def rows(self) -> pd.Series:
+        """แถวที่ผิดอย่างน้อยหนึ่งกฎ (ไม่รวมกฎ mark)"""
+        return pd.Series(self._rows, index=self.index)
+
+    def hit(self, name: str) -> pd.Series:
+        """mask รายแถวของกฎชื่อ name (กฎชื่อซ้ำ → OR กัน)"""
+        return pd.Series(self._hits.get(name, np.zeros(len(self.index), dtype=bool)), index=self.index)
+
+    def any(self) -> bool:
+        return bool(self._rows.any())
+
+    def count(self) -> int:
+        return int(self._rows.sum())
+
+    def css(self, row: str | None = GRAY, cell: str | None = RED, mark: str | None = BLUE) -> pd.DataFrame:
+        """CSS ต่อ cell ตามลำดับเดิมของ Styler: เทาทั้งแถว → แดง cell ที่ผิด → ฟ้า cell ที่ mark"""
+        # code ต่อ cell = bit ของชั้นที่ติด (เทา 1, แดง 2, ฟ้า 4) → เปิดตาราง CSS 8 แบบ ไม่ต่อ string ทีละ cell
+        code = (np.broadcast_to(self._rows[:, None], self._cells.shape).astype(np.uint8)
+                | (self._cells.astype(np.uint8) << 1) | (self._marked.astype(np.uint8) << 2))
+        table = np.array(
+            [";".join(css for bit, css in ((1, row), (2, cell), (4, mark)) if k & bit and css) for k in range(8)],
+            dtype=object,
+        )
+        return pd.DataFrame(table[code], index=self.index, columns=self.columns, dtype=object)
+
+    def style(self, styler, row: str | None = GRAY, cell: str | None = RED, mark: str | None = BLUE):
+        """ใส่สีให้ Styler ด้วย apply(axis=None) ครั้งเดียว (แทน lambda ทีละแถว)"""
+        frame = self.css(row=row, cell=cell, mark=mark)
+        return styler.apply(lambda _: frame, axis=None)
+
+
+class RuleSet:
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+
+    def __iter__(self):
+        return iter(self.rules)
+
+    def only(self, *names: str) -> "RuleSet":
+        """ชุดย่อยเฉพาะกฎชื่อ names (เช่น ตาราง drill-down ที่ไฮไลต์แค่ power)"""
+        return RuleSet(r for r in self.rules if r.name in names)
+
+    def evaluate(self, df: pd.DataFrame) -> Violations:
+        n = len(df)
+        col_pos = {c: i for i, c in enumerate(df.columns)}
+        cells = np.zeros((n, len(df.columns)), dtype=bool)
+        marked = np.zeros_like(cells)
+        hits = {}
+        for rule in self.rules:
+            pos = col_pos.get(rule.cell)
+            if pos is None or n == 0:
+                continue
+            m = np.asarray(pd.Series(rule.test(df)).fillna(False), dtype=bool)
+            if rule.mark:
+                marked[:, pos] |= m
+            else:
+                cells[:, pos] |= m
+            hits[rule.name] = hits[rule.name] | m if rule.name in hits else m
+        return Violations(df, hits, cells, marked)
+
+
+_registry: dict = {}
+
+
+def register(section: str, ruleset: RuleSet) -> RuleSet:
+    _registry[section] = ruleset
+    return ruleset
+
+
+def registered(section: str) -> RuleSet:
+    return _registry.get(section, RuleSet([]))
@@ -0,0 +1,111 @@
+# utils/table_view.py
+"""
+ตารางผลแบบแบ่งหน้า (server-side) — ส่งไป browser ทีละหน้า และคำนวณสี (Styler) เฉพาะแถวของหน้านั้น
+
+เดิม analyzer ส่ง Styler ของทั้งตารางด้วย st.write/st.dataframe (และ app9 ต้องเพิ่ม
+styler.render.max_elements) → เวลา render และหน่วยความจำของ browser โตตามจำนวนแถวของไฟล์
+ตอนนี้:
+    paged_table(df_filtered, ns="cpu", style=self._style_dataframe, file_name="cpu.csv")
+      - ค้นหา (contains ทุกคอลัมน์ข้อความ) + เรียงตามคอลัมน์ ทำฝั่ง server บน df ทั้งก้อน
+      - เลือกจำนวนแถวต่อหน้า / เลขหน้า → style(df_page) ถูกเรียกกับแถวของหน้าที่เห็นเท่านั้น
+      - ดาวน์โหลด CSV ได้ทั้งชุด (หลังค้นหา/เรียง) — สร้างไฟล์เมื่อกด Prepare เท่านั้น
+
+style: callable(df_page) → Styler (หรือ tuple ที่ตัวแรกเป็น Styler) ได้ frame ที่ copy แล้ว แก้ไขได้
+ค่าของ widget อยู่ใน st.session_state ภายใต้ prefix f"{ns}_tv_"
+"""
+import math
+from typing import Callable
+
+import pandas as pd
+import streamlit as st
+
+PAGE_SIZES = (50, 100, 250, 500, 1000)
+_NO_SORT = "(none)"
+
+
+def _search_mask(df: pd.DataFrame, text: str) -> pd.Series:
+    mask = pd.Series(False, index=df.index)
+    for c in df.columns:
+        col = df[c]
+        if pd.api.types.is_numeric_dtype(col) or pd.api.types.is_datetime64_any_dtype(col):
+            continue
+        mask |= col.astype(str).str.contains(text, case=False, regex=False, na=False)
+    return mask
+
+
+def _sorted(df: pd.DataFrame, col: str, descending: bool) -> pd.DataFrame:
+    try:
+        return df.sort_values(col, ascending=not descending, kind="stable", na_position="last")
+    except TypeError:
+        # คอลัมน์ object ที่ปนชนิด (เช่น ตัวเลข + ข้อความ) → เรียงแบบข้อความ
+        key = df[col].astype(str).where(df[col].notna())
+        return df.loc[key.sort_values(ascending=not descending, kind="stable", na_position="last").index]
+
+
+def paged_table(
+    df: pd.DataFrame,
+    *,
+    ns: str,
+    style: Callable | None = None,
+    page_sizes=PAGE_SIZES,
+    page_size: int = 100,
+    file_name: str | None = None,
+) -> pd.DataFrame:
+    """แสดง df ทีละหน้า คืน DataFrame ของหน้าที่แสดง (index เดิมของ df)"""
+    key = f"{ns}_tv_"
+    c_q, c_sort, c_desc, c_size, c_page = st.columns([3, 3, 1, 1.2, 1.2])
+
+    text = c_q.text_input("Search", key=key + "q", placeholder="contains…").strip()
+    sort_col = c_sort.selectbox("Sort by", [_NO_SORT, *map(str, df.columns)], key=key + "sort")
+    descending = c_desc.checkbox("Desc", key=key + "desc")
+    if st.session_state.get(key + "size") not in page_sizes:
+        st.session_state[key + "size"] = page_size if page_size in page_sizes else page_sizes[0]
+    size = c_size.selectbox("Rows / page", page_sizes, key=key + "size")
+
+    view = df
+    if text:
+        view = view[_search_mask(view, text)]
+    if sort_col != _NO_SORT and sort_col in map(str, view.columns):
+        col = next(c for c in view.columns if str(c) == sort_col)
+        view = _sorted(view, col, descending)
+
+    n = len(view)
+    pages = max(1, math.ceil(n / size))
+
+    # เปลี่ยนค้นหา/เรียง/ขนาดหน้า/จำนวนแถว → กลับไปหน้าแรก และกันเลขหน้าเกินจำนวนหน้า
+    sig = (text, sort_col, descending, size, len(df), n)
+    if st.session_state.get(key + "sig") != sig:
+        st.session_state[key + "sig"] = sig
+        st.session_state[key + "page"] = 1
+    st.session_state[key + "page"] = min(max(int(st.session_state.get(key + "page", 1)), 1), pages)
+    page = c_page.number_input(f"Page (of {pages:,})", min_value=1, max_value=pages, step=1, key=key + "page")
+
+    start = (int(page) - 1) * size
+    df_page = view.iloc[start:start + size]
+
+    if style is not None and not df_page.empty:
+        styled = style(df_page.copy())
+        if isinstance(styled, tuple):
+            styled = styled[0]
+        st.dataframe(styled, use_container_width=True)
+    else:
+        st.dataframe(df_page, use_container_width=True)
+
+    c_info, c_csv = st.columns([4, 1])
+    c_info.caption(
+        f"Rows {start + 1 if n else 0:,}–{start + len(df_page):,} of {n:,}"
+        + (f" (search matched {n:,}/{len(df):,})" if text else "")
+    )
+    if file_name:
+        # สร้าง CSV ทั้งชุดเมื่อกดเท่านั้น (ไม่ encode ทุก rerun) และใช้ได้จนกว่า view จะเปลี่ยน
+        if c_csv.button("Prepare CSV", key=key + "csv"):
+            st.session_state[key + "csv_sig"] = sig
+        if st.session_state.get(key + "csv_sig") == sig:
+            c_csv.download_button(
+                f"⬇ CSV ({n:,} rows)",
+                data=view.to_csv(index=False).encode("utf-8-sig"),
+                file_name=file_name,
+                mime="text/csv",
+                key=key + "dl",
+            )
+    return df_page
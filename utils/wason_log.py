@@ -0,0 +1,358 @@
+# utils/wason_log.py
+"""
+Parser ของ WASON log (.txt) แบบอ่านรอบเดียว ใช้ร่วมกันโดย:
+    - Preset_Analyzer   → calls   (CALL block + WR / WR NO_ALARM / PreRout WORK--(USED) ต่อ call)
+    - Line_Analyzer     → presets (Call ID → preset ที่ WORK--(USED)--(SUCCESS) สำหรับ pmap)
+    - APO_Analyzer      → sites   (WASON Conn + APOPLUS och-inst ต่อ WASON IP)
+    - Dashboard (APO donut) ผ่าน ApoRemnantAnalyzer
+
+เดิมแต่ละตัว splitlines() + regex ทั้งไฟล์เอง (log รวม 6 region > 200 MB → อ่าน 4 รอบ)
+ตอนนี้เดินทีละบรรทัดครั้งเดียว (ทีละ chunk ไม่สร้าง list ของทั้งไฟล์) แล้ว cache ผลตาม hash ของ log
+
+การใช้งาน:
+    from utils import wason_log
+    log = wason_log.parse(text)      # cache ใน utils.memo → เรียกซ้ำได้ไม่เสียเวลา
+    log.calls / log.presets / log.sites   (ใช้ร่วมกันทุกหน้า ห้ามแก้ไข)
+
+    # log ใหญ่ที่ยังไม่ได้อ่านเข้า memory: ส่ง file handle / generator ได้ (ไม่ cache)
+    with open("wason.txt", "rb") as f:
+        for cid, ip, preset in wason_log.iter_presets(f): ...
+"""
+from __future__ import annotations
+
+import codecs
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from utils import memo
+
+# เพิ่มเมื่อแก้ตรรกะของ tokenizer → cache เก่าจะไม่ถูกใช้
+PARSER_VERSION = 1
+
+CHUNK_CHARS = 1 << 20
+
+# WASON IP → ชื่อไซต์ (ค่า default ของ Line preset map และ APO Remnant)
+DEFAULT_SITE_TABLE: Dict[str, str] = {
+    "30.10.90.6":  "HYI-4",
+    "30.10.10.6":  "Jasmine",
+    "30.10.30.6":  "Phu Nga",
+    "30.10.50.6":  "SNI-POI",
+    "30.10.70.6":  "NKS",
+    "30.10.110.6": "PKT",
+}
+
+# ---------- Preset (CALL block) ----------
+# Match: [WASON][CALL 8] [30.10.90.6 30.10.10.6 85] COPPER
+CALL_HEADER_RE = re.compile(r"\[WASON\]\[CALL\s+(\d+)\]\s+\[([^\]]+)\]")
+
+# Any Conn line that contains WR
+CONN_HAS_WR_RE = re.compile(r"\[WASON\]\s*\[Conn\s+\d+\].*\bWR\b", re.IGNORECASE)
+
+# Specifically "WR NO_ALARM"
+CONN_WR_NOALARM_RE = re.compile(
+    r"\[WASON\]\s*\[Conn\s+\d+\][^\n]*\bWR\s+NO_ALARM\b", re.IGNORECASE
+)
+
+# A preroute line like: --2--WORK--(USED)--(SUCCESS)-- (robust to trailing text)
+PREROUT_USED_RE = re.compile(
+    r"\[WASON\]--\s*(\d+)\s*--\s*WORK\s*--\s*\(USED\)\s*--\s*\((\w+)\).*",
+    re.IGNORECASE,
+)
+
+# ---------- Line preset map ----------
+PMAP_CALL_RE = re.compile(r"\[CALL\s+\d+\]\s+\[([\d.]+)\s+[\d.]+\s+(\d+)\]")
+PMAP_USED_SUCCESS_RE = re.compile(r"--(\d+)--WORK--\(USED\)--\(SUCCESS\)")
+
+# ---------- APO (WASON Conn + APOPLUS och-inst) ----------
+WASON_EXEC_RE = re.compile(r'^\s*ZXPOTN\(.*\)#\s*exec\s+diag_c\("cc-cmd setcallcv SetupApo"\)')
+WASON_END_RE  = re.compile(r'^\[WASON\]ushell command finished\b', re.I)
+WASON_CONN_RE = re.compile(r"^\[WASON\]\s*Conn\s*\[")
+WASON_CONN_PAIR_RE = re.compile(r"Conn\s*\[\s*([\d\.]+)\s+([\d\.]+)\s+(\d+)\s+(\d+)\s*\]")
+
+APOP_BEGIN_RE = re.compile(r'^\[APOPLUS\]\s*===\s*show all och-inst\s*===', re.I)
+APOP_TOP_RE   = re.compile(r'^\[APOPLUS\]\s*TopNeIp\s*:\s*([0-9\.]+)')
+APOP_END_RE   = re.compile(r'^\[APOPLUS\]ushell command finished\b', re.I)
+APOP_ROW_RE   = re.compile(
+    r"^\[APOPLUS\]\d+\s+0x[0-9a-fA-F]+\s+0x[0-9a-fA-F]+\s+(0x[0-9a-fA-F]{8})\s+(0x[0-9a-fA-F]{8}).*(HEAD_[A-Z_]+)"
+)
+
+
+# ========== Event model ==========
+@dataclass
+class CallBlock:
+    """
+    [WASON][CALL n] ถึงก่อน CALL ถัดไป
+    lines เก็บเฉพาะ call ที่มี WR (ใช้แสดง raw log) — call อื่นไม่ต้องใช้ จึงไม่เก็บ
+    """
+    call_id: int
+    ip: str
+    lines: List[str] = field(default_factory=list)
+    has_wr: bool = False
+    wr_no_alarm: bool = False
+    used_rows: List[Dict] = field(default_factory=list)  # {"index", "result", "raw"}
+
+
+@dataclass
+class SiteLog:
+    """บรรทัด WASON/APOPLUS ของหนึ่ง WASON IP (ตรรกะเดียวกับ ApoRemnantAnalyzer.parse เดิม)"""
+    wason_lines: List[str] = field(default_factory=list)
+    apop_lines: List[str] = field(default_factory=list)
+    # (traffic_hex, conn_hex, state, raw_line)
+    apop_rows: List[Tuple[str, str, str, str]] = field(default_factory=list)
+    # Conn ใน wason_lines: (first_ip, call_id, conn_hex, raw_line)
+    conns: List[Tuple[str, int, str, str]] = field(default_factory=list)
+
+
+@dataclass
+class WasonLog:
+    calls: List[CallBlock] = field(default_factory=list)
+    # (call_id จาก CALL header ตัด 0 นำหน้า, WASON IP, preset) ตามลำดับใน log
+    presets: List[Tuple[str, str, str]] = field(default_factory=list)
+    sites: Dict[str, SiteLog] = field(default_factory=dict)  # key: WASON IP (ลำดับที่เจอ)
+
+
+# ========== Helpers ==========
+def _split_chunks(chunks: Iterable[str]) -> Iterator[str]:
+    """ต่อ chunk แล้วตัดหลัง "\\n" ตัวสุดท้าย → ได้บรรทัดเหมือน splitlines() ของทั้งก้อน"""
+    rest = ""
+    for chunk in chunks:
+        buf = rest + chunk
+        cut = buf.rfind("\n") + 1
+        if cut:
+            yield from buf[:cut].splitlines()
+        rest = buf[cut:]
+    if rest:
+        yield from rest.splitlines()
+
+
+def _read_chunks(f, chunk_chars: int) -> Iterator[str]:
+    """อ่าน file handle ทีละ chunk (bytes → utf-8 ignore แบบเดียวกับ utils.ingest)"""
+    decoder = None
+    while True:
+        chunk = f.read(chunk_chars)
+        if not chunk:
+            break
+        if isinstance(chunk, bytes):
+            decoder = decoder or codecs.getincrementaldecoder("utf-8")(errors="ignore")
+            chunk = decoder.decode(chunk)
+        yield chunk
+    if decoder is not None:
+        yield decoder.decode(b"", final=True)
+
+
+def iter_lines(source, chunk_chars: int = CHUNK_CHARS) -> Iterator[str]:
+    """
+    บรรทัดของ log แบบ text.splitlines() แต่ทยอยคืนทีละ chunk (ไม่สร้าง list ของทั้งไฟล์)
+    source: str / file handle (text หรือ binary) / iterable ของบรรทัด (มีหรือไม่มี newline ท้ายก็ได้)
+    """
+    if isinstance(source, str):
+        start, n = 0, len(source)
+        while start < n:
+            end = source.find("\n", min(start + chunk_chars, n) - 1)
+            end = n if end < 0 else end + 1
+            yield from source[start:end].splitlines()
+            start = end
+    elif hasattr(source, "read"):
+        yield from _split_chunks(_read_chunks(source, chunk_chars))
+    else:
+        for item in source:
+            if isinstance(item, bytes):
+                item = item.decode("utf-8", errors="ignore")
+            yield from (item.splitlines() or [""])
+
+
+def topne_to_wason_ip(top_ne_ip: str) -> Optional[str]:
+    m = re.match(r"(\d+)\.(\d+)\.(\d+)\.(\d+)", top_ne_ip)
+    if not m:
+        return None
+    x = m.group(3)
+    return f"30.10.{x}.6"
+
+
+def wason_conn_pair(conn_line: str) -> Optional[Tuple[str, int, str]]:
+    """
+    [WASON] Conn [30.10.x.x 30.10.y.y CALLID CONNNO] ...
+    return: (first_ip, call_id:int, conn_hex:str)
+    """
+    m = WASON_CONN_PAIR_RE.search(conn_line)
+    if not m:
+        return None
+    first_ip, _second_ip, call_id_str, conn_no_str = m.groups()
+    return first_ip, int(call_id_str), f"0x{int(conn_no_str):08x}".lower()
+
+
+# ========== Line preset map (state machine) ==========
+class PresetScanner:
+    """
+    [CALL n] [ip ip cid] → รอ [PreRout]: → รอ --p--WORK--(USED)--(SUCCESS) (เจอ [CALL ใหม่ก่อน = ทิ้ง)
+    feed() ทีละบรรทัด คืน (call_id ตัด 0 นำหน้า, WASON IP, preset) เมื่อครบ ไม่งั้น None
+    """
+    __slots__ = ("pending", "state")
+
+    def __init__(self):
+        self.pending: Optional[Tuple[str, str]] = None
+        self.state: Optional[str] = None
+
+    def feed(self, ln: str) -> Optional[Tuple[str, str, str]]:
+        if "[CALL" in ln:
+            self.pending = None
+            m = PMAP_CALL_RE.search(ln)
+            if m:
+                self.pending = (m.group(2).strip().lstrip("0"), m.group(1).strip())
+                self.state = "prerout"
+            return None
+        if self.pending is None:
+            return None
+        if self.state == "prerout":
+            if "[PreRout]:" in ln:
+                self.state = "used"
+            return None
+        m = PMAP_USED_SUCCESS_RE.search(ln) if "WORK" in ln else None
+        if not m:
+            return None
+        hit = (*self.pending, m.group(1).strip())
+        self.pending = None
+        return hit
+
+
+def iter_presets(source) -> Iterator[Tuple[str, str, str]]:
+    """preset ของแต่ละ CALL แบบ streaming (source เหมือน iter_lines) — ไม่ผ่าน cache"""
+    feed = PresetScanner().feed
+    for ln in iter_lines(source):
+        hit = feed(ln)
+        if hit:
+            yield hit
+
+
+# ========== Tokenizer (one pass) ==========
+def tokenize(lines: Iterable[str]) -> WasonLog:
+    log = WasonLog()
+    sites = log.sites
+
+    # --- Preset: CALL block ปัจจุบัน ---
+    cur: Optional[CallBlock] = None
+
+    def _close_call():
+        if not cur.has_wr:
+            cur.lines = []
+        log.calls.append(cur)
+
+    # --- Line pmap ---
+    scan_preset = PresetScanner().feed
+
+    # --- APO ---
+    wason_prebuf: List[Tuple[str, Optional[tuple]]] = []
+    apop_prebuf: List[str] = []
+    cap_wason = cap_apop = False
+    wason_ip: Optional[str] = None
+    apop_ip: Optional[str] = None
+
+    def _site(ip: str) -> SiteLog:
+        if ip not in sites:
+            sites[ip] = SiteLog()
+        return sites[ip]
+
+    def _add_wason(site: SiteLog, ln: str, conn):
+        site.wason_lines.append(ln)
+        if conn:
+            site.conns.append((conn[0], conn[1], conn[2], ln))
+
+    for ln in lines:
+        has_call = "[CALL" in ln
+
+        # ===== Preset =====
+        m = CALL_HEADER_RE.search(ln) if has_call else None
+        if m:
+            if cur is not None:
+                _close_call()
+            cur = CallBlock(call_id=int(m.group(1)), ip=m.group(2))
+        if cur is not None:
+            cur.lines.append(ln)
+            if CONN_HAS_WR_RE.search(ln):
+                cur.has_wr = True
+                if not cur.wr_no_alarm and CONN_WR_NOALARM_RE.search(ln):
+                    cur.wr_no_alarm = True
+            if "--" in ln:
+                mu = PREROUT_USED_RE.search(ln)
+                if mu:
+                    cur.used_rows.append({"index": int(mu.group(1)), "result": mu.group(2).upper(), "raw": ln})
+
+        # ===== Line pmap =====
+        hit = scan_preset(ln)
+        if hit:
+            log.presets.append(hit)
+
+        # ===== APO =====
+        # WASON begin / end
+        if "SetupApo" in ln and WASON_EXEC_RE.search(ln):
+            cap_wason = True
+            wason_ip = None
+            wason_prebuf = [(ln, None)]
+        if not ln.startswith("["):
+            continue
+        if WASON_END_RE.match(ln):
+            if cap_wason and wason_ip:
+                _add_wason(sites[wason_ip], ln, None)
+            cap_wason = False
+            wason_ip = None
+            wason_prebuf = []
+            continue
+
+        # APOP begin / end
+        if APOP_BEGIN_RE.match(ln):
+            cap_apop = True
+            apop_ip = None
+            apop_prebuf = [ln]
+            continue
+        if APOP_END_RE.match(ln):
+            if cap_apop and apop_ip:
+                sites[apop_ip].apop_lines.append(ln)
+            cap_apop = False
+            apop_ip = None
+            apop_prebuf = []
+            continue
+
+        # collect WASON
+        if cap_wason:
+            if ln.startswith("[WASON]"):
+                conn = wason_conn_pair(ln) if WASON_CONN_RE.match(ln) else None
+                if wason_ip is None:
+                    wason_prebuf.append((ln, conn))
+                    if conn:
+                        wason_ip = conn[0]
+                        site = _site(wason_ip)
+                        for pre_ln, pre_conn in wason_prebuf:
+                            _add_wason(site, pre_ln, pre_conn)
+                        wason_prebuf = []
+                else:
+                    _add_wason(sites[wason_ip], ln, conn)
+            continue
+
+        # collect APOP
+        if cap_apop and ln.startswith("[APOPLUS]"):
+            if apop_ip is None:
+                apop_prebuf.append(ln)
+                mtop = APOP_TOP_RE.search(ln)
+                if mtop:
+                    apop_ip = topne_to_wason_ip(mtop.group(1))
+                    if apop_ip:
+                        _site(apop_ip).apop_lines.extend(apop_prebuf)
+                        apop_prebuf = []
+                continue
+
+            site = sites[apop_ip]
+            site.apop_lines.append(ln)
+            mrow = APOP_ROW_RE.match(ln)
+            if mrow:
+                site.apop_rows.append((mrow.group(1).lower(), mrow.group(2).lower(), mrow.group(3), ln))
+
+    if cur is not None:
+        _close_call()
+    return log
+
+
+def parse(text: str) -> WasonLog:
+    """WasonLog ของทั้ง log (cache ตาม hash ของเนื้อ log) — ไม่ cache: tokenize(iter_lines(f))"""
+    key = ("wason_log", PARSER_VERSION, memo.text_digest(text))
+    return memo.get_or_compute(key, lambda: tokenize(iter_lines(text)))